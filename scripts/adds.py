@@ -299,6 +299,9 @@ class ADDSCli:
             console.print(f"[dim]{goodbye}[/]")
         except KeyboardInterrupt:
             console.print("\n\n[bold red]👋 强制退出[/]")
+        finally:
+            # 强制退出时后台归档以规则摘要落盘（正常退出已在 run() 中关闭，重复调用无副作用）
+            loop.core.shutdown()
 
     def list_roles(self):
         """列出内置角色"""
@@ -466,7 +469,8 @@ class ADDSCli:
                 else:
                     status_icon = "🟢" if s.get("status") == "active" else "📦"
                     print(f"  {status_icon} {s['session_id']}  agent={s.get('agent', '?')}  "
-                          f"feature={s.get('feature', '?')}  status={s.get('status', '?')}")
+                          f"feature={s.get('feature', '?')}  status={s.get('status', '?')}  "
+                          f"工具输出={s.get('logs', 0)}")
             print()
 
         elif args.session_command == "restore":
@@ -482,12 +486,64 @@ class ADDSCli:
             session_id = args.session_id
             logs = mgr.list_logs(session_id)
             if not logs:
-                print(f"📭 Session {session_id} 无 .log 文件")
+                print(f"📭 Session {session_id} 无工具输出记录")
             else:
-                print(f"📋 Session {session_id} 的 .log 文件:")
+                print(f"📋 Session {session_id} 的工具输出:")
                 for log in logs:
                     print(f"  📄 {log}")
 
+        elif args.session_command == "gc":
+            removed, freed = mgr.gc_blobs(min_age=args.min_age, dry_run=args.dry_run)
+            action = "可删除" if args.dry_run else "已删除"
+            print(f"🧹 {action} {removed} 个未引用的 blob，释放 {freed:,} 字节")
+            print(f"   剩余 blob 占用: {mgr.blobs.disk_usage():,} 字节")
+
+        elif args.session_command == "reindex":
+            count = mgr.reindex()
+            print(f"🗂  Session 目录已重建: {count} 个条目 → {mgr.catalog.path}")
+
+    def budget_command(self, args):
+        """Token 预算子命令：工具调用账本报告"""
+        from token_budget import load_ledger
+
+        sessions_dir = self.ai_dir / "sessions"
+        if args.session_id:
+            path = sessions_dir / f"{args.session_id}.ledger.jsonl"
+        else:
+            ledgers = sorted(sessions_dir.glob("*.ledger.jsonl"),
+                             key=lambda p: p.stat().st_mtime)
+            path = ledgers[-1] if ledgers else None
+        if path is None or not path.exists():
+            print("📭 暂无工具调用账本")
+            return
+
+        entries = load_ledger(str(path))
+        session_id = path.name[:-len(".ledger.jsonl")]
+        raw_total = sum(e.raw_tokens for e in entries)
+        live_total = sum(e.tokens for e in entries)
+        print("=" * 70)
+        print(f"💰 Token 账本: {session_id}")
+        print("=" * 70)
+        print(f"  工具调用: {len(entries)}  原始: {raw_total:,} tokens  "
+              f"当前: {live_total:,} tokens  压缩节省: {raw_total - live_total:,}")
+
+        by_tool = {}
+        for e in entries:
+            agg = by_tool.setdefault(e.tool, [0, 0, 0])
+            agg[0] += 1
+            agg[1] += e.raw_tokens
+            agg[2] += e.tokens
+        print("\n  按工具:")
+        for tool, (count, raw, live) in sorted(by_tool.items(), key=lambda kv: -kv[1][2]):
+            print(f"    {tool:16s} {count:4d} 次  原始 {raw:>9,}  当前 {live:>9,}")
+
+        print(f"\n  最贵的 {args.top} 次调用（按当前 Token）:")
+        for e in sorted(entries, key=lambda e: e.tokens, reverse=True)[:args.top]:
+            mark = f"  → {e.log_file}" if e.compacted else ""
+            print(f"    #{e.call_id:<4d} turn={e.turn:<3d} {e.tool:12s} "
+                  f"args={e.args_hash}  {e.raw_tokens:>8,} → {e.tokens:>8,}{mark}")
+        print()
+
     def perm_command(self, args):
         """P0-4: 权限管理子命令"""
         from permission_manager import PermissionManager
@@ -557,6 +613,7 @@ Examples:
   adds init                         初始化项目
   adds status                       查看项目状态
   adds validate                   校验 feature_list.md
+  adds index build                  构建 / 刷新项目搜索索引
   adds install-deps                 安装 Python 依赖
         """
     )
@@ -608,8 +665,23 @@ Examples:
     session_sub.add_parser("status", help="显示当前 Session 状态")
     session_restore = session_sub.add_parser("restore", help="从 .mem 恢复 Session")
     session_restore.add_argument("session_id", type=str, help="Session ID")
-    session_logs = session_sub.add_parser("logs", help="查看 Session 的 .log 文件")
+    session_logs = session_sub.add_parser("logs", help="查看 Session 的工具输出记录")
     session_logs.add_argument("session_id", type=str, help="Session ID")
+    session_gc = session_sub.add_parser("gc", help="清理不再被 .ses / .mem 引用的工具输出 blob")
+    session_gc.add_argument("--dry-run", action="store_true", help="只统计不删除")
+    session_gc.add_argument("--min-age", type=float, default=3600.0,
+                            help="只删除早于该秒数写入的 blob（默认 3600）")
+    session_sub.add_parser("reindex", help="扫描 .ses / .mem 重建 Session 目录（catalog.jsonl）")
+
+    # budget command
+    budget_parser = subparsers.add_parser("budget", help="Token 预算与工具调用账本")
+    budget_sub = budget_parser.add_subparsers(dest="budget_command")
+    budget_report = budget_sub.add_parser("report", help="显示工具调用 Token 账本")
+    budget_report.add_argument("--session", dest="session_id", type=str, default="",
+                               help="Session ID（默认最近一次）")
+    budget_report.add_argument("--top", type=int, default=10, help="显示最贵的 N 次调用")
+    # 不带子命令时等同于 budget report
+    budget_parser.set_defaults(budget_command="report", session_id="", top=10)
 
     # mem command (P0-3)
     from memory_cli import add_mem_subparser
@@ -635,6 +707,10 @@ Examples:
     from agent_fork import add_fork_subparser
     add_fork_subparser(subparsers)
 
+    # index command
+    from project_index import add_index_subparser
+    add_index_subparser(subparsers)
+
     # perm command (P0-4)
     perm_parser = subparsers.add_parser("perm", help="权限管理（P0-4）")
     perm_sub = perm_parser.add_subparsers(dest="perm_command")
@@ -696,6 +772,8 @@ Examples:
         cli.session_command(args)
     elif args.command == "perm":
         cli.perm_command(args)
+    elif args.command == "budget":
+        cli.budget_command(args)
     elif args.command == "mem":
         cli.mem_command(args)
     elif args.command == "skill":
@@ -713,6 +791,9 @@ Examples:
     elif args.command == "fork":
         from agent_fork import handle_fork_command
         handle_fork_command(args, project_root=str(cli.project_root))
+    elif args.command == "index":
+        from project_index import handle_index_command
+        handle_index_command(args, project_root=str(cli.project_root))
 
 
 if __name__ == "__main__":
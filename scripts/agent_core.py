@@ -20,17 +20,29 @@ CLI 和 TUI 各自实现回调即可获得完整功能。
 from __future__ import annotations
 
 import asyncio
+import json
 import logging
+import re
 import subprocess
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Any, Callable, Dict, List, Optional, Tuple
 
-from model.base import ModelInterface, ModelResponse
+from async_shell import run_shell
+from shell_session import PersistentShell
+from project_index import ProjectIndex, literal_text, load_index_config, ripgrep_search
+from read_cache import format_numbered, get_read_cache
+from message_store import MessageStore
+from tool_dedup import DEFAULT_DEDUP_CONFIG, ToolResultDeduper
+from tool_registry import BUILTIN_TOOLS, ToolRegistry, default_registry
+from model.base import ModelInterface, ModelResponse, SystemBlock, SystemPrompt
+from model.tokenizer import CALIBRATION_FILE, TokenCalibrator
 from token_budget import TokenBudget, estimate_tokens, load_budget_config
 from session_manager import SessionManager
-from context_compactor import ContextCompactor
+from session_writer import SessionWriter, load_session_writer_config
+from context_compactor import ContextCompactor, Layer2Job
 from summary_decision_engine import SummaryStrategy
 from memory_manager import MemoryManager
 from permission_manager import PermissionManager, PermissionDecision, PermissionLevel
@@ -56,6 +68,72 @@ BUILTIN_ROLES = {
 }
 
 
+# ═══════════════════════════════════════════════════════════
+# 工具执行配置
+# ═══════════════════════════════════════════════════════════
+
+# 只读工具（含别名）：同一轮内可并发执行
+READONLY_TOOL_NAMES = {
+    name for spec in BUILTIN_TOOLS if spec.readonly for name in (spec.name, *spec.aliases)
+}
+
+DEFAULT_TOOL_CONFIG = {
+    "native_tools": True,      # 是否向模型发送工具 schema（模型支持 tools 时）
+    "parallel": True,          # 是否并发执行同一轮的只读工具调用
+    "max_concurrency": 4,      # 单轮同时执行的只读工具数上限
+    "thread_pool_size": 4,     # 同步工具使用的线程池大小
+    "shell_timeout": 30,       # shell 命令超时（秒）
+    "shell_head_chars": 3000,  # shell stdout 保留的头部字符数
+    "shell_tail_chars": 2000,  # shell stdout 保留的尾部字符数
+    "shell_stderr_chars": 2000,  # shell stderr 保留字符数（头尾各半）
+    "persistent_shell": False,   # 是否使用持久化 shell 会话（保留 cwd/env）
+    "read_max_chars": 8000,      # read 单次输出的字符上限
+    "read_default_limit": 2000,  # read 未指定 limit 时的行数
+    "read_cache_bytes": 64 * 1024 * 1024,   # 进程内读取缓存的字节预算
+    "read_mmap_threshold": 1024 * 1024,     # 超过此大小的文件使用 mmap 按行范围读取
+    **DEFAULT_DEDUP_CONFIG,                 # 工具结果上下文去重（相同 → 占位，文件变化 → diff）
+}
+
+
+# 退出时等待后台 Layer2 归档的最长时间（秒），超时后由 shutdown 以规则摘要落盘
+ARCHIVE_WAIT_TIMEOUT = 30.0
+
+
+def _in_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def is_readonly_tool(tool_name: Optional[str]) -> bool:
+    """工具是否为只读（可与同轮其他只读调用并发执行）"""
+    return bool(tool_name) and tool_name.lower().strip() in READONLY_TOOL_NAMES
+
+
+def load_tool_config(project_root: str) -> Dict[str, Any]:
+    """从 .ai/settings.json 加载 tools 配置（缺省项用默认值）
+
+    Args:
+        project_root: 项目根目录
+
+    Returns:
+        tools 配置字典
+    """
+    config = dict(DEFAULT_TOOL_CONFIG)
+    settings_path = Path(project_root) / ".ai" / "settings.json"
+    if settings_path.exists():
+        try:
+            data = json.loads(settings_path.read_text(encoding="utf-8"))
+            config.update(data.get("tools", {}))
+        except (json.JSONDecodeError, OSError) as e:
+            logger.warning("Failed to load settings.json: %s", e)
+    config["max_concurrency"] = max(1, int(config["max_concurrency"]))
+    config["thread_pool_size"] = max(1, int(config["thread_pool_size"]))
+    return config
+
+
 # ═══════════════════════════════════════════════════════════
 # 回调接口 — UI 层实现
 # ═══════════════════════════════════════════════════════════
@@ -72,6 +150,8 @@ class AgentCallbacks:
     on_thinking: Optional[Callable[[str, bool], None]] = None
     # 工具调用（tool_name, args）
     on_tool_call: Optional[Callable[[str, dict], None]] = None
+    # 工具流式输出片段（tool_name, chunk），如 shell 的实时 stdout/stderr
+    on_tool_output: Optional[Callable[[str, str], None]] = None
     # Agent Loop 状态变化（thinking/streaming/tool_call/executing/waiting/idle）
     on_status: Optional[Callable[[str], None]] = None
     # 完整回复完成（full_text）
@@ -122,8 +202,19 @@ class AgentCore:
 
         # P0-2: Token 预算 + Session + 压缩
         self.budget = TokenBudget(context_window=ctx_window, config=budget_config)
-        self.session_mgr = SessionManager(sessions_dir=sessions_dir)
-        self.compactor = ContextCompactor(self.budget, self.session_mgr)
+        # 估算 → 实际 Token 的在线校正（按适配器/模型分别拟合，持久化在 .ai/）
+        self.token_calibrator: Optional[TokenCalibrator] = None
+        self._calibration_key = f"{type(model).__name__}:{model.get_model_name()}"
+        if budget_config.get("token_calibration", True):
+            self.token_calibrator = TokenCalibrator(
+                str(self.project_root / ".ai" / CALIBRATION_FILE))
+            self.budget.set_token_scale(self.token_calibrator.factor(self._calibration_key))
+        self._session_writer = SessionWriter.from_config(load_session_writer_config(project_root))
+        self.session_mgr = SessionManager(
+            sessions_dir=sessions_dir,
+            writer=self._session_writer,
+        )
+        self.compactor = ContextCompactor(self.budget, self.session_mgr, config=budget_config)
 
         # P0-3: 记忆
         self.memory_mgr = MemoryManager(
@@ -144,18 +235,47 @@ class AgentCore:
         self.skill_mgr = SkillManager(project_root=project_root)
 
         # ── 会话状态 ─────────────────────────────────
-        self.messages: List[Dict[str, Any]] = []
+        self.messages = MessageStore()
         self.system_prompt: str = BUILTIN_ROLES.get(agent_role, f"你是一个 {agent_role} 角色的 AI 助手")
+        self._role_prompt: str = self.system_prompt
         self.turn_count: int = 0
         self.streaming: bool = False
+        # 模型调用累计用量（提供方返回的 usage，含提示词缓存命中/写入）
+        self.usage_stats: Dict[str, int] = {
+            "input_tokens": 0, "output_tokens": 0,
+            "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0,
+            "requests": 0,
+        }
 
         # 模型锁（防止并发调用）
         self._model_lock = asyncio.Lock()
+        # 后台 Layer2 归档任务 → 归档任务状态
+        self._layer2_jobs: Dict["asyncio.Task", Layer2Job] = {}
+
+        # 工具执行：只读工具并发 + 同步工具线程池（延迟创建）
+        self.tool_config = load_tool_config(project_root)
+        self.tools: ToolRegistry = default_registry()
+        # 工具结果去重（重复 / 未变化的结果不再完整进入上下文）
+        self.tool_dedup = ToolResultDeduper(self.tool_config)
+        self._tool_pool: Optional[ThreadPoolExecutor] = None
+        # 运行中的 shell 任务（abort_tools 时取消并杀死进程组）
+        self._shell_tasks: set = set()
+        self._aborted_shell_tasks: set = set()
+        # 持久化 shell 会话（tools.persistent_shell 开启时延迟创建）
+        self._shell_session: Optional[PersistentShell] = None
+        # 文件读取缓存（进程内所有 AgentCore 共享）
+        self._read_cache = get_read_cache(
+            max_bytes=self.tool_config["read_cache_bytes"],
+            mmap_threshold=self.tool_config["read_mmap_threshold"],
+        )
+        # 项目搜索索引（grep/glob，延迟加载）
+        self.index_config = load_index_config(project_root)
+        self._project_index: Optional[ProjectIndex] = None
 
     # ── 初始化 ──────────────────────────────────────────
 
     def init_session(self) -> None:
-        """初始化 Session 和 Token 预算（启动时调用）
+        """初始化 Session 和 Token 预算（启动时 / Layer2 归档后开始新 session 时调用）
 
         在此方法中注入模型身份、技能、记忆等附加信息，
         确保在 system_prompt 被外部覆盖后仍然生效。
@@ -165,10 +285,33 @@ class AgentCore:
             agent=self.agent_role,
             feature=self.feature,
         )
+        # 工具调用账本随 session 持久化（adds budget report 读取）
+        self.budget.set_ledger_path(
+            str(self.session_mgr.sessions_dir / f"{session_id}.ledger.jsonl"),
+            writer=self._session_writer)
+
+        # 外部设置的角色提示词（再次初始化时沿用，不重复注入）
+        if not isinstance(self.system_prompt, SystemPrompt):
+            self._role_prompt = self.system_prompt
+        self.system_prompt = self._build_system_prompt()
+
+        # Token 预算初始化
+        system_tokens = estimate_tokens(self.system_prompt)
+        self.budget.allocate(system_prompt=system_tokens)
+        logger.info("Session initialized: %s | ctx=%d | system_tokens=%d",
+                     session_id, ctx_window, system_tokens)
+
+    def _build_system_prompt(self) -> SystemPrompt:
+        """组装系统提示词分段
+
+        角色/身份/能力边界、技能索引在会话内不变，作为可缓存前缀；
+        摘要与记忆随会话变化，放在最后。
+        """
+        static_text = self._role_prompt
 
         # 注入模型身份（防止 LLM 编造自己是什么模型）
         model_name = self.model.get_model_name()
-        self.system_prompt += (
+        static_text += (
             f"\n\n## 模型身份\n"
             f"你是 {model_name} 大模型。当用户问你是谁、是什么模型时，"
             f"你必须如实回答你是 {model_name}，不要编造或声称自己是其他模型。"
@@ -176,7 +319,7 @@ class AgentCore:
 
         # 注入能力边界说明
         if not self.model.supports_feature("tools"):
-            self.system_prompt += (
+            static_text += (
                 "\n\n## 能力边界\n"
                 "你当前没有工具执行能力（无法运行命令、读写文件等）。"
                 "请不要输出 ```bash 等代码块假装执行命令，"
@@ -186,24 +329,24 @@ class AgentCore:
 
         # 注入 Level 0 技能索引
         skill_section = self.skill_mgr.build_level0_section()
-        if skill_section:
-            self.system_prompt += "\n\n" + skill_section
+        skill_text = "\n\n" + skill_section if skill_section else ""
 
-        # 注入上一个 session 的摘要
+        dynamic_text = ""
+        # 注入上一个 session 的摘要（后台归档未完成时为原始记录开头，完成后刷新为摘要）
         prev_summary = self.session_mgr.get_prev_session_summary()
         if prev_summary:
-            self.system_prompt += f"\n\n## 上一次对话摘要\n{prev_summary[:2000]}"
+            dynamic_text += f"\n\n## 上一次对话摘要\n{prev_summary[:2000]}"
 
         # 注入固定记忆
         memory_injection = self.memory_mgr.build_memory_injection(role=self.agent_role)
         if memory_injection:
-            self.system_prompt += f"\n\n## 项目经验记忆\n{memory_injection}"
+            dynamic_text += f"\n\n## 项目经验记忆\n{memory_injection}"
 
-        # Token 预算初始化
-        system_tokens = estimate_tokens(self.system_prompt)
-        self.budget.allocate(system_prompt=system_tokens)
-        logger.info("Session initialized: %s | ctx=%d | system_tokens=%d",
-                     session_id, ctx_window, system_tokens)
+        return SystemPrompt([
+            SystemBlock(static_text, cache=True),
+            SystemBlock(skill_text, cache=True),
+            SystemBlock(dynamic_text),
+        ])
 
     # ── 核心：Agent Loop ────────────────────────────────
 
@@ -227,7 +370,7 @@ class AgentCore:
             return None
 
         # 追加用户消息
-        self.messages.append({"role": "user", "content": user_text})
+        user_msg = self.messages.append({"role": "user", "content": user_text})
         self.turn_count += 1
         self.resilience.reset_session_stats()
 
@@ -235,7 +378,7 @@ class AgentCore:
         self.session_mgr.append_message("user", user_text)
 
         # Token 预算检查
-        self.budget.track("history", estimate_tokens(user_text))
+        self.budget.track("history", user_msg.tokens)
 
         # ── Agent Loop ──────────────────────────────
         full_response_parts: List[str] = []
@@ -248,7 +391,7 @@ class AgentCore:
                 if self.budget.utilization > 0.50:
                     self._compact_layer1(cb)
 
-                # 动态构建消息
+                # 增量构建消息（只格式化新增条目）
                 messages = self._build_messages()
 
                 logger.info("AgentLoop round %d/%d | msgs=%d | budget=%.1f%%",
@@ -260,12 +403,12 @@ class AgentCore:
                     messages, cb, round_num,
                 )
 
-                # 有文本回复 → 收集并退出循环
-                if round_result.text:
+                # 只有文本回复 → 收集并退出循环
+                if round_result.text and not round_result.tool_calls:
                     full_response_parts.append(round_result.text)
                     break
 
-                # 纯工具调用 → 执行后继续
+                # 工具调用（可附带文本）→ 执行后继续
                 if round_result.tool_calls:
                     logger.info("AgentLoop round %d: %d 工具调用",
                                 round_num + 1, len(round_result.tool_calls))
@@ -273,32 +416,46 @@ class AgentCore:
                     if cb.on_status:
                         cb.on_status("executing")
 
-                    # 将模型决策加入消息历史
+                    # 将模型决策加入消息历史（带调用 id 时适配器按原生 tool_use 格式发送）
                     tool_names = [t[0] or "unknown" for t in round_result.tool_calls]
                     assistant_msg = f"调用工具: {', '.join(tool_names)}"
-                    self.messages.append({"role": "assistant", "content": assistant_msg})
+                    call_ids = round_result.tool_call_ids
+                    if all(call_ids):
+                        decision = {
+                            "role": "assistant", "content": round_result.text,
+                            "tool_calls": [{"id": cid, "name": tname, "arguments": targs}
+                                           for cid, (tname, targs) in zip(call_ids, round_result.tool_calls)],
+                        }
+                        if round_result.thinking_blocks:
+                            decision["thinking_blocks"] = round_result.thinking_blocks
+                        self.messages.append(decision)
+                    else:
+                        call_ids = [None] * len(round_result.tool_calls)
+                        self.messages.append({"role": "assistant", "content": assistant_msg})
+                    if round_result.text:
+                        assistant_msg = f"{round_result.text}\n{assistant_msg}"
                     self.session_mgr.append_message("assistant", assistant_msg)
 
-                    # 执行每个工具
-                    for tname, targs in round_result.tool_calls:
-                        # ── 权限检查 ──
-                        decision = self.permission.check(tname, str(targs))
-                        if decision.needs_confirmation:
-                            allowed = await self._ask_permission(decision, cb)
-                            if not allowed:
-                                result = f"🚫 用户拒绝了工具调用: {tname}"
-                                if cb.on_error:
-                                    cb.on_error(result)
-                            else:
-                                result = await self._execute_tool(tname, targs)
-                        elif decision.is_denied:
-                            result = f"🚫 权限拒绝: {decision.reason}"
-                            if cb.on_error:
-                                cb.on_error(result)
-                        else:
-                            result = await self._execute_tool(tname, targs)
-
-                        self.messages.append({"role": "tool_result", "content": result})
+                    # 执行工具（权限顺序检查 → 只读调用并发）
+                    results = await self._run_tool_calls(round_result.tool_calls, cb)
+
+                    for (tname, targs), call_id, result in zip(round_result.tool_calls, call_ids, results):
+                        # 重复 / 未变化的结果 → 占位或 diff（Session 中仍记录完整输出）
+                        spec = self.tools.resolve(tname) if tname else None
+                        dedup_name = spec.name if spec else (tname or "unknown")
+                        content, hit = self.tool_dedup.check(
+                            dedup_name, targs, result, self.turn_count, self.messages)
+                        # Token 预算：按调用记账（call_id 用于压缩时归因；上下文只计实际发送的部分）
+                        entry = self.budget.record_tool_call(
+                            tname, targs, estimate_tokens(result), turn=self.turn_count,
+                            sent_tokens=estimate_tokens(content),
+                        )
+                        tool_msg = {"role": "tool_result", "content": content, "call_id": entry.call_id}
+                        if call_id:
+                            tool_msg["tool_call_id"] = call_id
+                        stored = self.messages.append(tool_msg)
+                        self.tool_dedup.record(dedup_name, targs, result, content,
+                                               self.turn_count, stored, hit)
                         self.session_mgr.append_message("tool_result", result)
 
                         # 工具输出保存到 .log
@@ -307,18 +464,8 @@ class AgentCore:
                             self.session_mgr.save_tool_output(
                                 result, summary=summary, strategy="tool_filter"
                             )
-                        logger.debug("Tool Result | %s => %d chars", tname, len(result))
-
-                    # Token 预算更新
-                    for tname, targs in round_result.tool_calls:
-                        result_msg = next(
-                            (m for m in self.messages if m["role"] == "tool_result"),
-                            {}
-                        )
-                        if result_msg:
-                            self.budget.reserve(
-                                f"tool_{tname}", estimate_tokens(result_msg.get("content", ""))
-                            )
+                        logger.debug("Tool Result | %s => %d chars | %d tokens",
+                                     tname, len(result), entry.raw_tokens)
 
                     continue  # 下一轮
 
@@ -339,12 +486,12 @@ class AgentCore:
         full_text = "".join(full_response_parts)
 
         if full_text:
-            self.messages.append({"role": "assistant", "content": full_text})
+            reply_msg = self.messages.append({"role": "assistant", "content": full_text})
             self.session_mgr.append_message(
                 "assistant", full_text,
                 strategy="llm_analyze", priority="high",
             )
-            self.budget.track("history", estimate_tokens(full_text))
+            self.budget.track("history", reply_msg.tokens)
 
             # Token 预算警告
             warning = self.compactor.get_warning()
@@ -368,6 +515,8 @@ class AgentCore:
         text: str = ""
         thinking: str = ""
         tool_calls: List[Tuple[str, dict]] = field(default_factory=list)
+        tool_call_ids: List[Optional[str]] = field(default_factory=list)  # 提供方给出的调用 id
+        thinking_blocks: List[dict] = field(default_factory=list)  # 需随 tool_use 回放的签名 thinking 块
         finish_reason: str = "stop"
 
     async def _call_model_with_resilience(
@@ -388,6 +537,8 @@ class AgentCore:
             result = self._RoundResult()
             thinking_parts: List[str] = []
             tool_calls: List[Tuple[str, dict]] = []
+            tool_call_ids: List[Optional[str]] = []
+            thinking_blocks: List[dict] = []
             _thinking_shown = False
             finish_reason = "stop"
             error_occurred = None
@@ -400,10 +551,13 @@ class AgentCore:
                         {"role": "user", "content": "（接上文，请继续完成被截断的回复）"}
                     ]
 
+                # 请求前的估算值，与响应 usage 中的实际值一起用于校正
+                estimated_tokens = self.budget.estimated_used
                 async with self._model_lock:
                     async for resp in self.model.chat(
                         call_messages,
                         system_prompt=self.system_prompt or None,
+                        tools=self._tool_definitions(),
                         stream=True,
                     ):
                         # ── Debug 日志 ──
@@ -418,6 +572,10 @@ class AgentCore:
                             for hint in resp.progress_hints:
                                 logger.debug("  progress | %s", hint)
 
+                        # ── 用量（每次请求的最终响应携带） ──
+                        if resp.finish_reason not in ("streaming", "thinking", "error") and resp.usage:
+                            self._record_usage(resp.usage, estimated_tokens)
+
                         # ── 错误 ──
                         if resp.finish_reason == "error":
                             if cb.on_error:
@@ -438,12 +596,17 @@ class AgentCore:
                                 if cb.on_thinking:
                                     cb.on_thinking(resp.thinking, False)
 
+                        if resp.thinking_blocks:
+                            thinking_blocks.extend(resp.thinking_blocks)
+
                         # ── 工具调用 ──
                         if resp.tool_calls:
                             for tc in resp.tool_calls:
                                 tname = tc.get("name") if isinstance(tc, dict) else getattr(tc, "name", None)
                                 targs = tc.get("arguments") if isinstance(tc, dict) else getattr(tc, "arguments", {})
-                                tool_calls.append((tname, targs))
+                                tcid = tc.get("id") if isinstance(tc, dict) else getattr(tc, "id", None)
+                                tool_calls.append((tname, targs or {}))
+                                tool_call_ids.append(tcid)
                                 logger.debug("LLM >> tool_call | %s", tname)
                                 if cb.on_tool_call:
                                     cb.on_tool_call(tname, targs)
@@ -529,6 +692,8 @@ class AgentCore:
 
             result.thinking = "".join(thinking_parts)
             result.tool_calls = tool_calls
+            result.tool_call_ids = tool_call_ids
+            result.thinking_blocks = thinking_blocks
             result.finish_reason = finish_reason
             return result
 
@@ -536,31 +701,116 @@ class AgentCore:
         result.text = "".join(full_response_parts)
         result.thinking = "".join(thinking_parts)
         result.tool_calls = tool_calls
+        result.tool_call_ids = tool_call_ids
         return result
 
     # ── 工具执行 ────────────────────────────────────────
 
-    async def _execute_tool(self, tool_name: str, args: dict) -> str:
+    async def _run_tool_calls(self, tool_calls: List[Tuple[str, dict]],
+                              cb: AgentCallbacks) -> List[str]:
+        """执行一轮工具调用
+
+        1. 权限检查与用户确认严格按模型给出的顺序进行
+        2. 通过检查的连续只读调用（read/glob/grep）作为一批并发执行
+        3. 写入类调用（write/shell 等）作为屏障串行执行，保证读写顺序语义
+
+        Returns:
+            与 tool_calls 一一对应的结果列表（保持原始顺序）
+        """
+        results: List[Optional[str]] = [None] * len(tool_calls)
+        approved: List[int] = []
+
+        for i, (tname, targs) in enumerate(tool_calls):
+            decision = self.permission.check(tname, str(targs))
+            if decision.needs_confirmation:
+                if await self._ask_permission(decision, cb):
+                    approved.append(i)
+                    continue
+                results[i] = f"🚫 用户拒绝了工具调用: {tname}"
+            elif decision.is_denied:
+                results[i] = f"🚫 权限拒绝: {decision.reason}"
+            else:
+                approved.append(i)
+                continue
+            if cb.on_error:
+                cb.on_error(results[i])
+
+        batch: List[int] = []
+        for i in approved:
+            tname, targs = tool_calls[i]
+            if self.tool_config["parallel"] and is_readonly_tool(tname):
+                batch.append(i)
+                continue
+            await self._run_readonly_batch(batch, tool_calls, results)
+            batch = []
+            results[i] = await self._execute_tool(tname, targs, cb)
+        await self._run_readonly_batch(batch, tool_calls, results)
+
+        return [r if r is not None else "" for r in results]
+
+    async def _run_readonly_batch(self, indices: List[int],
+                                  tool_calls: List[Tuple[str, dict]],
+                                  results: List[Optional[str]]) -> None:
+        """并发执行一批只读工具调用（受 max_concurrency 限制），结果按下标回填"""
+        if not indices:
+            return
+        if len(indices) > 1:
+            logger.info("Concurrent tool stage: %d read-only calls", len(indices))
+
+        semaphore = asyncio.Semaphore(self.tool_config["max_concurrency"])
+
+        async def _run(i: int) -> None:
+            tname, targs = tool_calls[i]
+            async with semaphore:
+                results[i] = await self._execute_tool(tname, targs)
+
+        await asyncio.gather(*(_run(i) for i in indices))
+
+    def _tool_definitions(self) -> Optional[List[Dict[str, Any]]]:
+        """发送给模型的工具定义（模型不支持工具或配置关闭时为 None）"""
+        if not self.tool_config["native_tools"] or not self.model.supports_feature("tools"):
+            return None
+        return self.tools.schemas()
+
+    def _get_tool_pool(self) -> ThreadPoolExecutor:
+        """获取同步工具线程池（延迟创建）"""
+        if self._tool_pool is None:
+            self._tool_pool = ThreadPoolExecutor(
+                max_workers=self.tool_config["thread_pool_size"],
+                thread_name_prefix="adds-tool",
+            )
+        return self._tool_pool
+
+    async def _run_in_pool(self, fn: Callable[[dict], str], args: dict) -> str:
+        """在线程池中执行同步工具，避免阻塞事件循环"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_tool_pool(), fn, args)
+
+    async def _execute_tool(self, tool_name: str, args: dict,
+                            cb: Optional[AgentCallbacks] = None) -> str:
         """执行工具调用"""
         if not tool_name:
             return "❌ 工具名为空"
 
-        tool_name = tool_name.lower().strip()
+        spec = self.tools.resolve(tool_name)
         logger.info("Execute tool: %s | args=%s", tool_name, list(args.keys()) if args else [])
+        if spec is None:
+            return f"⚠️ 工具 '{tool_name}' 暂未实现\n可用: {', '.join(self.tools.names())}"
+        args = args or {}
 
         try:
-            if tool_name in ("read", "read_file"):
-                return self._tool_read(args)
-            elif tool_name in ("glob", "search", "search_file", "find"):
-                return self._tool_glob(args)
-            elif tool_name in ("grep", "search_content", "rg"):
-                return self._tool_grep(args)
-            elif tool_name in ("write", "write_file"):
+            if spec.name == "read":
+                return await self._run_in_pool(self._tool_read, args)
+            elif spec.name == "glob":
+                return await self._run_in_pool(self._tool_glob, args)
+            elif spec.name == "grep":
+                return await self._run_in_pool(self._tool_grep, args)
+            elif spec.name == "write":
                 return self._tool_write(args)
-            elif tool_name in ("shell", "bash", "command", "exec"):
-                return await self._tool_shell(args)
+            elif spec.name == "shell":
+                return await self._tool_shell(args, cb)
             else:
-                return f"⚠️ 工具 '{tool_name}' 暂未实现\n可用: read, glob, grep, write, shell"
+                return f"⚠️ 工具 '{spec.name}' 暂未实现"
 
         except Exception as e:
             logger.error("Tool error: %s | %s", tool_name, e)
@@ -573,21 +823,39 @@ class AgentCore:
         p = self._resolve_path(path)
         if not p.exists():
             return f"❌ 文件不存在: {p}"
+        cfg = self.tool_config
         try:
-            content = p.read_text(encoding="utf-8", errors="replace")
-            max_chars = 8000
-            if len(content) > max_chars:
-                content = content[:max_chars] + f"\n... (截断，共 {len(content)} 字符)"
-            return content
+            offset = int(args.get("offset") or 1)
+            limit = int(args.get("limit") or cfg["read_default_limit"])
+        except (TypeError, ValueError):
+            return "❌ read: offset/limit 必须是整数"
+        try:
+            view = self._read_cache.read_lines(str(p), offset=offset, limit=limit)
         except Exception as e:
             return f"❌ 读取失败: {e}"
+        if view.total_lines == 0:
+            return "(空文件)"
+        if not view.lines:
+            return f"❌ read: offset={offset} 超出文件范围（共 {view.total_lines} 行）"
+        content, last = format_numbered(view, max_chars=cfg["read_max_chars"])
+        if last < view.total_lines:
+            content += (f"\n... (共 {view.total_lines} 行，已显示 {view.start}-{last} 行，"
+                        f"使用 offset={last + 1} 继续读取)")
+        return content
 
     def _tool_glob(self, args: dict) -> str:
         pattern = args.get("pattern") or args.get("glob") or args.get("query", "*")
         directory = args.get("directory") or args.get("path") or str(self.project_root)
         directory = self._resolve_path(directory)
         try:
-            matches = list(directory.glob(pattern))[:50]
+            prefix = self._index_prefix(directory)
+            index = self._get_project_index()
+            if index is not None and prefix is not None and not index.is_stale():
+                matches = [self.project_root / rel for rel in index.glob(pattern, prefix)[:50]]
+            else:
+                if index is not None:
+                    index.refresh_in_background(self._get_tool_pool())
+                matches = list(directory.glob(pattern))[:50]
             if not matches:
                 return f"无匹配: pattern={pattern}"
             return "\n".join(str(m.relative_to(self.project_root)) for m in matches)
@@ -597,22 +865,80 @@ class AgentCore:
     def _tool_grep(self, args: dict) -> str:
         pattern = args.get("pattern") or args.get("query", "")
         path = args.get("path") or str(self.project_root)
+        include = args.get("include") or args.get("glob")
         if not pattern:
             return "❌ grep: 缺少 pattern"
+        # 统一按 Python re 语法：无论走索引还是 ripgrep / grep 回退，无效正则给出同样的错误
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            return f"❌ grep: 无效的正则表达式: {e}"
+
+        resolved = self._resolve_path(path)
+        prefix = self._index_prefix(resolved)
+        index = self._get_project_index()
+        if index is None or prefix is None:
+            output = self._grep_fallback(pattern, str(resolved), include)
+        else:
+            output = None
+            if index.is_stale():
+                # 索引过期：优先用 ripgrep 回答本次查询，索引在后台刷新
+                if self.index_config["use_ripgrep"]:
+                    output = ripgrep_search(pattern, str(self.project_root), prefix, include)
+                if output is not None:
+                    index.refresh_in_background(self._get_tool_pool())
+                else:
+                    index.refresh()
+            if output is None:
+                try:
+                    hits = index.search(pattern, prefix=prefix, include=include)
+                except re.error as e:
+                    return f"❌ grep: 无效的正则表达式: {e}"
+                output = "\n".join(f"{rel}:{lineno}:{line[:300]}" for rel, lineno, line in hits)
+        if output is None:
+            return "❌ 搜索超时"
+        output = output.rstrip("\n")[:5000]
+        if not output:
+            return f"未找到匹配: pattern={pattern}"
+        return output
+
+    def _grep_fallback(self, pattern: str, path: str,
+                       include: Optional[str] = None) -> Optional[str]:
+        """无索引可用时（索引关闭 / 路径在项目外）：ripgrep → grep -rn（字面量 -F，否则 -P）"""
+        if self.index_config["use_ripgrep"]:
+            output = ripgrep_search(pattern, str(self.project_root), path, include)
+            if output is not None:
+                return output
+        includes = [f"--include={include}"] if include else [
+            "--include=*.py", "--include=*.md", "--include=*.yaml", "--include=*.json"]
+        literal = literal_text(pattern)
+        match = ["-F", "-e", literal] if literal is not None else ["-P", "-e", pattern]
         try:
             result = subprocess.run(
-                ["grep", "-rn", "--include=*.py", "--include=*.md",
-                 "--include=*.yaml", "--include=*.json", pattern, path],
+                ["grep", "-rn", *includes, *match, path],
                 capture_output=True, text=True, timeout=10,
             )
-            output = result.stdout[:5000]
-            if not output:
-                return f"未找到匹配: pattern={pattern}"
-            return output
+            if result.returncode > 1 and not result.stdout:
+                return f"❌ grep: {result.stderr.strip()[:300]}"
+            return result.stdout
         except subprocess.TimeoutExpired:
-            return "❌ 搜索超时"
-        except Exception as e:
-            return f"❌ 搜索失败: {e}"
+            return None
+
+    def _get_project_index(self) -> Optional[ProjectIndex]:
+        """获取项目搜索索引（index.enabled 关闭时返回 None）"""
+        if not self.index_config["enabled"]:
+            return None
+        if self._project_index is None:
+            self._project_index = ProjectIndex(str(self.project_root), config=self.index_config)
+        return self._project_index
+
+    def _index_prefix(self, path: Path) -> Optional[str]:
+        """路径相对项目根的前缀（项目外返回 None）"""
+        try:
+            rel = path.resolve().relative_to(self.project_root.resolve()).as_posix()
+        except ValueError:
+            return None
+        return "" if rel == "." else rel
 
     def _tool_write(self, args: dict) -> str:
         path = args.get("file_path") or args.get("path", "")
@@ -623,27 +949,101 @@ class AgentCore:
         try:
             p.parent.mkdir(parents=True, exist_ok=True)
             p.write_text(content, encoding="utf-8")
+            self._read_cache.invalidate(str(p))
+            if self._project_index is not None:
+                self._project_index.update_paths([p])
             return f"✅ 已写入: {p} ({len(content)} 字符)"
         except Exception as e:
             return f"❌ 写入失败: {e}"
 
-    async def _tool_shell(self, args: dict) -> str:
+    async def _tool_shell(self, args: dict,
+                          cb: Optional[AgentCallbacks] = None) -> str:
         cmd = args.get("command") or args.get("cmd", "")
         if not cmd:
             return "❌ shell: 缺少 command"
+
+        on_output = None
+        if cb and cb.on_tool_output:
+            on_output = lambda chunk: cb.on_tool_output("shell", chunk)
+
+        cfg = self.tool_config
+        timeout = cfg["shell_timeout"]
+        capture = dict(
+            timeout=timeout,
+            on_output=on_output,
+            head_chars=cfg["shell_head_chars"],
+            tail_chars=cfg["shell_tail_chars"],
+            stderr_chars=cfg["shell_stderr_chars"],
+        )
+        if cfg["persistent_shell"]:
+            runner = self._get_shell_session().run(cmd, **capture)
+        else:
+            runner = run_shell(cmd, cwd=str(self.project_root), **capture)
+        task = asyncio.ensure_future(runner)
+        self._shell_tasks.add(task)
         try:
-            result = subprocess.run(
-                cmd, shell=True, capture_output=True, text=True,
-                timeout=30, cwd=str(self.project_root),
-            )
-            output = result.stdout[:5000]
-            if result.returncode != 0:
-                output += f"\n❌ Exit code: {result.returncode}\n{result.stderr[:2000]}"
-            return output or "(无输出)"
-        except subprocess.TimeoutExpired:
-            return "❌ 命令超时（30s）"
+            result = await task
+        except asyncio.CancelledError:
+            if task not in self._aborted_shell_tasks:
+                raise
+            return "⚠️ 命令已被用户中止"
         except Exception as e:
             return f"❌ 执行失败: {e}"
+        finally:
+            self._shell_tasks.discard(task)
+            self._aborted_shell_tasks.discard(task)
+            # shell 命令可能修改任意文件
+            if self._project_index is not None:
+                self._project_index.mark_dirty()
+
+        output = result.stdout
+        if result.truncated:
+            output += f"\n摘要: {result.summary}（共 {result.stdout_chars} 字符）"
+        if result.timed_out:
+            note = "，shell 会话已重置" if cfg["persistent_shell"] else ""
+            return f"{output}\n❌ 命令超时（{timeout}s）{note}".lstrip("\n")
+        if result.returncode != 0:
+            output += f"\n❌ Exit code: {result.returncode}\n{result.stderr}"
+        return output or "(无输出)"
+
+    def _get_shell_session(self) -> PersistentShell:
+        """获取持久化 shell 会话（延迟创建，进程在首次执行时启动）"""
+        if self._shell_session is None:
+            self._shell_session = PersistentShell(cwd=str(self.project_root))
+        return self._shell_session
+
+    def shutdown(self) -> None:
+        """释放工具执行资源（持久化 shell 会话、线程池、搜索索引），完成归档并刷盘 Session 写入"""
+        if self._shell_session is not None:
+            self._shell_session.kill()
+            self._shell_session = None
+        if self._tool_pool is not None:
+            self._tool_pool.shutdown(wait=False)
+            self._tool_pool = None
+        if self._project_index is not None:
+            self._project_index.close()
+        # 未完成的后台归档：以规则摘要立即写入 .mem，不丢失记录
+        for task, job in list(self._layer2_jobs.items()):
+            self.compactor.finish_layer2(job)
+            task.cancel()
+        self._layer2_jobs.clear()
+        self.session_mgr.close()
+
+    def abort_tools(self) -> int:
+        """中止所有运行中的 shell 命令（杀死进程组）
+
+        Returns:
+            被中止的命令数
+        """
+        count = 0
+        for task in list(self._shell_tasks):
+            if not task.done():
+                self._aborted_shell_tasks.add(task)
+                task.cancel()
+                count += 1
+        if count:
+            logger.info("Aborted %d running shell command(s)", count)
+        return count
 
     def _resolve_path(self, path_str: str) -> Path:
         p = Path(path_str)
@@ -665,10 +1065,9 @@ class AgentCore:
     # ── 上下文压缩 ──────────────────────────────────────
 
     def _compact_layer1(self, cb: AgentCallbacks) -> None:
-        """Layer1 实时压缩（工具输出截断）"""
-        compressed, results = self.compactor.layer1_compress_batch(self.messages)
+        """Layer1 实时压缩（工具输出截断，最贵的工具结果优先，降到触发线以下即停止）"""
+        results = self._apply_layer1(until=self.budget.layer1_trigger)
         if results:
-            self.messages = compressed
             saved = sum(r.saved_tokens for r in results if hasattr(r, 'saved_tokens'))
             if saved > 0 and cb.on_compact:
                 cb.on_compact("layer1", saved)
@@ -676,9 +1075,8 @@ class AgentCore:
     def _try_compact_for_ptl(self, cb: AgentCallbacks) -> bool:
         """PTL 恢复策略：Layer1 压缩 → Layer2 归档 → 新 Session"""
         # Layer1: 压缩工具输出
-        compressed, results = self.compactor.layer1_compress_batch(self.messages)
+        results = self._apply_layer1()
         if results:
-            self.messages = compressed
             saved = sum(r.saved_tokens for r in results if hasattr(r, 'saved_tokens'))
             if saved > 0:
                 if cb.on_compact:
@@ -686,29 +1084,110 @@ class AgentCore:
                 logger.info("PTL: Layer1 saved %d tokens", saved)
                 return True
 
-        # Layer2: 归档
-        result = self.compactor.layer2_archive(model_interface=self.model)
-        if result:
-            if cb.on_compact:
-                cb.on_compact("layer2", 0)
-            logger.info("PTL: Layer2 archive triggered")
-            # 清空当前对话历史，开始新 session
-            self.messages.clear()
-            self.turn_count = 0
-            self.budget.reset()
-            return True
+        # Layer2: 归档（事件循环中后台摘要，新 session 立即开始）
+        if self.compactor.config["layer2_background"] and _in_event_loop():
+            if self._start_layer2(cb):
+                logger.info("PTL: Layer2 archive started in background")
+                return True
+        else:
+            result = self.compactor.layer2_archive(model_interface=self.model)
+            if result:
+                if cb.on_compact:
+                    cb.on_compact("layer2", 0)
+                logger.info("PTL: Layer2 archive triggered")
+                self._start_new_session()
+                return True
 
         if cb.on_warning:
             cb.on_warning("⛔ Token 硬限制且压缩恢复无效")
         return False
 
+    def _start_new_session(self) -> None:
+        """清空当前对话历史，开始新 session"""
+        self.messages.clear()
+        self.tool_dedup.clear()
+        self.turn_count = 0
+        self.budget.reset()
+        self.init_session()
+
+    def _start_layer2(self, cb: AgentCallbacks) -> bool:
+        """分离当前 session 并在后台归档，对话立即在新 session 中继续"""
+        job = self.compactor.begin_layer2()
+        if job is None:
+            return False
+        if cb.on_compact:
+            cb.on_compact("layer2_started", 0)
+        self._start_new_session()
+        # 与仍在进行的上一个归档串联：按 session 顺序写入 .mem
+        previous = next(reversed(self._layer2_jobs), None)
+        if previous is not None:
+            job.previous = self._layer2_jobs[previous]
+        task = asyncio.get_running_loop().create_task(self._run_layer2(job, cb, previous))
+        self._layer2_jobs[task] = job
+        task.add_done_callback(lambda t: self._layer2_jobs.pop(t, None))
+        return True
+
+    async def _run_layer2(self, job: Layer2Job, cb: AgentCallbacks,
+                          previous: Optional["asyncio.Task"] = None) -> None:
+        """后台 Layer2：分块摘要 → 等待上一个归档 → 写入 .mem → 新 session 注入摘要"""
+        def progress(done: int, total: int) -> None:
+            if cb.on_compact:
+                cb.on_compact(f"layer2 {done}/{total}", 0)
+
+        try:
+            result = await self.compactor.run_layer2(job, self.model, progress, after=previous)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Layer2 archive failed: %s | %s", job.session_id, e, exc_info=True)
+            if cb.on_error:
+                cb.on_error(f"❌ 归档失败: {e}")
+            return
+
+        # 新 session 的系统提示词补上刚归档的摘要
+        if self.session_mgr.get_current_session_id():
+            self.system_prompt = self._build_system_prompt()
+            self.budget.allocate(system_prompt=estimate_tokens(self.system_prompt))
+        if cb.on_compact:
+            cb.on_compact("layer2", max(0, result.original_tokens - result.summary_tokens))
+
+    async def wait_for_archives(self, timeout: Optional[float] = None) -> bool:
+        """等待所有后台 Layer2 归档完成
+
+        Args:
+            timeout: 最长等待秒数；None 表示一直等待
+
+        Returns:
+            是否全部完成（超时未完成的任务由 shutdown 以规则摘要落盘）
+        """
+        if not self._layer2_jobs:
+            return True
+        _, pending = await asyncio.wait(list(self._layer2_jobs), timeout=timeout)
+        if pending:
+            logger.warning("Layer2 archive still running after %ss: %d job(s)",
+                           timeout, len(pending))
+        return not pending
+
+    async def close(self, timeout: Optional[float] = ARCHIVE_WAIT_TIMEOUT) -> None:
+        """退出：等待后台归档（有上限）→ 归档当前 session → 释放资源"""
+        await self.wait_for_archives(timeout=timeout)
+        self.archive_session()
+        self.shutdown()
+
+    def _apply_layer1(self, until: Optional[float] = None) -> List[Any]:
+        """对尚未处理的消息增量执行 Layer1 压缩（水位线之后，最贵的工具结果优先）
+
+        Args:
+            until: 预算利用率降到该值以下时停止；None 表示处理全部未处理消息
+
+        Returns:
+            Layer1Result 列表
+        """
+        return self.compactor.layer1_compress_store(self.messages, until=until)
+
     def _build_messages(self) -> List[Dict]:
-        """构建模型消息列表"""
-        return [
-            {"role": m["role"], "content": m["content"]}
-            for m in self.messages
-            if m["role"] in ("user", "assistant", "tool_result")
-        ]
+        """构建模型消息列表（适配器格式的增量载荷）"""
+        return self.messages.payload(self.model, self.system_prompt or None)
 
     # ── Session 归档 ────────────────────────────────────
 
@@ -758,6 +1237,29 @@ class AgentCore:
 
     # ── 状态查询 ────────────────────────────────────────
 
+    def _record_usage(self, usage: Dict[str, Any], estimated_tokens: int = 0) -> None:
+        """累计模型调用的 Token 用量（含提示词缓存读写），并据此校正预算
+
+        Args:
+            usage: 提供方返回的 usage
+            estimated_tokens: 本次请求发送前预算中的估算用量（0 表示不参与校正）
+        """
+        for key in self.usage_stats:
+            if key != "requests":
+                self.usage_stats[key] += int(usage.get(key, 0) or 0)
+        self.usage_stats["requests"] += 1
+        if usage.get("cache_read_input_tokens") or usage.get("cache_creation_input_tokens"):
+            logger.debug("Prompt cache | read=%d | write=%d | input=%d",
+                         usage.get("cache_read_input_tokens", 0),
+                         usage.get("cache_creation_input_tokens", 0),
+                         usage.get("input_tokens", 0))
+        if self.token_calibrator is not None and estimated_tokens:
+            # 提示词缓存命中 / 写入的部分不计入 input_tokens，但同样占用上下文
+            actual = sum(int(usage.get(key, 0) or 0) for key in (
+                "input_tokens", "cache_creation_input_tokens", "cache_read_input_tokens"))
+            self.budget.set_token_scale(self.token_calibrator.observe(
+                self._calibration_key, estimated_tokens, actual))
+
     def get_stats(self) -> Dict[str, Any]:
         """获取 Agent 状态统计"""
         return {
@@ -770,11 +1272,17 @@ class AgentCore:
             "budget_action": self.budget.recommend_action(),
             "permission_mode": self.permission.current_mode,
             "resilience_stats": self.resilience.get_stats(),
+            "usage": dict(self.usage_stats),
+            "token_scale": round(self.budget.token_scale, 3),
+            "layer1": self.compactor.get_stats()["layer1"],
+            "layer2_pending": len(self._layer2_jobs),
+            "tool_dedup": dict(self.tool_dedup.stats),
         }
 
     def clear_messages(self) -> None:
         """清空对话历史"""
         self.messages.clear()
+        self.tool_dedup.clear()
         self.turn_count = 0
         self.budget._history = 0
         self.budget._tool_results = 0
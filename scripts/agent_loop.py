@@ -71,6 +71,11 @@ class CLICallbacks:
         dim = self._color("banner_dim", "#B8860B")
         self._print(f"[{dim}]🔧 调用工具: [{accent}]{tool_name}[/]")
 
+    def on_tool_output(self, tool_name: str, chunk: str):
+        """工具实时输出（shell 命令 stdout/stderr）→ 原样打印，不解析 Rich 标记"""
+        sys.stdout.write(chunk)
+        sys.stdout.flush()
+
     def on_status(self, status: str):
         """Agent Loop 状态变化"""
         # CLI 用 thinking/streaming 指示器，不额外渲染
@@ -129,9 +134,12 @@ class CLICallbacks:
             return False
 
     def on_compact(self, strategy: str, saved_tokens: int):
-        """压缩通知"""
+        """压缩通知（saved_tokens 为 0 时为进度通知，如后台归档的 layer2 3/8）"""
         dim = self._color("banner_dim", "#B8860B")
-        self._print(f"[dim {dim}]📦 压缩 ({strategy}): 节省 {saved_tokens:,} tokens[/]")
+        if saved_tokens:
+            self._print(f"[dim {dim}]📦 压缩 ({strategy}): 节省 {saved_tokens:,} tokens[/]")
+        else:
+            self._print(f"[dim {dim}]📦 压缩 ({strategy})[/]")
 
     def on_continuation(self, attempt: int):
         """续写通知"""
@@ -306,8 +314,8 @@ class AgentLoop:
             await self.core.send_message(user_input, callbacks=self._cli_cb)
             self._print()  # 空行分隔
 
-        # 归档 session
-        self.core.archive_session()
+        # 等待后台归档 → 归档当前 session → 释放 shell / 索引 / Session 写入
+        await self.core.close()
         return self.core.turn_count
 
     # ── 命令处理方法 ────────────────────────────────────
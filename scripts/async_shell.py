@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+ADDS Async Shell — 非阻塞、流式、可中止的 shell 执行
+
+设计目标：
+- 基于 asyncio.create_subprocess_shell，不阻塞事件循环（TUI 渲染、其他工作区）
+- stdout/stderr 按块流式回调（on_output），UI 可实时显示
+- 有界捕获：只保留头部 + 尾部（环形缓冲），巨量输出不驻留内存
+- 摘要增量计算：ToolFilterStream 在流上运行，获得完整输出的摘要
+- 超时 / 用户中止时杀死整个进程组（包括子进程）
+"""
+
+import asyncio
+import codecs
+import logging
+import os
+import signal
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Optional
+
+from summary_decision_engine import ToolFilterStream
+
+logger = logging.getLogger(__name__)
+
+
+# 每次从管道读取的字节数
+READ_CHUNK_BYTES = 65536
+
+# SIGTERM 后等待进程退出的时间（秒），超时则 SIGKILL
+KILL_GRACE_SECONDS = 1.0
+
+
+# ═══════════════════════════════════════════════════════════
+# 有界输出捕获
+# ═══════════════════════════════════════════════════════════
+
+class HeadTailBuffer:
+    """头部 + 尾部有界文本缓冲
+
+    前 head_chars 个字符原样保留，之后只在环形缓冲中保留最后
+    tail_chars 个字符，中间部分只计数。内存占用 O(head + tail)。
+    """
+
+    def __init__(self, head_chars: int = 3000, tail_chars: int = 2000):
+        self.head_chars = head_chars
+        self.tail_chars = tail_chars
+        self.total_chars = 0
+        self._head: list = []
+        self._head_len = 0
+        self._tail: Deque[str] = deque()
+        self._tail_len = 0
+
+    def write(self, text: str) -> None:
+        """追加文本"""
+        if not text:
+            return
+        self.total_chars += len(text)
+
+        if self._head_len < self.head_chars:
+            take = text[:self.head_chars - self._head_len]
+            self._head.append(take)
+            self._head_len += len(take)
+            text = text[len(take):]
+            if not text:
+                return
+
+        if self.tail_chars <= 0:
+            return
+        if len(text) >= self.tail_chars:
+            self._tail.clear()
+            self._tail.append(text[-self.tail_chars:])
+            self._tail_len = self.tail_chars
+            return
+        self._tail.append(text)
+        self._tail_len += len(text)
+        while self._tail_len - len(self._tail[0]) >= self.tail_chars:
+            self._tail_len -= len(self._tail.popleft())
+
+    @property
+    def omitted_chars(self) -> int:
+        """被丢弃的中间字符数"""
+        tail_kept = min(self._tail_len, self.tail_chars)
+        return max(0, self.total_chars - self._head_len - tail_kept)
+
+    @property
+    def truncated(self) -> bool:
+        return self.omitted_chars > 0
+
+    def getvalue(self) -> str:
+        """返回 头部 + 省略标记 + 尾部"""
+        head = "".join(self._head)
+        tail = "".join(self._tail)[-self.tail_chars:] if self._tail else ""
+        omitted = self.omitted_chars
+        if omitted:
+            return f"{head}\n... (省略 {omitted} 字符) ...\n{tail}"
+        return head + tail
+
+
+# ═══════════════════════════════════════════════════════════
+# 执行结果
+# ═══════════════════════════════════════════════════════════
+
+@dataclass
+class ShellResult:
+    """异步 shell 执行结果"""
+    stdout: str = ""              # 头部 + 尾部（可能已截断）
+    stderr: str = ""
+    returncode: Optional[int] = None
+    timed_out: bool = False
+    truncated: bool = False       # stdout 是否被截断
+    stdout_chars: int = 0         # stdout 原始总字符数
+    summary: str = ""             # 基于完整 stdout 流的增量摘要
+    duration: float = 0.0
+
+    @property
+    def success(self) -> bool:
+        return self.returncode == 0 and not self.timed_out
+
+
+# ═══════════════════════════════════════════════════════════
+# 进程组终止
+# ═══════════════════════════════════════════════════════════
+
+async def kill_process_group(proc: asyncio.subprocess.Process) -> None:
+    """终止进程及其整个进程组：SIGTERM → 等待 → SIGKILL"""
+    if proc.returncode is not None:
+        return
+
+    def _signal(sig: int) -> None:
+        try:
+            if hasattr(os, "killpg"):
+                os.killpg(proc.pid, sig)
+            else:
+                proc.kill()
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    _signal(signal.SIGTERM)
+    try:
+        await asyncio.wait_for(proc.wait(), timeout=KILL_GRACE_SECONDS)
+    except asyncio.TimeoutError:
+        _signal(getattr(signal, "SIGKILL", signal.SIGTERM))
+        try:
+            await asyncio.wait_for(proc.wait(), timeout=KILL_GRACE_SECONDS)
+        except asyncio.TimeoutError:
+            logger.warning("Process %d did not exit after SIGKILL", proc.pid)
+
+
+# ═══════════════════════════════════════════════════════════
+# 流式执行
+# ═══════════════════════════════════════════════════════════
+
+async def _pump(stream: asyncio.StreamReader, sink: HeadTailBuffer,
+                on_output: Optional[Callable[[str], None]],
+                filter_stream: Optional[ToolFilterStream] = None) -> None:
+    """从管道读取字节 → 增量解码 → 写入缓冲 / 摘要 / 回调"""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while True:
+        data = await stream.read(READ_CHUNK_BYTES)
+        text = decoder.decode(data, final=not data)
+        if text:
+            sink.write(text)
+            if filter_stream is not None:
+                filter_stream.feed(text)
+            if on_output:
+                try:
+                    on_output(text)
+                except Exception as e:
+                    logger.debug("on_output callback failed: %s", e)
+        if not data:
+            break
+
+
+async def run_shell(
+    command: str,
+    cwd: Optional[str] = None,
+    timeout: float = 30.0,
+    on_output: Optional[Callable[[str], None]] = None,
+    head_chars: int = 3000,
+    tail_chars: int = 2000,
+    stderr_chars: int = 2000,
+    tool_name: str = "shell",
+) -> ShellResult:
+    """异步执行 shell 命令（流式、有界、可中止）
+
+    进程在新的会话中启动，超时或所在任务被取消（用户中止）时，
+    整个进程组会被终止；取消会继续向上传播。
+
+    Args:
+        command: shell 命令
+        cwd: 工作目录
+        timeout: 超时秒数
+        on_output: 输出块回调（stdout 与 stderr 均会回调）
+        head_chars / tail_chars: stdout 保留的头部 / 尾部字符数
+        stderr_chars: stderr 头部与尾部各保留的字符数（各占一半）
+        tool_name: 传给 ToolFilterStream 的工具名
+
+    Returns:
+        ShellResult
+    """
+    start = time.monotonic()
+    proc = await asyncio.create_subprocess_shell(
+        command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        stdin=asyncio.subprocess.DEVNULL,
+        cwd=cwd,
+        start_new_session=True,
+    )
+
+    out_buf = HeadTailBuffer(head_chars, tail_chars)
+    err_buf = HeadTailBuffer(stderr_chars // 2, stderr_chars - stderr_chars // 2)
+    filter_stream = ToolFilterStream(tool_name=tool_name)
+    result = ShellResult()
+
+    pumps = asyncio.gather(
+        _pump(proc.stdout, out_buf, on_output, filter_stream),
+        _pump(proc.stderr, err_buf, on_output),
+    )
+    try:
+        await asyncio.wait_for(asyncio.shield(pumps), timeout=timeout)
+        await proc.wait()
+    except asyncio.TimeoutError:
+        result.timed_out = True
+        await kill_process_group(proc)
+        await _drain(pumps)
+    except asyncio.CancelledError:
+        await kill_process_group(proc)
+        await _drain(pumps)
+        raise
+
+    result.stdout = out_buf.getvalue()
+    result.stderr = err_buf.getvalue()
+    result.returncode = proc.returncode
+    result.truncated = out_buf.truncated
+    result.stdout_chars = out_buf.total_chars
+    result.summary = filter_stream.result()
+    result.duration = time.monotonic() - start
+    return result
+
+
+async def _drain(pumps: "asyncio.Future") -> None:
+    """进程终止后等待读取任务结束（管道关闭），超时则放弃"""
+    try:
+        await asyncio.wait_for(pumps, timeout=KILL_GRACE_SECONDS)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        pumps.cancel()
+    except Exception as e:
+        logger.debug("Output pump failed: %s", e)
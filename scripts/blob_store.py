@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+ADDS Blob Store — 内容寻址的压缩工具输出存储
+
+设计目标：
+- 工具输出按内容哈希存储：同一内容（如重复读取的同一文件）只存一份
+- 落盘前压缩：安装了 zstandard 时用 zstd，否则用 gzip（读取时按后缀自动识别）
+- .ses 中以 `blob:<哈希>` 引用，SessionManager.read_log / reconstruct_full_session 透明解压
+- 不再被任何 .ses / .mem 引用的 blob 由 `adds session gc` 清理
+
+目录结构：
+    .ai/sessions/blobs/
+    ├── 3f/3fa2...e1.zst      # 哈希前两位分目录
+    └── a0/a09c...47.gz
+
+使用方式：
+    store = BlobStore(".ai/sessions/blobs")
+    ref = store.put(tool_output)           # → "blob:3fa2...e1"
+    text = store.get(ref)
+    with store.open_text(ref) as f:        # 流式读取（大输出不整体读入内存）
+        for chunk in iter(lambda: f.read(65536), ""): ...
+    removed, freed = store.gc(referenced_refs)
+"""
+
+import gzip
+import hashlib
+import io
+import logging
+import re
+import time
+from pathlib import Path
+from typing import IO, Dict, Iterable, Iterator, Optional, Set, Tuple
+
+from session_writer import write_bytes_atomic
+
+try:
+    import zstandard as zstd  # 可选依赖
+except ImportError:
+    zstd = None
+
+logger = logging.getLogger(__name__)
+
+
+BLOB_PREFIX = "blob:"
+DIGEST_CHARS = 32                       # sha256 前 128 位
+CODEC_SUFFIXES = {"zstd": ".zst", "gzip": ".gz"}
+
+# .ses / .mem 中的引用：新格式 blob:<哈希>，旧格式 <session>-sesN.log
+BLOB_REF_PATTERN = re.compile(rf"{BLOB_PREFIX}[0-9a-f]{{{DIGEST_CHARS}}}")
+
+
+def is_blob_ref(name: str) -> bool:
+    return BLOB_REF_PATTERN.fullmatch(name or "") is not None
+
+
+def default_codec() -> str:
+    """可用的最佳压缩算法"""
+    return "zstd" if zstd is not None else "gzip"
+
+
+class BlobStore:
+    """内容寻址的压缩 blob 存储"""
+
+    def __init__(self, root: str, codec: str = "auto", level: int = 3):
+        """
+        Args:
+            root: blob 根目录
+            codec: "auto" | "zstd" | "gzip"（zstd 不可用时回退为 gzip）
+            level: 压缩级别
+        """
+        self.root = Path(root)
+        if codec == "auto":
+            codec = default_codec()
+        elif codec == "zstd" and zstd is None:
+            logger.warning("zstandard not installed, blob store falls back to gzip")
+            codec = "gzip"
+        if codec not in CODEC_SUFFIXES:
+            raise ValueError(f"codec 必须是 auto / zstd / gzip: {codec!r}")
+        self.codec = codec
+        self.level = level
+        # 已定位过的 blob: 哈希 → 路径
+        self._known: Dict[str, Path] = {}
+
+        self.stats = {"puts": 0, "dedup_hits": 0, "raw_bytes": 0, "stored_bytes": 0}
+
+    # ──── 写入 ────
+
+    @staticmethod
+    def digest(content: str) -> str:
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()[:DIGEST_CHARS]
+
+    def put(self, content: str, writer=None) -> str:
+        """存储内容，返回引用 `blob:<哈希>`（内容已存在时不重复写入）
+
+        Args:
+            content: 文本内容
+            writer: SessionWriter（传入时排队写出，保证先于 .ses 中的引用落盘）
+        """
+        digest = self.digest(content)
+        ref = BLOB_PREFIX + digest
+        self.stats["puts"] += 1
+        raw = content.encode("utf-8")
+        self.stats["raw_bytes"] += len(raw)
+        if self._locate(digest) is not None:
+            self.stats["dedup_hits"] += 1
+            return ref
+
+        data = self._compress(raw)
+        path = self._path(digest, self.codec)
+        if writer is not None:
+            writer.write_bytes(path, data)
+        else:
+            write_bytes_atomic(path, data)
+        self._known[digest] = path
+        self.stats["stored_bytes"] += len(data)
+        logger.debug("Blob stored: %s | %d → %d bytes", digest, len(raw), len(data))
+        return ref
+
+    # ──── 读取 ────
+
+    def get(self, ref: str) -> str:
+        """按引用读取并解压内容"""
+        digest = _digest_of(ref)
+        path = self._locate(digest)
+        if path is None or not path.exists():
+            raise FileNotFoundError(f"Blob not found: {ref}")
+        return self._decompress(path.read_bytes(), path.suffix).decode("utf-8")
+
+    def open_text(self, ref: str) -> IO[str]:
+        """按引用打开解压后的文本流（不做换行转换，与 get 的内容一致）"""
+        digest = _digest_of(ref)
+        path = self._locate(digest)
+        if path is None:
+            raise FileNotFoundError(f"Blob not found: {ref}")
+        if path.suffix == CODEC_SUFFIXES["zstd"]:
+            if zstd is None:
+                raise RuntimeError("读取 .zst blob 需要安装 zstandard")
+            stream = zstd.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+        else:
+            stream = gzip.open(path, "rb")
+        return io.TextIOWrapper(stream, encoding="utf-8", newline="")
+
+    def contains(self, ref: str) -> bool:
+        return self._locate(_digest_of(ref)) is not None
+
+    def refs(self) -> Iterator[str]:
+        """磁盘上所有 blob 的引用"""
+        for path in self._iter_paths():
+            yield BLOB_PREFIX + path.name.split(".", 1)[0]
+
+    def disk_usage(self) -> int:
+        """blob 占用的磁盘字节数"""
+        return sum(path.stat().st_size for path in self._iter_paths())
+
+    # ──── 清理 ────
+
+    def gc(self, referenced: Iterable[str], min_age: float = 0.0,
+           dry_run: bool = False) -> Tuple[int, int]:
+        """删除未被引用的 blob
+
+        Args:
+            referenced: 仍被引用的 blob 引用集合
+            min_age: 只删除修改时间早于该秒数的 blob（避免删掉引用尚未落盘的新 blob）
+            dry_run: 只统计不删除
+
+        Returns:
+            (删除的 blob 数, 释放的字节数)
+        """
+        keep: Set[str] = {_digest_of(ref) for ref in referenced if is_blob_ref(ref)}
+        cutoff = time.time() - min_age
+        removed = freed = 0
+        for path in list(self._iter_paths()):
+            digest = path.name.split(".", 1)[0]
+            if digest in keep:
+                continue
+            stat = path.stat()
+            if stat.st_mtime > cutoff:
+                continue
+            removed += 1
+            freed += stat.st_size
+            if not dry_run:
+                path.unlink()
+                self._known.pop(digest, None)
+        if not dry_run:
+            for sub in self.root.glob("*"):
+                if sub.is_dir() and not any(sub.iterdir()):
+                    sub.rmdir()
+        return removed, freed
+
+    # ──── 内部方法 ────
+
+    def _path(self, digest: str, codec: str) -> Path:
+        return self.root / digest[:2] / f"{digest}{CODEC_SUFFIXES[codec]}"
+
+    def _locate(self, digest: str) -> Optional[Path]:
+        # 每次都确认文件仍在（可能已被另一进程的 gc 删除）；排队写入中的 blob
+        # 此时会被再写一次，内容相同且原子替换，无副作用
+        path = self._known.get(digest)
+        if path is not None and path.exists():
+            return path
+        for codec in CODEC_SUFFIXES:
+            path = self._path(digest, codec)
+            if path.exists():
+                self._known[digest] = path
+                return path
+        return None
+
+    def _iter_paths(self) -> Iterator[Path]:
+        if not self.root.is_dir():
+            return
+        for suffix in CODEC_SUFFIXES.values():
+            yield from self.root.glob(f"??/*{suffix}")
+
+    def _compress(self, raw: bytes) -> bytes:
+        if self.codec == "zstd":
+            return zstd.ZstdCompressor(level=self.level).compress(raw)
+        return gzip.compress(raw, compresslevel=min(9, max(1, self.level * 2)), mtime=0)
+
+    @staticmethod
+    def _decompress(data: bytes, suffix: str) -> bytes:
+        if suffix == CODEC_SUFFIXES["zstd"]:
+            if zstd is None:
+                raise RuntimeError("读取 .zst blob 需要安装 zstandard")
+            return zstd.ZstdDecompressor().decompress(data)
+        return gzip.decompress(data)
+
+
+def _digest_of(ref: str) -> str:
+    return ref[len(BLOB_PREFIX):] if ref.startswith(BLOB_PREFIX) else ref
+
@@ -3,35 +3,73 @@
 ADDS Context Compactor — 两层压缩引擎
 
 设计目标：
-- Layer 1: 任务内实时压缩（工具输出超阈值 → 保存 .log + 替换为摘要）
-- Layer 2: 会话归档压缩（上下文超 80% → LLM 摘要 + .mem 归档 + 新 session）
+- Layer 1: 任务内实时压缩（工具输出超阈值 → 保存 blob + 替换为结构化摘要）；
+  按水位线增量处理，已处理的消息不再重复决策
+- Layer 2: 会话归档压缩（上下文超 80% → LLM 摘要 + .mem 归档 + 新 session）；
+  长记录按 Token 分块并发摘要（map）再分层合并（reduce），可作为后台任务运行；
+  完整记录全程流式处理（逐块读出 → 分块摘要 / 写入 .mem），内存占用与 session 大小无关
 
 参考：P0-2 路线图 — 两层压缩策略
 
 核心原则：
 - 压缩 ≠ 丢弃细节
 - 压缩 = 将细节移出当前上下文 + 保留回溯线索 + 结构化摘要留在链上
-- 错误信号永不压缩（KEEP_FULL）
+- 错误信号永不丢弃（KEEP_FULL：只用保留失败细节的提取器压缩，否则原样保留）
 """
 
+import asyncio
+import concurrent.futures
+import functools
+import itertools
 import logging
+import re
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
 
+from message_store import MessageStore
+from model.tokenizer import count_wide_chars
 from token_budget import TokenBudget, estimate_tokens
 from session_manager import SessionManager
+from tool_extractors import ExtractorRegistry, default_extractors
 from summary_decision_engine import (
     SummaryDecisionEngine,
     SummaryStrategy,
     has_error_signals,
-    apply_tool_filter,
     is_redundant_message,
     LAYER2_SUMMARY_PROMPT,
+    LAYER2_CHUNK_PROMPT,
+    LAYER2_MERGE_PROMPT,
 )
 
 logger = logging.getLogger(__name__)
 
 
+DEFAULT_LAYER2_CONFIG = {
+    "layer2_background": True,     # Agent Loop 中后台归档（新 session 立即开始）
+    "layer2_chunk_tokens": 8000,   # 分块大小上限（同时不超过模型窗口的 1/4）
+    "layer2_concurrency": 4,       # 同时进行的摘要请求数
+    "layer2_merge_fanin": 8,       # 每次合并的分块摘要数
+    "layer2_call_timeout": 120,    # 单次摘要请求超时（秒）
+}
+
+DEFAULT_LAYER1_CONFIG = {
+    "layer1_extract_tokens": 400,        # 工具输出摘要的 Token 预算
+    "layer1_extract_errors": True,       # 含错误信号的长输出也按结构提取（保留失败细节）
+    "layer1_error_extract_tokens": 1200,  # 含错误信号输出的摘要预算
+    "layer1_error_min_saving": 0.3,      # 提取结果至少节省该比例才替换原文
+}
+
+# 记录中每条消息以 "### [role]" 开头，分块优先在消息边界切分
+_MESSAGE_BOUNDARY = re.compile(r"(?=\n### \[)")
+_MESSAGE_START = "### ["
+
+# 规则摘要逐行扫描时单行的最大长度（超长行硬切，避免整行读入内存）
+_SUMMARY_LINE_CHARS = 64 * 1024
+
+# 完整记录：字符串，或按顺序产出片段的迭代器
+Record = Union[str, Iterable[str]]
+
+
 # ═══════════════════════════════════════════════════════════
 # 压缩结果数据结构
 # ═══════════════════════════════════════════════════════════
@@ -71,6 +109,29 @@ class Layer2Result:
         return min(1.0, self.summary_tokens / self.original_tokens)
 
 
+@dataclass
+class Layer2Job:
+    """一次 Layer2 归档：已从当前 session 分离，等待摘要完成后写入 .mem"""
+    session_id: str
+    record: Callable[[], Iterator[str]]    # 每次调用重新流式读取完整记录
+    original_tokens: int = 0
+    result: Optional[Layer2Result] = None
+    previous: Optional["Layer2Job"] = None   # 更早且尚未写入的归档，须先于本任务写入
+
+    @property
+    def done(self) -> bool:
+        return self.result is not None
+
+    @property
+    def full_record(self) -> str:
+        """完整记录（兼容接口：一次性读入内存，大 session 请用 record()）"""
+        return "".join(self.record())
+
+
+# 摘要进度回调：(已完成请求数, 总请求数)
+ProgressCallback = Callable[[int, int], None]
+
+
 # ═══════════════════════════════════════════════════════════
 # Context Compactor
 # ═══════════════════════════════════════════════════════════
@@ -93,10 +154,18 @@ class ContextCompactor:
         budget: TokenBudget,
         session_mgr: SessionManager,
         decision_engine: Optional[SummaryDecisionEngine] = None,
+        config: Optional[Dict[str, Any]] = None,
+        extractors: Optional[ExtractorRegistry] = None,
     ):
         self.budget = budget
         self.session_mgr = session_mgr
         self.engine = decision_engine or SummaryDecisionEngine()
+        # Layer1 / Layer2 配置（来自 .ai/settings.json 的 compaction 节）
+        defaults = {**DEFAULT_LAYER1_CONFIG, **DEFAULT_LAYER2_CONFIG}
+        self.config = dict(defaults)
+        self.config.update({k: v for k, v in (config or {}).items() if k in defaults})
+        # 工具输出的结构化提取器（可注册自定义提取器）
+        self.extractors = extractors or default_extractors()
 
         self._layer1_stats = {
             "total_compressions": 0,
@@ -106,6 +175,14 @@ class ContextCompactor:
             "llm_analyze_count": 0,
             "hybrid_count": 0,
             "dropped_count": 0,
+            # KEEP_FULL 长输出按结构提取（保留失败细节）的次数
+            "error_extract_count": 0,
+            # 各提取器的使用次数
+            "extractors": {},
+            # 增量扫描：每轮检查的消息数 / 因已处理而跳过的消息数
+            "scanned_count": 0,
+            "skipped_count": 0,
+            "watermark": 0,
         }
 
     # ══════════════════════════════════════════════════════
@@ -117,10 +194,10 @@ class ContextCompactor:
 
         处理流程：
         1. 决定摘要策略
-        2. KEEP_FULL → 完全保留
-        3. TOOL_FILTER → 规则提取摘要，长输出保存到 .log
+        2. KEEP_FULL → 保留；长输出只用保留失败细节的提取器压缩，原文保存到 blob
+        3. TOOL_FILTER → 结构化提取摘要（按 Token 预算），长输出保存到 blob
         4. LLM_ANALYZE → 标记高价值，等待 Layer2 处理
-        5. HYBRID → 规则提取 + 标记 LLM 精炼
+        5. HYBRID → 结构化提取 + 标记 LLM 精炼
         6. 冗余消息 → 丢弃
 
         Args:
@@ -141,8 +218,19 @@ class ContextCompactor:
         self._layer1_stats["total_compressions"] += 1
 
         if strategy == SummaryStrategy.KEEP_FULL:
-            # 错误信号：完全保留，不做任何压缩
+            # 错误信号：不丢弃任何失败细节
             self._layer1_stats["keep_full_count"] += 1
+            if (self.config["layer1_extract_errors"]
+                    and message.get("role") == "tool_result"
+                    and self.budget.tool_output_exceeds_threshold(content)):
+                new_message = self._extract_and_offload(message, result, "keep_full")
+                if new_message is not None:
+                    self._layer1_stats["error_extract_count"] += 1
+                    logger.debug(
+                        f"L1 KEEP_FULL extract: {original_chars} → {result.compressed_chars} chars "
+                        f"(saved to {result.log_filename})"
+                    )
+                    return new_message, result
             result.compressed_chars = original_chars
             result.compression_ratio  # 1.0
             logger.debug(f"L1 KEEP_FULL: {original_chars} chars (error signals)")
@@ -159,32 +247,12 @@ class ContextCompactor:
                 logger.debug(f"L1 DROP: redundant message")
                 return message, result
 
-            # 长工具输出 → 保存到 .log + 替换为摘要
+            # 长工具输出 → 原文保存到 blob + 替换为结构化摘要
             if self.budget.tool_output_exceeds_threshold(content):
-                summary = apply_tool_filter(content)
-                log_filename = self.session_mgr.save_tool_output(
-                    content, summary=summary, strategy="tool_filter"
-                )
-                result.saved_to_log = True
-                result.log_filename = log_filename
-                result.compressed_chars = len(summary)
-
-                # 更新预算
-                original_tokens = estimate_tokens(content)
-                summary_tokens = estimate_tokens(summary)
-                self.budget.deduct("tool_results", original_tokens)
-                self.budget.track("tool_results", summary_tokens)
-
-                new_message = {
-                    **message,
-                    "content": f"详见 `{log_filename}`\n摘要: {summary}",
-                }
-
-                saved = original_chars - result.compressed_chars
-                self._layer1_stats["total_saved_chars"] += saved
+                new_message = self._extract_and_offload(message, result, "tool_filter")
                 logger.debug(
                     f"L1 TOOL_FILTER: {original_chars} → {result.compressed_chars} chars "
-                    f"({saved} saved, saved to {log_filename})"
+                    f"(saved to {result.log_filename})"
                 )
                 return new_message, result
 
@@ -204,22 +272,7 @@ class ContextCompactor:
             self._layer1_stats["hybrid_count"] += 1
             # 先工具过滤，再标记 LLM 精炼
             if self.budget.tool_output_exceeds_threshold(content):
-                summary = apply_tool_filter(content)
-                log_filename = self.session_mgr.save_tool_output(
-                    content, summary=summary, strategy="hybrid"
-                )
-                result.saved_to_log = True
-                result.log_filename = log_filename
-                result.compressed_chars = len(summary)
-
-                new_message = {
-                    **message,
-                    "content": f"详见 `{log_filename}`\n摘要: {summary}",
-                }
-
-                saved = original_chars - result.compressed_chars
-                self._layer1_stats["total_saved_chars"] += saved
-                return new_message, result
+                return self._extract_and_offload(message, result, "hybrid"), result
 
             result.compressed_chars = original_chars
             return message, result
@@ -228,6 +281,119 @@ class ContextCompactor:
         result.compressed_chars = original_chars
         return message, result
 
+    def _extract_and_offload(self, message: Dict, result: Layer1Result,
+                             strategy: str) -> Optional[Dict]:
+        """按结构提取摘要，原文保存到 blob，返回替换后的消息
+
+        strategy 为 keep_full 时只使用保留失败细节的提取器，且提取结果
+        节省不足 layer1_error_min_saving 时放弃（返回 None，原文保留）。
+        """
+        content = message.get("content", "")
+        call_id = message.get("call_id")
+        entry = self.budget.ledger_entry(call_id) if call_id is not None else None
+        tool_name = entry.tool if entry is not None else ""
+
+        if strategy == "keep_full":
+            extraction = self.extractors.extract(
+                content, tool_name, budget_tokens=self.config["layer1_error_extract_tokens"],
+                errors_only=True)
+            if extraction is None or extraction.tokens > estimate_tokens(content) * (
+                    1 - self.config["layer1_error_min_saving"]):
+                return None
+        else:
+            extraction = self.extractors.extract(
+                content, tool_name, budget_tokens=self.config["layer1_extract_tokens"])
+        summary = extraction.text
+        counts = self._layer1_stats["extractors"]
+        counts[extraction.extractor] = counts.get(extraction.extractor, 0) + 1
+
+        log_filename = self.session_mgr.save_tool_output(content, summary=summary, strategy=strategy)
+        result.saved_to_log = True
+        result.log_filename = log_filename
+        result.compressed_chars = len(summary)
+
+        # 多行摘要另起一行，保持「详见 `ref`」在首行
+        separator = "\n" if "\n" in summary else " "
+        new_message = {
+            **message,
+            "content": f"详见 `{log_filename}`\n摘要:{separator}{summary}",
+        }
+        if strategy != "hybrid" or call_id is not None:
+            self._account_compaction(message, new_message["content"], summary, log_filename)
+        self._layer1_stats["total_saved_chars"] += len(content) - result.compressed_chars
+        return new_message
+
+    def _account_compaction(self, message: Dict, new_content: str,
+                            summary: str, log_filename: str) -> None:
+        """压缩后的预算修正：有账本记录的工具结果按 call_id 归因，否则按原文估算扣减"""
+        call_id = message.get("call_id")
+        if call_id is not None and self.budget.ledger_entry(call_id) is not None:
+            self.budget.record_compaction(call_id, estimate_tokens(new_content), log_filename)
+            return
+        self.budget.deduct("tool_results", estimate_tokens(message.get("content", "")))
+        self.budget.track("tool_results", estimate_tokens(summary))
+
+    def rank_by_cost(self, messages: List[Dict],
+                     indices: Optional[Iterable[int]] = None) -> List[int]:
+        """压缩顺序：账本中当前 Token 最多的工具结果优先，其余消息保持原顺序
+
+        Args:
+            messages: 消息列表（工具结果消息带 call_id）
+            indices: 只对这些下标排序（None 表示全部消息）
+
+        Returns:
+            消息下标列表
+        """
+        candidates = range(len(messages)) if indices is None else list(indices)
+        costs = {}
+        for i in candidates:
+            call_id = messages[i].get("call_id")
+            entry = self.budget.ledger_entry(call_id) if call_id is not None else None
+            if entry is not None and not entry.compacted:
+                costs[i] = entry.tokens
+        ranked = sorted(costs, key=lambda i: costs[i], reverse=True)
+        return ranked + [i for i in candidates if i not in costs]
+
+    def layer1_compress_store(self, store: MessageStore,
+                              until: Optional[float] = None) -> List[Layer1Result]:
+        """增量 Layer1 压缩：只处理水位线之后尚未处理的消息，原地修补存储
+
+        Layer1 的决策只取决于消息内容，处理过的消息（含保留原样的）
+        打上已处理标记，之后的轮次直接跳过，每轮开销为 O(新消息)。
+
+        Args:
+            store: 对话消息存储
+            until: 预算利用率降到该值以下时停止（剩余消息留到下一轮）；
+                   None 表示处理全部未处理消息
+
+        Returns:
+            Layer1Result 列表
+        """
+        pending = store.layer1_pending()
+        self._layer1_stats["skipped_count"] += len(store) - len(pending)
+
+        results = []
+        dropped = []
+        for i in self.rank_by_cost(store, pending):
+            if until is not None and self.budget.utilization <= until:
+                break
+            msg = store[i]
+            new_msg, result = self.layer1_compress(msg)
+            self._layer1_stats["scanned_count"] += 1
+            results.append(result)
+            if result.dropped and msg.get("tool_call_id"):
+                # 原生工具结果必须与 tool_use 配对，不能丢弃，只清空内容
+                store.replace(i, "(冗余输出已省略)", layer1_done=True)
+            elif result.dropped:
+                dropped.append(i)
+            elif new_msg["content"] != msg["content"]:
+                store.replace(i, new_msg["content"], layer1_done=True)
+            else:
+                store.mark_layer1_done(i)
+        store.remove(dropped)
+        self._layer1_stats["watermark"] = store.layer1_watermark
+        return results
+
     def layer1_compress_batch(self, messages: List[Dict]) -> Tuple[List[Dict], List[Layer1Result]]:
         """批量 Layer1 压缩
 
@@ -253,144 +419,318 @@ class ContextCompactor:
     # ══════════════════════════════════════════════════════
 
     def layer2_archive(self, model_interface=None) -> Optional[Layer2Result]:
-        """Layer2 归档：压缩当前 session → .mem 文件
+        """Layer2 归档（同步）：压缩当前 session → .mem 文件
 
         操作流程：
         1. 合并 .ses + .log → 完整记录
-        2. 调用 LLM 生成结构化摘要（如果有 model_interface）
+        2. 调用 LLM 生成结构化摘要（如果有 model_interface；长记录分块 map-reduce）
         3. 生成 .mem 文件（摘要 + 完整记录 + 链式指针）
         4. 回写 .ses 为摘要版
         5. 更新 TokenBudget
 
+        在事件循环中请改用 begin_layer2 + run_layer2（后台任务，不阻塞）。
+
         Args:
             model_interface: 模型接口（用于 LLM 摘要，如果为 None 则用简单摘要）
 
         Returns:
             归档结果，或 None（如果没有活跃 session）
         """
+        job = self.begin_layer2()
+        if job is None:
+            return None
+        if model_interface:
+            summary = _run_sync(self.summarize_async(model_interface, job.record()))
+        else:
+            summary = self._generate_simple_summary(job.record())
+        return self.finish_layer2(job, summary)
+
+    def begin_layer2(self) -> Optional[Layer2Job]:
+        """Layer2 第一步：分离当前 session（完整记录在摘要 / 归档时流式重建）
+
+        返回后调用方即可创建新 session 继续工作，摘要与归档由
+        run_layer2（后台）或 finish_layer2 完成。
+
+        Returns:
+            归档任务，或 None（如果没有活跃 session）
+        """
         session_id = self.session_mgr.get_current_session_id()
         if not session_id:
             logger.warning("No active session to archive")
             return None
+        self.session_mgr.detach_session()
+        # 分离后的 .ses 不再追加，归档前可多次重新读取
+        record = functools.partial(self.session_mgr.iter_full_session, session_id)
+        return Layer2Job(session_id=session_id, record=record,
+                         original_tokens=self.budget.used)
 
-        # Step 1: 重建完整记录
-        full_record = self.session_mgr.reconstruct_full_session(session_id)
+    async def run_layer2(self, job: Layer2Job, model_interface=None,
+                         on_progress: Optional[ProgressCallback] = None,
+                         after: Optional["asyncio.Future"] = None) -> Layer2Result:
+        """Layer2 后半段（异步）：分块摘要 → 写入 .mem
 
-        # Step 2: 生成摘要
-        if model_interface:
-            summary = self._generate_llm_summary(model_interface, full_record)
-        else:
-            summary = self._generate_simple_summary(full_record)
+        任务被取消时以规则摘要完成归档，完整记录不会丢失。
+
+        Args:
+            after: 更早的归档任务（对应 job.previous）；摘要可并行生成，
+                   写入 .mem 前先等它结束，使其用上 LLM 摘要
+        """
+        try:
+            if model_interface:
+                summary = await self.summarize_async(model_interface, job.record(), on_progress)
+            else:
+                summary = self._generate_simple_summary(job.record())
+            if after is not None:
+                await asyncio.wait([after])
+        except asyncio.CancelledError:
+            self.finish_layer2(job)
+            raise
+        return self.finish_layer2(job, summary)
+
+    def finish_layer2(self, job: Layer2Job, summary: Optional[str] = None) -> Layer2Result:
+        """Layer2 最后一步：写入 .mem、回写 .ses（同一任务只执行一次）
 
-        # Step 3-4: 归档
+        Args:
+            job: begin_layer2 返回的任务
+            summary: 结构化摘要（None 表示用规则摘要，如退出时摘要尚未完成）
+        """
+        if job.result is not None:
+            return job.result
+        # .mem 的 Prev/Next 链按 session 顺序连接：更早的归档先写入
+        if job.previous is not None:
+            self.finish_layer2(job.previous)
+            job.previous = None
+        if summary is None:
+            summary = self._generate_simple_summary(job.record())
+
+        chars = wide = 0
+
+        def counted() -> Iterator[str]:
+            nonlocal chars, wide
+            for piece in job.record():
+                chars += len(piece)
+                wide += count_wide_chars(piece)
+                yield piece
+
+        # 完整记录边读边写入 .mem
         mem_path = self.session_mgr.archive_session(
             summary=summary,
-            full_record=full_record,
+            full_record=counted(),
+            session_id=job.session_id,
         )
-
-        # Step 5: 计算结果
-        summary_tokens = estimate_tokens(summary)
-        original_tokens = self.budget.used
-
-        result = Layer2Result(
-            session_id=session_id,
+        job.result = Layer2Result(
+            session_id=job.session_id,
             mem_path=mem_path,
-            summary_tokens=summary_tokens,
-            original_tokens=original_tokens,
+            summary_tokens=estimate_tokens(summary),
+            original_tokens=job.original_tokens,
+            full_record_tokens=max(1, int(wide / 2 + (chars - wide) / 4)) if chars else 0,
         )
-
         logger.info(
-            f"L2 Archive: session={session_id}, "
-            f"tokens {original_tokens} → {summary_tokens} "
-            f"(ratio: {result.compression_ratio:.2f})"
+            f"L2 Archive: session={job.session_id}, "
+            f"tokens {job.original_tokens} → {job.result.summary_tokens} "
+            f"(ratio: {job.result.compression_ratio:.2f})"
         )
+        return job.result
 
-        return result
+    # ──── 分块 map-reduce 摘要 ────
 
-    def _generate_llm_summary(self, model_interface, full_record: str) -> str:
-        """调用 LLM 生成结构化摘要
+    def split_record(self, full_record: str, chunk_tokens: int) -> List[str]:
+        """按 Token 数把完整记录切成若干块（优先在消息边界，其次在行边界切分）"""
+        return list(self.iter_record_chunks((full_record,), chunk_tokens))
+
+    def iter_record_chunks(self, record: Iterable[str], chunk_tokens: int) -> Iterator[str]:
+        """流式分块：逐片读入记录，凑满一块即产出（同时只持有约一块的内容）
+
+        消息（以 "\\n### [" 开头）不超过块大小时整条放入一块；超过时按行切分，
+        超长单行按字符硬切。
+        """
+        max_chars = chunk_tokens * 2
+        current: List[str] = []
+        current_tokens = 0
+        part: List[str] = []
+        part_chars = part_wide = 0     # 逐片累加，与整条消息的 estimate_tokens 一致
+        oversized = False       # 当前消息超过块大小：逐行装块
+
+        def pack(piece: str) -> Optional[str]:
+            nonlocal current, current_tokens
+            tokens = estimate_tokens(piece)
+            done = None
+            if current and current_tokens + tokens > chunk_tokens:
+                done = "".join(current)
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += tokens
+            return done
+
+        for segment, starts_message in _iter_message_segments(record, max_chars):
+            if starts_message:
+                if not oversized:
+                    done = pack("".join(part))
+                    if done is not None:
+                        yield done
+                part, part_chars, part_wide, oversized = [], 0, 0, False
+            if oversized:
+                done = pack(segment)
+                if done is not None:
+                    yield done
+                continue
+            part.append(segment)
+            part_chars += len(segment)
+            part_wide += count_wide_chars(segment)
+            if part_wide / 2 + (part_chars - part_wide) / 4 >= chunk_tokens + 1:
+                oversized = True
+                for line in part:
+                    done = pack(line)
+                    if done is not None:
+                        yield done
+                part = []
+        if not oversized:
+            done = pack("".join(part))
+            if done is not None:
+                yield done
+        if current:
+            yield "".join(current)
+
+    async def summarize_async(self, model_interface, full_record: Record,
+                              on_progress: Optional[ProgressCallback] = None) -> str:
+        """生成结构化摘要：记录较短时单次调用，否则分块并发摘要后分层合并
+
+        记录按块流式读入，同时进行中的分块请求不超过 layer2_concurrency，
+        内存中只保留这些分块与已完成的分块摘要。
+        单个请求失败时该部分回退为规则摘要 / 直接拼接，不影响其余部分。
 
         Args:
             model_interface: ModelInterface 实例
-            full_record: 完整 session 记录
+            full_record: 完整 session 记录（字符串或片段迭代器）
+            on_progress: 进度回调 (已完成请求数, 总请求数)；分块数在读取过程中
+                         逐步确定，总请求数可能随之增大
 
         Returns:
-            LLM 生成的结构化摘要
+            结构化摘要
         """
-        # 截断过长记录（避免超出上下文窗口）
-        max_input_chars = int(model_interface.get_context_window() * 3)  # 约 3 字符/token
-        if len(full_record) > max_input_chars:
-            # 保留头部和尾部
-            half = max_input_chars // 2
-            full_record = full_record[:half] + "\n\n... (中间内容已截断) ...\n\n" + full_record[-half:]
-
-        prompt = LAYER2_SUMMARY_PROMPT.format(content=full_record)
+        chunk_tokens = max(256, min(int(self.config["layer2_chunk_tokens"]),
+                                    model_interface.get_context_window() // 4))
+        fanin = max(2, int(self.config["layer2_merge_fanin"]))
+        concurrency = max(1, int(self.config["layer2_concurrency"]))
+        record = (full_record,) if isinstance(full_record, str) else full_record
+        chunks = self.iter_record_chunks(record, chunk_tokens)
+        first = next(chunks, "")
+        second = next(chunks, None)
+
+        def request_total(n_chunks: int) -> int:
+            # 总请求数 = 分块数 + 各层合并次数
+            total, width = n_chunks, n_chunks
+            while width > 1:
+                width = -(-width // fanin)
+                total += width
+            return total
+
+        total = request_total(1 if second is None else 2)
+        done = 0
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def call(prompt: str, fallback: Callable[[], str]) -> str:
+            nonlocal done
+            async with semaphore:
+                try:
+                    text = await asyncio.wait_for(
+                        self._complete(model_interface, prompt),
+                        timeout=self.config["layer2_call_timeout"])
+                except Exception as e:  # 含超时；取消（CancelledError）照常传播
+                    logger.warning(f"L2 summary request failed, using fallback: {e}")
+                    text = ""
+            done += 1
+            if on_progress:
+                on_progress(done, total)
+            return text or fallback()
+
+        if second is None:
+            return await call(LAYER2_SUMMARY_PROMPT.format(content=first),
+                              lambda: self._generate_simple_summary(first))
+
+        # map：边读边提交，进行中的分块不超过 concurrency 个
+        parts: List[str] = []
+        in_flight: Set[asyncio.Future] = set()
+
+        async def summarize_chunk(index: int, chunk: str) -> None:
+            parts[index] = await call(
+                LAYER2_CHUNK_PROMPT.format(index=index + 1, total="?", content=chunk),
+                lambda: self._generate_simple_summary(chunk))
 
         try:
-            import asyncio
-            messages = [{"role": "user", "content": prompt}]
-
-            # 收集非流式响应
-            full_response = []
-            async def _call():
-                async for resp in model_interface.chat(
-                    messages, system_prompt=None, stream=False
-                ):
-                    if resp.content:
-                        full_response.append(resp.content)
-
-            try:
-                loop = asyncio.get_event_loop()
-                if loop.is_running():
-                    # 如果已在事件循环中，创建 task
-                    import concurrent.futures
-                    with concurrent.futures.ThreadPoolExecutor() as pool:
-                        future = pool.submit(asyncio.run, _call())
-                        future.result(timeout=120)
-                else:
-                    asyncio.run(_call())
-            except RuntimeError:
-                asyncio.run(_call())
-
-            summary = "".join(full_response)
-            if summary:
-                logger.info(f"LLM summary generated: {len(summary)} chars")
-                return summary
-
-        except Exception as e:
-            logger.warning(f"LLM summary failed, falling back to simple: {e}")
-
-        # 回退到简单摘要
-        return self._generate_simple_summary(full_record)
-
-    def _generate_simple_summary(self, full_record: str) -> str:
+            for index, chunk in enumerate(itertools.chain((first, second), chunks)):
+                if len(in_flight) >= concurrency:
+                    _, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                parts.append("")
+                total = request_total(len(parts))
+                in_flight.add(asyncio.ensure_future(summarize_chunk(index, chunk)))
+            await asyncio.gather(*in_flight)
+        finally:
+            for task in in_flight:
+                task.cancel()
+        logger.info(f"L2 map-reduce: {len(parts)} chunks, {total} requests")
+
+        while len(parts) > 1:
+            groups = [parts[i:i + fanin] for i in range(0, len(parts), fanin)]
+            parts = await asyncio.gather(*(
+                call(LAYER2_MERGE_PROMPT.format(count=len(group), content=_join_parts(group)),
+                     lambda group=group: _join_parts(group))
+                for group in groups
+            ))
+        return parts[0]
+
+    @staticmethod
+    async def _complete(model_interface, prompt: str) -> str:
+        """单次非流式调用，返回完整文本（模型返回错误时抛出）"""
+        parts = []
+        async for resp in model_interface.chat(
+            [{"role": "user", "content": prompt}], system_prompt=None, stream=False
+        ):
+            if resp.finish_reason == "error":
+                raise RuntimeError(resp.content)
+            if resp.content:
+                parts.append(resp.content)
+        return "".join(parts)
+
+    def _generate_simple_summary(self, full_record: Record) -> str:
         """简单摘要生成（无 LLM，基于规则提取）
 
         Args:
-            full_record: 完整 session 记录
+            full_record: 完整 session 记录（字符串或片段迭代器，逐行扫描）
 
         Returns:
             基于规则提取的摘要
         """
-        lines = full_record.split("\n")
+        record = (full_record,) if isinstance(full_record, str) else full_record
         decisions = []
         errors = []
         code_changes = []
         test_results = []
-
-        for line in lines:
+        # 无结构化信息时的回退：记录开头 500 字符
+        head: List[str] = []
+        head_chars = 0
+        total_chars = 0
+
+        for line in _iter_lines(record, _SUMMARY_LINE_CHARS):
+            total_chars += len(line)
+            if head_chars <= 500:
+                head.append(line)
+                head_chars += len(line)
             stripped = line.strip()
             # 提取决策
-            if any(kw in stripped.lower() for kw in ["决定", "决定", "decided", "conclusion"]):
+            if len(decisions) < 10 and any(
+                    kw in stripped.lower() for kw in ["决定", "决定", "decided", "conclusion"]):
                 decisions.append(stripped)
             # 提取错误
-            if has_error_signals(stripped):
+            if len(errors) < 5 and has_error_signals(stripped):
                 errors.append(stripped)
             # 提取代码变更
-            if stripped.startswith("新增:") or stripped.startswith("修改:") or stripped.startswith("删除:"):
+            if len(code_changes) < 10 and (
+                    stripped.startswith("新增:") or stripped.startswith("修改:") or stripped.startswith("删除:")):
                 code_changes.append(stripped)
             # 提取测试结果
-            if "passed" in stripped.lower() and ("failed" in stripped.lower() or "test" in stripped.lower()):
+            if len(test_results) < 5 and "passed" in stripped.lower() and (
+                    "failed" in stripped.lower() or "test" in stripped.lower()):
                 test_results.append(stripped)
 
         # 组装摘要
@@ -406,7 +746,8 @@ class ContextCompactor:
 
         if not parts:
             # 无结构化信息，截取前 500 字符
-            parts.append("### 会话概要\n" + full_record[:500] + "..." if len(full_record) > 500 else full_record)
+            opening = "".join(head)
+            parts.append("### 会话概要\n" + opening[:500] + "..." if total_chars > 500 else opening)
 
         return "\n\n".join(parts)
 
@@ -460,7 +801,7 @@ class ContextCompactor:
     def get_stats(self) -> Dict:
         """获取压缩统计"""
         return {
-            "layer1": dict(self._layer1_stats),
+            "layer1": {**self._layer1_stats, "extractors": dict(self._layer1_stats["extractors"])},
             "budget": self.budget.snapshot().to_dict(),
             "recommendation": self.budget.recommend_action(),
         }
@@ -479,6 +820,7 @@ class ContextCompactor:
             f"LLM_ANALYZE: {l1['llm_analyze_count']}  "
             f"HYBRID: {l1['hybrid_count']}\n"
             f"    Dropped: {l1['dropped_count']}  "
+            f"Error extracts: {l1['error_extract_count']}  "
             f"Saved chars: {l1['total_saved_chars']:,}\n"
             f"  Recommendation: {stats['recommendation']}"
         )
@@ -506,7 +848,65 @@ def create_compactor(
     budget = TokenBudget(context_window=context_window, config=config)
     session_mgr = SessionManager(sessions_dir=sessions_dir)
     decision_engine = SummaryDecisionEngine(config=config)
-    return ContextCompactor(budget, session_mgr, decision_engine)
+    return ContextCompactor(budget, session_mgr, decision_engine, config=config)
+
+
+def _iter_lines(record: Iterable[str], max_chars: int) -> Iterator[str]:
+    """把片段流切成行（保留换行符）；超长行从行首起每 max_chars 个字符硬切"""
+    buffer = ""
+    for piece in record:
+        buffer += piece
+        start = 0
+        while True:
+            end = buffer.find("\n", start)
+            if end < 0:
+                break
+            line = buffer[start:end + 1]
+            for i in range(0, len(line), max_chars):
+                yield line[i:i + max_chars]
+            start = end + 1
+        buffer = buffer[start:]
+        # 未结束的长行：先产出整段，余下部分不足 max_chars
+        cut = len(buffer) - len(buffer) % max_chars
+        for i in range(0, cut, max_chars):
+            yield buffer[i:i + max_chars]
+        buffer = buffer[cut:]
+    if buffer:
+        yield buffer
+
+
+def _iter_message_segments(record: Iterable[str], max_chars: int) -> Iterator[Tuple[str, bool]]:
+    """逐行产出 (片段, 是否开始新消息)
+
+    与 _MESSAGE_BOUNDARY 的切分一致：消息边界在 "\\n### [" 的换行符之前，
+    该换行符作为新消息的第一个片段。
+    """
+    held: Optional[str] = None
+    for segment in _iter_lines(record, max_chars):
+        if held is not None and held.endswith("\n") and segment.startswith(_MESSAGE_START):
+            if len(held) > 1:
+                yield held[:-1], False
+            yield "\n", True
+        elif held is not None:
+            yield held, False
+        held = segment
+    if held is not None:
+        yield held, False
+
+
+def _join_parts(parts: List[str]) -> str:
+    """按顺序拼接分段摘要（合并请求的输入 / 合并失败时的回退）"""
+    return "\n\n".join(f"#### 第 {i} 部分\n{part.strip()}" for i, part in enumerate(parts, 1))
+
+
+def _run_sync(coro) -> Any:
+    """在同步代码中运行协程（已在事件循环中时放到独立线程的新循环中执行）"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, coro).result()
 
 
 # ═══════════════════════════════════════════════════════════
@@ -258,7 +258,13 @@ class LocalBackend(ExecutionBackend):
         return True  # 本地执行始终可用
 
     def execute(self, context: ExecutionContext) -> ExecutionResult:
-        """在本地执行命令"""
+        """在本地执行命令
+
+        每次执行都启动独立的 /bin/sh，不复用 AgentCore 的持久化 shell 会话：
+        ExecutionContext 自带 env / work_dir / stdin / 超时，是一次隔离的执行，
+        共享会话会把上一个上下文的 cd、export 泄漏给下一个，绕过 SandboxPolicy
+        检查过的执行环境。
+        """
         limits = context.get_resource_limits()
         env = context.get_env_with_defaults()
         started_at = datetime.now().isoformat()
@@ -72,6 +72,11 @@ def add_mem_subparser(subparsers) -> None:
     search_parser.add_argument("--top-k", type=int, default=5,
                                 help="返回结果数")
 
+    # reindex
+    reindex_parser = mem_sub.add_parser("reindex", help="重建记忆检索倒排索引（memory_index.jsonl）")
+    reindex_parser.add_argument("--vectors", action="store_true",
+                                help="同时重建语义检索向量索引（需安装 numpy）")
+
     # add
     add_parser = mem_sub.add_parser("add", help="手动添加记忆到 index.mem")
     add_parser.add_argument("content", type=str, help="记忆内容")
@@ -110,6 +115,8 @@ def handle_mem_command(args, project_root: str = ".") -> None:
         _cmd_checkpoint(mgr, args.tag, promote=args.promote)
     elif args.mem_command == "search":
         _cmd_search(mgr, args.query, top_k=args.top_k)
+    elif args.mem_command == "reindex":
+        _cmd_reindex(mgr, vectors=args.vectors)
     elif args.mem_command == "add":
         _cmd_add(mgr, args.content, category=args.category,
                  role=args.role, module=args.module,
@@ -232,9 +239,10 @@ def _cmd_prune(mgr, module: str = "", status: str = "",
         return
 
     if confirm == "y":
-        for item in to_prune:
-            mgr.delete_item(item.id)
-        print(f"✅ 已清理 {len(to_prune)} 条记忆")
+        # 全部删除在一个事务中完成，只写一次 index.mem
+        with mgr.transaction():
+            removed = sum(1 for item in to_prune if mgr.delete_item(item.id))
+        print(f"✅ 已清理 {removed} 条记忆")
     else:
         print("已取消")
 
@@ -357,12 +365,13 @@ def _cmd_promote(mgr, tag: str) -> None:
         return
 
     if confirm == "y":
-        for item, _ in candidates:
-            mgr.update_item(item.id, {
-                "promoted": True,
-                "promoted_at": tag,
-            })
-            promoted.append(item.id)
+        with mgr.transaction():
+            for item, _ in candidates:
+                if mgr.update_item(item.id, {
+                    "promoted": True,
+                    "promoted_at": tag,
+                }):
+                    promoted.append(item.id)
 
         print(f"\n✅ 已晋升 {len(promoted)} 条记忆:")
         for pid in promoted:
@@ -391,6 +400,25 @@ def _cmd_search(mgr, query: str, top_k: int = 5) -> None:
         print()
 
 
+def _cmd_reindex(mgr, vectors: bool = False) -> None:
+    """adds mem reindex — 重建记忆检索索引"""
+    count = mgr.memory_index.rebuild()
+    stats = mgr.memory_index.stats()
+    print(f"🗂  记忆索引已重建: {count} 个文件, {stats['terms']} 个词项 → {mgr.memory_index.path}")
+    if not vectors:
+        return
+    from vector_index import VectorIndex, available
+
+    if not available():
+        print("⚠️  未安装 numpy，跳过向量索引（pip install numpy）")
+        return
+    index = mgr.vector_index or VectorIndex(str(mgr.sessions_dir))
+    count = index.rebuild()
+    stats = index.stats()
+    print(f"🧭 向量索引已重建: {count} 个文件, {stats['vectors']} 个段落向量 "
+          f"({stats['dim']} 维) → {index.root}")
+
+
 def _cmd_add(mgr, content: str, category: str = "experience",
              role: str = "common", module: str = "",
              tags: Optional[List[str]] = None,
@@ -0,0 +1,514 @@
+#!/usr/bin/env python3
+"""
+ADDS Memory Index — .mem 文件的持久化倒排索引（记忆检索加速）
+
+RegexMemoryRetriever 原本对每个关键词启动一次 rg 子进程扫描全部 .mem；
+归档积累到数百个后，一次多关键词查询就是多次全量扫描。索引把「词项 →
+文件 / 行号」倒排表保存在磁盘上，查询只做倒排表求交：
+
+- 分词：英文 / 数字按单词（小写，下划线与标点均为分隔符），
+  CJK（汉字 / 假名 / 谚文）按二元组（单字成段时保留单字）
+- 查询：关键词分词后逐词项取候选行求交，再用原行文本校验子串匹配，
+  结果与逐行 `keyword.lower() in line.lower()` 一致；
+  非二元组词项按子串匹配词表（"auth" 命中 "authentication"）
+- 增量：SessionManager.archive_session / MemoryManager.write_index_mem
+  写文件后直接追加该文件的倒排记录；查询前按 mtime/size 校验目录中的
+  .mem，外部修改 / 删除的文件重新索引 / 移除
+- 超过 MAX_INDEXED_BYTES 的文件只登记不建倒排表，查询时总是作为候选逐行扫描
+- 字段：按标题把每行归入 固定记忆 / 记忆索引（index.mem）或 摘要 / 完整记录
+  （.mem 归档），并统计各字段的行数与词项数，供 BM25F 排序使用
+
+存储（.ai/sessions/memory_index.jsonl）：第一行是按词项组织的快照，
+之后追加按文件组织的增量记录（与 catalog.jsonl 相同的半行容错方式）。
+行号表以字符串保存，只在查询用到该词项时才解码：
+
+    {"version": 1,
+     "files": {"20260409-153000.mem": [0, mtime_ns, size, false, sections, fields], ...},
+     "terms": {"jwt": "0:3,17;5:2", ...}}
+    {"file": "20260410-090000.mem", "mtime_ns": ..., "size": ..., "terms": {"jwt": "1,4"},
+     "sections": [[1, "record"], [9, "summary"], [20, "record"]],
+     "fields": {"summary": [行数, 词项数], "record": [行数, 词项数]}}
+    {"file": "20260411-101500.mem", "mtime_ns": ..., "size": ..., "large": true}
+    {"drop": "20260401-090000.mem"}
+
+同一文件的新记录整体替换旧内容；增量记录累积较多时合并为新快照。
+
+使用方式：
+    index = MemoryIndex(".ai/sessions")
+    index.update_file(mem_path)            # 写入 .mem 后
+    index.refresh()
+    hits = index.search("JWT")             # [(文件名, 行号, 行文本), ...]
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import uuid
+from dataclasses import astuple, dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from session_writer import write_bytes_atomic
+
+logger = logging.getLogger(__name__)
+
+
+INDEX_FILENAME = "memory_index.jsonl"
+INDEX_VERSION = 1
+
+# 超过此大小的 .mem 不建倒排表（归档时不占用内存 / 时间），查询时逐行扫描
+MAX_INDEXED_BYTES = 2 * 1024 * 1024
+
+# 增量记录数超过该值且超过文件数的一半时合并为新快照
+COMPACT_MIN_RECORDS = 64
+
+# CJK 码位区间：假名、扩展 A、统一汉字、谚文音节、兼容汉字
+_CJK_RANGES = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+_TOKEN_RE = re.compile(f"[{_CJK_RANGES}]+|[^\\W_{_CJK_RANGES}]+")
+_CJK_RE = re.compile(f"[{_CJK_RANGES}]")
+
+# 字段（BM25F）
+FIELD_FIXED = "fixed"       # index.mem 固定记忆区
+FIELD_INDEX = "index"       # index.mem 记忆索引表 / 冲突记录
+FIELD_SUMMARY = "summary"   # .mem 结构化摘要
+FIELD_RECORD = "record"     # .mem 完整记录（及头部元数据）
+
+INDEX_MEM_NAME = "index.mem"
+
+# 各字段的起始标题
+_INDEX_MEM_SECTIONS = {
+    "## 固定记忆": FIELD_FIXED,
+    "## 记忆索引": FIELD_INDEX,
+    "## 冲突记录": FIELD_INDEX,
+}
+_ARCHIVE_SECTIONS = {
+    "## 结构化摘要": FIELD_SUMMARY,
+    "## 完整记录": FIELD_RECORD,
+}
+
+# (文件名, 行号, 行文本)
+Hit = Tuple[str, int, str]
+
+
+@dataclass
+class FileEntry:
+    """已索引文件的元数据"""
+    mtime_ns: int = 0
+    size: int = 0
+    large: bool = False
+    # [[起始行号, 字段], ...]（按行号递增）
+    sections: List[List] = field(default_factory=list)
+    # 字段 → [行数, 词项数]
+    fields: Dict[str, List[int]] = field(default_factory=dict)
+
+    def field_of(self, line_number: int) -> str:
+        current = FIELD_RECORD
+        for start, name in self.sections:
+            if start > line_number:
+                break
+            current = name
+        return current
+
+
+def tokenize(text: str) -> List[str]:
+    """分词：单词（小写）+ CJK 二元组（可能重复，按出现顺序）"""
+    terms: List[str] = []
+    for run in _TOKEN_RE.findall(text.lower()):
+        if _CJK_RE.match(run) and len(run) > 1:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            terms.append(run)
+    return terms
+
+
+def _is_bigram(term: str) -> bool:
+    return len(term) == 2 and _CJK_RE.match(term) is not None
+
+
+def index_lines(lines: Iterable[str], name: str = "") -> Dict:
+    """为若干行（行号从 1 开始）建立倒排表与字段统计
+
+    Returns:
+        {"terms": {词项: "行号,..."}, "sections": [[起始行号, 字段], ...],
+         "fields": {字段: [行数, 词项数]}}
+    """
+    # index.mem 按固定记忆 / 索引表分区；归档在「完整记录」之后不再识别标题
+    # （工具输出中可能出现同样的标题文本）
+    if name == INDEX_MEM_NAME:
+        headings, current = _INDEX_MEM_SECTIONS, FIELD_FIXED
+    else:
+        headings, current = _ARCHIVE_SECTIONS, FIELD_RECORD
+    postings: Dict[str, List[str]] = {}
+    sections: List[List] = [[1, current]]
+    fields: Dict[str, List[int]] = {}
+    for number, line in enumerate(lines, 1):
+        if headings and line.startswith("## "):
+            heading = headings.get(line.strip())
+            if heading is not None:
+                if heading != current:
+                    current = heading
+                    sections.append([number, current])
+                if headings is _ARCHIVE_SECTIONS and current == FIELD_RECORD:
+                    headings = {}
+        terms = tokenize(line)
+        stats = fields.setdefault(current, [0, 0])
+        stats[0] += 1
+        stats[1] += len(terms)
+        label = str(number)
+        for term in set(terms):
+            postings.setdefault(term, []).append(label)
+    return {"terms": {term: ",".join(numbers) for term, numbers in postings.items()},
+            "sections": [s for i, s in enumerate(sections)
+                         if i + 1 == len(sections) or sections[i + 1][0] != s[0]],
+            "fields": fields}
+
+
+def _decode(numbers: str) -> Set[int]:
+    return set(map(int, numbers.split(",")))
+
+
+class MemoryIndex:
+    """sessions 目录中 .mem 文件的倒排索引"""
+
+    def __init__(self, sessions_dir: str = ".ai/sessions"):
+        self.sessions_dir = Path(sessions_dir)
+        self.path = self.sessions_dir / INDEX_FILENAME
+        self._files: Dict[str, FileEntry] = {}
+        # 快照：词项 → "文件ID:行号,...;文件ID:行号,..."，以及文件 ID → 文件名
+        self._base: Dict[str, str] = {}
+        self._base_names: Dict[str, str] = {}
+        # 快照之后被替换 / 删除的文件（其快照内容作废）
+        self._superseded: Set[str] = set()
+        # 快照之后追加的文件：文件名 → {词项: "行号,..."}
+        self._overlay: Dict[str, Dict[str, str]] = {}
+        self._vocab: Optional[Set[str]] = None
+        self._field_totals: Optional[Dict[str, List[int]]] = None
+        self._loaded = False
+        self._inode: Optional[int] = None
+        self._offset = 0
+        self._journal = 0        # 快照之后的增量记录数
+        # 本实例追加的记录（已在内存中生效，增量读取时跳过）
+        self._token = uuid.uuid4().hex[:12]
+        self._lock = threading.RLock()
+
+    # ──── 写入 ────
+
+    def update_file(self, path) -> None:
+        """（重新）索引一个 .mem 文件并追加记录
+
+        未加载索引的实例（如只负责写入的 SessionManager）只追加记录，不读取索引。
+        """
+        path = Path(path)
+        try:
+            stat = path.stat()
+            record = {"file": path.name, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+            if stat.st_size > MAX_INDEXED_BYTES:
+                record["large"] = True
+            else:
+                with open(path, encoding="utf-8", errors="replace", newline="\n") as f:
+                    record.update(index_lines(f, path.name))
+        except FileNotFoundError:
+            self.drop_file(path.name)
+            return
+        with self._lock:
+            if self._loaded:
+                self._apply(record)
+                record["by"] = self._token
+            self._append(record)
+
+    def drop_file(self, name: str) -> None:
+        with self._lock:
+            if self._loaded:
+                if name not in self._files:
+                    return
+                self._apply({"drop": name})
+                self._append({"by": self._token, "drop": name})
+            else:
+                self._append({"drop": name})
+
+    def _append(self, record: Dict) -> None:
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        self.sessions_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "ab+") as f:
+            # 崩溃残留的半行：先补换行，使其成为一行可丢弃的坏记录
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    line = "\n" + line
+            f.write(line.encode("utf-8"))
+
+    def _apply(self, record: Dict) -> None:
+        if "version" in record:
+            self._apply_snapshot(record)
+            return
+        self._journal += 1
+        name = record.get("drop") or record.get("file")
+        if not name:
+            return
+        self._vocab = self._field_totals = None
+        if name in self._files and name not in self._overlay:
+            self._superseded.add(name)
+        self._overlay.pop(name, None)
+        if "drop" in record:
+            self._files.pop(name, None)
+            return
+        self._files[name] = FileEntry(record.get("mtime_ns", 0), record.get("size", 0),
+                                      bool(record.get("large")), record.get("sections", []),
+                                      record.get("fields", {}))
+        self._overlay[name] = record.get("terms", {})
+
+    def _apply_snapshot(self, record: Dict) -> None:
+        self._files, self._base_names = {}, {}
+        for name, (file_id, *info) in record.get("files", {}).items():
+            self._files[name] = FileEntry(*info)
+            self._base_names[str(file_id)] = name
+        self._base = record.get("terms", {})
+        self._superseded, self._overlay = set(), {}
+        self._vocab = self._field_totals = None
+        self._journal = 0
+
+    # ──── 加载 / 校验 ────
+
+    def refresh(self) -> Dict[str, int]:
+        """读入其他实例追加的记录，并按 mtime/size 校验目录中的 .mem
+
+        Returns:
+            {"indexed": 重新索引的文件数, "dropped": 移除的文件数}
+        """
+        with self._lock:
+            self._load()
+            on_disk: Dict[str, Tuple[int, int]] = {}
+            try:
+                with os.scandir(self.sessions_dir) as it:
+                    for entry in it:
+                        if entry.name.endswith(".mem") and entry.is_file():
+                            stat = entry.stat()
+                            on_disk[entry.name] = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                pass
+
+            stats = {"indexed": 0, "dropped": 0}
+            for name, key in on_disk.items():
+                known = self._files.get(name)
+                if known is None or (known.mtime_ns, known.size) != key:
+                    self.update_file(self.sessions_dir / name)
+                    stats["indexed"] += 1
+            for name in [n for n in self._files if n not in on_disk]:
+                self.drop_file(name)
+                stats["dropped"] += 1
+
+            if self._inode is None or self._journal > max(COMPACT_MIN_RECORDS, len(self._files) // 2):
+                self.compact()      # 首次建立索引 / 增量记录过多：写出快照
+            if stats["indexed"] or stats["dropped"]:
+                logger.debug(f"Memory index refreshed: {stats}")
+            return stats
+
+    def _load(self) -> None:
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            if self._inode is not None:
+                self._reset()   # 索引文件被删除：重新索引全部文件
+            self._loaded = True
+            return
+        replay = not self._loaded or stat.st_ino != self._inode or stat.st_size < self._offset
+        if replay:
+            # 首次加载 / 文件被替换：内存状态清空，本实例写过的记录也要重放
+            self._reset()
+            self._inode = stat.st_ino
+            self._loaded = True
+        if stat.st_size > self._offset:
+            self._read_from(self._offset, skip_own=not replay)
+
+    def _reset(self) -> None:
+        self._apply_snapshot({})
+        self._inode, self._offset = None, 0
+
+    def _read_from(self, offset: int, skip_own: bool = True) -> None:
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        # 没有换行结尾的最后一行可能仍在写入，留到下次读取
+        end = data.rfind(b"\n") + 1
+        for raw in data[:end].splitlines():
+            if not raw.strip():
+                continue
+            try:
+                record = json.loads(raw)
+            except ValueError:
+                logger.warning("Memory index: skipping malformed record in %s", self.path.name)
+                continue
+            if skip_own and record.get("by") == self._token:
+                continue
+            self._apply(record)
+        self._offset = offset + end
+
+    def compact(self) -> None:
+        """合并快照与增量记录，改写为新快照"""
+        with self._lock:
+            names = sorted(self._files)
+            ids = {name: str(i) for i, name in enumerate(names)}
+            merged: Dict[str, List[str]] = {}
+            for term, postings in self._base.items():
+                for posting in postings.split(";"):
+                    file_id, _, numbers = posting.partition(":")
+                    name = self._base_names.get(file_id)
+                    if name in ids and name not in self._superseded:
+                        merged.setdefault(term, []).append(f"{ids[name]}:{numbers}")
+            for name, terms in self._overlay.items():
+                for term, numbers in terms.items():
+                    merged.setdefault(term, []).append(f"{ids[name]}:{numbers}")
+            snapshot = {
+                "version": INDEX_VERSION,
+                "files": {name: [int(ids[name]), *astuple(self._files[name])] for name in names},
+                "terms": {term: ";".join(postings) for term, postings in merged.items()},
+            }
+            data = (json.dumps(snapshot, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+            write_bytes_atomic(self.path, data)
+            self._apply_snapshot(snapshot)
+            self._inode = self.path.stat().st_ino
+            self._offset = len(data)
+
+    def rebuild(self) -> int:
+        """丢弃索引并重新索引目录中全部 .mem
+
+        Returns:
+            文件数
+        """
+        with self._lock:
+            try:
+                self.path.unlink()
+            except FileNotFoundError:
+                pass
+            self._reset()
+            self._loaded = False
+            self.refresh()
+            return len(self._files)
+
+    # ──── 查询 ────
+
+    def search(self, keyword: str) -> Optional[List[Hit]]:
+        """查找包含关键词（不区分大小写的子串）的行
+
+        Returns:
+            [(文件名, 行号, 行文本), ...]（按文件名、行号排序）；
+            关键词不含可索引的词项时返回 None（由调用方回退到逐行扫描）
+        """
+        terms = set(tokenize(keyword))
+        if not terms:
+            return None
+        with self._lock:
+            if not self._loaded:
+                self.refresh()
+            large = sorted(name for name, entry in self._files.items() if entry.large)
+            candidates = self._candidates(terms)
+
+        needle = keyword.lower()
+        hits: List[Hit] = []
+        for name in sorted(candidates):
+            for number, line in self._read_lines(name, candidates[name]):
+                if needle in line.lower():
+                    hits.append((name, number, line))
+        for name in large:
+            hits.extend(self._scan(name, needle))
+        hits.sort(key=lambda hit: (hit[0], hit[1]))
+        return hits
+
+    def _candidates(self, terms: Set[str]) -> Dict[str, Set[int]]:
+        """同时包含全部词项的候选行 {文件名: 行号集合}"""
+        candidates: Dict[str, Set[int]] = {}
+        # 长词项通常更少见，先处理以尽早缩小候选
+        for i, term in enumerate(sorted(terms, key=len, reverse=True)):
+            lines = self._lines_for(term)
+            if i == 0:
+                candidates = lines
+            else:
+                candidates = {name: candidates[name] & numbers
+                              for name, numbers in lines.items() if name in candidates}
+                candidates = {name: numbers for name, numbers in candidates.items() if numbers}
+            if not candidates:
+                break
+        return candidates
+
+    def _lines_for(self, term: str) -> Dict[str, Set[int]]:
+        """词项命中的 {文件名: 行号集合}（非二元组词项按子串匹配词表）"""
+        if _is_bigram(term):
+            matched = [term]
+        else:
+            matched = [t for t in self._vocabulary() if term in t]
+        lines: Dict[str, Set[int]] = {}
+        for vocab_term in matched:
+            postings = self._base.get(vocab_term)
+            if postings:
+                for posting in postings.split(";"):
+                    file_id, _, numbers = posting.partition(":")
+                    name = self._base_names[file_id]
+                    if name not in self._superseded:
+                        lines.setdefault(name, set()).update(_decode(numbers))
+            for name, file_terms in self._overlay.items():
+                numbers = file_terms.get(vocab_term)
+                if numbers:
+                    lines.setdefault(name, set()).update(_decode(numbers))
+        return lines
+
+    def field_of(self, name: str, line_number: int) -> str:
+        """行所属字段（未知文件 / 大文件视为完整记录）"""
+        with self._lock:
+            entry = self._files.get(name)
+        return entry.field_of(line_number) if entry is not None else FIELD_RECORD
+
+    def field_totals(self) -> Dict[str, List[int]]:
+        """各字段的 [总行数, 总词项数]（BM25 的文档数与平均长度）"""
+        with self._lock:
+            if self._field_totals is None:
+                totals: Dict[str, List[int]] = {}
+                for entry in self._files.values():
+                    for name, (lines, tokens) in entry.fields.items():
+                        total = totals.setdefault(name, [0, 0])
+                        total[0] += lines
+                        total[1] += tokens
+                self._field_totals = totals
+            return {name: list(total) for name, total in self._field_totals.items()}
+
+    def _vocabulary(self) -> Set[str]:
+        if self._vocab is None:
+            self._vocab = set(self._base).union(*self._overlay.values())
+        return self._vocab
+
+    def _read_lines(self, name: str, numbers: Set[int]) -> List[Tuple[int, str]]:
+        """读取文件中指定行号的行（去掉换行符）"""
+        wanted = sorted(numbers)
+        last = wanted[-1]
+        found: List[Tuple[int, str]] = []
+        try:
+            with open(self.sessions_dir / name, encoding="utf-8", errors="replace", newline="\n") as f:
+                i = 0
+                for number, line in enumerate(f, 1):
+                    if number == wanted[i]:
+                        found.append((number, line.rstrip("\n")))
+                        i += 1
+                    if number >= last:
+                        break
+        except OSError as e:
+            logger.debug(f"Memory index: failed to read {name}: {e}")
+        return found
+
+    def _scan(self, name: str, needle: str) -> List[Hit]:
+        """逐行扫描未建倒排表的大文件"""
+        hits: List[Hit] = []
+        try:
+            with open(self.sessions_dir / name, encoding="utf-8", errors="replace", newline="\n") as f:
+                for number, line in enumerate(f, 1):
+                    if needle in line.lower():
+                        hits.append((name, number, line.rstrip("\n")))
+        except OSError as e:
+            logger.debug(f"Memory index: failed to read {name}: {e}")
+        return hits
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"files": len(self._files),
+                    "large_files": sum(1 for entry in self._files.values() if entry.large),
+                    "terms": len(self._vocabulary()), "records": self._journal}
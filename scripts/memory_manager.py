@@ -12,22 +12,36 @@ ADDS Memory Manager — 记忆管理器（两层 + 进化 + 检索 + 冲突检
 参考：P0-3 路线图 — 记忆进化机制
 """
 
+import contextlib
+import functools
+import itertools
 import logging
 import re
-from dataclasses import dataclass, field
+import threading
+from dataclasses import dataclass, field, replace
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import IO, Dict, Iterator, List, Optional, Tuple
 
 from index_priority_sorter import (
     IndexPrioritySorter, MemoryItem,
     parse_index_mem, build_index_content,
 )
 from memory_conflict_detector import MemoryConflictDetector, ConflictRecord
-from memory_retriever import MemoryRetriever, RegexMemoryRetriever, SearchResult
+from memory_index import MemoryIndex
+from memory_retriever import (
+    MemoryRetriever, RegexMemoryRetriever, SearchResult, VectorMemoryRetriever,
+)
 from memory_detox import MemoryDetox, InvalidationResult
 from role_memory_injector import RoleAwareMemoryInjector
 from consistency_guard import ConsistencyGuard, RegressionAlarm
+from session_writer import write_bytes_atomic
+from vector_index import VectorIndex, available as vector_available, load_vector_config
+
+try:
+    import fcntl  # 仅 POSIX
+except ImportError:
+    fcntl = None
 
 logger = logging.getLogger(__name__)
 
@@ -107,6 +121,90 @@ class MemoryUpgradeEvaluation:
         return False
 
 
+@dataclass
+class IndexMemSnapshot:
+    """解析后的 index.mem（进程级缓存，按 inode / mtime / size 失效）"""
+    key: Tuple[int, int, int]
+    generation: int              # 每次内容变化递增（用于派生缓存失效）
+    content: str
+    items: List[MemoryItem]
+    index_entries: List[Dict]
+    conflict_records: List[Dict]
+
+
+@dataclass
+class IndexMemTransaction:
+    """index.mem 事务的工作副本（提交时整体渲染写出）"""
+    base: IndexMemSnapshot
+    items: List[MemoryItem]
+    index_entries: List[Dict]
+    conflict_records: List[Dict]
+    dirty: bool = False
+    view: Optional[IndexMemSnapshot] = None     # 渲染后的待写内容（修改后作废）
+
+
+class IndexMemConflictError(RuntimeError):
+    """事务提交时发现 index.mem 已被不加锁的写入方修改"""
+
+
+INDEX_MEM_LOCK_NAME = "index.mem.lock"
+
+
+class _IndexMemLock:
+    """index.mem 写锁：进程内可重入（线程互斥），进程间用 fcntl 文件锁"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._file: Optional[IO[str]] = None
+
+    def __enter__(self) -> "_IndexMemLock":
+        self._rlock.acquire()
+        if self._depth == 0:
+            try:
+                self._file = open(self.path, "a")
+                if fcntl is not None:
+                    fcntl.flock(self._file, fcntl.LOCK_EX)
+            except BaseException:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self._rlock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._depth -= 1
+        if self._depth == 0:
+            if fcntl is not None:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._rlock.release()
+
+
+def _in_transaction(method):
+    """方法体在 index.mem 事务中执行（读-改-写不与其他写入方交错，已在事务中时并入）"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.transaction():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+# 进程级缓存：index.mem 路径 → 解析结果 / 写锁（同一进程内的 MemoryManager 共用）
+_index_mem_cache: Dict[str, IndexMemSnapshot] = {}
+_index_mem_locks: Dict[str, _IndexMemLock] = {}
+_index_mem_cache_lock = threading.Lock()
+_index_mem_generations = itertools.count(1)
+
+
+def _copy_item(item: MemoryItem) -> MemoryItem:
+    return replace(item, tags=list(item.tags))
+
+
 @dataclass
 class MemoryStatus:
     """记忆系统状态概览"""
@@ -129,7 +227,7 @@ class MemoryManager:
     """记忆管理器 — 两层记忆 + 进化 + 排毒 + 角色化
 
     核心职责:
-    1. 读写 index.mem（固定记忆 + 索引）
+    1. 读写 index.mem（固定记忆 + 索引；transaction() 批量原子写入，多进程安全）
     2. 记忆进化（升级/降级）
     3. 冲突检测
     4. 角色化注入
@@ -186,13 +284,31 @@ class MemoryManager:
         # 子模块
         self.sorter = IndexPrioritySorter(project_root)
         self.conflict_detector = MemoryConflictDetector()
-        self.retriever = RegexMemoryRetriever(str(self.sessions_dir))
+        # 记忆检索倒排索引（写入 index.mem 等文件后增量更新）
+        self.memory_index = MemoryIndex(str(self.sessions_dir))
+        self.retriever = RegexMemoryRetriever(str(self.sessions_dir), index=self.memory_index)
+        # 语义检索（settings.json memory_vector.enabled 且安装了 numpy 时启用）
+        self.vector_index: Optional[VectorIndex] = None
+        vector_config = load_vector_config(project_root)
+        if vector_config["enabled"]:
+            if vector_available():
+                self.vector_index = VectorIndex(str(self.sessions_dir), dim=vector_config["dim"])
+                self.retriever = VectorMemoryRetriever(
+                    str(self.sessions_dir), index=self.vector_index, keyword=self.retriever,
+                    fusion=vector_config["fusion"], rrf_k=vector_config["rrf_k"],
+                )
+            else:
+                logger.warning("memory_vector enabled but numpy not installed, using keyword search")
         self.injector = RoleAwareMemoryInjector()
         self.detox = MemoryDetox(project_root)
         self.guard = ConsistencyGuard(self.retriever)
 
         # index.mem 路径
         self.index_mem_path = self.sessions_dir / "index.mem"
+        # 按角色渲染的注入段落: 角色 → (index.mem 代数, 文本)
+        self._injections: Dict[str, Tuple[int, str]] = {}
+        # 当前线程进行中的事务
+        self._local = threading.local()
 
     # ════════════════════════════════════════════
     # index.mem 读写
@@ -200,52 +316,178 @@ class MemoryManager:
 
     def ensure_index_mem(self) -> None:
         """确保 index.mem 存在"""
-        if not self.index_mem_path.exists():
-            content = self.DEFAULT_INDEX_MEM.format(
-                timestamp=datetime.now().strftime("%Y-%m-%d %H:%M")
-            )
-            self.index_mem_path.write_text(content, encoding="utf-8")
-            logger.info("Created default index.mem")
+        if self.index_mem_path.exists():
+            return
+        with self._index_mem_lock():
+            # 加锁后再确认：其他进程可能刚刚创建并写入
+            if not self.index_mem_path.exists():
+                content = self.DEFAULT_INDEX_MEM.format(
+                    timestamp=datetime.now().strftime("%Y-%m-%d %H:%M")
+                )
+                self._write_index_content(content)
+                logger.info("Created default index.mem")
 
     def read_index_mem(self) -> Tuple[str, List[MemoryItem]]:
-        """读取 index.mem
+        """读取 index.mem（事务中读到的是包含未提交修改的内容）
 
         Returns:
-            (raw_content, parsed_items)
+            (raw_content, parsed_items)；条目是缓存的副本，调用方可以直接修改
         """
+        snapshot = self._state()
+        return snapshot.content, [_copy_item(item) for item in snapshot.items]
+
+    def load_index_mem(self) -> IndexMemSnapshot:
+        """解析后的 index.mem（文件未变化时直接返回缓存，调用方不得修改其内容）"""
         self.ensure_index_mem()
+        path = str(self.index_mem_path.resolve())
+        stat = self.index_mem_path.stat()
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with _index_mem_cache_lock:
+            snapshot = _index_mem_cache.get(path)
+        if snapshot is not None and snapshot.key == key:
+            return snapshot
         content = self.index_mem_path.read_text(encoding="utf-8")
-
-        # 提取固定记忆区
-        fixed_section = self._extract_fixed_section(content)
-        items = parse_index_mem(fixed_section)
-
-        return content, items
+        return self._cache_index_mem(path, key, content)
+
+    @property
+    def index_generation(self) -> int:
+        """index.mem 当前内容的代数（内容变化后递增）"""
+        return self.load_index_mem().generation
+
+    def _cache_index_mem(self, path: str, key: Tuple[int, int, int],
+                         content: str) -> IndexMemSnapshot:
+        snapshot = IndexMemSnapshot(
+            key=key,
+            generation=next(_index_mem_generations),
+            content=content,
+            # 提取固定记忆区
+            items=parse_index_mem(self._extract_fixed_section(content)),
+            index_entries=self._parse_index_entries(content),
+            conflict_records=self._parse_conflict_records(content),
+        )
+        with _index_mem_cache_lock:
+            _index_mem_cache[path] = snapshot
+        return snapshot
+
+    def _write_index_content(self, content: str) -> None:
+        """原子写入 index.mem（临时文件 + rename），并直接以写入内容更新缓存（不再读回）"""
+        write_bytes_atomic(self.index_mem_path, content.encode("utf-8"))
+        stat = self.index_mem_path.stat()
+        self._cache_index_mem(str(self.index_mem_path.resolve()),
+                              (stat.st_ino, stat.st_mtime_ns, stat.st_size), content)
+        self._index_file(self.index_mem_path)
 
     def write_index_mem(self, items: List[MemoryItem],
                         index_entries: Optional[List[Dict]] = None,
                         conflict_records: Optional[List[Dict]] = None) -> None:
-        """写入 index.mem
+        """写入 index.mem（事务中只更新待写状态，提交时一次写出）
 
         Args:
             items: 固定记忆条目
-            index_entries: 记忆索引表行
-            conflict_records: 冲突记录
+            index_entries: 记忆索引表行（None 时保留现有）
+            conflict_records: 冲突记录（None 时保留现有）
         """
+        with self.transaction() as txn:
+            txn.items = list(items)
+            if index_entries is not None:
+                txn.index_entries = list(index_entries)
+            if conflict_records is not None:
+                txn.conflict_records = list(conflict_records)
+            txn.dirty = True
+            txn.view = None
+
+    # ──── 事务 ────
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[IndexMemTransaction]:
+        """index.mem 事务：块内的全部修改合并为一次原子写入
+
+        - 进程内按路径互斥，进程间在 index.mem.lock 上加 fcntl 文件锁
+        - 进入时以最新的文件内容建立工作副本，块内的读取能看到未提交的修改
+        - 正常退出且有修改时，校验文件版本（inode / mtime / size）未被
+          不加锁的写入方改动，再以临时文件 + rename 写出；版本不符时抛出
+          IndexMemConflictError，块内抛出异常时放弃全部修改
+        - 同一线程内嵌套调用并入最外层事务
+
+        用法:
+            with mgr.transaction():
+                mgr.update_item("exp-001", {"status": "demoted"})
+                mgr.delete_item("exp-004")
+        """
+        txn = getattr(self._local, "txn", None)
+        if txn is not None:
+            yield txn
+            return
+        self.ensure_index_mem()
+        with self._index_mem_lock():
+            base = self.load_index_mem()
+            txn = IndexMemTransaction(
+                base=base,
+                items=[_copy_item(item) for item in base.items],
+                index_entries=[dict(entry) for entry in base.index_entries],
+                conflict_records=[dict(record) for record in base.conflict_records],
+            )
+            self._local.txn = txn
+            try:
+                yield txn
+            finally:
+                self._local.txn = None
+            if txn.dirty:
+                self._commit(txn)
+
+    def _commit(self, txn: IndexMemTransaction) -> None:
+        try:
+            stat = self.index_mem_path.stat()
+            key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            key = None
+        if key != txn.base.key:
+            raise IndexMemConflictError(
+                f"{self.index_mem_path} 在事务期间被未加锁的写入方修改，本次修改未写入"
+            )
+        self._write_index_content(self._render_index_mem(txn))
+        logger.info(f"Updated index.mem ({len(txn.items)} items)")
+
+    def _state(self) -> IndexMemSnapshot:
+        """当前线程看到的 index.mem：事务中有未提交修改时为待写内容，否则为文件内容"""
+        txn = getattr(self._local, "txn", None)
+        if txn is None:
+            return self.load_index_mem()
+        if not txn.dirty:
+            return txn.base
+        if txn.view is None:
+            txn.view = IndexMemSnapshot(
+                key=txn.base.key,
+                generation=0,
+                content=self._render_index_mem(txn),
+                items=txn.items,
+                index_entries=txn.index_entries,
+                conflict_records=txn.conflict_records,
+            )
+        return txn.view
+
+    def _index_mem_lock(self) -> "_IndexMemLock":
+        path = str(self.index_mem_path.resolve())
+        with _index_mem_cache_lock:
+            lock = _index_mem_locks.get(path)
+            if lock is None:
+                lock = _index_mem_locks[path] = _IndexMemLock(self.sessions_dir / INDEX_MEM_LOCK_NAME)
+        return lock
+
+    def _render_index_mem(self, txn: IndexMemTransaction) -> str:
         # 构建头部
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M")
 
-        # 读取现有的链式指针信息
+        # 沿用现有的链式指针信息
         prev_val = "null"
         next_val = "null"
-        if self.index_mem_path.exists():
-            existing = self.index_mem_path.read_text(encoding="utf-8")
-            prev_match = re.search(r'# Prev:\s*(\S+)', existing)
-            next_match = re.search(r'# Next:\s*(\S+)', existing)
-            if prev_match:
-                prev_val = prev_match.group(1)
-            if next_match:
-                next_val = next_match.group(1)
+        existing = txn.base.content
+        prev_match = re.search(r'# Prev:\s*(\S+)', existing)
+        next_match = re.search(r'# Next:\s*(\S+)', existing)
+        if prev_match:
+            prev_val = prev_match.group(1)
+        if next_match:
+            next_val = next_match.group(1)
 
         header = f"""# ADDS 记忆索引
 # Page: 1
@@ -260,11 +502,16 @@ class MemoryManager:
 """
 
         # 构建固定记忆内容
-        fixed_content = build_index_content(items, index_entries, conflict_records)
+        return header + build_index_content(txn.items, txn.index_entries, txn.conflict_records)
 
-        # 写入
-        self.index_mem_path.write_text(header + fixed_content, encoding="utf-8")
-        logger.info(f"Updated index.mem ({len(items)} items)")
+    def _index_file(self, path: Path) -> None:
+        """把写入的记忆文件更新到检索索引（失败时检索前按 mtime/size 补齐）"""
+        try:
+            self.memory_index.update_file(path)
+            if self.vector_index is not None and self.vector_index.exists():
+                self.vector_index.update_file(path)
+        except OSError as e:
+            logger.warning(f"Failed to index {path.name}: {e}")
 
     def _extract_fixed_section(self, content: str) -> str:
         """提取 index.mem 的固定记忆区"""
@@ -301,10 +548,11 @@ class MemoryManager:
         # 过滤低置信度
         evaluations = [e for e in evaluations if e.confidence >= min_confidence]
 
-        # 执行升级
-        for ev in evaluations:
-            if ev.should_upgrade:
-                await self._upgrade_memory(ev)
+        # 执行升级（全部晋升合并为一次写入）
+        with self.transaction():
+            for ev in evaluations:
+                if ev.should_upgrade:
+                    await self._upgrade_memory(ev)
 
         return evaluations
 
@@ -395,54 +643,13 @@ class MemoryManager:
         2. 无冲突 → 写入 index.mem
         3. 有冲突 → 标记待审
         """
-        _, existing_items = self.read_index_mem()
-        existing_contents = [item.content for item in existing_items]
-
-        # 冲突扫描
-        conflicts = self.detox.check_new_memory_conflicts(
-            evaluation.content, existing_contents
-        )
-
-        if conflicts:
-            logger.warning(
-                f"Conflict detected for upgrade: {conflicts[0]['conflict_type']}"
-            )
-            return False
-
-        # 写入
-        new_item = MemoryItem(
-            id=f"exp-{len(existing_items)+1:03d}",
-            content=evaluation.content,
-            category=evaluation.category,
-            role=evaluation.role,
-            status="active",
-        )
-        existing_items.append(new_item)
-
-        # 容量检查 + 优先级排序
-        code_heat_map = self.sorter.build_code_heat_map()
-        current, overflow = self.sorter.sort_for_index(
-            existing_items, self.max_fixed_memory_chars, code_heat_map
-        )
-
-        self.write_index_mem(current)
-        self.add_index_entry(
-            time=datetime.now().strftime("%m-%d %H:%M"),
-            file="auto",
-            summary=f"晋升: {evaluation.content[:45]}..." if len(evaluation.content) > 45 else f"晋升: {evaluation.content}",
-            priority="高",
-        )
-
-        if overflow:
-            logger.info(f"Overflow: {len(overflow)} items demoted")
-            self._write_prev_index(overflow)
-
-        return True
+        return self._upgrade_memory_sync(evaluation)
 
+    @_in_transaction
     def _upgrade_memory_sync(self, evaluation: MemoryUpgradeEvaluation) -> bool:
         """同步版记忆升级（P0: 不需要 await，直接写入）
 
-        与 async 版 _upgrade_memory 逻辑相同，但不需要事件循环。
+        async 版 _upgrade_memory 直接调用本方法；读取、冲突扫描与写入在同一事务中。
         """
         _, existing_items = self.read_index_mem()
         existing_contents = [item.content for item in existing_items]
@@ -466,26 +673,11 @@ class MemoryManager:
             role=evaluation.role,
             status="active",
         )
-        existing_items.append(new_item)
-
-        # 容量检查 + 优先级排序
-        code_heat_map = self.sorter.build_code_heat_map()
-        current, overflow = self.sorter.sort_for_index(
-            existing_items, self.max_fixed_memory_chars, code_heat_map
-        )
-
-        self.write_index_mem(current)
-        self.add_index_entry(
-            time=datetime.now().strftime("%m-%d %H:%M"),
-            file="auto",
+        self._insert_item(
+            existing_items, new_item, file="auto",
             summary=f"晋升: {evaluation.content[:45]}..." if len(evaluation.content) > 45 else f"晋升: {evaluation.content}",
             priority="高",
         )
-
-        if overflow:
-            logger.info(f"Overflow: {len(overflow)} items demoted")
-            self._write_prev_index(overflow)
-
         return True
 
     def _write_prev_index(self, overflow_items: List[MemoryItem]) -> None:
@@ -507,6 +699,7 @@ class MemoryManager:
 """
         content = build_index_content(overflow_items)
         prev_path.write_text(header + content, encoding="utf-8")
+        self._index_file(prev_path)
 
     # ════════════════════════════════════════════
     # 记忆注入
@@ -519,15 +712,21 @@ class MemoryManager:
             role: 当前 Agent 角色
 
         Returns:
-            格式化的记忆段落文本
+            格式化的记忆段落文本（index.mem 未变化时复用该角色上次渲染的结果）
         """
-        _, items = self.read_index_mem()
+        snapshot = self._state()
+        cached = self._injections.get(role)
+        if cached is not None and cached[0] == snapshot.generation:
+            return cached[1]
 
         # 获取强制复读
-        forced_reminders = self.sorter.get_forced_reminders(items, role)
+        forced_reminders = self.sorter.get_forced_reminders(snapshot.items, role)
 
         # 角色过滤
-        return self.injector.build_memory_section(items, role, forced_reminders)
+        section = self.injector.build_memory_section(snapshot.items, role, forced_reminders)
+        if snapshot.generation:     # 事务中未提交的内容不缓存
+            self._injections[role] = (snapshot.generation, section)
+        return section
 
     # ════════════════════════════════════════════
     # 记忆检索
@@ -564,9 +763,12 @@ class MemoryManager:
             session_mem, failed_context, referenced
         )
 
-        # 更新 index.mem
+        # 更新 index.mem：评估期间文件可能已被其他写入方修改，按 ID 合并到最新内容
         if any(r.related for r in results):
-            self.write_index_mem(items)
+            evaluated = {item.id: item for item in referenced}
+            with self.transaction():
+                _, current = self.read_index_mem()
+                self.write_index_mem([evaluated.get(item.id, item) for item in current])
 
         return results
 
@@ -576,7 +778,7 @@ class MemoryManager:
 
     def get_status(self) -> MemoryStatus:
         """获取记忆系统状态概览"""
-        _, items = self.read_index_mem()
+        items = self._state().items
 
         # 计算容量
         content_str = "\n".join(item.content for item in items)
@@ -595,12 +797,12 @@ class MemoryManager:
 
     def get_item_by_id(self, item_id: str) -> Optional[MemoryItem]:
         """按 ID 查找记忆条目"""
-        _, items = self.read_index_mem()
-        for item in items:
+        for item in self._state().items:
             if item.id == item_id:
-                return item
+                return _copy_item(item)
         return None
 
+    @_in_transaction
     def update_item(self, item_id: str, updates: Dict) -> bool:
         """更新记忆条目
 
@@ -623,6 +825,7 @@ class MemoryManager:
 
         return False
 
+    @_in_transaction
     def add_item(self, content: str, category: str = "experience",
                  role: str = "common", module: str = "",
                  tags: Optional[List[str]] = None,
@@ -660,6 +863,16 @@ class MemoryManager:
             tags=tags or [],
             status="active",
         )
+        self._insert_item(
+            items, new_item, file="manual",
+            summary=summary or (content[:45] + "..." if len(content) > 45 else content),
+            priority="中",
+        )
+        return True
+
+    def _insert_item(self, items: List[MemoryItem], new_item: MemoryItem,
+                     file: str, summary: str, priority: str) -> None:
+        """加入新条目并追加索引行，一次写入 index.mem（溢出条目降级到 index-prev.mem）"""
         items.append(new_item)
 
         # 容量检查 + 优先级排序
@@ -668,20 +881,22 @@ class MemoryManager:
             items, self.max_fixed_memory_chars, code_heat_map
         )
 
-        self.write_index_mem(current)
-        self.add_index_entry(
-            time=datetime.now().strftime("%m-%d %H:%M"),
-            file="manual",
-            summary=summary or (content[:45] + "..." if len(content) > 45 else content),
-            priority="中",
-        )
+        snapshot = self._state()
+        index_entries = [dict(entry) for entry in snapshot.index_entries]
+        index_entries.append({
+            "time": datetime.now().strftime("%m-%d %H:%M"),
+            "file": file,
+            "summary": summary,
+            "priority": priority,
+        })
+        self.write_index_mem(current, index_entries,
+                             [dict(record) for record in snapshot.conflict_records])
 
         if overflow:
             logger.info(f"Overflow: {len(overflow)} items demoted")
             self._write_prev_index(overflow)
 
-        return True
-
+    @_in_transaction
     def delete_item(self, item_id: str) -> bool:
         """删除记忆条目（从 index.mem 移除）"""
         _, items = self.read_index_mem()
@@ -693,13 +908,14 @@ class MemoryManager:
         self.write_index_mem(new_items)
         return True
 
+    @_in_transaction
     def add_index_entry(self, time: str, file: str,
                         summary: str, priority: str = "中") -> None:
         """添加记忆索引条目"""
-        content, items = self.read_index_mem()
+        snapshot = self._state()
 
-        # 解析现有索引表
-        index_entries = self._parse_index_entries(content)
+        # 现有索引表
+        index_entries = [dict(entry) for entry in snapshot.index_entries]
         index_entries.append({
             "time": time,
             "file": file,
@@ -707,18 +923,18 @@ class MemoryManager:
             "priority": priority,
         })
 
-        # 解析冲突记录
-        conflict_records = self._parse_conflict_records(content)
+        conflict_records = [dict(record) for record in snapshot.conflict_records]
 
-        self.write_index_mem(items, index_entries, conflict_records)
+        self.write_index_mem(snapshot.items, index_entries, conflict_records)
 
+    @_in_transaction
     def add_conflict_record(self, description: str, source_a: str,
                             source_b: str, resolution: str) -> None:
         """添加冲突记录"""
-        content, items = self.read_index_mem()
+        snapshot = self._state()
 
-        index_entries = self._parse_index_entries(content)
-        conflict_records = self._parse_conflict_records(content)
+        index_entries = [dict(entry) for entry in snapshot.index_entries]
+        conflict_records = [dict(record) for record in snapshot.conflict_records]
         conflict_records.append({
             "time": datetime.now().strftime("%m-%d %H:%M"),
             "description": description,
@@ -727,7 +943,7 @@ class MemoryManager:
             "resolution": resolution,
         })
 
-        self.write_index_mem(items, index_entries, conflict_records)
+        self.write_index_mem(snapshot.items, index_entries, conflict_records)
 
     def checkpoint(self, tag: str) -> str:
         """记忆快照（checkpoint）
@@ -740,11 +956,11 @@ class MemoryManager:
         Returns:
             快照文件路径
         """
-        self.ensure_index_mem()
-        content = self.index_mem_path.read_text(encoding="utf-8")
+        content = self._state().content
 
         checkpoint_path = self.sessions_dir / f"index-{tag}.mem"
         checkpoint_path.write_text(content, encoding="utf-8")
+        self._index_file(checkpoint_path)
 
         logger.info(f"Memory checkpoint: {checkpoint_path}")
         return str(checkpoint_path)
@@ -3,21 +3,28 @@
 ADDS Memory Retriever — 记忆检索抽象接口
 
 设计目标：
-- P0: RegexMemoryRetriever（基于 rg 的关键词检索）
-- P1: VectorMemoryRetriever（向量索引语义检索，占位）
+- P0: RegexMemoryRetriever（关键词检索，基于 memory_index 倒排索引）
+- P1: VectorMemoryRetriever（本地向量索引语义检索，可与关键词检索 RRF 融合）
 - 统一抽象接口，支持渐进升级
 
 参考：P0-3 路线图 — 记忆检索方式
 """
 
 import asyncio
+import heapq
 import logging
+import math
 import re
-import subprocess
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
+
+from memory_index import (
+    FIELD_FIXED, FIELD_INDEX, FIELD_RECORD, FIELD_SUMMARY, INDEX_MEM_NAME,
+    Hit, MemoryIndex, tokenize,
+)
+from vector_index import VectorIndex, available as vector_available
 
 logger = logging.getLogger(__name__)
 
@@ -42,13 +49,15 @@ class MemoryRetriever(ABC):
 
 
 class RegexMemoryRetriever(MemoryRetriever):
-    """P0: 基于 rg 的关键词检索
+    """P0: 关键词检索（基于 .mem 倒排索引）
 
     实现策略:
     1. 从 query 中提取关键词（去停用词、保留名词/动词）
-    2. 用 rg 在 .ai/sessions/*.mem 和 index.mem 中搜索
-    3. 按匹配行数和关键词密度排序
-    4. 固定记忆区 + index.mem 的匹配权重加倍
+    2. 在 .ai/sessions/*.mem 和 index.mem 的倒排索引中查找命中行
+       （不启动子进程；索引按 mtime/size 增量更新）
+    3. BM25F 排序：词项稀有度（idf）、行长归一化、字段权重
+       （固定记忆 / 记忆索引 / 摘要 / 完整记录），堆选择 top_k
+    4. 长行只返回命中处前后的片段
     """
 
     # 中文停用词
@@ -67,8 +76,24 @@ class RegexMemoryRetriever(MemoryRetriever):
         "very", "just", "about", "above", "below", "between",
     }
 
-    def __init__(self, sessions_dir: str = ".ai/sessions"):
+    # BM25F 参数与字段权重（固定记忆 > 索引表 > 摘要 > 完整记录）
+    BM25_K1 = 1.2
+    BM25_B = 0.75
+    FIELD_BOOSTS = {
+        FIELD_FIXED: 3.0,
+        FIELD_INDEX: 2.0,
+        FIELD_SUMMARY: 1.5,
+        FIELD_RECORD: 1.0,
+    }
+
+    # 结果片段的最大字符数（长行截取命中处前后的窗口）
+    SNIPPET_CHARS = 160
+
+    def __init__(self, sessions_dir: str = ".ai/sessions",
+                 index: Optional[MemoryIndex] = None):
         self.sessions_dir = Path(sessions_dir)
+        # 与写入方（MemoryManager）共用同一个索引实例时，写入立即可见
+        self.index = index or MemoryIndex(str(self.sessions_dir))
 
     def _extract_keywords(self, query: str) -> List[str]:
         """从查询中提取搜索关键词
@@ -97,100 +122,93 @@ class RegexMemoryRetriever(MemoryRetriever):
 
         return keywords
 
-    async def _rg_search(self, keywords: List[str]) -> List[SearchResult]:
-        """用 rg 在 .mem 文件中搜索"""
+    async def _index_search(self, keywords: List[str]) -> List[SearchResult]:
+        """用倒排索引查找各关键词的命中行（在线程中执行，不阻塞事件循环）"""
         if not keywords:
             return []
+        return await asyncio.to_thread(self._index_search_sync, keywords)
 
-        results = []
-        mem_files = list(self.sessions_dir.glob("*.mem"))
-
-        if not mem_files:
-            return []
+    def _index_search_sync(self, keywords: List[str]) -> List[SearchResult]:
+        try:
+            self.index.refresh()
+        except OSError as e:
+            # 索引不可写（只读目录等）：回退到逐行扫描
+            logger.warning(f"Memory index unavailable, scanning .mem files: {e}")
+            mem_files = list(self.sessions_dir.glob("*.mem"))
+            return [r for kw in keywords for r in self._scan_files(kw, mem_files)]
 
-        for keyword in keywords:
-            try:
-                cmd = ["rg", "-n", "--no-heading", "-i", keyword]
-                cmd.extend(str(f) for f in mem_files)
+        results = []
+        hits_by_keyword: Dict[str, List[Hit]] = {}
+        for keyword in dict.fromkeys(kw.lower() for kw in keywords):
+            hits = self.index.search(keyword)
+            if hits is None:
+                # 关键词不含可索引的词项（纯标点等）
+                results.extend(self._scan_files(keyword, list(self.sessions_dir.glob("*.mem"))))
+                continue
+            hits_by_keyword[keyword] = hits
+        return self._score_bm25(hits_by_keyword) + results
 
-                proc = subprocess.run(
-                    cmd, capture_output=True, text=True,
-                    cwd=str(self.sessions_dir.parent.parent),
-                )
+    def _score_bm25(self, hits_by_keyword: Dict[str, List[Hit]]) -> List[SearchResult]:
+        """BM25F 打分：每行为一个文档，所在字段决定权重与平均长度
 
-                if proc.returncode != 0:
-                    continue
-
-                for line in proc.stdout.strip().split("\n"):
-                    if not line:
-                        continue
-
-                    # 解析 rg 输出: filename:linenum:content
-                    match = re.match(r'(.+?):(\d+):(.*)', line)
-                    if match:
-                        filepath, linenum, content = match.groups()
-                        filename = Path(filepath).name
-
-                        # 判断来源
-                        source = ".mem文件"
-                        if filename == "index.mem":
-                            source = "固定记忆"
-                            # 检查是否在索引区
-                            if "记忆索引" in content or "| 时间 |" in content:
-                                source = "记忆索引"
-
-                        results.append(SearchResult(
-                            source=source,
-                            file=filename,
-                            content=content.strip(),
-                            relevance=1.0 if source == "固定记忆" else 0.5,
-                            line_number=int(linenum),
-                        ))
-
-            except FileNotFoundError:
-                # rg 未安装，尝试 grep 回退
-                try:
-                    grep_cmd = ["grep", "-n", "-i", keyword]
-                    grep_cmd.extend(str(f) for f in mem_files)
-                    proc = subprocess.run(
-                        grep_cmd, capture_output=True, text=True,
-                        cwd=str(self.sessions_dir.parent.parent),
-                    )
-                    if proc.returncode == 0:
-                        for line in proc.stdout.strip().split("\n"):
-                            if not line:
-                                continue
-                            # grep 输出格式: filename:linenum:content
-                            match = re.match(r'(.+?):(\d+):(.*)', line)
-                            if match:
-                                filepath, linenum, content = match.groups()
-                                results.append(SearchResult(
-                                    source=Path(filepath).name,
-                                    file=Path(filepath).name,
-                                    content=content.strip(),
-                                    relevance=0.5,
-                                    line_number=int(linenum),
-                                ))
-                    else:
-                        results.extend(await self._python_search(keyword, mem_files))
-                except FileNotFoundError:
-                    # grep 也没有，回退到纯 Python 搜索
-                    if not hasattr(self, '_warned_grep_fallback'):
-                        logger.warning(
-                            "[ADDS] 未检测到 ripgrep (rg) 或 grep，"
-                            "记忆检索将使用 Python 回退搜索（较慢）。"
-                            "建议安装 ripgrep: brew install ripgrep"
-                        )
-                        self._warned_grep_fallback = True
-                    results.extend(await self._python_search(keyword, mem_files))
-            except Exception as e:
-                logger.debug(f"Search error for '{keyword}': {e}")
+        score = Σ idf(kw) · tf' / (k1 + tf')，
+        tf' = boost(字段) · tf / (1 - b + b · 行长 / 字段平均行长)，
+        idf 由命中行数（df）与索引总行数（N）计算。得分按最高分归一化到 0-1。
+        """
+        totals = self.index.field_totals()
+        total_lines = sum(lines for lines, _ in totals.values())
+        lines: Dict[Tuple[str, int], Tuple[str, List[str]]] = {}
+        idf: Dict[str, float] = {}
+        for keyword, hits in hits_by_keyword.items():
+            df = len(hits)
+            n = max(total_lines, df)
+            idf[keyword] = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for name, number, text in hits:
+                lines.setdefault((name, number), (text, []))[1].append(keyword)
 
+        results = []
+        for (name, number), (text, matched) in lines.items():
+            field_name = self.index.field_of(name, number)
+            field_lines, field_tokens = totals.get(field_name, (0, 0))
+            avg_length = field_tokens / field_lines if field_lines else 1.0
+            length = len(tokenize(text)) or 1
+            norm = 1 - self.BM25_B + self.BM25_B * length / max(avg_length, 1.0)
+            boost = self.FIELD_BOOSTS.get(field_name, 1.0)
+            lower = text.lower()
+            score = 0.0
+            for keyword in matched:
+                weighted = boost * lower.count(keyword) / norm
+                score += idf[keyword] * weighted / (self.BM25_K1 + weighted)
+            result = self._make_result(name, number, text, field_name)
+            result.content = self._snippet(text, matched)
+            result.relevance = score
+            results.append(result)
+
+        best = max((r.relevance for r in results), default=0.0)
+        if best > 0:
+            for r in results:
+                r.relevance = round(r.relevance / best, 4)
         return results
 
+    def _snippet(self, line: str, keywords: List[str]) -> str:
+        """行过长时截取第一个命中处前后的窗口"""
+        line = line.strip()
+        width = self.SNIPPET_CHARS
+        if len(line) <= width:
+            return line
+        lower = line.lower()
+        positions = [p for p in (lower.find(kw) for kw in keywords) if p >= 0]
+        center = min(positions) if positions else 0
+        start = max(0, min(center - width // 3, len(line) - width))
+        end = start + width
+        return ("…" if start > 0 else "") + line[start:end] + ("…" if end < len(line) else "")
+
     async def _python_search(self, keyword: str,
                              mem_files: List[Path]) -> List[SearchResult]:
         """回退: Python 实现的关键词搜索"""
+        return self._scan_files(keyword, mem_files)
+
+    def _scan_files(self, keyword: str, mem_files: List[Path]) -> List[SearchResult]:
         results = []
         kw_lower = keyword.lower()
 
@@ -199,36 +217,36 @@ class RegexMemoryRetriever(MemoryRetriever):
                 content = mem_path.read_text(encoding="utf-8")
                 for i, line in enumerate(content.split("\n"), 1):
                     if kw_lower in line.lower():
-                        filename = mem_path.name
-                        source = ".mem文件"
-                        if filename == "index.mem":
-                            source = "固定记忆"
-
-                        results.append(SearchResult(
-                            source=source,
-                            file=filename,
-                            content=line.strip(),
-                            relevance=1.0 if source == "固定记忆" else 0.5,
-                            line_number=i,
-                        ))
+                        results.append(self._make_result(mem_path.name, i, line))
             except Exception as e:
                 logger.debug(f"Failed to read {mem_path}: {e}")
 
         return results
 
+    def _make_result(self, filename: str, line_number: int, content: str,
+                     field_name: Optional[str] = None) -> SearchResult:
+        """按文件与字段（未知时按内容）判断来源，并给出基础相关度"""
+        source = ".mem文件"
+        if filename == INDEX_MEM_NAME:
+            source = "固定记忆"
+            # 检查是否在索引区
+            if field_name == FIELD_INDEX or (
+                    field_name is None and ("记忆索引" in content or "| 时间 |" in content)):
+                source = "记忆索引"
+        return SearchResult(
+            source=source,
+            file=filename,
+            content=content.strip(),
+            relevance=1.0 if source == "固定记忆" else 0.5,
+            line_number=line_number,
+        )
+
     def _rank_and_topk(self, results: List[SearchResult],
                        top_k: int) -> List[SearchResult]:
-        """排序并取 top_k
-
-        排序策略：
-        1. 固定记忆权重 ×2
-        2. 多关键词匹配加权
-        3. 按 relevance 降序
-        """
-        # 合并同文件同行的结果
-        merged: Dict[str, SearchResult] = {}
+        """合并同一行的结果并取相关度最高的 top_k（堆选择，不做全量排序）"""
+        merged: Dict[Tuple[str, int], SearchResult] = {}
         for r in results:
-            key = f"{r.file}:{r.line_number}"
+            key = (r.file, r.line_number)
             if key in merged:
                 merged[key].relevance += r.relevance * 0.5
             else:
@@ -239,15 +257,7 @@ class RegexMemoryRetriever(MemoryRetriever):
                     relevance=r.relevance,
                     line_number=r.line_number,
                 )
-
-        # 固定记忆权重加倍
-        for r in merged.values():
-            if r.source == "固定记忆":
-                r.relevance *= 2.0
-
-        # 排序
-        ranked = sorted(merged.values(), key=lambda x: x.relevance, reverse=True)
-        return ranked[:top_k]
+        return heapq.nlargest(top_k, merged.values(), key=lambda r: r.relevance)
 
     async def search(self, query: str, top_k: int = 5) -> List[SearchResult]:
         """搜索记忆
@@ -263,22 +273,85 @@ class RegexMemoryRetriever(MemoryRetriever):
         if not keywords:
             return []
 
-        results = await self._rg_search(keywords)
+        results = await self._index_search(keywords)
         return self._rank_and_topk(results, top_k)
 
 
 class VectorMemoryRetriever(MemoryRetriever):
-    """P1: 基于向量索引的语义检索（占位，P1 实现）
+    """P1: 基于本地向量索引的语义检索（vector_index.VectorIndex）
 
-    技术选型:
-    - LanceDB: 轻量本地向量数据库
-    - 嵌入模型: 本地 small model 或 API 调用
-    - 混合检索: 向量 + rg 融合排序
+    - 段落向量按余弦相似度取 top_k（numpy 批量矩阵乘，memmap 读取）
+    - fusion=True 时与关键词检索结果做倒数排名融合（RRF）：
+      关键词命中行按所在段落与向量结果对齐，两路都靠前的段落排在最前
+    - 未安装 numpy 时回退到关键词检索
     """
 
+    def __init__(self, sessions_dir: str = ".ai/sessions",
+                 index: Optional[VectorIndex] = None,
+                 keyword: Optional[MemoryRetriever] = None,
+                 fusion: bool = True, rrf_k: int = 60):
+        self.sessions_dir = Path(sessions_dir)
+        self.index = index or VectorIndex(str(self.sessions_dir))
+        self.keyword = keyword or RegexMemoryRetriever(str(self.sessions_dir))
+        self.fusion = fusion
+        self.rrf_k = rrf_k
+
     async def search(self, query: str, top_k: int = 5) -> List[SearchResult]:
-        """P1 实现: 向量语义检索"""
-        logger.warning("VectorMemoryRetriever not implemented, falling back to regex")
-        # 回退到正则检索
-        fallback = RegexMemoryRetriever()
-        return await fallback.search(query, top_k)
+        """语义检索（可与关键词检索融合）"""
+        if not vector_available():
+            logger.warning("numpy not installed, vector search falls back to keyword search")
+            return await self.keyword.search(query, top_k)
+
+        # 融合时两路各取更深的候选，保证融合后的 top_k 不受单路截断影响
+        depth = max(top_k * 4, 20) if self.fusion else top_k
+        vector = await asyncio.to_thread(self._vector_search_sync, query, depth)
+        if not self.fusion:
+            return vector
+        keyword = await self.keyword.search(query, depth)
+        return reciprocal_rank_fusion([keyword, vector], top_k, k=self.rrf_k,
+                                      key=self._passage_key)
+
+    def _vector_search_sync(self, query: str, top_k: int) -> List[SearchResult]:
+        self.index.refresh()
+        results = []
+        for name, start, end, score in self.index.search(query, top_k):
+            text = self.index.read_passage(name, (start, end))
+            if len(text) > RegexMemoryRetriever.SNIPPET_CHARS:
+                text = text[:RegexMemoryRetriever.SNIPPET_CHARS] + "…"
+            results.append(SearchResult(
+                source="固定记忆" if name == INDEX_MEM_NAME else ".mem文件",
+                file=name,
+                content=text,
+                relevance=score,
+                line_number=start,
+            ))
+        return results
+
+    def _passage_key(self, result: SearchResult) -> Tuple[str, int]:
+        span = self.index.passage_of(result.file, result.line_number)
+        return result.file, span[0] if span else result.line_number
+
+
+def reciprocal_rank_fusion(result_lists: List[List[SearchResult]], top_k: int,
+                           k: int = 60, key=None) -> List[SearchResult]:
+    """倒数排名融合：score = Σ 1 / (k + 排名)，相关度按最高分归一化到 0-1
+
+    Args:
+        result_lists: 各路检索结果（各自按相关度降序）
+        top_k: 返回结果数
+        k: RRF 常数（越大越平滑，排名靠后的结果也有贡献）
+        key: 结果 → 对齐键（默认按 文件 + 行号）；同键结果保留先出现的一条
+    """
+    key = key or (lambda r: (r.file, r.line_number))
+    fused: Dict[Tuple[str, int], SearchResult] = {}
+    scores: Dict[Tuple[str, int], float] = {}
+    for results in result_lists:
+        for rank, result in enumerate(results, 1):
+            item = key(result)
+            fused.setdefault(item, result)
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    best = heapq.nlargest(top_k, scores.items(), key=lambda kv: kv[1])
+    if not best:
+        return []
+    top = best[0][1]
+    return [replace(fused[item], relevance=round(score / top, 4)) for item, score in best]
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+ADDS Message Store — 增量维护的对话消息存储
+
+设计目标：
+- 每条消息只估算一次 Token 数（缓存在条目上），总量增量维护
+- 每种提供方格式（由适配器的 message_format_key 区分）维护一份
+  append-only 的载荷列表：每轮只格式化新增消息，O(新消息) 而非 O(历史)
+- 压缩只修补受影响的条目（replace/remove），载荷中对应位置原地更新
+- Layer1 水位线：条目记录是否已被 Layer1 处理，水位线之前全部已处理，
+  每轮压缩只检查新增 / 内容变化的条目
+- 条目是 dict 子类，保持 {"role", "content"} 的读取方式不变
+
+使用方式：
+    store = MessageStore()
+    store.append({"role": "user", "content": "你好"})
+    payload = store.payload(model, system_prompt)   # 传给 model.chat()
+    store.replace(0, "压缩后的内容")                  # 载荷同步更新
+"""
+
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from model.base import FormattedMessages, format_plain_message
+from token_budget import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class StoredMessage(dict):
+    """存储中的消息（dict 子类 + 缓存的 Token 数）
+
+    内容只能通过 MessageStore.replace 修改，直接改 dict 不会刷新缓存。
+    layer1_done 表示当前内容已经过 Layer1 处理（替换内容后重置）。
+    """
+    __slots__ = ("tokens", "layer1_done")
+
+    def __init__(self, role: str, content: str, **extra: Any):
+        super().__init__(role=role, content=content, **extra)
+        self.tokens = estimate_tokens(content)
+        self.layer1_done = False
+
+
+class _PlainFormat:
+    """未实现消息格式化接口的模型（如测试替身）使用默认格式"""
+    message_format_key = "plain"
+    format_message = staticmethod(format_plain_message)
+
+    @staticmethod
+    def format_system(system_prompt: str) -> None:
+        return None
+
+
+@dataclass
+class _PayloadState:
+    """某一提供方格式的载荷状态"""
+    messages: FormattedMessages
+    formatter: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]
+    positions: List[int] = field(default_factory=list)  # 条目下标 → 载荷下标（-1 表示跳过）
+    head: int = 0                                        # 载荷头部的 system 消息数
+
+
+class MessageStore:
+    """对话消息存储（可迭代 / 下标访问，行为类似 list[dict]）"""
+
+    def __init__(self, messages: Optional[Iterable[Dict[str, Any]]] = None):
+        self._entries: List[StoredMessage] = []
+        self._tokens = 0
+        self._payloads: Dict[str, _PayloadState] = {}
+        # 该下标之前的条目都已经过 Layer1 处理
+        self._layer1_watermark = 0
+        for message in messages or ():
+            self.append(message)
+
+    # ──── list 兼容接口 ────
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[StoredMessage]:
+        return iter(self._entries)
+
+    def __reversed__(self) -> Iterator[StoredMessage]:
+        return reversed(self._entries)
+
+    def __getitem__(self, index):
+        return self._entries[index]
+
+    def __bool__(self) -> bool:
+        return bool(self._entries)
+
+    # ──── 修改 ────
+
+    @property
+    def total_tokens(self) -> int:
+        """所有消息的 Token 估算总和"""
+        return self._tokens
+
+    def append(self, message: Dict[str, Any]) -> StoredMessage:
+        """追加消息，返回存储条目（可读取 .tokens）"""
+        if isinstance(message, StoredMessage):
+            entry = message
+        else:
+            extra = {k: v for k, v in message.items() if k not in ("role", "content")}
+            entry = StoredMessage(message.get("role", "user"), message.get("content", ""), **extra)
+        self._entries.append(entry)
+        self._tokens += entry.tokens
+        return entry
+
+    def extend(self, messages: Iterable[Dict[str, Any]]) -> None:
+        for message in messages:
+            self.append(message)
+
+    def replace(self, index: int, content: str, layer1_done: bool = False) -> StoredMessage:
+        """替换条目内容（如 Layer1 压缩），只更新该条目及其载荷位置
+
+        Args:
+            index: 条目下标
+            content: 新内容
+            layer1_done: 新内容是否已经过 Layer1 处理（否则下一轮重新检查）
+
+        Returns:
+            新条目
+        """
+        old = self._entries[index]
+        extra = {k: v for k, v in old.items() if k not in ("role", "content")}
+        entry = StoredMessage(old["role"], content, **extra)
+        entry.layer1_done = layer1_done
+        if not layer1_done:
+            self._layer1_watermark = min(self._layer1_watermark, index)
+        self._entries[index] = entry
+        self._tokens += entry.tokens - old.tokens
+
+        for key, state in list(self._payloads.items()):
+            if index >= len(state.positions):
+                continue
+            pos = state.positions[index]
+            formatted = state.formatter(entry)
+            if pos >= 0 and formatted is not None:
+                state.messages[pos] = formatted
+            elif pos >= 0 or formatted is not None:
+                # 可见性变化（跳过 ↔ 保留）：该格式的载荷整体重建
+                self._invalidate(key)
+        return entry
+
+    def remove(self, indices: Iterable[int]) -> int:
+        """删除若干条目（如 Layer1 丢弃冗余消息）
+
+        Returns:
+            删除的条数
+        """
+        drop = set(indices)
+        if not drop:
+            return 0
+        kept = []
+        for i, entry in enumerate(self._entries):
+            if i in drop:
+                self._tokens -= entry.tokens
+            else:
+                kept.append(entry)
+        self._layer1_watermark -= sum(1 for i in drop if i < self._layer1_watermark)
+        self._entries = kept
+        for key in list(self._payloads):
+            self._invalidate(key)
+        return len(drop)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._tokens = 0
+        self._layer1_watermark = 0
+        for key in list(self._payloads):
+            self._invalidate(key)
+
+    # ──── Layer1 水位线 ────
+
+    @property
+    def layer1_watermark(self) -> int:
+        """Layer1 水位线（之前的条目都已处理）"""
+        return self._layer1_watermark
+
+    def layer1_pending(self) -> List[int]:
+        """尚未经过 Layer1 处理的条目下标（先推进水位线，只扫描其后的条目）"""
+        entries = self._entries
+        mark = self._layer1_watermark
+        while mark < len(entries) and entries[mark].layer1_done:
+            mark += 1
+        self._layer1_watermark = mark
+        return [i for i in range(mark, len(entries)) if not entries[i].layer1_done]
+
+    def mark_layer1_done(self, index: int) -> None:
+        """标记条目已经过 Layer1 处理（内容未变化时使用）"""
+        self._entries[index].layer1_done = True
+
+    # ──── 提供方载荷 ────
+
+    def payload(self, model, system_prompt: Optional[str] = None) -> FormattedMessages:
+        """获取适配器格式的消息载荷（增量格式化新增条目）
+
+        返回的列表是存储持有的活动对象：后续 append/replace 会原地更新它，
+        调用方不要修改。
+
+        Args:
+            model: 模型适配器（ModelInterface）
+            system_prompt: 系统提示词（适配器要求放在消息列表中时使用）
+        """
+        if not isinstance(getattr(model, "message_format_key", None), str):
+            model = _PlainFormat
+        key = model.message_format_key
+        state = self._payloads.get(key)
+        if state is None:
+            state = _PayloadState(messages=FormattedMessages(format_key=key),
+                                  formatter=model.format_message)
+            self._payloads[key] = state
+
+        # system 头部：变化时原地更新
+        head = model.format_system(system_prompt) if system_prompt else None
+        if state.messages.system_prompt != system_prompt:
+            if head is not None and state.head:
+                state.messages[0] = head
+            elif head is not None:
+                state.messages.insert(0, head)
+                state.head = 1
+                state.positions = [p + 1 if p >= 0 else p for p in state.positions]
+            elif state.head:
+                del state.messages[0]
+                state.head = 0
+                state.positions = [p - 1 if p >= 0 else p for p in state.positions]
+            state.messages.system_prompt = system_prompt
+
+        for entry in self._entries[len(state.positions):]:
+            formatted = state.formatter(entry)
+            if formatted is None:
+                state.positions.append(-1)
+            else:
+                state.positions.append(len(state.messages))
+                state.messages.append(formatted)
+        return state.messages
+
+    def _invalidate(self, key: str) -> None:
+        """清空某格式的载荷（保留列表对象，下次 payload() 时重建）"""
+        state = self._payloads[key]
+        del state.messages[state.head:]
+        state.positions = []
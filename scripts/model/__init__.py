@@ -7,7 +7,7 @@ ADDS Model Layer — 大模型调用层
 - SDK: 直接编程调用（codebuddy-agent-sdk）
 """
 
-from .base import ModelInterface, ModelResponse
+from .base import ModelInterface, ModelResponse, SystemBlock, SystemPrompt
 from .factory import ModelFactory
 from .api_adapter import APIAdapter
 from .cli_adapter import CLIAdapter
@@ -16,6 +16,8 @@ from .sdk_adapter import SDKAdapter
 __all__ = [
     "ModelInterface",
     "ModelResponse",
+    "SystemBlock",
+    "SystemPrompt",
     "ModelFactory",
     "APIAdapter",
     "CLIAdapter",
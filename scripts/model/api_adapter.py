@@ -3,12 +3,26 @@ ADDS Model Layer — API 调用适配器
 
 基于 anthropic 库，使用 Anthropic 兼容格式调用 MiniMax 等模型。
 优势：原生支持 thinking 块，可获取模型推理过程。
+
+提示词缓存（prompt_caching，默认开启）：
+- system 按 SystemPrompt 分段传入，可缓存分段末尾设置 cache_control 断点
+- 消息历史的最后一条设置断点：下一轮请求的历史前缀可直接命中缓存
+- usage 中记录 cache_creation_input_tokens / cache_read_input_tokens
+
+extended thinking 与工具调用：带 tool_use 的 assistant 回合回放时，必须原样带上
+该回合的 thinking（含 signature）/ redacted_thinking 块并放在最前，否则请求被拒绝。
+适配器在 ModelResponse.thinking_blocks 中返回这些块，AgentCore 存到历史条目上。
 """
 
 import os
 from typing import AsyncIterator, Optional
 
-from .base import ModelInterface, ModelResponse
+from .base import ModelInterface, ModelResponse, parse_tool_arguments, system_blocks
+
+# Anthropic 单次请求最多 4 个 cache_control 断点（其中 1 个留给消息历史）
+MAX_CACHE_BREAKPOINTS = 4
+
+_EPHEMERAL = {"type": "ephemeral"}
 
 
 class APIAdapter(ModelInterface):
@@ -25,6 +39,8 @@ class APIAdapter(ModelInterface):
         self.model = provider_config.get("model", "MiniMax-M2.7")
         self.context_window = provider_config.get("context_window", 204800)
         self.thinking_budget = provider_config.get("thinking_budget", 10000)
+        self.prompt_caching = provider_config.get("prompt_caching", True)
+        self.tokenizer_spec = provider_config.get("tokenizer", "auto")
         self._features = {
             "streaming": True,
             "tools": True,
@@ -50,22 +66,88 @@ class APIAdapter(ModelInterface):
                 )
         return self._client
 
-    def _build_anthropic_messages(self, messages: list[dict]) -> list[dict]:
+    message_format_key = "anthropic"
+
+    def format_message(self, message: dict) -> Optional[dict]:
         """将 OpenAI 格式消息转为 Anthropic 格式
 
         OpenAI: [{"role": "system", "content": "..."}, {"role": "user", "content": "..."}]
         Anthropic: system 单独传, messages 只含 user/assistant
         """
-        result = []
-        for msg in messages:
-            role = msg.get("role", "user")
-            content = msg.get("content", "")
-            # 跳过 system 消息（通过 system_prompt 参数单独传）
-            if role == "system":
-                continue
-            # 转换为 Anthropic 格式
-            result.append({"role": role, "content": content})
-        return result
+        role = message.get("role", "user")
+        # 跳过 system 消息（通过 system_prompt 参数单独传）
+        if role == "system":
+            return None
+        content = message.get("content", "")
+        # 原生工具调用：assistant 的 tool_use 块 + user 的 tool_result 块（按 id 配对）
+        tool_calls = message.get("tool_calls")
+        if role == "assistant" and tool_calls and all(tc.get("id") for tc in tool_calls):
+            # 签名的 thinking 块必须原样放在最前
+            blocks = [dict(b) for b in message.get("thinking_blocks") or ()]
+            blocks += [{"type": "text", "text": content}] if content else []
+            blocks += [{"type": "tool_use", "id": tc["id"], "name": tc["name"],
+                        "input": tc.get("arguments") or {}} for tc in tool_calls]
+            return {"role": "assistant", "content": blocks}
+        if role == "tool_result" and message.get("tool_call_id"):
+            return {"role": "user", "content": [{
+                "type": "tool_result", "tool_use_id": message["tool_call_id"], "content": content,
+            }]}
+        return {"role": role, "content": content}
+
+    def _build_anthropic_messages(self, messages: list[dict]) -> list[dict]:
+        """构建 Anthropic 格式消息列表（已格式化的载荷直接复用）"""
+        return self.build_messages(messages)
+
+    def _build_system_param(self, system_prompt: str):
+        """构建 system 参数：普通字符串原样传；分段提示词转为带缓存断点的 text 块"""
+        blocks = system_blocks(system_prompt)
+        if not self.prompt_caching or not any(b.cache for b in blocks):
+            return str(system_prompt)
+        # 断点过多时保留靠后的（覆盖的前缀更长）
+        budget = MAX_CACHE_BREAKPOINTS - 1
+        cached = [i for i, b in enumerate(blocks) if b.cache][-budget:]
+        param = []
+        for i, block in enumerate(blocks):
+            item = {"type": "text", "text": block.text}
+            if i in cached:
+                item["cache_control"] = _EPHEMERAL
+            param.append(item)
+        return param
+
+    @staticmethod
+    def _mark_history_breakpoint(api_messages: list) -> list:
+        """在最后一条消息上设置缓存断点（返回新列表，不修改载荷中的消息）"""
+        if not api_messages:
+            return api_messages
+        last = api_messages[-1]
+        content = last.get("content")
+        if isinstance(content, str):
+            if not content:
+                return api_messages
+            blocks = [{"type": "text", "text": content, "cache_control": _EPHEMERAL}]
+        elif isinstance(content, list) and content and isinstance(content[-1], dict):
+            blocks = content[:-1] + [dict(content[-1], cache_control=_EPHEMERAL)]
+        else:
+            return api_messages
+        return api_messages[:-1] + [dict(last, content=blocks)]
+
+    @staticmethod
+    def _thinking_block(pending: dict) -> dict:
+        """流式拼接的 thinking 块 → 回放用的内容块"""
+        if pending["type"] == "redacted_thinking":
+            return {"type": "redacted_thinking", "data": pending["data"]}
+        return {"type": "thinking", "thinking": "".join(pending["parts"]),
+                "signature": pending["signature"]}
+
+    @staticmethod
+    def _usage_dict(usage) -> dict:
+        """提取 usage（含提示词缓存的读写 Token 数）"""
+        return {
+            "input_tokens": getattr(usage, "input_tokens", 0) or 0,
+            "output_tokens": getattr(usage, "output_tokens", 0) or 0,
+            "cache_creation_input_tokens": getattr(usage, "cache_creation_input_tokens", 0) or 0,
+            "cache_read_input_tokens": getattr(usage, "cache_read_input_tokens", 0) or 0,
+        }
 
     async def chat(
         self,
@@ -80,6 +162,8 @@ class APIAdapter(ModelInterface):
 
         # 构建消息列表（过滤 system 消息）
         api_messages = self._build_anthropic_messages(messages)
+        if self.prompt_caching:
+            api_messages = self._mark_history_breakpoint(api_messages)
 
         # 构建请求参数
         request_params = {
@@ -88,9 +172,9 @@ class APIAdapter(ModelInterface):
             "messages": api_messages,
         }
 
-        # 系统提示词（Anthropic 格式：单独传）
+        # 系统提示词（Anthropic 格式：单独传；分段提示词带缓存断点）
         if system_prompt:
-            request_params["system"] = system_prompt
+            request_params["system"] = self._build_system_param(system_prompt)
 
         # 启用 thinking（extended thinking）
         # MiniMax-M2.x 支持推理过程输出
@@ -101,7 +185,7 @@ class APIAdapter(ModelInterface):
 
         # 工具定义
         if tools:
-            request_params["tools"] = tools
+            request_params["tools"] = self.format_tools(tools)
 
         request_params.update(kwargs)
 
@@ -112,13 +196,44 @@ class APIAdapter(ModelInterface):
                     collected_content = []
                     collected_thinking = []
                     collected_usage = {"input_tokens": 0, "output_tokens": 0}
+                    # 流式工具调用：按内容块下标拼接 input_json_delta
+                    pending_tools = {}
+                    # thinking 块：按内容块下标拼接 thinking_delta / signature_delta
+                    pending_thinking = {}
 
                     async for event in stream_ctx:
+                        if event.type == "content_block_start":
+                            block = event.content_block
+                            block_type = getattr(block, "type", None)
+                            if block_type == "tool_use":
+                                pending_tools[event.index] = {
+                                    "id": block.id, "name": block.name, "json": [],
+                                    "input": getattr(block, "input", None),
+                                }
+                            elif block_type == "thinking":
+                                pending_thinking[event.index] = {
+                                    "type": "thinking", "parts": [getattr(block, "thinking", "") or ""],
+                                    "signature": getattr(block, "signature", "") or "",
+                                }
+                            elif block_type == "redacted_thinking":
+                                pending_thinking[event.index] = {
+                                    "type": "redacted_thinking", "data": block.data,
+                                }
+
                         # 处理 thinking 事件
-                        if event.type == "content_block_delta":
+                        elif event.type == "content_block_delta":
                             delta = event.delta
-                            if hasattr(delta, "thinking") and delta.thinking:
+                            partial = getattr(delta, "partial_json", None)
+                            if partial is not None:
+                                if event.index in pending_tools:
+                                    pending_tools[event.index]["json"].append(partial)
+                            elif getattr(delta, "signature", None):
+                                if event.index in pending_thinking:
+                                    pending_thinking[event.index]["signature"] += delta.signature
+                            elif hasattr(delta, "thinking") and delta.thinking:
                                 collected_thinking.append(delta.thinking)
+                                if event.index in pending_thinking:
+                                    pending_thinking[event.index]["parts"].append(delta.thinking)
                                 yield ModelResponse(
                                     content="",
                                     model=request_params["model"],
@@ -139,16 +254,23 @@ class APIAdapter(ModelInterface):
                         elif event.type == "message_stop":
                             # 获取最终 usage
                             msg = await stream_ctx.get_final_message()
-                            collected_usage = {
-                                "input_tokens": getattr(msg.usage, "input_tokens", 0),
-                                "output_tokens": getattr(msg.usage, "output_tokens", 0),
-                            }
+                            collected_usage = self._usage_dict(msg.usage)
+                            tool_calls = [
+                                {"id": t["id"], "name": t["name"],
+                                 "arguments": parse_tool_arguments("".join(t["json"]) or t["input"])}
+                                for _, t in sorted(pending_tools.items())
+                            ]
+                            thinking_blocks = [
+                                self._thinking_block(t) for _, t in sorted(pending_thinking.items())
+                            ]
                             yield ModelResponse(
                                 content="",
                                 model=msg.model or self.model,
                                 usage=collected_usage,
+                                tool_calls=tool_calls or None,
                                 finish_reason="stop",
                                 thinking="".join(collected_thinking) or None,
+                                thinking_blocks=thinking_blocks or None,
                             )
 
             else:
@@ -158,23 +280,31 @@ class APIAdapter(ModelInterface):
                 # 提取 thinking 和 text 内容
                 thinking_text = ""
                 response_text = ""
+                tool_calls = []
+                thinking_blocks = []
                 for block in response.content:
                     if block.type == "thinking":
                         thinking_text += block.thinking
+                        thinking_blocks.append({"type": "thinking", "thinking": block.thinking,
+                                                "signature": getattr(block, "signature", "") or ""})
+                    elif block.type == "redacted_thinking":
+                        thinking_blocks.append({"type": "redacted_thinking", "data": block.data})
                     elif block.type == "text":
                         response_text += block.text
+                    elif block.type == "tool_use":
+                        tool_calls.append({"id": block.id, "name": block.name,
+                                           "arguments": parse_tool_arguments(block.input)})
 
-                usage_data = {
-                    "input_tokens": getattr(response.usage, "input_tokens", 0),
-                    "output_tokens": getattr(response.usage, "output_tokens", 0),
-                }
+                usage_data = self._usage_dict(response.usage)
 
                 yield ModelResponse(
                     content=response_text,
                     model=response.model or self.model,
                     usage=usage_data,
+                    tool_calls=tool_calls or None,
                     finish_reason=response.stop_reason or "stop",
                     thinking=thinking_text or None,
+                    thinking_blocks=thinking_blocks or None,
                 )
 
         except Exception as e:
@@ -185,12 +315,6 @@ class APIAdapter(ModelInterface):
                 finish_reason="error",
             )
 
-    def count_tokens(self, text: str) -> int:
-        """Token 计数（近似估算）"""
-        cn_chars = sum(1 for c in text if "\u4e00" <= c <= "\u9fff")
-        en_chars = len(text) - cn_chars
-        return cn_chars // 2 + en_chars // 4
-
     def get_context_window(self) -> int:
         """返回模型上下文窗口大小"""
         return self.context_window
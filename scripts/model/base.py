@@ -4,11 +4,16 @@ ADDS Model Layer — 抽象基类与通用数据结构
 核心接口：
 - ModelResponse: 统一模型响应
 - ModelInterface: 模型调用抽象基类（所有 Adapter 必须实现）
+- FormattedMessages: 已按适配器格式化好的消息载荷
+- SystemPrompt: 分段系统提示词（带提供方缓存断点）
 """
 
+import json
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
-from typing import AsyncIterator, Optional
+from typing import AsyncIterator, Iterable, Optional
+
+from .tokenizer import Tokenizer, get_tokenizer
 
 
 @dataclass
@@ -18,15 +23,100 @@ class ModelResponse:
     content: str
     model: str
     usage: dict = field(default_factory=lambda: {"input_tokens": 0, "output_tokens": 0})
-    tool_calls: Optional[list] = None
+    tool_calls: Optional[list] = None  # [{"id": ..., "name": ..., "arguments": {...}}]
     finish_reason: str = "stop"
     thinking: Optional[str] = None  # 模型推理过程（Anthropic thinking 块）
+    # 需随工具调用回合原样回放的 thinking / redacted_thinking 块（含 signature）
+    thinking_blocks: Optional[list] = None
     progress_hints: Optional[list[dict]] = None
     # progress_hints 示例:
     # [{"phase": "compiling", "progress": 30, "detail": "Building contracts..."},
     #  {"phase": "testing", "progress": 80, "detail": "Running test suite..."}]
 
 
+def format_plain_message(message: dict) -> Optional[dict]:
+    """默认消息格式：保留 user/assistant/tool_result 的 role + content"""
+    role = message.get("role", "user")
+    if role not in ("user", "assistant", "tool_result"):
+        return None
+    content = message.get("content", "")
+    if not content and message.get("tool_calls"):
+        content = "调用工具: " + ", ".join(tc.get("name") or "unknown" for tc in message["tool_calls"])
+    return {"role": role, "content": content}
+
+
+def parse_tool_arguments(raw) -> dict:
+    """解析工具调用参数（流式拼接的 JSON 字符串 / 已解析的 dict）
+
+    无法解析时返回 {}（工具执行时会报告缺少参数），不抛异常。
+    """
+    if isinstance(raw, dict):
+        return raw
+    if not raw:
+        return {}
+    try:
+        value = json.loads(raw)
+    except (TypeError, ValueError):
+        return {}
+    return value if isinstance(value, dict) else {}
+
+
+@dataclass(frozen=True)
+class SystemBlock:
+    """系统提示词分段
+
+    cache=True 表示在该段末尾设置提供方缓存断点：
+    从提示词开头到此段为止的前缀在会话内保持不变，可由提供方缓存复用。
+    """
+
+    text: str
+    cache: bool = False
+
+
+class SystemPrompt(str):
+    """分段系统提示词
+
+    str 子类，值即各段拼接后的完整提示词：不支持缓存的适配器当作普通字符串使用，
+    支持缓存的适配器（APIAdapter）读取 blocks 生成带 cache_control 的 system 段。
+    对其做字符串拼接等操作会得到普通 str（分段信息随之丢弃）。
+    """
+
+    def __new__(cls, blocks: Iterable[SystemBlock]):
+        blocks = tuple(b for b in blocks if b.text)
+        obj = super().__new__(cls, "".join(b.text for b in blocks))
+        obj.blocks = blocks
+        return obj
+
+
+def system_blocks(system_prompt: Optional[str]) -> tuple:
+    """取系统提示词的分段（普通字符串视为单个不缓存的分段）"""
+    if not system_prompt:
+        return ()
+    blocks = getattr(system_prompt, "blocks", None)
+    if blocks is not None:
+        return blocks
+    return (SystemBlock(str(system_prompt)),)
+
+
+def _has_system_head(model, messages: "FormattedMessages") -> bool:
+    """载荷头部是否带有 system 消息（由载荷记录的系统提示词判断）"""
+    return bool(messages.system_prompt) and model.format_system(messages.system_prompt) is not None
+
+
+class FormattedMessages(list):
+    """已按某种适配器格式化好的消息载荷
+
+    由 MessageStore 增量维护；适配器收到 format_key 与自身一致、
+    且 system_prompt 相同（或 system 不在消息列表中）的载荷时直接使用，不再逐条转换。
+    """
+
+    def __init__(self, items=(), format_key: str = "plain",
+                 system_prompt: Optional[str] = None):
+        super().__init__(items)
+        self.format_key = format_key
+        self.system_prompt = system_prompt
+
+
 class ModelInterface(ABC):
     """模型调用抽象基类
 
@@ -47,26 +137,44 @@ class ModelInterface(ABC):
 
         Args:
             messages: 消息列表，格式: [{"role": "user"/"assistant", "content": "..."}]
-            system_prompt: 系统提示词（可选，部分 Adapter 通过其他方式注入）
-            tools: 工具定义列表（可选）
+            system_prompt: 系统提示词（可选，部分 Adapter 通过其他方式注入）；
+                可传 SystemPrompt 标记可缓存的前缀分段
+            tools: 工具定义列表（可选，name/description/input_schema 形状，
+                适配器经 format_tools 转为自身格式）
             stream: 是否启用流式输出
             **kwargs: 模型特定参数
 
         Yields:
-            ModelResponse: 流式响应片段
+            ModelResponse: 流式响应片段；工具调用在一次请求的最终响应中
+            以 tool_calls 给出（含并行调用）
         """
         pass
         # 让 yield 使其成为异步生成器
         # pylint: disable=unreachable
         yield  # type: ignore  # noqa
 
-    @abstractmethod
+    # 分词器规格（见 tokenizer.get_tokenizer），适配器从 provider_config["tokenizer"] 读取
+    tokenizer_spec = "auto"
+
+    def get_tokenizer(self) -> Tokenizer:
+        """当前分词器（首次调用时按 tokenizer_spec 加载）"""
+        tokenizer = getattr(self, "_tokenizer", None)
+        if tokenizer is None:
+            tokenizer = get_tokenizer(self.tokenizer_spec)
+            self._tokenizer = tokenizer
+        return tokenizer
+
+    def set_tokenizer(self, tokenizer: Tokenizer) -> None:
+        """替换分词器（插件入口）"""
+        self._tokenizer = tokenizer
+
     def count_tokens(self, text: str) -> int:
-        """Token 计数（近似估算）
+        """Token 计数
 
-        简单估算规则：英文 ~4 字符/token，中文 ~2 字符/token
+        有离线词表（tiktoken）时精确计数，否则按英文 ~4 字符/token、
+        中文 ~2 字符/token 估算。
         """
-        pass
+        return self.get_tokenizer().count(text)
 
     @abstractmethod
     def get_context_window(self) -> int:
@@ -88,3 +196,41 @@ class ModelInterface(ABC):
     def get_model_name(self) -> str:
         """返回当前使用的模型名称"""
         return getattr(self, "model", "unknown")
+
+    # ──── 消息格式化 ────
+
+    # 消息格式标识：格式相同的适配器可共用同一份格式化载荷
+    message_format_key = "plain"
+
+    def format_message(self, message: dict) -> Optional[dict]:
+        """将一条内部消息转为适配器格式（返回 None 表示不发送）"""
+        return format_plain_message(message)
+
+    def format_system(self, system_prompt: str) -> Optional[dict]:
+        """系统提示词需要作为消息放在列表头部时返回该消息，否则返回 None"""
+        return None
+
+    def format_tools(self, tools: list) -> list:
+        """将工具定义（name/description/input_schema）转为适配器格式"""
+        return tools
+
+    def build_messages(self, messages: list, system_prompt: Optional[str] = None) -> list:
+        """构建请求用的消息列表
+
+        已格式化的载荷（FormattedMessages）直接复用；否则逐条转换。
+        系统提示词不放在消息列表中的格式（format_system 返回 None）只比较 format_key。
+        """
+        head = self.format_system(system_prompt) if system_prompt else None
+        if (isinstance(messages, FormattedMessages)
+                and messages.format_key == self.message_format_key
+                and (messages.system_prompt == system_prompt
+                     or (head is None and not _has_system_head(self, messages)))):
+            return messages
+        result = []
+        if head is not None:
+            result.append(head)
+        for msg in messages:
+            formatted = self.format_message(msg)
+            if formatted is not None:
+                result.append(formatted)
+        return result
@@ -30,6 +30,7 @@ class CLIAdapter(ModelInterface):
         self.command = cli_config.get("command", "")
         self.model = cli_config.get("model", "")
         self.context_window = cli_config.get("context_window", 204800)
+        self.tokenizer_spec = cli_config.get("tokenizer", "auto")
         self._features = {
             "streaming": True,
             "tools": False,
@@ -314,11 +315,6 @@ class CLIAdapter(ModelInterface):
 
     # ─── 通用接口 ───────────────────────────────────────────────
 
-    def count_tokens(self, text: str) -> int:
-        cn_chars = sum(1 for c in text if "\u4e00" <= c <= "\u9fff")
-        en_chars = len(text) - cn_chars
-        return cn_chars // 2 + en_chars // 4
-
     def get_context_window(self) -> int:
         return self.context_window
 
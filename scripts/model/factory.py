@@ -111,6 +111,7 @@ class ModelFactory:
                     "api_key_env": api_config.get("api_key_env", ""),
                     "model": model_name,
                     "context_window": api_config.get("context_window", 128000),
+                    "tokenizer": api_config.get("tokenizer", "auto"),
                 })
             else:
                 return APIAdapter({
@@ -119,6 +120,7 @@ class ModelFactory:
                     "model": model_name,
                     "context_window": api_config.get("context_window", 128000),
                     "thinking_budget": api_config.get("thinking_budget", 10000),
+                    "tokenizer": api_config.get("tokenizer", "auto"),
                 })
 
         elif mode == "cli":
@@ -128,6 +130,7 @@ class ModelFactory:
                 "command": cli_config["command"],
                 "model": model_name,
                 "context_window": cli_config.get("context_window", 204800),
+                "tokenizer": cli_config.get("tokenizer", "auto"),
             })
 
         elif mode == "sdk":
@@ -136,6 +139,7 @@ class ModelFactory:
                 "package": sdk_config["package"],
                 "model": model_name,
                 "context_window": sdk_config.get("context_window", 200000),
+                "tokenizer": sdk_config.get("tokenizer", "auto"),
             })
 
         else:
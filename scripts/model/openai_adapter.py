@@ -7,10 +7,11 @@ ADDS Model Layer — OpenAI 兼容 API 适配器
 - 其他 OpenAI 兼容端点
 """
 
+import json
 import os
 from typing import AsyncIterator, Optional
 
-from .base import ModelInterface, ModelResponse
+from .base import ModelInterface, ModelResponse, parse_tool_arguments
 
 
 class OpenAIAdapter(ModelInterface):
@@ -26,6 +27,7 @@ class OpenAIAdapter(ModelInterface):
         self.api_key = os.environ.get(self.api_key_env, provider_config.get("api_key", ""))
         self.model = provider_config.get("model", "meta/llama-3.1-70b-instruct")
         self.context_window = provider_config.get("context_window", 128000)
+        self.tokenizer_spec = provider_config.get("tokenizer", "auto")
         self._features = {
             "streaming": True,
             "tools": True,
@@ -48,6 +50,45 @@ class OpenAIAdapter(ModelInterface):
                 raise ImportError("openai 库未安装。请运行: pip install openai")
         return self._client
 
+    message_format_key = "openai"
+
+    def format_message(self, message: dict) -> Optional[dict]:
+        """OpenAI 格式：发送 user/assistant 消息，以及带 tool_call_id 的工具结果"""
+        role = message.get("role", "user")
+        content = message.get("content", "")
+        tool_calls = message.get("tool_calls")
+        if role == "assistant" and tool_calls and all(tc.get("id") for tc in tool_calls):
+            return {
+                "role": "assistant",
+                "content": content or None,
+                "tool_calls": [{
+                    "id": tc["id"],
+                    "type": "function",
+                    "function": {"name": tc["name"],
+                                 "arguments": json.dumps(tc.get("arguments") or {}, ensure_ascii=False)},
+                } for tc in tool_calls],
+            }
+        if role == "tool_result" and message.get("tool_call_id"):
+            return {"role": "tool", "tool_call_id": message["tool_call_id"], "content": content}
+        if role not in ("user", "assistant"):
+            return None
+        return {"role": role, "content": content}
+
+    def format_tools(self, tools: list) -> list:
+        """工具定义转为 OpenAI function 格式（已是该格式的原样保留）"""
+        return [tool if tool.get("type") == "function" else {
+            "type": "function",
+            "function": {
+                "name": tool["name"],
+                "description": tool.get("description", ""),
+                "parameters": tool.get("input_schema") or {"type": "object", "properties": {}},
+            },
+        } for tool in tools]
+
+    def format_system(self, system_prompt: str) -> Optional[dict]:
+        """OpenAI 格式：系统提示词作为首条 system 消息"""
+        return {"role": "system", "content": system_prompt}
+
     async def chat(
         self,
         messages: list[dict],
@@ -59,15 +100,8 @@ class OpenAIAdapter(ModelInterface):
         """流式聊天接口（OpenAI 格式）"""
         client = self._get_client()
 
-        # 构建消息列表
-        api_messages = []
-        if system_prompt:
-            api_messages.append({"role": "system", "content": system_prompt})
-        for msg in messages:
-            role = msg.get("role", "user")
-            content = msg.get("content", "")
-            if role in ("user", "assistant"):
-                api_messages.append({"role": role, "content": content})
+        # 构建消息列表（已格式化的载荷直接复用）
+        api_messages = self.build_messages(messages, system_prompt)
 
         request_params = {
             "model": kwargs.pop("model", self.model),
@@ -76,13 +110,15 @@ class OpenAIAdapter(ModelInterface):
             "stream": stream,
         }
         if tools:
-            request_params["tools"] = tools
+            request_params["tools"] = self.format_tools(tools)
         request_params.update(kwargs)
 
         try:
             if stream:
                 response = await client.chat.completions.create(**request_params)
                 collected = []
+                # 流式工具调用：按 index 拼接 id / name / arguments 片段（支持并行调用）
+                pending_tools = {}
                 async for chunk in response:
                     delta = chunk.choices[0].delta if chunk.choices else None
                     if delta and delta.content:
@@ -93,18 +129,40 @@ class OpenAIAdapter(ModelInterface):
                             usage={"input_tokens": 0, "output_tokens": 0},
                             finish_reason="streaming",
                         )
+                    for tc in (getattr(delta, "tool_calls", None) or []) if delta else []:
+                        slot = pending_tools.setdefault(tc.index, {"id": None, "name": "", "args": []})
+                        if tc.id:
+                            slot["id"] = tc.id
+                        fn = tc.function
+                        if fn is not None:
+                            if fn.name:
+                                slot["name"] += fn.name
+                            if fn.arguments:
+                                slot["args"].append(fn.arguments)
                     finish = chunk.choices[0].finish_reason if chunk.choices else None
-                    if finish == "stop":
+                    if finish in ("stop", "tool_calls"):
+                        tool_calls = [
+                            {"id": t["id"], "name": t["name"],
+                             "arguments": parse_tool_arguments("".join(t["args"]))}
+                            for _, t in sorted(pending_tools.items())
+                        ]
                         yield ModelResponse(
                             content="",
                             model=self.model,
                             usage={"input_tokens": 0, "output_tokens": len(collected)},
+                            tool_calls=tool_calls or None,
                             finish_reason="stop",
                         )
             else:
                 request_params["stream"] = False
                 response = await client.chat.completions.create(**request_params)
-                content = response.choices[0].message.content or ""
+                message = response.choices[0].message
+                content = message.content or ""
+                tool_calls = [
+                    {"id": tc.id, "name": tc.function.name,
+                     "arguments": parse_tool_arguments(tc.function.arguments)}
+                    for tc in (getattr(message, "tool_calls", None) or [])
+                ]
                 usage = {
                     "input_tokens": getattr(response.usage, "prompt_tokens", 0),
                     "output_tokens": getattr(response.usage, "completion_tokens", 0),
@@ -113,6 +171,7 @@ class OpenAIAdapter(ModelInterface):
                     content=content,
                     model=response.model or self.model,
                     usage=usage,
+                    tool_calls=tool_calls or None,
                     finish_reason="stop",
                 )
 
@@ -124,11 +183,6 @@ class OpenAIAdapter(ModelInterface):
                 finish_reason="error",
             )
 
-    def count_tokens(self, text: str) -> int:
-        cn_chars = sum(1 for c in text if "\u4e00" <= c <= "\u9fff")
-        en_chars = len(text) - cn_chars
-        return cn_chars // 2 + en_chars // 4
-
     def get_context_window(self) -> int:
         return self.context_window
 
@@ -20,6 +20,7 @@ class SDKAdapter(ModelInterface):
         self.package = sdk_config["package"]  # e.g. "codebuddy-agent-sdk"
         self.model = sdk_config.get("model", "default")
         self.context_window = sdk_config.get("context_window", 200000)
+        self.tokenizer_spec = sdk_config.get("tokenizer", "auto")
         self._sdk_config = sdk_config
         self._sdk = None
 
@@ -149,12 +150,6 @@ class SDKAdapter(ModelInterface):
                 finish_reason="error",
             )
 
-    def count_tokens(self, text: str) -> int:
-        """Token 计数（近似估算）"""
-        cn_chars = sum(1 for c in text if "\u4e00" <= c <= "\u9fff")
-        en_chars = len(text) - cn_chars
-        return cn_chars // 2 + en_chars // 4
-
     def get_context_window(self) -> int:
         """返回模型上下文窗口大小"""
         return self.context_window
@@ -0,0 +1,306 @@
+"""
+ADDS Model Layer — Token 估算
+
+所有 Token 估算（TokenBudget、MessageStore、各适配器的 count_tokens）共用此实现。
+
+估算规则：宽字符（CJK）约 2 字符/token，其他约 4 字符/token。
+
+宽字符统计不逐字符循环，而是整体编码为 UTF-8 后用 bytes.translate 只保留
+宽字符的首字节再取长度（C 层单次扫描）。首字节与码位区间的对应：
+
+    E3        U+3000–U+3FFF   CJK 标点、平假名/片假名、注音、兼容字母、扩展 A 起始
+    E4–E9     U+4000–U+9FFF   CJK 扩展 A、统一汉字
+    EA        U+A000–U+AFFF   彝文、谚文音节起始
+    EB–ED     U+B000–U+DFFF   谚文音节
+    EF        U+F000–U+FFFF   兼容汉字、竖排/兼容标点、全角字符
+    F0 A0–B3  U+20000–U+33FFF CJK 扩展 B–H
+
+纯 ASCII 文本直接走 isascii() 快速路径；较长文本按内容哈希缓存估算结果。
+
+另外提供：
+- Tokenizer 插件：ModelInterface.count_tokens 经 get_tokenizer(spec) 取得分词器，
+  安装了离线词表（tiktoken）时精确计数，否则回退到上面的估算
+- TokenCalibrator：用提供方返回的真实 input_tokens 在线拟合「估算 → 实际」的
+  校正系数（按提供方/模型分别拟合），持久化在 .ai/token_calibration.json
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 宽字符的 UTF-8 首字节（3 字节序列）
+_WIDE_LEAD_BYTES = bytes([0xE3, 0xE4, 0xE5, 0xE6, 0xE7, 0xE8, 0xE9,
+                          0xEA, 0xEB, 0xEC, 0xED, 0xEF])
+_DELETE_NON_WIDE = bytes(b for b in range(256) if b not in _WIDE_LEAD_BYTES)
+# 4 字节序列中的 CJK 扩展 B–H
+_SUPPLEMENTARY_CJK = re.compile(rb"\xf0[\xa0-\xb3]")
+
+# 短于此长度的文本不缓存（直接计算比查缓存更快）
+MEMO_MIN_CHARS = 256
+MEMO_MAX_ENTRIES = 4096
+
+_memo: "OrderedDict[Tuple[int, int], int]" = OrderedDict()
+_memo_lock = threading.Lock()
+_memo_stats: Dict[str, int] = {"hits": 0, "misses": 0}
+
+
+def count_wide_chars(text: str) -> int:
+    """统计宽字符（CJK / 假名 / 谚文 / 全角）个数"""
+    if not text or text.isascii():
+        return 0
+    data = text.encode("utf-8", "surrogatepass")
+    count = len(data.translate(None, _DELETE_NON_WIDE))
+    if b"\xf0" in data:
+        count += len(_SUPPLEMENTARY_CJK.findall(data))
+    return count
+
+
+def _estimate(text: str) -> int:
+    wide = count_wide_chars(text)
+    estimated = wide / 2 + (len(text) - wide) / 4
+    return max(1, int(estimated))
+
+
+def estimate_tokens(text: str) -> int:
+    """Token 估算（宽字符 2 字符/token，其他 4 字符/token）
+
+    Args:
+        text: 待估算文本
+
+    Returns:
+        估算的 Token 数（空文本为 0，否则至少为 1）
+    """
+    if not text:
+        return 0
+    if len(text) < MEMO_MIN_CHARS:
+        return _estimate(text)
+
+    key = (len(text), hash(text))
+    with _memo_lock:
+        cached = _memo.get(key)
+        if cached is not None:
+            _memo.move_to_end(key)
+            _memo_stats["hits"] += 1
+            return cached
+        _memo_stats["misses"] += 1
+    tokens = _estimate(text)
+    with _memo_lock:
+        _memo[key] = tokens
+        if len(_memo) > MEMO_MAX_ENTRIES:
+            _memo.popitem(last=False)
+    return tokens
+
+
+def estimate_cache_info() -> Dict[str, int]:
+    """估算缓存统计"""
+    with _memo_lock:
+        return dict(_memo_stats, size=len(_memo))
+
+
+def clear_estimate_cache() -> None:
+    with _memo_lock:
+        _memo.clear()
+        _memo_stats.update(hits=0, misses=0)
+
+
+# ═══════════════════════════════════════════════════════════
+# 分词器插件
+# ═══════════════════════════════════════════════════════════
+
+DEFAULT_TIKTOKEN_ENCODING = "cl100k_base"
+
+
+class Tokenizer:
+    """分词器接口：name 标识实现，exact 表示是否为精确计数"""
+    name = "base"
+    exact = False
+
+    def count(self, text: str) -> int:
+        raise NotImplementedError
+
+
+class HeuristicTokenizer(Tokenizer):
+    """启发式估算（宽字符 2 字符/token，其他 4 字符/token）"""
+    name = "heuristic"
+
+    def count(self, text: str) -> int:
+        return estimate_tokens(text)
+
+
+class TiktokenTokenizer(Tokenizer):
+    """tiktoken 精确计数（需本地已有词表，不同提供方的词表仅近似）"""
+    exact = True
+
+    def __init__(self, encoding: Any):
+        self._encoding = encoding
+        self.name = f"tiktoken:{encoding.name}"
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+
+_tokenizers: Dict[str, Tokenizer] = {}
+_tokenizers_lock = threading.Lock()
+
+
+def _load_tiktoken(encoding_name: str) -> Tokenizer:
+    import tiktoken  # 可选依赖
+    return TiktokenTokenizer(tiktoken.get_encoding(encoding_name))
+
+
+def get_tokenizer(spec: Optional[str] = "auto") -> Tokenizer:
+    """按规格取得分词器（进程内缓存）
+
+    Args:
+        spec: "heuristic" | "auto"（有 tiktoken 用之，否则启发式）|
+              "tiktoken" | "tiktoken:<encoding>"
+
+    Returns:
+        分词器；精确分词器不可用时回退为 HeuristicTokenizer
+    """
+    spec = (spec or "auto").strip().lower()
+    with _tokenizers_lock:
+        cached = _tokenizers.get(spec)
+    if cached is not None:
+        return cached
+
+    tokenizer: Tokenizer = HeuristicTokenizer()
+    if spec == "auto" or spec.startswith("tiktoken"):
+        _, _, encoding_name = spec.partition(":")
+        try:
+            tokenizer = _load_tiktoken(encoding_name or DEFAULT_TIKTOKEN_ENCODING)
+        except Exception as e:  # 未安装 / 词表不在本地（离线）
+            log = logger.debug if spec == "auto" else logger.warning
+            log("Tokenizer %r unavailable, using heuristic: %s", spec, e)
+    elif spec != "heuristic":
+        logger.warning("Unknown tokenizer %r, using heuristic", spec)
+
+    with _tokenizers_lock:
+        _tokenizers[spec] = tokenizer
+    return tokenizer
+
+
+# ═══════════════════════════════════════════════════════════
+# 在线校正
+# ═══════════════════════════════════════════════════════════
+
+CALIBRATION_FILE = "token_calibration.json"
+
+
+class TokenCalibrator:
+    """估算 Token → 提供方实际 input_tokens 的在线校正
+
+    每个 key（提供方/模型）独立拟合过原点的最小二乘系数 factor = Σxy / Σxx，
+    x 为请求前的估算值，y 为响应 usage 中的实际值。累计量按 decay 指数衰减，
+    使系数跟随最近的请求（提示词结构、语言比例变化）。
+
+    使用方式：
+        calibrator = TokenCalibrator(".ai/token_calibration.json")
+        calibrator.observe("APIAdapter:MiniMax-M2.7", estimated, actual)
+        budget.set_token_scale(calibrator.factor("APIAdapter:MiniMax-M2.7"))
+    """
+
+    MIN_FACTOR = 0.25
+    MAX_FACTOR = 4.0
+
+    def __init__(self, path: Optional[str] = None, min_samples: int = 3,
+                 decay: float = 0.95, min_estimate: int = 64):
+        """
+        Args:
+            path: 持久化文件（None 表示只在内存中拟合）
+            min_samples: 样本数达到该值后才启用系数
+            decay: 累计量衰减系数（1.0 表示不衰减）
+            min_estimate: 估算值小于该值的请求不参与拟合（固定开销占比过大）
+        """
+        self.path = Path(path) if path else None
+        self.min_samples = min_samples
+        self.decay = decay
+        self.min_estimate = min_estimate
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def observe(self, key: str, estimated: int, actual: int) -> float:
+        """记录一次请求的估算值与实际值，返回更新后的系数"""
+        if estimated < self.min_estimate or actual <= 0:
+            return self.factor(key)
+        ratio = actual / estimated
+        if not self.MIN_FACTOR <= ratio <= self.MAX_FACTOR:
+            # 估算口径与实际请求不一致（如提供方未计入缓存部分），不参与拟合
+            logger.debug("Calibration sample ignored | %s | est=%d | actual=%d",
+                         key, estimated, actual)
+            return self.factor(key)
+        with self._lock:
+            stat = self._stats.setdefault(key, {"sxx": 0.0, "sxy": 0.0, "samples": 0})
+            stat["sxx"] = stat["sxx"] * self.decay + float(estimated) * estimated
+            stat["sxy"] = stat["sxy"] * self.decay + float(estimated) * actual
+            stat["samples"] += 1
+            stat["updated"] = time.time()
+        self._save()
+        factor = self.factor(key)
+        logger.debug("Token calibration | %s | est=%d | actual=%d | factor=%.3f",
+                     key, estimated, actual, factor)
+        return factor
+
+    def factor(self, key: str) -> float:
+        """key 的校正系数（样本不足时为 1.0）"""
+        with self._lock:
+            stat = self._stats.get(key)
+            if not stat or stat["samples"] < self.min_samples or stat["sxx"] <= 0:
+                return 1.0
+            factor = stat["sxy"] / stat["sxx"]
+        return min(self.MAX_FACTOR, max(self.MIN_FACTOR, factor))
+
+    def samples(self, key: str) -> int:
+        with self._lock:
+            stat = self._stats.get(key)
+            return stat["samples"] if stat else 0
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        """各 key 的样本数与当前系数"""
+        with self._lock:
+            keys = list(self._stats)
+        return {key: {"samples": self.samples(key), "factor": round(self.factor(key), 4)}
+                for key in keys}
+
+    # ──── 持久化 ────
+
+    def _load(self) -> None:
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            for key, stat in data.get("providers", {}).items():
+                self._stats[key] = {
+                    "sxx": float(stat["sxx"]), "sxy": float(stat["sxy"]),
+                    "samples": int(stat["samples"]), "updated": stat.get("updated", 0),
+                }
+        except (json.JSONDecodeError, OSError, KeyError, TypeError, ValueError) as e:
+            logger.warning("Failed to load token calibration: %s", e)
+
+    def _save(self) -> None:
+        if self.path is None:
+            return
+        with self._lock:
+            providers = {key: dict(stat) for key, stat in self._stats.items()}
+        for key, stat in providers.items():
+            if stat["sxx"] > 0:
+                stat["factor"] = round(stat["sxy"] / stat["sxx"], 4)
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp.write_text(json.dumps({"version": 1, "providers": providers},
+                                      ensure_ascii=False, indent=2), encoding="utf-8")
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning("Failed to save token calibration: %s", e)
@@ -0,0 +1,864 @@
+#!/usr/bin/env python3
+"""
+ADDS Project Index — 项目级 trigram 内容索引（grep / glob 加速）
+
+设计目标：
+- 路径表：项目内所有文件（遵守 .gitignore），供 glob 直接匹配
+- trigram 倒排索引：正则查询先提取必需的字面量片段 → 求候选文件交集，
+  再只对候选文件做正则校验，避免每次全树扫描
+- 增量更新：按 mtime/size 判断变化，只重建变化的文件；
+  旧的文件 ID 标记为失效（墓碑），失效比例过高时压缩倒排表
+- .ai/ 下的运行时状态（sessions / index / logs 等）不建索引
+- 索引过期（外部修改、git HEAD 变化、超过最大年龄）时，
+  查询回退到 ripgrep（可用时），并在后台刷新索引
+
+存储布局（.ai/index/）：
+    meta.json        版本、构建时间、git HEAD、下一个文件 ID
+    files.json       路径表 {相对路径: [文件ID, mtime_ns, size, 类型]}
+    trigrams.json.gz 倒排表 {trigram: [文件ID, ...]}
+
+使用方式：
+    index = ProjectIndex(project_root)
+    index.refresh()                        # 增量构建
+    hits = index.search(r"def \\w+_tool")  # [(path, lineno, line), ...]
+    paths = index.glob("**/*.py")
+"""
+
+import fnmatch
+import gzip
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+try:
+    import re._parser as sre_parse          # Python 3.11+
+    import re._constants as sre_constants
+except ImportError:  # pragma: no cover
+    import sre_parse
+    import sre_constants
+
+logger = logging.getLogger(__name__)
+
+
+# 索引格式版本（格式不兼容时全量重建）
+INDEX_VERSION = 2
+
+# 文件类型
+KIND_TEXT = "t"      # 已建立 trigram 索引的文本文件
+KIND_LARGE = "l"     # 超过大小上限：不建索引，查询时总是作为候选
+KIND_BINARY = "b"    # 二进制：不参与内容搜索
+
+# 二进制检测读取的字节数
+BINARY_SNIFF_BYTES = 8192
+
+# ADDS 运行时状态（session 记录 / 索引 / 日志等）：不建索引，ripgrep 回退时同样排除，
+# 避免 grep 把之前的工具输出从 session 记录中再搜回上下文
+RUNTIME_STATE_PATHS = (
+    ".ai/sessions/", ".ai/index/", ".ai/logs/", ".ai/notifications/", ".ai/gateway/",
+    ".ai/token_calibration.json",
+)
+
+
+def is_runtime_state(rel: str) -> bool:
+    """相对路径是否属于 ADDS 运行时状态"""
+    return any(rel == p.rstrip("/") or rel.startswith(p) for p in RUNTIME_STATE_PATHS)
+
+
+# 非 git 仓库时总是跳过的目录
+DEFAULT_SKIP_DIRS = {
+    ".git", ".hg", ".svn", "node_modules", "__pycache__",
+    ".venv", "venv", ".tox", ".nox", ".mypy_cache", ".pytest_cache", ".ruff_cache",
+}
+
+DEFAULT_INDEX_CONFIG = {
+    "enabled": True,             # 是否启用索引（关闭时 grep 回退到 ripgrep / grep）
+    "max_age_seconds": 600,      # 索引最大年龄，超过视为过期
+    "max_file_bytes": 1_000_000, # 超过此大小的文件不建 trigram 索引
+    "use_ripgrep": True,         # 索引过期时是否回退到 ripgrep
+    "compact_ratio": 0.3,        # 失效文件 ID 比例超过此值时压缩倒排表
+}
+
+
+def load_index_config(project_root: str) -> Dict[str, Any]:
+    """从 .ai/settings.json 加载 index 配置（缺省项用默认值）
+
+    Args:
+        project_root: 项目根目录
+
+    Returns:
+        index 配置字典
+    """
+    config = dict(DEFAULT_INDEX_CONFIG)
+    settings_path = Path(project_root) / ".ai" / "settings.json"
+    if settings_path.exists():
+        try:
+            data = json.loads(settings_path.read_text(encoding="utf-8"))
+            config.update(data.get("index", {}))
+        except (json.JSONDecodeError, OSError) as e:
+            logger.warning("Failed to load settings.json: %s", e)
+    return config
+
+
+# ═══════════════════════════════════════════════════════════
+# trigram 提取
+# ═══════════════════════════════════════════════════════════
+
+# re.IGNORECASE 下与 ASCII 字母等价的非 ASCII 字符（'İ'.lower() 还会变成两个字符）
+_ASCII_CASE_FOLD = str.maketrans({"\u0130": "i", "\u0131": "i", "\u017f": "s", "\u212a": "k"})
+
+
+def fold_case(text: str) -> str:
+    """trigram 用的大小写折叠（与 re.IGNORECASE 对 ASCII 字母的等价关系一致）"""
+    if not text.isascii():
+        text = text.translate(_ASCII_CASE_FOLD)
+    return text.lower()
+
+
+def extract_trigrams(text: str) -> Set[str]:
+    """提取文本的 trigram 集合（大小写折叠）"""
+    text = fold_case(text)
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def required_literals(pattern: str, flags: int = 0) -> Optional[List[str]]:
+    """提取正则匹配时必然出现的字面量片段
+
+    只分析顶层拼接序列（以及必然出现的分组 / 至少重复一次的子模式），
+    分支、字符类、可选项等都视为片段断点。
+
+    Returns:
+        字面量片段列表；正则无法解析时返回 None
+    """
+    parsed = _parse_pattern(pattern, flags)
+    if parsed is None:
+        return None
+    literals: List[str] = []
+    _collect_literals(parsed, literals)
+    return literals
+
+
+def literal_text(pattern: str) -> Optional[str]:
+    """正则只由字面量组成时返回其文本（如 foo\\.bar → foo.bar），否则返回 None
+
+    ripgrep / grep 回退对字面量用 -F 搜索，与 Python re 的结果必然一致。
+    """
+    parsed = _parse_pattern(pattern)
+    if parsed is None or parsed.state.flags & ~re.UNICODE:
+        return None
+    if not all(op is sre_constants.LITERAL for op, _ in parsed):
+        return None
+    return "".join(chr(av) for _, av in parsed)
+
+
+def _parse_pattern(pattern: str, flags: int = 0):
+    try:
+        return sre_parse.parse(pattern, flags)
+    except (re.error, RecursionError):
+        return None
+
+
+def _ignores_case(parsed) -> bool:
+    """正则是否有忽略大小写的部分（flags 参数、全局 (?i) 或局部 (?i:...)）"""
+    if parsed.state.flags & re.IGNORECASE:
+        return True
+
+    def walk(node) -> bool:
+        for op, av in node:
+            if op is sre_constants.SUBPATTERN and av[1] & re.IGNORECASE:
+                return True
+            stack = [av]
+            while stack:
+                item = stack.pop()
+                if isinstance(item, sre_parse.SubPattern):
+                    if walk(item):
+                        return True
+                elif isinstance(item, (tuple, list)):
+                    stack.extend(item)
+        return False
+
+    return walk(parsed)
+
+
+def _collect_literals(subpattern, out: List[str]) -> None:
+    run: List[str] = []
+
+    def _flush() -> None:
+        if run:
+            out.append("".join(run))
+            run.clear()
+
+    for op, av in subpattern:
+        if op is sre_constants.LITERAL:
+            run.append(chr(av))
+            continue
+        _flush()
+        if op is sre_constants.SUBPATTERN:
+            _collect_literals(av[-1], out)
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT,
+                    getattr(sre_constants, "POSSESSIVE_REPEAT", None)):
+            min_count, _max_count, item = av
+            if min_count >= 1:
+                _collect_literals(item, out)
+        elif op is getattr(sre_constants, "ATOMIC_GROUP", None):
+            _collect_literals(av, out)
+    _flush()
+
+
+def query_trigrams(pattern: str, flags: int = 0) -> Optional[Set[str]]:
+    """正则查询所需的 trigram 集合
+
+    Returns:
+        trigram 集合（可能为空，表示无法缩小候选范围）；正则无效时返回 None
+    """
+    parsed = _parse_pattern(pattern, flags)
+    if parsed is None:
+        return None
+    literals: List[str] = []
+    _collect_literals(parsed, literals)
+    grams: Set[str] = set()
+    for lit in literals:
+        if len(lit) >= 3:
+            grams |= extract_trigrams(lit)
+    if _ignores_case(parsed):
+        # 非 ASCII 字符的忽略大小写等价关系（如 σ / ς）与 lower() 不一致，不用于缩小候选
+        grams = {g for g in grams if g.isascii()}
+    return grams
+
+
+# ═══════════════════════════════════════════════════════════
+# glob / .gitignore 匹配
+# ═══════════════════════════════════════════════════════════
+
+def glob_to_regex(pattern: str) -> "re.Pattern":
+    """将 glob 模式（支持 **）编译为匹配相对路径的正则"""
+    i, n = 0, len(pattern)
+    parts: List[str] = []
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern[i:i + 3] == "**/":
+                parts.append("(?:.*/)?")
+                i += 3
+                continue
+            if pattern[i:i + 2] == "**":
+                parts.append(".*")
+                i += 2
+                continue
+            parts.append("[^/]*")
+        elif c == "?":
+            parts.append("[^/]")
+        elif c == "[":
+            j = pattern.find("]", i + 1)
+            if j == -1:
+                parts.append(re.escape(c))
+            else:
+                body = pattern[i + 1:j]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                parts.append(f"[{body}]")
+                i = j
+        else:
+            parts.append(re.escape(c))
+        i += 1
+    return re.compile("".join(parts) + r"\Z")
+
+
+class GitignoreMatcher:
+    """.gitignore 规则的简化实现（仅用于非 git 仓库的回退遍历）
+
+    支持：注释、否定（!）、目录规则（尾部 /）、锚定规则（含 /）、通配符。
+    """
+
+    def __init__(self, lines: Iterable[str] = ()):
+        self._rules: List[Tuple[bool, bool, bool, str]] = []
+        for line in lines:
+            line = line.rstrip("\n").rstrip()
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.strip("/") if dir_only else line
+            anchored = "/" in line
+            self._rules.append((negate, dir_only, anchored, line.lstrip("/")))
+
+    @classmethod
+    def from_file(cls, path: Path) -> "GitignoreMatcher":
+        try:
+            return cls(path.read_text(encoding="utf-8", errors="replace").splitlines())
+        except OSError:
+            return cls()
+
+    def ignored(self, rel_path: str, is_dir: bool = False) -> bool:
+        result = False
+        name = rel_path.rsplit("/", 1)[-1]
+        for negate, dir_only, anchored, pat in self._rules:
+            if dir_only and not is_dir:
+                continue
+            target = rel_path if anchored else name
+            if fnmatch.fnmatchcase(target, pat):
+                result = not negate
+        return result
+
+
+# ═══════════════════════════════════════════════════════════
+# 项目索引
+# ═══════════════════════════════════════════════════════════
+
+class ProjectIndex:
+    """项目 trigram 内容索引 + 路径表
+
+    线程安全：查询与刷新通过内部锁互斥，可在工具线程池中使用。
+    """
+
+    def __init__(self, project_root: str, index_dir: Optional[str] = None,
+                 config: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            project_root: 项目根目录
+            index_dir: 索引目录（默认 .ai/index/）
+            config: index 配置（默认从 settings.json 加载）
+        """
+        self.project_root = Path(project_root).resolve()
+        self.index_dir = Path(index_dir) if index_dir else self.project_root / ".ai" / "index"
+        self.config = config if config is not None else load_index_config(str(self.project_root))
+
+        self.files: Dict[str, list] = {}          # path → [id, mtime_ns, size, kind]
+        self.postings: Dict[str, List[int]] = {}  # trigram → [id, ...]（升序）
+        self.built_at: float = 0.0
+        self.git_head: Optional[str] = None
+        self._next_id = 0
+        self._dead_ids = 0
+        self._loaded = False
+        self._dirty = False          # 外部可能修改了文件（如执行了 shell 命令）
+        self._unsaved = False
+        self._lock = threading.RLock()
+        self._refreshing = threading.Lock()
+
+    # ──── 加载 / 保存 ────
+
+    @property
+    def exists(self) -> bool:
+        return (self.index_dir / "meta.json").exists()
+
+    def load(self) -> bool:
+        """从磁盘加载索引
+
+        Returns:
+            是否加载成功（不存在或版本不兼容时返回 False）
+        """
+        with self._lock:
+            if self._loaded:
+                return True
+            try:
+                meta = json.loads((self.index_dir / "meta.json").read_text(encoding="utf-8"))
+                if meta.get("version") != INDEX_VERSION:
+                    logger.info("Index version mismatch, full rebuild required")
+                    return False
+                files = json.loads((self.index_dir / "files.json").read_text(encoding="utf-8"))
+                with gzip.open(self.index_dir / "trigrams.json.gz", "rt", encoding="utf-8") as f:
+                    postings = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.debug("Index not loaded: %s", e)
+                return False
+            self.files = files
+            self.postings = postings
+            self.built_at = meta.get("built_at", 0.0)
+            self.git_head = meta.get("git_head")
+            self._next_id = meta.get("next_id", 0)
+            self._dead_ids = meta.get("dead_ids", 0)
+            self._loaded = True
+            return True
+
+    def save(self, meta_only: bool = False) -> None:
+        """原子写入索引文件
+
+        Args:
+            meta_only: 只更新 meta.json（路径表与倒排表未变化时）
+        """
+        with self._lock:
+            self.index_dir.mkdir(parents=True, exist_ok=True)
+            meta = {
+                "version": INDEX_VERSION,
+                "built_at": self.built_at,
+                "git_head": self.git_head,
+                "next_id": self._next_id,
+                "dead_ids": self._dead_ids,
+                "file_count": len(self.files),
+            }
+            if meta_only and not self._unsaved:
+                self._atomic_write("meta.json",
+                                   json.dumps(meta, ensure_ascii=False, indent=2).encode("utf-8"))
+                return
+            self._atomic_write("files.json",
+                               json.dumps(self.files, ensure_ascii=False).encode("utf-8"))
+            self._atomic_write("trigrams.json.gz", gzip.compress(
+                json.dumps(self.postings, ensure_ascii=False).encode("utf-8"), compresslevel=5))
+            # meta 最后写入：存在即表示索引完整
+            self._atomic_write("meta.json",
+                               json.dumps(meta, ensure_ascii=False, indent=2).encode("utf-8"))
+            self._unsaved = False
+
+    def _atomic_write(self, name: str, data: bytes) -> None:
+        target = self.index_dir / name
+        tmp = target.with_name(f".{name}.{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, target)
+
+    def close(self) -> None:
+        """保存尚未落盘的增量更新"""
+        with self._lock:
+            if self._loaded and self._unsaved:
+                try:
+                    self.save()
+                except OSError as e:
+                    logger.warning("Failed to save project index: %s", e)
+
+    # ──── 过期判断 ────
+
+    def mark_dirty(self) -> None:
+        """标记索引可能过期（文件可能被外部修改）"""
+        self._dirty = True
+
+    def stale_reasons(self) -> List[str]:
+        """索引过期的原因列表（空列表表示索引新鲜）"""
+        if not self._loaded and not self.load():
+            return ["索引不存在"]
+        reasons = []
+        if self._dirty:
+            reasons.append("文件可能已被修改")
+        if self.git_head != read_git_head(self.project_root):
+            reasons.append("git HEAD 已变化")
+        age = time.time() - self.built_at
+        if age > self.config["max_age_seconds"]:
+            reasons.append(f"索引已 {int(age)}s 未刷新")
+        return reasons
+
+    def is_stale(self) -> bool:
+        return bool(self.stale_reasons())
+
+    # ──── 构建 / 刷新 ────
+
+    def refresh(self, full: bool = False) -> Dict[str, int]:
+        """增量刷新索引（按 mtime/size 检测变化）
+
+        Args:
+            full: 丢弃现有索引，全量重建
+
+        Returns:
+            统计 {"added", "updated", "removed", "unchanged", "files"}
+        """
+        with self._refreshing, self._lock:
+            if full or not self.load():
+                self.files, self.postings = {}, {}
+                self._next_id = self._dead_ids = 0
+                self._loaded = True
+                self._unsaved = True
+            self._dirty = False
+            head = read_git_head(self.project_root)
+
+            stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+            seen = set()
+            for rel in list_project_files(self.project_root):
+                if is_runtime_state(rel):
+                    continue
+                try:
+                    st = os.stat(self.project_root / rel)
+                except OSError:
+                    continue
+                seen.add(rel)
+                entry = self.files.get(rel)
+                if entry and entry[1] == st.st_mtime_ns and entry[2] == st.st_size:
+                    stats["unchanged"] += 1
+                    continue
+                stats["updated" if entry else "added"] += 1
+                self._index_file(rel, st)
+
+            for rel in [p for p in self.files if p not in seen]:
+                self._drop_file(rel)
+                stats["removed"] += 1
+
+            if self._dead_ids > self.config["compact_ratio"] * max(1, self._next_id):
+                self._compact()
+
+            changed = stats["added"] + stats["updated"] + stats["removed"]
+            self._unsaved = self._unsaved or bool(changed)
+            self.git_head = head
+            self.built_at = time.time()
+            self.save(meta_only=True)
+            stats["files"] = len(self.files)
+            return stats
+
+    def refresh_in_background(self, executor) -> bool:
+        """在线程池中刷新索引（已有刷新进行中时跳过）
+
+        Returns:
+            是否提交了刷新任务
+        """
+        if self._refreshing.locked():
+            return False
+        executor.submit(self._refresh_quietly)
+        return True
+
+    def _refresh_quietly(self) -> None:
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.warning("Background index refresh failed: %s", e)
+
+    def update_paths(self, paths: Iterable[str]) -> None:
+        """立即更新指定文件的索引（如 write 工具写入后），不落盘"""
+        with self._lock:
+            if not self._loaded:
+                return
+            for path in paths:
+                p = Path(path)
+                p = p if p.is_absolute() else self.project_root / p
+                try:
+                    rel = p.resolve().relative_to(self.project_root).as_posix()
+                except ValueError:
+                    continue
+                if is_runtime_state(rel):
+                    continue
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    if rel in self.files:
+                        self._drop_file(rel)
+                    continue
+                self._index_file(rel, st)
+            self._unsaved = True
+
+    def _index_file(self, rel: str, st: os.stat_result) -> None:
+        """（重新）索引单个文件：旧 ID 作废，分配新 ID"""
+        if rel in self.files:
+            self._drop_file(rel)
+        file_id = self._next_id
+        self._next_id += 1
+        kind = KIND_LARGE if st.st_size > self.config["max_file_bytes"] else KIND_TEXT
+        if kind == KIND_TEXT:
+            try:
+                data = (self.project_root / rel).read_bytes()
+            except OSError:
+                return
+            if b"\0" in data[:BINARY_SNIFF_BYTES]:
+                kind = KIND_BINARY
+            else:
+                for gram in extract_trigrams(data.decode("utf-8", errors="replace")):
+                    self.postings.setdefault(gram, []).append(file_id)
+        self.files[rel] = [file_id, st.st_mtime_ns, st.st_size, kind]
+
+    def _drop_file(self, rel: str) -> None:
+        entry = self.files.pop(rel, None)
+        if entry and entry[3] == KIND_TEXT:
+            self._dead_ids += 1
+
+    def _compact(self) -> None:
+        """移除倒排表中的失效文件 ID"""
+        live = {e[0] for e in self.files.values() if e[3] == KIND_TEXT}
+        compacted = {}
+        for gram, ids in self.postings.items():
+            kept = [i for i in ids if i in live]
+            if kept:
+                compacted[gram] = kept
+        logger.info("Compacted index postings: %d → %d trigrams, %d dead ids dropped",
+                    len(self.postings), len(compacted), self._dead_ids)
+        self.postings = compacted
+        self._dead_ids = 0
+
+    # ──── 查询 ────
+
+    def candidates(self, pattern: str, flags: int = 0,
+                   prefix: str = "") -> Optional[List[str]]:
+        """正则查询的候选文件（相对路径，已排序）
+
+        Args:
+            pattern: 正则表达式
+            flags: re 标志
+            prefix: 只返回该相对目录 / 文件下的路径
+
+        Returns:
+            候选路径列表；正则无效时返回 None
+        """
+        grams = query_trigrams(pattern, flags)
+        if grams is None:
+            return None
+        with self._lock:
+            if not self._loaded:
+                self.load()
+            ids: Optional[Set[int]] = None
+            # 从最短的倒排列表开始求交集
+            for gram in sorted(grams, key=lambda g: len(self.postings.get(g, ()))):
+                posting = self.postings.get(gram)
+                if not posting:
+                    ids = set()
+                    break
+                ids = set(posting) if ids is None else ids.intersection(posting)
+                if not ids:
+                    break
+            result = []
+            for rel, (file_id, _mtime, _size, kind) in self.files.items():
+                if kind == KIND_BINARY or not _under(rel, prefix):
+                    continue
+                if kind == KIND_LARGE or ids is None or file_id in ids:
+                    result.append(rel)
+        result.sort()
+        return result
+
+    def search(self, pattern: str, flags: int = 0, prefix: str = "",
+               include: Optional[str] = None,
+               max_matches: int = 200) -> List[Tuple[str, int, str]]:
+        """正则搜索（trigram 过滤 + 逐文件校验）
+
+        Args:
+            pattern: 正则表达式
+            flags: re 标志
+            prefix: 限定相对目录 / 文件
+            include: 文件名 glob 过滤（如 "*.py"）
+            max_matches: 最多返回的匹配行数
+
+        Returns:
+            [(相对路径, 行号, 行内容), ...]
+
+        Raises:
+            re.error: 正则无效
+        """
+        regex = re.compile(pattern, flags)
+        whole = re.compile(pattern, flags | re.MULTILINE)
+        paths = self.candidates(pattern, flags, prefix) or []
+        hits: List[Tuple[str, int, str]] = []
+        for rel in paths:
+            if include and not fnmatch.fnmatch(rel.rsplit("/", 1)[-1], include):
+                continue
+            try:
+                text = (self.project_root / rel).read_text(encoding="utf-8", errors="replace")
+            except OSError:
+                continue
+            if not whole.search(text):
+                continue
+            for lineno, line in enumerate(text.splitlines(), 1):
+                if regex.search(line):
+                    hits.append((rel, lineno, line))
+                    if len(hits) >= max_matches:
+                        return hits
+        return hits
+
+    def glob(self, pattern: str, prefix: str = "") -> List[str]:
+        """用路径表匹配 glob 模式（相对 prefix 目录），返回相对项目根的路径"""
+        rx = glob_to_regex(pattern)
+        prefix = prefix.strip("/")
+        with self._lock:
+            if not self._loaded:
+                self.load()
+            paths = list(self.files)
+        result = []
+        for rel in paths:
+            if prefix:
+                if not rel.startswith(prefix + "/"):
+                    continue
+                sub = rel[len(prefix) + 1:]
+            else:
+                sub = rel
+            if rx.match(sub):
+                result.append(rel)
+        result.sort()
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """索引统计（用于 adds index status）"""
+        with self._lock:
+            if not self._loaded:
+                self.load()
+            kinds = {KIND_TEXT: 0, KIND_LARGE: 0, KIND_BINARY: 0}
+            for entry in self.files.values():
+                kinds[entry[3]] = kinds.get(entry[3], 0) + 1
+            disk = sum(p.stat().st_size for p in self.index_dir.glob("*") if p.is_file()) \
+                if self.index_dir.exists() else 0
+            return {
+                "files": len(self.files),
+                "text_files": kinds[KIND_TEXT],
+                "large_files": kinds[KIND_LARGE],
+                "binary_files": kinds[KIND_BINARY],
+                "trigrams": len(self.postings),
+                "dead_ids": self._dead_ids,
+                "built_at": self.built_at,
+                "git_head": self.git_head,
+                "disk_bytes": disk,
+            }
+
+
+def _under(rel: str, prefix: str) -> bool:
+    prefix = prefix.strip("/")
+    return not prefix or rel == prefix or rel.startswith(prefix + "/")
+
+
+# ═══════════════════════════════════════════════════════════
+# 文件枚举 / git
+# ═══════════════════════════════════════════════════════════
+
+def list_project_files(project_root: Path) -> List[str]:
+    """列出项目文件（相对路径，遵守 .gitignore）
+
+    git 仓库使用 git ls-files（已跟踪 + 未忽略的未跟踪文件），
+    否则遍历目录并应用根目录 .gitignore。
+    """
+    project_root = Path(project_root)
+    if (project_root / ".git").exists():
+        try:
+            result = subprocess.run(
+                ["git", "ls-files", "-z", "--cached", "--others", "--exclude-standard"],
+                cwd=str(project_root), capture_output=True, timeout=60,
+            )
+            if result.returncode == 0:
+                paths = result.stdout.decode("utf-8", errors="replace").split("\0")
+                return sorted({p for p in paths if p})
+        except (OSError, subprocess.TimeoutExpired) as e:
+            logger.debug("git ls-files failed, walking tree: %s", e)
+    return _walk_files(project_root)
+
+
+def _walk_files(project_root: Path) -> List[str]:
+    matcher = GitignoreMatcher.from_file(project_root / ".gitignore")
+    result = []
+    for dirpath, dirnames, filenames in os.walk(project_root):
+        rel_dir = os.path.relpath(dirpath, project_root).replace(os.sep, "/")
+        rel_dir = "" if rel_dir == "." else rel_dir + "/"
+        dirnames[:] = sorted(
+            d for d in dirnames
+            if d not in DEFAULT_SKIP_DIRS and not matcher.ignored(rel_dir + d, is_dir=True)
+        )
+        for name in filenames:
+            rel = rel_dir + name
+            if not matcher.ignored(rel):
+                result.append(rel)
+    result.sort()
+    return result
+
+
+def read_git_head(project_root: Path) -> Optional[str]:
+    """读取当前 git HEAD 提交（直接读 .git 文件，不启动子进程）"""
+    git_dir = Path(project_root) / ".git"
+    try:
+        head = (git_dir / "HEAD").read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+    if not head.startswith("ref: "):
+        return head
+    ref = head[5:]
+    try:
+        return (git_dir / ref).read_text(encoding="utf-8").strip()
+    except OSError:
+        pass
+    try:
+        for line in (git_dir / "packed-refs").read_text(encoding="utf-8").splitlines():
+            if line.endswith(" " + ref):
+                return line.split(" ", 1)[0]
+    except OSError:
+        pass
+    return None     # 尚无提交（unborn 分支）或引用无法解析
+
+
+# ═══════════════════════════════════════════════════════════
+# ripgrep 回退
+# ═══════════════════════════════════════════════════════════
+
+def ripgrep_available() -> bool:
+    return shutil.which("rg") is not None
+
+
+def ripgrep_search(pattern: str, project_root: str, path: str = "",
+                   include: Optional[str] = None, ignore_case: bool = False,
+                   timeout: float = 10.0) -> Optional[str]:
+    """使用 ripgrep 搜索（遵守 .gitignore），输出 path:line:text
+
+    pattern 按 Python re 语法理解（与索引查询一致）：字面量用 -F，
+    其余用 PCRE2 引擎（rg 未编译 PCRE2 支持时返回 None，由调用方回退）。
+
+    Returns:
+        ripgrep 输出（无匹配时为空字符串）；rg 不可用或出错时返回 None
+    """
+    rg = shutil.which("rg")
+    if not rg:
+        return None
+    cmd = [rg, "-n", "--no-heading", "--color", "never"]
+    if ignore_case:
+        cmd.append("-i")
+    if include:
+        cmd += ["-g", include]
+    for state in RUNTIME_STATE_PATHS:
+        cmd += ["-g", "!" + (state + "**" if state.endswith("/") else state)]
+    literal = literal_text(pattern)
+    if literal is not None:
+        cmd += ["-F", "-e", literal]
+    else:
+        cmd += ["--pcre2", "-e", pattern]
+    cmd += ["--", path or "."]
+    try:
+        result = subprocess.run(cmd, cwd=project_root, capture_output=True,
+                                text=True, timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.debug("ripgrep failed: %s", e)
+        return None
+    if result.returncode not in (0, 1):
+        logger.debug("ripgrep exit %d: %s", result.returncode, result.stderr[:200])
+        return None
+    return result.stdout
+
+
+# ═══════════════════════════════════════════════════════════
+# CLI: adds index
+# ═══════════════════════════════════════════════════════════
+
+def add_index_subparser(subparsers):
+    """添加 index 子命令到 argparse"""
+    index_parser = subparsers.add_parser("index", help="项目搜索索引管理")
+    index_sub = index_parser.add_subparsers(dest="index_command")
+
+    build_parser = index_sub.add_parser("build", help="构建 / 增量刷新索引")
+    build_parser.add_argument("--full", action="store_true", help="丢弃现有索引，全量重建")
+
+    index_sub.add_parser("status", help="显示索引状态")
+
+
+def handle_index_command(args, project_root: str = "."):
+    """处理 index 子命令"""
+    index = ProjectIndex(project_root)
+    cmd = getattr(args, "index_command", None) or "status"
+
+    if cmd == "build":
+        start = time.monotonic()
+        stats = index.refresh(full=args.full)
+        elapsed = time.monotonic() - start
+        print(f"✅ 索引已{'重建' if args.full else '更新'}: {stats['files']} 个文件 "
+              f"(新增 {stats['added']} / 更新 {stats['updated']} / "
+              f"删除 {stats['removed']} / 未变 {stats['unchanged']})，耗时 {elapsed:.2f}s")
+        print(f"   位置: {index.index_dir}")
+
+    elif cmd == "status":
+        if not index.exists:
+            print("📭 索引不存在，使用 adds index build 构建")
+            return
+        stats = index.stats()
+        reasons = index.stale_reasons()
+        built = datetime.fromtimestamp(stats["built_at"]).strftime("%Y-%m-%d %H:%M:%S")
+        print("=" * 50)
+        print("🔎 项目索引状态")
+        print("=" * 50)
+        print(f"  位置: {index.index_dir}")
+        print(f"  文件: {stats['files']} (文本 {stats['text_files']} / "
+              f"大文件 {stats['large_files']} / 二进制 {stats['binary_files']})")
+        print(f"  trigram: {stats['trigrams']}  失效 ID: {stats['dead_ids']}")
+        print(f"  磁盘占用: {stats['disk_bytes'] / 1024:.1f} KB")
+        print(f"  构建时间: {built}")
+        print(f"  git HEAD: {(stats['git_head'] or '-')[:12]}")
+        print(f"  状态: {'⚠️ 过期（' + '；'.join(reasons) + '）' if reasons else '✅ 最新'}")
+        print(f"  ripgrep: {'可用' if ripgrep_available() else '未安装'}")
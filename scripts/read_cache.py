@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+ADDS Read Cache — 内容校验的文件读取缓存（read 工具）
+
+设计目标：
+- LRU 缓存，按 (path, mtime_ns, size, inode) 校验：文件变化即失效，无需显式通知
+- 字节预算淘汰：缓存总占用超过 max_bytes 时淘汰最久未使用的条目
+- 小文件缓存解码后的行列表；大文件（≥ mmap_threshold）只缓存行起始偏移，
+  读取时 mmap 文件并只解码请求的行范围
+- 进程内共享：同一进程中的所有 AgentCore（如 TUI 多工作区）共用一个缓存
+
+使用方式：
+    cache = get_read_cache()
+    view = cache.read_lines("/path/to/file.py", offset=100, limit=50)
+    text, last_line = format_numbered(view, max_chars=8000)
+"""
+
+import logging
+import mmap
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+# 默认缓存字节预算
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+
+# 超过此大小的文件走 mmap + 行偏移索引
+DEFAULT_MMAP_THRESHOLD = 1024 * 1024
+
+# 单行输出的最大字符数
+MAX_LINE_CHARS = 2000
+
+
+@dataclass
+class _Entry:
+    """缓存条目"""
+    signature: Tuple[int, int, int]            # (mtime_ns, size, inode)
+    lines: Optional[List[str]] = None          # 小文件：解码后的行（不含换行符）
+    line_starts: Optional[array] = None        # 大文件：每行起始字节偏移
+    cost: int = 0                              # 计入预算的字节数
+
+
+@dataclass
+class LineView:
+    """一次范围读取的结果"""
+    path: str
+    lines: List[str] = field(default_factory=list)
+    start: int = 1                  # 第一行的行号（1 起）
+    total_lines: int = 0
+    cached: bool = False            # 是否命中缓存
+
+    @property
+    def end(self) -> int:
+        """最后一行的行号"""
+        return self.start + len(self.lines) - 1
+
+
+class ReadCache:
+    """文件读取 LRU 缓存（线程安全）"""
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES,
+                 mmap_threshold: int = DEFAULT_MMAP_THRESHOLD):
+        self.max_bytes = max_bytes
+        self.mmap_threshold = mmap_threshold
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def current_bytes(self) -> int:
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def read_lines(self, path: str, offset: int = 1,
+                   limit: Optional[int] = None) -> LineView:
+        """读取文件的行范围
+
+        Args:
+            path: 文件路径（绝对路径）
+            offset: 起始行号（1 起）
+            limit: 最多返回的行数（None 表示到文件末尾）
+
+        Returns:
+            LineView
+
+        Raises:
+            OSError: 文件不存在或无法读取
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.signature == signature:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                cached = True
+            else:
+                cached = False
+                self.misses += 1
+        if not cached:
+            entry = self._load(path, signature)
+            self._store(path, entry)
+
+        offset = max(1, int(offset))
+        if entry.lines is not None:
+            total = len(entry.lines)
+            stop = total if limit is None else min(total, offset - 1 + max(0, int(limit)))
+            lines = entry.lines[offset - 1:stop]
+        else:
+            total = len(entry.line_starts)
+            stop = total if limit is None else min(total, offset - 1 + max(0, int(limit)))
+            lines = self._read_mmap_range(path, entry, signature, offset - 1, stop)
+        return LineView(path=path, lines=lines, start=offset, total_lines=total, cached=cached)
+
+    def invalidate(self, path: str) -> None:
+        """移除指定文件的缓存条目"""
+        path = os.path.abspath(path)
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self._bytes -= entry.cost
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    # ──── 内部 ────
+
+    def _load(self, path: str, signature: Tuple[int, int, int]) -> _Entry:
+        size = signature[1]
+        if size >= self.mmap_threshold:
+            starts = _scan_line_starts(path, size)
+            return _Entry(signature=signature, line_starts=starts,
+                          cost=starts.itemsize * len(starts))
+        with open(path, "rb") as f:
+            data = f.read()
+        lines = _split_lines(data.decode("utf-8", errors="replace"))
+        return _Entry(signature=signature, lines=lines, cost=len(data) + 8 * len(lines))
+
+    def _store(self, path: str, entry: _Entry) -> None:
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self._bytes -= old.cost
+            if entry.cost > self.max_bytes:
+                return
+            self._entries[path] = entry
+            self._bytes += entry.cost
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.cost
+
+    def _read_mmap_range(self, path: str, entry: _Entry,
+                         signature: Tuple[int, int, int], first: int, stop: int) -> List[str]:
+        """从 mmap 中只解码 [first, stop) 行"""
+        if first >= stop:
+            return []
+        starts = entry.line_starts
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size != signature[1]:
+                raise OSError(f"文件在读取过程中被修改: {path}")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                end = starts[stop] if stop < len(starts) else len(mm)
+                chunk = mm[starts[first]:end]
+        return _split_lines(chunk.decode("utf-8", errors="replace"))
+
+
+def _split_lines(text: str) -> List[str]:
+    """按换行符切分行（与行偏移索引的切分方式一致），去掉行尾的回车符"""
+    lines = text.split("\n")
+    if lines and lines[-1] == "":
+        lines.pop()
+    return [line[:-1] if line.endswith("\r") else line for line in lines]
+
+
+def _scan_line_starts(path: str, size: int) -> array:
+    """扫描文件的行起始偏移（不解码内容）"""
+    starts = array("q")
+    if size == 0:
+        return starts
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = 0
+        while pos < size:
+            starts.append(pos)
+            nl = mm.find(b"\n", pos)
+            if nl == -1:
+                break
+            pos = nl + 1
+    return starts
+
+
+def format_numbered(view: LineView, max_chars: Optional[int] = None) -> Tuple[str, int]:
+    """格式化为带行号的文本（cat -n 风格）
+
+    Args:
+        view: 读取结果
+        max_chars: 输出字符上限（超出时在整行边界截断）
+
+    Returns:
+        (文本, 实际输出的最后一行行号)
+    """
+    out = []
+    used = 0
+    last = view.start - 1
+    for i, line in enumerate(view.lines):
+        if len(line) > MAX_LINE_CHARS:
+            line = line[:MAX_LINE_CHARS] + "…"
+        text = f"{view.start + i:>6}\t{line}"
+        if max_chars is not None and out and used + len(text) + 1 > max_chars:
+            break
+        out.append(text)
+        used += len(text) + 1
+        last = view.start + i
+    return "\n".join(out), last
+
+
+# ═══════════════════════════════════════════════════════════
+# 进程内共享缓存
+# ═══════════════════════════════════════════════════════════
+
+_shared_cache: Optional[ReadCache] = None
+_shared_lock = threading.Lock()
+
+
+def get_read_cache(max_bytes: int = DEFAULT_CACHE_BYTES,
+                   mmap_threshold: int = DEFAULT_MMAP_THRESHOLD) -> ReadCache:
+    """获取进程内共享的读取缓存（首次调用时按参数创建）"""
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = ReadCache(max_bytes=max_bytes, mmap_threshold=mmap_threshold)
+        return _shared_cache
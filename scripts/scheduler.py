@@ -510,7 +510,12 @@ class AgentExecutor:
         return record
 
     def _execute_command(self, command: str) -> Tuple[int, str, str]:
-        """执行 shell 命令"""
+        """执行 shell 命令
+
+        定时任务彼此独立，且在调度线程中同步执行，因此每次都用新的 /bin/sh：
+        持久化 shell 会话（PersistentShell）绑定 asyncio 事件循环，
+        并会在任务之间保留 cwd / 环境变量。
+        """
         result = subprocess.run(
             command, shell=True, capture_output=True, text=True,
             timeout=self.timeout, cwd=self.project_root,
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+ADDS Session Catalog — Session 元数据目录（替代目录扫描）
+
+list_sessions 原本逐个读取并解析所有 .ses，查找最新 session / .mem 需要
+glob + 排序整个 sessions 目录；session 积累到数千个后这些路径拖慢启动。
+目录把每个 session 的头信息、Prev/Next 指针、状态、文件大小、工具输出数
+保存在追加写的 JSONL 清单中，加载后在内存中查询：
+
+- 每次创建 / 归档 / 恢复产生一个事务：一行 JSON（含该事务更新的所有条目），
+  一次 write 写出；崩溃留下的半行在加载时丢弃，事务要么全部生效要么不生效
+- 条目整体写入（非增量）；同一目录的其他进程 / 实例追加的事务在下次查询时
+  按文件偏移增量读入（事务带实例标识，自己写的事务内存中已生效，读到时跳过）
+- 清单行数远多于条目数时整体改写为快照（临时文件 + 原子替换）；其他实例
+  发现清单被替换（inode 变化）时关闭缓存的追加句柄，之后的事务写入新文件
+- 清单缺失时调用 scan（由 SessionManager 提供，解析 .ses / .mem 头部）重建；
+  `adds session reindex` 强制重建
+
+清单格式（.ai/sessions/catalog.jsonl）：
+    {"version": 1}
+    {"put": [{"session_id": "20260409-153000", "status": "active", ...}]}
+    {"by": "3f2a9c01d4e5", "put": [{...新 session...}, {...前一个 session（Next 指针）...}]}
+
+使用方式：
+    catalog = SessionCatalog(".ai/sessions", scan=mgr.scan_sessions_dir, writer=writer)
+    catalog.commit(CatalogEntry(session_id=sid, has_ses=True, ...))
+    latest = catalog.latest_session(exclude=sid)
+"""
+
+import json
+import logging
+import uuid
+from dataclasses import asdict, dataclass, fields, replace
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+from session_writer import SessionWriter, write_bytes_atomic
+
+logger = logging.getLogger(__name__)
+
+
+CATALOG_FILENAME = "catalog.jsonl"
+CATALOG_VERSION = 1
+
+# 清单行数超过该值且超过条目数的 4 倍时改写为快照
+COMPACT_MIN_RECORDS = 256
+COMPACT_FACTOR = 4
+
+# 读取头信息时最多读取的字节数（头部在第一个 "---" 之前）
+HEADER_READ_BYTES = 4096
+
+
+@dataclass
+class CatalogEntry:
+    """一个 session 的目录条目（.ses 与 .mem 的头信息合并）"""
+    session_id: str
+    agent: str = ""
+    feature: str = ""
+    created: str = ""
+    status: str = "active"            # active | archived | restored
+    prev_session: Optional[str] = None
+    next_session: Optional[str] = None
+    has_ses: bool = False
+    ses_bytes: int = 0                # 最近一次生命周期事件时的 .ses 大小
+    log_count: int = 0                # .ses 中引用的工具输出数（归档后内联到 .mem，归零）
+    has_mem: bool = False
+    mem_bytes: int = 0
+    archived: str = ""
+    prev_mem: Optional[str] = None
+    next_mem: Optional[str] = None
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "CatalogEntry":
+        if data.keys() <= _ENTRY_FIELDS:
+            return cls(**data)
+        return cls(**{k: v for k, v in data.items() if k in _ENTRY_FIELDS})
+
+
+_ENTRY_FIELDS = frozenset(f.name for f in fields(CatalogEntry))
+
+
+class SessionCatalog:
+    """Session 目录（内存索引 + 追加写清单）"""
+
+    def __init__(self, sessions_dir: str, scan: Callable[[], Iterable[CatalogEntry]],
+                 writer: Optional[SessionWriter] = None):
+        """
+        Args:
+            sessions_dir: sessions 目录
+            scan: 扫描目录生成全部条目（重建时调用）
+            writer: SessionWriter（与 .ses 写入共用，保证写出顺序）
+        """
+        self.sessions_dir = Path(sessions_dir)
+        self.path = self.sessions_dir / CATALOG_FILENAME
+        self._scan = scan
+        self._writer = writer or SessionWriter(batched=False)
+        self._entries: Dict[str, CatalogEntry] = {}
+        self._loaded = False
+        # 已读入的清单位置（用于增量读取其他实例追加的事务）
+        self._inode: Optional[int] = None
+        self._offset = 0
+        self._records = 0
+        # 文件末尾是半行（崩溃残留）时，下一次追加先补换行
+        self._torn_tail = False
+        # 本实例写入的事务标识（事务可能仍在 writer 队列中，读到时不重放）
+        self._token = uuid.uuid4().hex[:12]
+
+    # ──── 查询 ────
+
+    def get(self, session_id: str) -> Optional[CatalogEntry]:
+        self.refresh()
+        entry = self._entries.get(session_id)
+        return replace(entry) if entry is not None else None
+
+    def entries(self) -> List[CatalogEntry]:
+        """所有条目（按 session ID 排序）"""
+        self.refresh()
+        return [replace(self._entries[sid]) for sid in sorted(self._entries)]
+
+    def ids(self) -> List[str]:
+        self.refresh()
+        return sorted(self._entries)
+
+    def latest_session(self, exclude: str = "") -> Optional[str]:
+        """ID 最大的 .ses（与按文件名倒序排序取第一个一致）"""
+        self.refresh()
+        candidates = [sid for sid, e in self._entries.items() if e.has_ses and sid != exclude]
+        return max(candidates) if candidates else None
+
+    def latest_mem(self, exclude: str = "") -> Optional[str]:
+        """ID 最大的 .mem"""
+        self.refresh()
+        candidates = [sid for sid, e in self._entries.items() if e.has_mem and sid != exclude]
+        return max(candidates) if candidates else None
+
+    def __contains__(self, session_id: str) -> bool:
+        self.refresh()
+        return session_id in self._entries
+
+    def __len__(self) -> int:
+        self.refresh()
+        return len(self._entries)
+
+    # ──── 更新 ────
+
+    def commit(self, *entries: CatalogEntry) -> None:
+        """以一个事务写入若干条目（整体替换同 ID 的旧条目）"""
+        if not entries:
+            return
+        self.refresh()
+        for entry in entries:
+            self._entries[entry.session_id] = replace(entry)
+        line = json.dumps({"by": self._token, "put": [e.to_dict() for e in entries]},
+                          ensure_ascii=False)
+        if self._torn_tail:
+            line = "\n" + line
+            self._torn_tail = False
+        self._writer.append(self.path, line + "\n")
+        self._records += 1
+        if self._records > COMPACT_MIN_RECORDS and self._records > COMPACT_FACTOR * len(self._entries):
+            self.compact()
+
+    def update(self, session_id: str, **changes) -> Optional[CatalogEntry]:
+        """修改单个条目的部分字段并提交（条目不存在时返回 None）"""
+        entry = self.get(session_id)
+        if entry is None:
+            return None
+        entry = replace(entry, **changes)
+        self.commit(entry)
+        return entry
+
+    def compact(self) -> None:
+        """把清单改写为快照（每个条目一行）"""
+        self._writer.flush(close_files=True)   # 排队中的追加先落到旧文件
+        self.refresh()                          # 先读入其他实例的事务（新实例此时尚未加载）
+        self._write_snapshot()
+
+    def rebuild(self) -> int:
+        """扫描 sessions 目录重建目录
+
+        Returns:
+            条目数
+        """
+        self._writer.flush(close_files=True)
+        self._entries = {entry.session_id: entry for entry in self._scan()}
+        self._loaded = True
+        self._write_snapshot()
+        logger.info(f"Session catalog rebuilt: {len(self._entries)} entries")
+        return len(self._entries)
+
+    # ──── 加载 ────
+
+    def refresh(self) -> None:
+        """读入清单的新内容（首次调用时加载；清单缺失时扫描目录重建）"""
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            # 首次使用（旧目录没有清单）或清单被删除：从目录重建
+            self.rebuild()
+            return
+        if not self._loaded or stat.st_ino != self._inode or stat.st_size < self._offset:
+            if self._loaded:
+                # 其他实例改写了清单：writer 缓存的追加句柄仍指向旧文件，关闭后重新打开
+                self._writer.flush(close_files=True)
+            self._entries = {}
+            self._offset = 0
+            self._records = 0
+            self._inode = stat.st_ino
+            self._loaded = True
+        if stat.st_size > self._offset:
+            self._read_from(self._offset)
+
+    def _read_from(self, offset: int) -> None:
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        # 没有换行结尾的最后一行可能仍在写入，留到下次读取；
+        # 若是崩溃残留，下一次追加会先补换行，使其成为一行可丢弃的坏记录
+        self._torn_tail = end < len(data)
+        for record in self._parse_records(data[:end]):
+            if record.get("by") == self._token:
+                continue    # 自己的事务（commit 时已计数并生效）
+            self._records += 1
+            for item in record.get("put", ()):
+                entry = CatalogEntry.from_dict(item)
+                self._entries[entry.session_id] = entry
+            for sid in record.get("del", ()):
+                self._entries.pop(sid, None)
+        self._offset = offset + end
+
+    def _parse_records(self, data: bytes) -> List[Dict]:
+        """解析若干完整的记录行（整体作为一个 JSON 数组解析，有坏行时逐行解析）"""
+        lines = [line for line in data.splitlines() if line.strip()]
+        try:
+            return json.loads(b"[" + b",".join(lines) + b"]")
+        except ValueError:
+            pass
+        records = []
+        for raw in lines:
+            try:
+                records.append(json.loads(raw))
+            except ValueError:
+                logger.warning("Catalog: skipping malformed record in %s", self.path.name)
+        return records
+
+    def _write_snapshot(self) -> None:
+        lines = [json.dumps({"version": CATALOG_VERSION})]
+        lines.extend(json.dumps({"put": [self._entries[sid].to_dict()]}, ensure_ascii=False)
+                     for sid in sorted(self._entries))
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        write_bytes_atomic(self.path, data)
+        stat = self.path.stat()
+        self._inode = stat.st_ino
+        self._offset = len(data)
+        self._records = len(lines)
+        self._torn_tail = False
+
+
+# ═══════════════════════════════════════════════════════════
+# 便捷函数
+# ═══════════════════════════════════════════════════════════
+
+def read_header_text(path: Path) -> str:
+    """读取文件开头直到第一个 "---" 行的内容（头部元数据）"""
+    with open(path, "rb") as f:
+        data = f.read(HEADER_READ_BYTES)
+    text = data.decode("utf-8", errors="ignore")
+    end = text.find("\n---")
+    return text[:end] if end >= 0 else text
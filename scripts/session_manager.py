@@ -6,28 +6,49 @@ ADDS Session Manager — Session 文件管理
 - 管理 .ses / .log / .mem 文件的生命周期
 - 链式 Session 结构（Prev/Next 指针）
 - Session 创建、读取、归档、恢复
+- .ses 追加与工具输出写入经 SessionWriter 排队（可后台批量写出）
+- 工具输出存入内容寻址的压缩 blob 存储（相同内容只存一份），.ses 中按哈希引用
+- Session 元数据（头信息、链式指针、状态、大小）记录在 catalog.jsonl 中，
+  列表 / 查找最新 session 不再扫描目录
+- 完整记录的重建与归档是流式的：逐行读取 .ses、工具输出分块读出并直接写入
+  .mem，内存占用与 session 大小无关
 
 文件格式参考：P0-2 路线图 — 文件体系设计
 
 .ai/sessions/
 ├── 20260409-153000.ses       # Session 对话记录（活跃/摘要版）
-├── 20260409-153000-ses1.log  # 工具输出 log
-├── 20260409-153000-ses2.log  # 同一 session 第 2 个 log
+├── 20260409-153000-ses1.log  # 工具输出 log（旧格式，仍可读取）
+├── blobs/3f/3fa2...e1.zst    # 工具输出 blob（.ses 中引用为 blob:<哈希>）
 ├── 20260409-153000.mem       # 记忆归档（摘要 + 完整记录）
+├── catalog.jsonl             # Session 目录（adds session reindex 可重建）
 └── index.mem                 # 记忆索引（始终注入上下文）
 """
 
 import json
 import logging
+import os
 import re
 from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from blob_store import BLOB_REF_PATTERN, BlobStore, is_blob_ref
+from memory_index import MemoryIndex
+from vector_index import VectorIndex
+from session_catalog import CatalogEntry, SessionCatalog, read_header_text
+from session_writer import SessionWriter
 
 logger = logging.getLogger(__name__)
 
 
+# .ses 中的工具输出引用：blob:<哈希>（旧格式为 <session>-sesN.log）
+LOG_REF_PATTERN = re.compile(rf'详见 `(\S+\.log|{BLOB_REF_PATTERN.pattern})`')
+
+# 流式重建时每次读取的工具输出字符数
+RECORD_READ_CHARS = 64 * 1024
+
+
 # ═══════════════════════════════════════════════════════════
 # 数据结构
 # ═══════════════════════════════════════════════════════════
@@ -153,15 +174,28 @@ class SessionManager:
     4. 归档 Session（.ses → .mem，含 LLM 摘要）
     5. 链式指针维护（Prev/Next）
     6. 恢复 Session（.mem → .ses）
+
+    写入经 SessionWriter 完成：未传入 writer 时同步写出（行为与逐条写入一致）；
+    传入批量 writer 时消息在后台批量落盘，读取 / 归档 / 改写前自动刷盘。
     """
 
-    def __init__(self, sessions_dir: str = ".ai/sessions"):
+    def __init__(self, sessions_dir: str = ".ai/sessions",
+                 writer: Optional[SessionWriter] = None,
+                 blob_store: Optional[BlobStore] = None):
         self.sessions_dir = Path(sessions_dir)
         self.sessions_dir.mkdir(parents=True, exist_ok=True)
+        self._writer = writer or SessionWriter(batched=False)
+        self.blobs = blob_store or BlobStore(str(self.sessions_dir / "blobs"))
+        # 元数据目录（首次查询时加载，清单缺失时扫描目录重建）
+        self.catalog = SessionCatalog(str(self.sessions_dir), scan=self.scan_sessions_dir,
+                                      writer=self._writer)
+        # 记忆检索倒排索引（此处只追加记录，不加载）
+        self.memory_index = MemoryIndex(str(self.sessions_dir))
+        # 向量索引：已建立时追加归档的段落向量
+        self.vector_index = VectorIndex(str(self.sessions_dir))
 
         self._current_session_id: Optional[str] = None
         self._current_header: Optional[SessionHeader] = None
-        self._log_counter: int = 0
 
     # ──── Session 创建 ────
 
@@ -175,18 +209,15 @@ class SessionManager:
         Returns:
             session_id (格式: YYYYMMDD-HHMMSS)
         """
+        # 前一个 session 的 .ses 将被改写（Next 指针）：先刷盘并关闭句柄
+        self._writer.flush(close_files=True)
         session_id = datetime.now().strftime("%Y%m%d-%H%M%S")
 
-        # 确保不与已有 session 冲突（同一秒内创建多个 session 时）
-        while self._ses_path(session_id).exists():
-            # 追加 -2, -3 等后缀
-            base = datetime.now().strftime("%Y%m%d-%H%M%S")
-            # 计数器递增
-            existing = list(self.sessions_dir.glob(f"{base}*.ses"))
-            if existing:
-                session_id = f"{base}-{len(existing)+1}"
-            else:
-                break
+        # 确保不与已有 session 冲突（同一秒内创建多个 session 时追加 -2, -3 等后缀）
+        base, n = session_id, 1
+        while session_id in self.catalog or self._ses_path(session_id).exists():
+            n += 1
+            session_id = f"{base}-{n}"
 
         # 查找前一个 session
         prev_session = self._find_latest_session_id(exclude=session_id)
@@ -207,11 +238,17 @@ class SessionManager:
 
         self._current_session_id = session_id
         self._current_header = header
-        self._log_counter = 0
 
-        # 更新前一个 session 的 Next 指针
+        # 更新前一个 session 的 Next 指针（与新条目同一个目录事务）
+        updates = [self._catalog_entry(header, ses_bytes=len(content.encode("utf-8")))]
         if prev_session:
             self._update_next_pointer(prev_session, session_id)
+            prev = self.catalog.get(prev_session)
+            if prev is not None and prev.has_ses:
+                prev.next_session = session_id
+                prev.ses_bytes = self._file_size(self._ses_path(prev_session))
+                updates.append(prev)
+        self.catalog.commit(*updates)
 
         logger.info(f"Session created: {session_id} (agent={agent}, feature={feature})")
         return session_id
@@ -253,13 +290,14 @@ class SessionManager:
 
         msg_lines.append("")  # 空行
 
-        # 追加写入
-        with open(ses_path, "a", encoding="utf-8") as f:
-            f.write("\n".join(msg_lines))
+        # 追加写入（排队，由 writer 批量落盘）
+        self._writer.append(ses_path, "\n".join(msg_lines))
 
     def save_tool_output(self, content: str, summary: str = "",
                          strategy: str = "tool_filter") -> str:
-        """保存工具输出到 .log 文件，并在 .ses 中留下引用
+        """保存工具输出到 blob 存储，并在 .ses 中留下引用
+
+        相同内容（如重复读取同一文件）只存储一份。
 
         Args:
             content: 完整工具输出
@@ -267,18 +305,14 @@ class SessionManager:
             strategy: 使用的压缩策略
 
         Returns:
-            log 文件名 (如 "20260409-153000-ses1.log")
+            引用 (如 "blob:3fa2...e1")，read_log 可读回原文
         """
         if not self._current_session_id:
             logger.warning("No active session, tool output ignored")
             return ""
 
-        self._log_counter += 1
-        log_filename = f"{self._current_session_id}-ses{self._log_counter}.log"
-        log_path = self.sessions_dir / log_filename
-
-        # 写入 .log 文件
-        log_path.write_text(content, encoding="utf-8")
+        # 写入 blob（与随后的 .ses 引用按顺序落盘）
+        log_filename = self.blobs.put(content, writer=self._writer)
 
         # 在 .ses 中追加引用 + 摘要
         placeholder = f"详见 `{log_filename}`"
@@ -288,10 +322,24 @@ class SessionManager:
             msg = placeholder
 
         self.append_message("tool_result", msg, strategy=strategy)
+        entry = self.catalog.get(self._current_session_id)
+        if entry is not None:
+            entry.log_count += 1
+            self.catalog.commit(entry)
 
         logger.debug(f"Tool output saved: {log_filename} ({len(content)} chars)")
         return log_filename
 
+    # ──── 刷盘 ────
+
+    def flush(self) -> None:
+        """将排队中的写入同步落盘"""
+        self._writer.flush()
+
+    def close(self) -> None:
+        """刷盘并释放 writer（之后的写入同步执行）"""
+        self._writer.close()
+
     # ──── Session 读取 ────
 
     def read_session(self, session_id: str) -> Tuple[SessionHeader, str]:
@@ -300,6 +348,7 @@ class SessionManager:
         Returns:
             (header, body_text)
         """
+        self._writer.flush()
         ses_path = self._ses_path(session_id)
         if not ses_path.exists():
             raise FileNotFoundError(f"Session not found: {ses_path}")
@@ -309,16 +358,29 @@ class SessionManager:
         return header, body
 
     def read_log(self, log_filename: str) -> str:
-        """读取 .log 文件内容"""
+        """读取工具输出（blob 引用自动解压；兼容旧的 .log 文件名）"""
+        self._writer.flush()
+        if is_blob_ref(log_filename):
+            return self.blobs.get(log_filename)
         log_path = self.sessions_dir / log_filename
         if not log_path.exists():
             raise FileNotFoundError(f"Log not found: {log_path}")
         return log_path.read_text(encoding="utf-8")
 
+    def open_log(self, log_filename: str) -> IO[str]:
+        """以文本流打开工具输出（blob 引用流式解压；兼容旧的 .log 文件名）"""
+        self._writer.flush()
+        if is_blob_ref(log_filename):
+            return self.blobs.open_text(log_filename)
+        log_path = self.sessions_dir / log_filename
+        if not log_path.exists():
+            raise FileNotFoundError(f"Log not found: {log_path}")
+        return open(log_path, encoding="utf-8")
+
     def reconstruct_full_session(self, session_id: str) -> str:
-        """重建完整 Session（将 .log 引用替换为实际内容）
+        """重建完整 Session（将工具输出引用替换为实际内容）
 
-        用于 Layer2 归档前合并 .ses + .log 文件。
+        兼容接口：一次性拼出完整文本。大 session 请用 iter_full_session 流式处理。
 
         Args:
             session_id: Session ID
@@ -326,59 +388,104 @@ class SessionManager:
         Returns:
             完整的 Session 文本（含所有工具输出）
         """
-        header, body = self.read_session(session_id)
-
-        # 查找所有 log 引用并替换
-        log_pattern = re.compile(r'详见 `(\S+\.log)`')
-        lines = body.split("\n")
-        reconstructed = []
-
-        i = 0
-        while i < len(lines):
-            line = lines[i]
-            match = log_pattern.search(line)
-            if match:
+        return "".join(self.iter_full_session(session_id))
+
+    def iter_full_session(self, session_id: str) -> Iterator[str]:
+        """流式重建完整 Session：逐行读取 .ses，工具输出按块读出
+
+        拼接结果与 reconstruct_full_session 相同；任一时刻只持有一行 .ses
+        与一块工具输出，用于 Layer2 归档前合并 .ses + blob / .log 文件。
+
+        Args:
+            session_id: Session ID
+
+        Yields:
+            完整记录的片段
+        """
+        self._writer.flush()
+        ses_path = self._ses_path(session_id)
+        if not ses_path.exists():
+            raise FileNotFoundError(f"Session not found: {ses_path}")
+
+        with open(ses_path, encoding="utf-8") as f:
+            header, body_lines = self._split_header_stream(f)
+            yield header.to_metadata() + "\n\n---\n\n"
+            first = True
+            for line in body_lines:
+                if not first:
+                    yield "\n"
+                first = False
+                match = LOG_REF_PATTERN.search(line)
+                if not match:
+                    yield line
+                    continue
                 log_filename = match.group(1)
                 try:
-                    log_content = self.read_log(log_filename)
-                    reconstructed.append(f"### [tool_result — 完整输出 from {log_filename}]")
-                    reconstructed.append(log_content)
+                    log = self.open_log(log_filename)
                 except FileNotFoundError:
-                    reconstructed.append(f"⚠️ Log file not found: {log_filename}")
-            else:
-                reconstructed.append(line)
-            i += 1
-
-        return header.to_metadata() + "\n\n---\n\n" + "\n".join(reconstructed)
+                    yield f"⚠️ Log file not found: {log_filename}"
+                    continue
+                with log:
+                    yield f"### [tool_result — 完整输出 from {log_filename}]\n"
+                    for chunk in iter(lambda: log.read(RECORD_READ_CHARS), ""):
+                        yield chunk
 
     # ──── Session 归档 ────
 
-    def archive_session(self, summary: str, full_record: str = "") -> str:
-        """归档当前 Session → 生成 .mem 文件
+    def detach_session(self) -> Optional[str]:
+        """结束当前 Session 的写入但暂不归档（后台 Layer2 归档前调用）
+
+        之后可以立即 create_session 开始新 session，
+        摘要完成后再以 archive_session(session_id=...) 归档被分离的 session。
+
+        Returns:
+            被分离的 session_id，或 None（没有活跃 session）
+        """
+        session_id = self._current_session_id
+        if session_id:
+            self._writer.flush(close_files=True)
+            self.catalog.update(session_id, ses_bytes=self._file_size(self._ses_path(session_id)))
+            self._current_session_id = None
+            self._current_header = None
+            logger.info(f"Session detached for archiving: {session_id}")
+        return session_id
+
+    def archive_session(self, summary: str, full_record: Union[str, Iterable[str], None] = "",
+                        session_id: Optional[str] = None) -> str:
+        """归档 Session → 生成 .mem 文件
 
         操作：
-        1. 合并 .ses + .log → 完整记录
+        1. 合并 .ses + .log → 完整记录（流式，边读边写入 .mem）
         2. 生成 .mem 文件（摘要 + 完整记录 + 链式指针）
         3. 回写 .ses 为摘要版
 
         Args:
             summary: LLM 生成的结构化摘要
-            full_record: 完整记录（如果为空，自动从 .ses + .log 重建）
+            full_record: 完整记录，可为字符串或片段迭代器
+                         （如果为空，自动从 .ses + .log 流式重建）
+            session_id: 要归档的 session（默认当前 session；可为已分离的 session）
 
         Returns:
             .mem 文件路径
         """
-        if not self._current_session_id:
+        session_id = session_id or self._current_session_id
+        if not session_id:
             raise RuntimeError("No active session to archive")
+        is_current = session_id == self._current_session_id
 
-        session_id = self._current_session_id
+        # .ses 将被回写为摘要版：先刷盘并关闭句柄
+        self._writer.flush(close_files=True)
 
-        # Step 1: 获取完整记录
+        # Step 1: 完整记录（写入 .mem 时逐片读取）
         if not full_record:
-            full_record = self.reconstruct_full_session(session_id)
+            record: Iterable[str] = self.iter_full_session(session_id)
+        elif isinstance(full_record, str):
+            record = (full_record,)
+        else:
+            record = full_record
 
         # Step 2: 生成 .mem 文件
-        header = self._current_header
+        header = self._current_header if is_current else self._read_header(session_id)
         prev_mem = self._find_latest_mem_id(exclude=session_id)
 
         mem_header = MemoryHeader(
@@ -390,7 +497,7 @@ class SessionManager:
             prev_mem=prev_mem,
         )
 
-        mem_content = mem_header.to_metadata() + f"""
+        mem_head = mem_header.to_metadata() + f"""
 
 ---
 
@@ -402,11 +509,10 @@ class SessionManager:
 
 ## 完整记录（含工具输出详情）
 
-{full_record}
 """
 
         mem_path = self._mem_path(session_id)
-        mem_path.write_text(mem_content, encoding="utf-8")
+        _write_stream(mem_path, [mem_head], record, ["\n"])
 
         # Step 3: 回写 .ses 为摘要版
         ses_summary = header.to_metadata() + f"\n# Status: archived\n\n---\n\n"
@@ -418,17 +524,41 @@ class SessionManager:
         ses_path = self._ses_path(session_id)
         ses_path.write_text(ses_summary, encoding="utf-8")
 
-        # 更新 header
-        header.status = "archived"
-        header.next_session = None  # 下一个 session 由下一个 create 设置
-
         # 更新前一个 .mem 的 Next 指针
         if prev_mem:
             self._update_mem_next_pointer(prev_mem, session_id)
 
+        # 记忆检索索引：追加新 .mem（及改写了指针的前一个 .mem）的倒排记录
+        self._index_mem(mem_path)
+        if prev_mem:
+            self._index_mem(self._mem_path(prev_mem))
+
+        # 目录：本 session 与前一个 .mem 的指针在同一个事务中更新
+        entry = self.catalog.get(session_id) or self._catalog_entry(header)
+        entry.status = "archived"
+        entry.has_ses = True
+        entry.ses_bytes = len(ses_summary.encode("utf-8"))
+        entry.log_count = 0     # 工具输出已内联到 .mem，摘要版 .ses 不再引用
+        entry.has_mem = True
+        entry.mem_bytes = self._file_size(mem_path)
+        entry.archived = mem_header.archived
+        entry.prev_mem = prev_mem
+        entry.next_mem = None
+        updates = [entry]
+        prev_entry = self.catalog.get(prev_mem) if prev_mem else None
+        if prev_entry is not None and prev_entry.has_mem:
+            prev_entry.next_mem = f"{session_id}.mem"
+            prev_entry.mem_bytes = self._file_size(self._mem_path(prev_mem))
+            updates.append(prev_entry)
+        self.catalog.commit(*updates)
+
         logger.info(f"Session archived: {session_id} → {mem_path.name}")
-        self._current_session_id = None
-        self._current_header = None
+        if is_current:
+            # 更新 header（下一个 session 由下一个 create 设置）
+            header.status = "archived"
+            header.next_session = None
+            self._current_session_id = None
+            self._current_header = None
 
         return str(mem_path)
 
@@ -448,6 +578,7 @@ class SessionManager:
             raise FileNotFoundError(f"Memory file not found: {mem_path}")
 
         mem_content = mem_path.read_text(encoding="utf-8")
+        self._writer.flush(close_files=True)
 
         # 解析 .mem 头部
         mem_header, body = self._split_mem_header(mem_content)
@@ -477,6 +608,14 @@ class SessionManager:
         ses_path = self._ses_path(session_id)
         ses_path.write_text(ses_content, encoding="utf-8")
 
+        restored = self._catalog_entry(ses_header, ses_bytes=len(ses_content.encode("utf-8")))
+        restored.has_mem = True
+        restored.mem_bytes = len(mem_content.encode("utf-8"))
+        restored.archived = mem_header.archived
+        restored.prev_mem = mem_header.prev_mem
+        restored.next_mem = mem_header.next_mem
+        self.catalog.commit(restored)
+
         logger.info(f"Session restored: {session_id}")
         return str(ses_path)
 
@@ -525,33 +664,114 @@ class SessionManager:
             return None
 
     def list_sessions(self) -> List[Dict]:
-        """列出所有 Session 的元数据"""
-        sessions = []
+        """列出所有 Session 的元数据（来自目录，不读取 .ses 文件）"""
+        return [
+            {
+                "session_id": entry.session_id,
+                "agent": entry.agent,
+                "feature": entry.feature,
+                "created": entry.created,
+                "status": entry.status,
+                "prev": entry.prev_session,
+                "next": entry.next_session,
+                "size": entry.ses_bytes,
+                "logs": entry.log_count,
+                "mem": f"{entry.session_id}.mem" if entry.has_mem else None,
+            }
+            for entry in self.catalog.entries() if entry.has_ses
+        ]
+
+    def reindex(self) -> int:
+        """扫描 sessions 目录重建目录（目录与文件不一致时使用）
+
+        Returns:
+            条目数
+        """
+        return self.catalog.rebuild()
+
+    def scan_sessions_dir(self) -> Iterator[CatalogEntry]:
+        """解析目录中所有 .ses / .mem 头部生成目录条目（重建目录用）"""
+        self._writer.flush()
+        entries: Dict[str, CatalogEntry] = {}
+        # 旧格式 .log 文件：<session>-sesN.log（一次扫描后按 session 分组）
+        legacy: Dict[str, set] = {}
+        for log_path in self.sessions_dir.glob("*-ses*.log"):
+            legacy.setdefault(log_path.name.rsplit("-ses", 1)[0], set()).add(log_path.name)
         for ses_path in sorted(self.sessions_dir.glob("*.ses")):
-            session_id = ses_path.stem
             try:
-                header, _ = self.read_session(session_id)
-                sessions.append({
-                    "session_id": session_id,
-                    "agent": header.agent,
-                    "feature": header.feature,
-                    "created": header.created,
-                    "status": header.status,
-                    "prev": header.prev_session,
-                    "next": header.next_session,
-                })
-            except Exception as e:
-                sessions.append({
-                    "session_id": session_id,
-                    "error": str(e),
-                })
-        return sessions
+                header = SessionHeader.from_metadata(read_header_text(ses_path))
+                text = ses_path.read_text(encoding="utf-8")
+            except (OSError, UnicodeDecodeError, TypeError) as e:
+                logger.warning(f"Catalog: failed to scan {ses_path.name}: {e}")
+                continue
+            header.session_id = ses_path.stem
+            refs = LOG_REF_PATTERN.findall(text)
+            legacy_logs = legacy.get(ses_path.stem, set())
+            entry = self._catalog_entry(header, ses_bytes=len(text.encode("utf-8")))
+            entry.log_count = len(refs) + len(legacy_logs - set(refs))
+            entries[entry.session_id] = entry
+        for mem_path in sorted(self.sessions_dir.glob("*.mem")):
+            if mem_path.stem.startswith("index"):
+                continue    # index.mem / index-prev.mem / 索引快照不是 session 归档
+            try:
+                mem_header = MemoryHeader.from_metadata(read_header_text(mem_path))
+            except (OSError, TypeError) as e:
+                logger.warning(f"Catalog: failed to scan {mem_path.name}: {e}")
+                continue
+            entry = entries.get(mem_path.stem)
+            if entry is None:
+                entry = entries[mem_path.stem] = CatalogEntry(
+                    session_id=mem_path.stem, agent=mem_header.agent,
+                    feature=mem_header.feature, created=mem_header.created, status="archived")
+            entry.has_mem = True
+            entry.mem_bytes = self._file_size(mem_path)
+            entry.archived = mem_header.archived
+            entry.prev_mem = mem_header.prev_mem
+            entry.next_mem = mem_header.next_mem
+        return iter(entries.values())
 
     def list_logs(self, session_id: str) -> List[str]:
-        """列出某个 Session 的所有 .log 文件"""
-        return sorted(
+        """列出某个 Session 的所有工具输出（旧 .log 文件 + .ses 中引用的 blob）"""
+        self._writer.flush()
+        logs = sorted(
             p.name for p in self.sessions_dir.glob(f"{session_id}-ses*.log")
         )
+        ses_path = self._ses_path(session_id)
+        if ses_path.exists():
+            refs = LOG_REF_PATTERN.findall(ses_path.read_text(encoding="utf-8"))
+            logs.extend(dict.fromkeys(ref for ref in refs if is_blob_ref(ref)))
+        return logs
+
+    # ──── Blob 清理 ────
+
+    def referenced_blobs(self) -> set:
+        """所有 .ses / .mem 中仍引用的 blob"""
+        self._writer.flush()
+        refs = set()
+        for pattern in ("*.ses", "*.mem"):
+            for path in self.sessions_dir.glob(pattern):
+                try:
+                    text = path.read_text(encoding="utf-8")
+                except OSError as e:
+                    logger.warning(f"Failed to scan {path.name} for blob refs: {e}")
+                    continue
+                refs.update(ref for ref in LOG_REF_PATTERN.findall(text) if is_blob_ref(ref))
+        return refs
+
+    def gc_blobs(self, min_age: float = 3600.0, dry_run: bool = False) -> Tuple[int, int]:
+        """删除不再被任何 .ses / .mem 引用的 blob
+
+        归档后的 .mem 已内联完整工具输出，原 .ses 回写为摘要版，
+        其 blob 即不再被引用。
+
+        Args:
+            min_age: 只删除早于该秒数写入的 blob（运行中的会话可能尚未写出引用）
+            dry_run: 只统计不删除
+
+        Returns:
+            (删除的 blob 数, 释放的字节数)
+        """
+        return self.blobs.gc(self.referenced_blobs(), min_age=min_age, dry_run=dry_run)
 
     def session_exists(self, session_id: str) -> bool:
         """Session 是否存在"""
@@ -585,6 +805,48 @@ class SessionManager:
         body = "\n".join(text.split("\n")[body_start:])
         return header, body.strip()
 
+    def _split_header_stream(self, f: IO[str]) -> Tuple[SessionHeader, Iterator[str]]:
+        """流式版 _split_header_body：解析头部，返回逐行产出正文的迭代器
+
+        正文行与 body.strip().split("\\n") 一致（首尾空白行去掉，首行去左侧、
+        末行去右侧空白）。
+        """
+        metadata_lines = []
+        found = False
+        for line in f:
+            if line.strip() == "---":
+                found = True
+                break
+            if line.strip():
+                metadata_lines.append(line.rstrip("\n"))
+        if not found:
+            f.seek(0)       # 没有分隔线：整个文件都是正文
+
+        def body() -> Iterator[str]:
+            held: Optional[str] = None
+            blank: List[str] = []
+            for raw in f:
+                line = raw[:-1] if raw.endswith("\n") else raw
+                if not line.strip():
+                    if held is not None:
+                        blank.append(line)
+                    continue
+                if held is None:
+                    held = line.lstrip()
+                    continue
+                yield held
+                yield from blank
+                held, blank = line, []
+            if held is not None:
+                yield held.rstrip()
+
+        return SessionHeader.from_metadata("\n".join(metadata_lines)), body()
+
+    def _read_header(self, session_id: str) -> SessionHeader:
+        """只读取 .ses 头部"""
+        self._writer.flush()
+        return SessionHeader.from_metadata(read_header_text(self._ses_path(session_id)))
+
     def _split_mem_header(self, text: str) -> Tuple[MemoryHeader, str]:
         """分割 .mem 文件的头部元数据和正文"""
         metadata_lines = []
@@ -602,21 +864,32 @@ class SessionManager:
 
     def _find_latest_session_id(self, exclude: str = "") -> Optional[str]:
         """查找最新的 Session ID（用于设置 Prev 指针）"""
-        ses_files = sorted(self.sessions_dir.glob("*.ses"), reverse=True)
-        for ses_path in ses_files:
-            sid = ses_path.stem
-            if sid != exclude:
-                return sid
-        return None
+        return self.catalog.latest_session(exclude=exclude)
 
     def _find_latest_mem_id(self, exclude: str = "") -> Optional[str]:
         """查找最新的 .mem 文件 ID"""
-        mem_files = sorted(self.sessions_dir.glob("*.mem"), reverse=True)
-        for mem_path in mem_files:
-            mid = mem_path.stem
-            if mid != exclude and mid != "index":
-                return mid
-        return None
+        return self.catalog.latest_mem(exclude=exclude)
+
+    @staticmethod
+    def _catalog_entry(header: SessionHeader, ses_bytes: int = 0) -> CatalogEntry:
+        return CatalogEntry(
+            session_id=header.session_id,
+            agent=header.agent,
+            feature=header.feature,
+            created=header.created,
+            status=header.status,
+            prev_session=header.prev_session,
+            next_session=header.next_session,
+            has_ses=True,
+            ses_bytes=ses_bytes,
+        )
+
+    @staticmethod
+    def _file_size(path: Path) -> int:
+        try:
+            return path.stat().st_size
+        except OSError:
+            return 0
 
     def _update_next_pointer(self, session_id: str, next_id: str) -> None:
         """更新 .ses 文件的 Next 指针"""
@@ -634,6 +907,15 @@ class SessionManager:
             )
         ses_path.write_text(content, encoding="utf-8")
 
+    def _index_mem(self, mem_path: Path) -> None:
+        try:
+            self.memory_index.update_file(mem_path)
+            if self.vector_index.exists():
+                self.vector_index.update_file(mem_path)
+        except OSError as e:
+            # 索引可在检索时按 mtime/size 补齐，不影响归档
+            logger.warning(f"Failed to index {mem_path.name}: {e}")
+
     def _update_mem_next_pointer(self, mem_id: str, next_id: str) -> None:
         """更新 .mem 文件的 Next 指针"""
         mem_path = self._mem_path(mem_id)
@@ -645,6 +927,20 @@ class SessionManager:
         mem_path.write_text(content, encoding="utf-8")
 
 
+def _write_stream(path: Path, *parts: Iterable[str]) -> None:
+    """依次写入各组片段（临时文件 + 原子替换，出错时不留下半个文件）"""
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            for pieces in parts:
+                for piece in pieces:
+                    f.write(piece)
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
 # ═══════════════════════════════════════════════════════════
 # 单元测试
 # ═══════════════════════════════════════════════════════════
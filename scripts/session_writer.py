@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+ADDS Session Writer — 批量写入 Session 文件（.ses 追加 / .log 与 blob 写入）
+
+设计目标：
+- 调用方（事件循环线程）只把记录放入队列，不做磁盘 I/O
+- 后台线程按大小 / 时间阈值批量写出：同一文件的连续追加合并为一次 write
+- 追加写使用缓存的文件句柄，不再每条消息 open/close 一次
+- 记录严格按入队顺序落盘（.log / blob 先于 .ses 中对它的引用）
+- 持久化级别 durability：
+    none  — 批次写入进程缓冲区，由缓冲区 / 显式 flush 落到 OS
+    flush — 每批写完后 flush 到 OS（进程崩溃不丢已写批次）
+    fsync — 每批写完后 flush + fsync（断电不丢已写批次）
+- 归档、读取、进程退出时保证刷盘（flush / atexit）
+
+使用方式：
+    writer = SessionWriter(durability="flush")
+    writer.append(ses_path, "\\n### [user]\\n你好\\n")
+    writer.write_file(log_path, tool_output)
+    writer.flush()          # 同步写出所有排队记录
+    writer.close()          # 刷盘 + 关闭句柄 + 停止后台线程
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+
+DURABILITY_LEVELS = ("none", "flush", "fsync")
+
+DEFAULT_SESSION_WRITER_CONFIG = {
+    "batched": True,              # 是否后台批量写入（False 时每条记录同步写出）
+    "durability": "flush",        # none | flush | fsync
+    "flush_interval": 0.5,        # 批次最长等待时间（秒）
+    "max_batch_bytes": 256 * 1024,  # 排队字节数达到该值时立即写出
+    "max_batch_records": 512,     # 排队记录数达到该值时立即写出
+    "max_open_files": 8,          # 缓存的追加句柄数上限
+}
+
+PathLike = Union[str, Path]
+Payload = Union[str, bytes]
+
+
+def load_session_writer_config(project_root: str) -> Dict[str, Any]:
+    """从 .ai/settings.json 加载 session_writer 配置（缺省项用默认值）"""
+    config = dict(DEFAULT_SESSION_WRITER_CONFIG)
+    settings_path = Path(project_root) / ".ai" / "settings.json"
+    if settings_path.exists():
+        try:
+            data = json.loads(settings_path.read_text(encoding="utf-8"))
+            config.update(data.get("session_writer", {}))
+        except (json.JSONDecodeError, OSError) as e:
+            logger.warning("Failed to load session_writer config: %s", e)
+    if config["durability"] not in DURABILITY_LEVELS:
+        logger.warning("Unknown durability %r, using 'flush'", config["durability"])
+        config["durability"] = "flush"
+    return config
+
+
+# 进程退出时刷盘所有仍存活的 writer
+_live_writers: "weakref.WeakSet[SessionWriter]" = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_all_writers() -> None:
+    for writer in list(_live_writers):
+        try:
+            writer.close()
+        except Exception as e:  # 退出阶段只记录，不抛出
+            logger.warning("Session writer flush at exit failed: %s", e)
+
+
+class SessionWriter:
+    """Session 文件批量写入器（线程安全）"""
+
+    def __init__(self, durability: str = "flush", batched: bool = True,
+                 flush_interval: float = 0.5,
+                 max_batch_bytes: int = DEFAULT_SESSION_WRITER_CONFIG["max_batch_bytes"],
+                 max_batch_records: int = DEFAULT_SESSION_WRITER_CONFIG["max_batch_records"],
+                 max_open_files: int = DEFAULT_SESSION_WRITER_CONFIG["max_open_files"]):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"durability 必须是 {DURABILITY_LEVELS} 之一: {durability!r}")
+        self.durability = durability
+        self.batched = batched
+        self.flush_interval = flush_interval
+        self.max_batch_bytes = max_batch_bytes
+        self.max_batch_records = max_batch_records
+        self.max_open_files = max_open_files
+
+        # 队列记录: (kind, path, data)，kind = "append" | "write" | "bytes"
+        self._queue: List[Tuple[str, Path, Payload]] = []
+        self._pending_bytes = 0
+        self._cond = threading.Condition()
+        # 串行化实际写出（取批次 + 写出在同一把锁内，保证入队顺序）
+        self._io_lock = threading.Lock()
+        self._handles: "OrderedDict[Path, Any]" = OrderedDict()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+        self.batches = 0
+        self.records = 0
+        _live_writers.add(self)
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "SessionWriter":
+        cfg = dict(DEFAULT_SESSION_WRITER_CONFIG, **config)
+        return cls(durability=cfg["durability"], batched=cfg["batched"],
+                   flush_interval=cfg["flush_interval"],
+                   max_batch_bytes=cfg["max_batch_bytes"],
+                   max_batch_records=cfg["max_batch_records"],
+                   max_open_files=cfg["max_open_files"])
+
+    @property
+    def pending(self) -> int:
+        """排队中的记录数"""
+        with self._cond:
+            return len(self._queue)
+
+    # ──── 入队 ────
+
+    def append(self, path: PathLike, text: str) -> None:
+        """追加文本到文件末尾"""
+        self._submit("append", Path(path), text)
+
+    def write_file(self, path: PathLike, text: str) -> None:
+        """整体写入文件（覆盖）"""
+        self._submit("write", Path(path), text)
+
+    def write_bytes(self, path: PathLike, data: bytes) -> None:
+        """整体写入二进制文件（临时文件 + 原子替换，自动创建父目录）"""
+        self._submit("bytes", Path(path), data)
+
+    def _submit(self, kind: str, path: Path, text: Payload) -> None:
+        if not self.batched or self._closed:
+            # 同步模式：逐条写出并刷到 OS（与逐条 open/append/close 的可见性一致）
+            with self._io_lock:
+                self._write_batch([(kind, path, text)], forced=True)
+            return
+        with self._cond:
+            self._queue.append((kind, path, text))
+            self._pending_bytes += len(text)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="adds-session-writer", daemon=True)
+                self._thread.start()
+            if (self._pending_bytes >= self.max_batch_bytes
+                    or len(self._queue) >= self.max_batch_records):
+                self._cond.notify()
+
+    # ──── 刷盘 ────
+
+    def flush(self, close_files: bool = False) -> None:
+        """同步写出所有排队记录并刷到 OS（durability=fsync 时同时 fsync）
+
+        Args:
+            close_files: 同时关闭缓存的句柄（文件将被整体改写前使用）
+        """
+        with self._io_lock:
+            self._drain_locked(forced=True)
+            if close_files:
+                self._close_handles()
+
+    def close(self) -> None:
+        """刷盘、关闭句柄并停止后台线程（之后的写入改为同步执行）"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=5)
+        self._thread = None
+        self.flush(close_files=True)
+        _live_writers.discard(self)
+
+    # ──── 后台线程 ────
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                # 等到阈值或超时，期间继续积攒记录
+                deadline = time.monotonic() + self.flush_interval
+                while (not self._closed
+                       and self._pending_bytes < self.max_batch_bytes
+                       and len(self._queue) < self.max_batch_records):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            with self._io_lock:
+                self._drain_locked(forced=False)
+
+    def _drain_locked(self, forced: bool) -> None:
+        """取出当前队列并写出（调用方持有 _io_lock）"""
+        with self._cond:
+            batch, self._queue = self._queue, []
+            self._pending_bytes = 0
+        self._write_batch(batch, forced=forced)
+
+    # ──── 写出 ────
+
+    def _write_batch(self, batch: List[Tuple[str, Path, Payload]], forced: bool) -> None:
+        """写出一批记录：同一文件的连续追加合并为一次 write"""
+        touched: Dict[Path, Any] = {}
+        i = 0
+        while i < len(batch):
+            kind, path, text = batch[i]
+            try:
+                if kind == "bytes":
+                    write_bytes_atomic(path, text, fsync=self.durability == "fsync")
+                    i += 1
+                    continue
+                if kind == "write":
+                    self._close_handle(path)
+                    path.write_text(text, encoding="utf-8")
+                    if self.durability == "fsync":
+                        _fsync_path(path)
+                    i += 1
+                    continue
+                parts = [text]
+                i += 1
+                while i < len(batch) and batch[i][0] == "append" and batch[i][1] == path:
+                    parts.append(batch[i][2])
+                    i += 1
+                handle = self._get_handle(path)
+                handle.write("".join(parts))
+                touched[path] = handle
+            except OSError as e:
+                logger.error("Session write failed: %s | %s", path, e)
+                i += 1
+
+        if forced or self.durability != "none":
+            for path, handle in touched.items():
+                try:
+                    handle.flush()
+                    if self.durability == "fsync":
+                        os.fsync(handle.fileno())
+                except (OSError, ValueError) as e:
+                    logger.error("Session flush failed: %s | %s", path, e)
+        if batch:
+            self.batches += 1
+            self.records += len(batch)
+
+    def _get_handle(self, path: Path):
+        handle = self._handles.get(path)
+        if handle is not None:
+            self._handles.move_to_end(path)
+            return handle
+        handle = open(path, "a", encoding="utf-8")
+        self._handles[path] = handle
+        while len(self._handles) > self.max_open_files:
+            _, old = self._handles.popitem(last=False)
+            old.close()
+        return handle
+
+    def _close_handle(self, path: Path) -> None:
+        handle = self._handles.pop(path, None)
+        if handle is not None:
+            handle.close()
+
+    def _close_handles(self) -> None:
+        while self._handles:
+            _, handle = self._handles.popitem(last=False)
+            try:
+                handle.close()
+            except OSError as e:
+                logger.error("Session file close failed: %s", e)
+
+
+def write_bytes_atomic(path: Path, data: bytes, fsync: bool = False) -> None:
+    """先写临时文件再原子替换（读者不会看到写了一半的文件）"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _fsync_path(path: Path) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+ADDS Shell Session — 跨调用保持的持久化 shell 会话
+
+设计目标：
+- 一个长驻 bash 进程服务一个 AgentCore 的所有 shell 调用，
+  保留 cwd / 环境变量，省去每条命令的进程启动开销
+- 哨兵分帧：每条命令后输出带随机 token 的结束标记（含退出码与 $PWD），
+  据此切分输出、获取退出码
+- 单命令超时：超时后终止整个会话进程组，下次调用自动重启（恢复到最后的 cwd）
+- 会话意外退出（如命令执行了 exit）时自动重启
+
+输出捕获与 async_shell.run_shell 一致：流式回调 + 头尾有界缓冲 + 增量摘要。
+"""
+
+import asyncio
+import codecs
+import logging
+import os
+import re
+import shlex
+import shutil
+import signal
+import time
+import uuid
+from typing import Callable, Optional
+
+from async_shell import (
+    HeadTailBuffer, ShellResult, kill_process_group, READ_CHUNK_BYTES,
+)
+from summary_decision_engine import ToolFilterStream
+
+logger = logging.getLogger(__name__)
+
+
+# 哨兵前缀（随每条命令附加随机 token，避免与真实输出冲突）
+SENTINEL_PREFIX = "__ADDS_DONE_"
+
+
+class PersistentShell:
+    """持久化 shell 会话
+
+    使用方式：
+        shell = PersistentShell(cwd="/path/to/project")
+        result = await shell.run("cd src && ls")
+        result = await shell.run("pwd")      # 仍在 src 下
+        await shell.close()
+    """
+
+    def __init__(self, cwd: str = ".", shell: Optional[str] = None,
+                 env: Optional[dict] = None):
+        """
+        Args:
+            cwd: 初始工作目录
+            shell: shell 可执行文件（默认 bash，不存在时回退 /bin/sh）
+            env: 环境变量（默认继承当前进程）
+        """
+        self.cwd = str(cwd)
+        self.shell = shell or shutil.which("bash") or "/bin/sh"
+        self.env = env
+        self.restarts = 0
+        self.commands_run = 0
+        self._proc: Optional[asyncio.subprocess.Process] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def alive(self) -> bool:
+        return self._proc is not None and self._proc.returncode is None
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self._proc.pid if self._proc else None
+
+    # ──── 生命周期 ────
+
+    async def _start(self) -> None:
+        """启动（或重启）shell 进程"""
+        if self._proc is not None:
+            self.restarts += 1
+            logger.info("Restarting persistent shell (restart #%d, cwd=%s)",
+                        self.restarts, self.cwd)
+        cwd = self.cwd if os.path.isdir(self.cwd) else None
+        args = [self.shell]
+        if os.path.basename(self.shell) == "bash":
+            args += ["--noprofile", "--norc"]
+        self._proc = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=cwd,
+            env=self.env,
+            start_new_session=True,
+        )
+
+    async def close(self) -> None:
+        """关闭会话（终止整个进程组）"""
+        if self._proc is None:
+            return
+        proc, self._proc = self._proc, None
+        if proc.returncode is None:
+            try:
+                proc.stdin.close()
+            except Exception:
+                pass
+            await kill_process_group(proc)
+
+    def kill(self) -> None:
+        """同步终止会话进程组（用于无事件循环的清理路径）"""
+        proc, self._proc = self._proc, None
+        if proc is None or proc.returncode is not None:
+            return
+        try:
+            if hasattr(os, "killpg"):
+                os.killpg(proc.pid, signal.SIGKILL)
+            else:
+                proc.kill()
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    # ──── 执行 ────
+
+    async def run(
+        self,
+        command: str,
+        timeout: float = 30.0,
+        on_output: Optional[Callable[[str], None]] = None,
+        head_chars: int = 3000,
+        tail_chars: int = 2000,
+        stderr_chars: int = 2000,
+        tool_name: str = "shell",
+    ) -> ShellResult:
+        """在会话中执行一条命令
+
+        命令通过 eval 执行（语法错误不会杀死会话），stdin 重定向到
+        /dev/null，避免命令读走后续指令。
+
+        Args:
+            参数含义同 async_shell.run_shell
+
+        Returns:
+            ShellResult
+        """
+        async with self._lock:
+            if not self.alive:
+                await self._start()
+            proc = self._proc
+            start = time.monotonic()
+            token = uuid.uuid4().hex
+            marker = f"{SENTINEL_PREFIX}{token}__"
+            script = (
+                f"eval {shlex.quote(command)} </dev/null\n"
+                f"__adds_rc=$?; printf '\\n{marker}%d__%s\\n' \"$__adds_rc\" \"$PWD\"; "
+                f"printf '\\n{marker}\\n' >&2\n"
+            )
+
+            out_buf = HeadTailBuffer(head_chars, tail_chars)
+            err_buf = HeadTailBuffer(stderr_chars // 2, stderr_chars - stderr_chars // 2)
+            filter_stream = ToolFilterStream(tool_name=tool_name)
+            result = ShellResult()
+            self.commands_run += 1
+
+            readers = asyncio.gather(
+                _read_until(proc.stdout, "\n" + marker,
+                            re.compile(re.escape("\n" + marker) + r"(\d+)__(.*)\n"),
+                            out_buf, on_output, filter_stream),
+                _read_until(proc.stderr, "\n" + marker,
+                            re.compile(re.escape("\n" + marker) + r"\n"),
+                            err_buf, on_output),
+            )
+            try:
+                proc.stdin.write(script.encode("utf-8"))
+                await proc.stdin.drain()
+                out_match, _ = await asyncio.wait_for(asyncio.shield(readers), timeout=timeout)
+                if out_match is not None:
+                    result.returncode = int(out_match.group(1))
+                    self.cwd = out_match.group(2) or self.cwd
+                else:
+                    # 会话在命令中退出（如 exit N）→ 下次调用自动重启
+                    result.returncode = await proc.wait()
+                    logger.info("Persistent shell exited during command (rc=%s)",
+                                result.returncode)
+            except asyncio.TimeoutError:
+                result.timed_out = True
+                await self._terminate(readers)
+            except asyncio.CancelledError:
+                await self._terminate(readers)
+                raise
+            except (BrokenPipeError, ConnectionResetError) as e:
+                logger.info("Persistent shell pipe broken: %s", e)
+                await self._terminate(readers)
+                result.returncode = -1
+                err_buf.write(f"shell 会话已断开: {e}")
+
+            result.stdout = out_buf.getvalue()
+            result.stderr = err_buf.getvalue()
+            result.truncated = out_buf.truncated
+            result.stdout_chars = out_buf.total_chars
+            result.summary = filter_stream.result()
+            result.duration = time.monotonic() - start
+            return result
+
+    async def _terminate(self, readers: "asyncio.Future") -> None:
+        """终止会话进程组（保留已退出进程的引用，下次 run 时计为重启）"""
+        if self._proc is not None:
+            await kill_process_group(self._proc)
+        try:
+            await asyncio.wait_for(readers, timeout=1.0)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            readers.cancel()
+        except Exception as e:
+            logger.debug("Shell reader failed: %s", e)
+
+
+async def _read_until(stream: asyncio.StreamReader, marker: str,
+                      pattern: "re.Pattern", sink: HeadTailBuffer,
+                      on_output: Optional[Callable[[str], None]],
+                      filter_stream: Optional[ToolFilterStream] = None) -> Optional["re.Match"]:
+    """读取输出直到哨兵行出现
+
+    哨兵总是以换行开头：最后一个换行之后、仍可能是哨兵前缀的文本会暂缓输出，
+    其余文本立即写入缓冲 / 摘要 / 回调。
+
+    Returns:
+        哨兵匹配对象；流结束（会话退出）时返回 None
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+
+    def _emit(text: str) -> None:
+        if not text:
+            return
+        sink.write(text)
+        if filter_stream is not None:
+            filter_stream.feed(text)
+        if on_output:
+            try:
+                on_output(text)
+            except Exception as e:
+                logger.debug("on_output callback failed: %s", e)
+
+    while True:
+        data = await stream.read(READ_CHUNK_BYTES)
+        pending += decoder.decode(data, final=not data)
+
+        match = pattern.search(pending)
+        if match:
+            _emit(pending[:match.start()])
+            return match
+        if not data:
+            _emit(pending)
+            return None
+
+        # 暂缓可能属于哨兵的尾部
+        idx = pending.rfind("\n")
+        if idx == -1:
+            _emit(pending)
+            pending = ""
+            continue
+        candidate = pending[idx:]
+        if candidate.startswith(marker) or marker.startswith(candidate):
+            _emit(pending[:idx])
+            pending = candidate
+        else:
+            _emit(pending)
+            pending = ""
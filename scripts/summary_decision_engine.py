@@ -8,14 +8,20 @@ ADDS Summary Decision Engine — 摘要策略决策引擎
 - 结构化输出 → TOOL_FILTER
 - 非结构化对话 → LLM_ANALYZE
 - 混合内容 → HYBRID
+- 单遍预分析：错误信号、决策关键词合并为一个正则，在小写化的内容上一次扫描，
+  连同结构特征缓存为每条内容的特征向量（ContentFeatures），
+  decide / extract_error_context / apply_tool_filter 共用
 
 参考：P0-2 路线图 — 摘要策略决策框架
 """
 
 import logging
 import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
 from enum import Enum
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, FrozenSet, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -67,6 +73,19 @@ REDUNDANT_PATTERNS = [
 ]
 
 
+# 「N passed, 0 failed」类测试通过行不算错误信号
+_TEST_PASS_LINE = re.compile(r'^\s*(\d+)\s+passed\s*,\s*0\s+(failed|error)', re.IGNORECASE)
+
+# 结构化输出特征（小写匹配）
+STRUCTURED_INDICATORS = (
+    "passed", "failed",     # 测试结果
+    "```",                   # 代码块
+    "| ", "|-",             # 表格
+    "error:",               # 错误信息
+    "+", "-", "@@",          # diff 输出
+)
+
+
 def has_error_signals(content: str) -> bool:
     """检测内容是否包含错误信号
 
@@ -84,22 +103,7 @@ def has_error_signals(content: str) -> bool:
     Returns:
         是否包含错误信号
     """
-    # 先排除测试结果中的 "0 failed" 或 "0 errors" 这类非错误信号
-    # 检测 "N failed" 中 N > 0 的情况才算错误
-    # 简单做法：移除 "0 failed", "0 errors", "0 warnings" 等行后再检测
-    filtered_lines = []
-    for line in content.split("\n"):
-        # 跳过包含 "0 failed", "0 errors" 的行（这些是测试通过信息）
-        if re.match(r'^\s*(\d+)\s+passed\s*,\s*0\s+(failed|error)', line, re.IGNORECASE):
-            continue
-        # 保留 "N failed" 中 N > 0 的行
-        filtered_lines.append(line)
-    filtered = "\n".join(filtered_lines)
-
-    for pattern in _COMPILED_ERROR_PATTERNS:
-        if pattern.search(filtered):
-            return True
-    return False
+    return analyze_content(content).has_errors
 
 
 def extract_error_context(content: str, context_lines: int = 3) -> str:
@@ -112,25 +116,19 @@ def extract_error_context(content: str, context_lines: int = 3) -> str:
     Returns:
         包含错误信号的行及其 ±context_lines 行上下文
     """
+    error_lines = analyze_content(content).error_lines
+    if not error_lines:
+        return content
+
     lines = content.split("\n")
     error_line_indices = set()
-
-    for i, line in enumerate(lines):
-        for pattern in _COMPILED_ERROR_PATTERNS:
-            if pattern.search(line):
-                # 添加错误行及其上下文
-                start = max(0, i - context_lines)
-                end = min(len(lines), i + context_lines + 1)
-                error_line_indices.update(range(start, end))
-                break
-
-    if not error_line_indices:
-        return content
+    for i in error_lines:
+        start = max(0, i - context_lines)
+        end = min(len(lines), i + context_lines + 1)
+        error_line_indices.update(range(start, end))
 
     # 按顺序提取
-    sorted_indices = sorted(error_line_indices)
-    result_lines = [lines[i] for i in sorted_indices]
-    return "\n".join(result_lines)
+    return "\n".join(lines[i] for i in sorted(error_line_indices))
 
 
 def is_redundant_message(content: str) -> bool:
@@ -158,8 +156,7 @@ def has_decision_keywords(content: str) -> bool:
     Returns:
         是否包含决策关键词
     """
-    lower = content.lower()
-    return any(kw in lower for kw in ALL_DECISION_KEYWORDS)
+    return bool(analyze_content(content).decision_hits)
 
 
 # ═══════════════════════════════════════════════════════════
@@ -184,14 +181,197 @@ GIT_STATUS_PATTERN = re.compile(
 )
 
 
+# ═══════════════════════════════════════════════════════════
+# 单遍预分析（特征向量）
+# ═══════════════════════════════════════════════════════════
+
+# 与 ERROR_SIGNAL_PATTERNS 等价的小写字面量（各异常名都含 "error"，"failed?" 即 "faile"）
+_ERROR_LITERALS = (
+    "error", "exception", "traceback", "faile", "critical", "warning",
+    "segmentation fault", "core dumped", "permission denied", "no such file", "not found",
+)
+_DECISION_LITERALS = frozenset(kw.lower() for kw in ALL_DECISION_KEYWORDS)
+
+# 错误信号 + 决策关键词合并为一个交替正则，在小写化的内容上一次扫描。
+# 全部为字面量（最长优先）时 re 可按首字符快速跳过，比逐个 IGNORECASE 模式快一个数量级
+_SIGNAL_PATTERN = re.compile("|".join(
+    [re.escape(w) for w in sorted(set(_ERROR_LITERALS) | _DECISION_LITERALS,
+                                  key=len, reverse=True)]
+    + [ERROR_SIGNAL_PATTERNS[0]]                  # exit code != 0
+))
+
+# 短于此长度的内容不缓存特征（直接计算比查缓存更快）
+ANALYSIS_MEMO_MIN_CHARS = 256
+ANALYSIS_MEMO_MAX_ENTRIES = 1024
+
+
+@dataclass(frozen=True)
+class ContentFeatures:
+    """一条内容的预分析特征（decide / extract_error_context / apply_tool_filter 共用）"""
+    length: int = 0
+    newlines: int = 0
+    first_line: str = ""
+    head: str = ""                                   # 前 200 字符
+    error_lines: Tuple[int, ...] = ()                # 含错误信号的行号（0 起）
+    has_errors: bool = False                         # 排除「N passed, 0 failed」行后仍有错误信号
+    decision_hits: FrozenSet[str] = frozenset()      # 命中的决策关键词（小写）
+    structured: bool = False                         # 含结构化输出特征（测试结果 / 代码块 / 表格 / diff）
+    markers: FrozenSet[str] = frozenset()            # passed / failed / warnings / pytest / py_code / js_code
+    pytest_counts: Optional[Tuple[str, str, str, str]] = None  # (passed, failed, warnings, duration)
+    git_count: int = 0
+    git_changes: Tuple[str, ...] = ()                # 前 5 个 git 变更
+
+
+_analysis_memo: "OrderedDict[Tuple[int, int], ContentFeatures]" = OrderedDict()
+_analysis_lock = threading.Lock()
+_analysis_stats: Dict[str, int] = {"hits": 0, "misses": 0}
+
+
+def analyze_content(content: str) -> ContentFeatures:
+    """单遍预分析内容（较长内容按哈希缓存）
+
+    Args:
+        content: 消息 / 工具输出内容
+
+    Returns:
+        特征向量
+    """
+    if len(content) < ANALYSIS_MEMO_MIN_CHARS:
+        return _analyze(content)
+    key = (len(content), hash(content))
+    with _analysis_lock:
+        cached = _analysis_memo.get(key)
+        if cached is not None:
+            _analysis_memo.move_to_end(key)
+            _analysis_stats["hits"] += 1
+            return cached
+        _analysis_stats["misses"] += 1
+    features = _analyze(content)
+    with _analysis_lock:
+        _analysis_memo[key] = features
+        if len(_analysis_memo) > ANALYSIS_MEMO_MAX_ENTRIES:
+            _analysis_memo.popitem(last=False)
+    return features
+
+
+def analysis_cache_info() -> Dict[str, int]:
+    """预分析缓存统计"""
+    with _analysis_lock:
+        return dict(_analysis_stats, size=len(_analysis_memo))
+
+
+def clear_analysis_cache() -> None:
+    with _analysis_lock:
+        _analysis_memo.clear()
+        _analysis_stats.update(hits=0, misses=0)
+
+
+def _analyze(content: str) -> ContentFeatures:
+    lower = content.lower()     # 不增删换行，行号与原文一致
+
+    # 信号扫描：错误行 + 决策关键词
+    error_lines: List[int] = []
+    has_errors = False
+    decision_hits = set()
+    line = line_pos = 0
+    for match in _SIGNAL_PATTERN.finditer(lower):
+        word = match.group()
+        if word in _DECISION_LITERALS:
+            decision_hits.add(word)
+            continue
+        start = match.start()
+        line += lower.count("\n", line_pos, start)
+        line_pos = start
+        if "\n" in word:
+            # 跨行的 exit code：整体检测计入，逐行提取上下文时不算错误行
+            has_errors = has_errors or not _is_test_pass_line(lower, start)
+            continue
+        if error_lines and error_lines[-1] == line:
+            continue
+        error_lines.append(line)
+        has_errors = has_errors or not _is_test_pass_line(lower, start)
+
+    # 工具过滤标记（与 ToolFilterStream 逐行检查的结果一致）
+    markers = {name for name, present in (
+        ("passed", "passed" in content),
+        ("failed", "failed" in content),
+        ("warnings", "warnings" in content),
+        ("pytest", "pytest" in lower),
+        ("py_code", "def " in content or "class " in content),
+        ("js_code", "function " in content or "const " in content),
+    ) if present}
+
+    first_nl = content.find("\n")
+    git_count, git_changes = _scan_git_status(content)
+    return ContentFeatures(
+        length=len(content),
+        newlines=content.count("\n"),
+        first_line=content if first_nl == -1 else content[:first_nl],
+        head=content[:200],
+        error_lines=tuple(error_lines),
+        has_errors=has_errors,
+        decision_hits=frozenset(decision_hits),
+        structured=any(ind in lower for ind in STRUCTURED_INDICATORS),
+        markers=frozenset(markers),
+        pytest_counts=_search_pytest(content) if "passed" in markers else None,
+        git_count=git_count,
+        git_changes=git_changes,
+    )
+
+
+def _is_test_pass_line(text: str, pos: int) -> bool:
+    """pos 所在行是否为「N passed, 0 failed」类测试通过行"""
+    line_start = text.rfind("\n", 0, pos) + 1
+    line_end = text.find("\n", pos)
+    line = text[line_start:] if line_end == -1 else text[line_start:line_end]
+    return _TEST_PASS_LINE.match(line) is not None
+
+
+def _pytest_counts(match: "re.Match") -> Tuple[str, str, str, str]:
+    return match.group(1), match.group(3) or "0", match.group(5) or "0", match.group(6) or ""
+
+
+def _search_pytest(content: str) -> Optional[Tuple[str, str, str, str]]:
+    """首个 pytest 统计行（与逐行匹配结果一致）"""
+    match = PYTEST_PATTERN.search(content)
+    if match is None:
+        return None
+    if "\n" in match.group():
+        # 整体匹配跨了行（\s 吃掉换行），回退为逐行匹配
+        for line in content.split("\n"):
+            match = PYTEST_PATTERN.search(line)
+            if match:
+                return _pytest_counts(match)
+        return None
+    return _pytest_counts(match)
+
+
+def _scan_git_status(content: str) -> Tuple[int, Tuple[str, ...]]:
+    """git status 变更计数与前 5 个变更（与逐行匹配结果一致）"""
+    count = 0
+    changes: List[str] = []
+    pos = 0
+    while True:
+        match = GIT_STATUS_PATTERN.search(content, pos)
+        if match is None:
+            break
+        newline = content.find("\n", match.start(), match.end())
+        if newline != -1:
+            # "status:" 之后到行尾只有空白，逐行匹配不会命中
+            pos = newline + 1
+            continue
+        count += 1
+        if len(changes) < 5:
+            changes.append(f"{match.group(1)} {match.group(2)}")
+        pos = match.end()
+    return count, tuple(changes)
+
+
 def tool_filter_pytest(content: str) -> str:
     """提取 pytest 结果摘要"""
     match = PYTEST_PATTERN.search(content)
     if match:
-        passed = match.group(1)
-        failed = match.group(3) or "0"
-        warnings = match.group(5) or "0"
-        duration = match.group(6) or ""
+        passed, failed, warnings, duration = _pytest_counts(match)
         return f"pytest: {passed} passed, {failed} failed, {warnings} warnings {duration}".strip()
     return f"[pytest output: {len(content)} chars]"
 
@@ -223,32 +403,144 @@ def tool_filter_git_status(content: str) -> str:
     return f"[git output: {len(content)} chars]"
 
 
-def apply_tool_filter(content: str, tool_name: str = "") -> str:
-    """应用工具过滤规则提取摘要
+class ToolFilterStream:
+    """apply_tool_filter 的增量版本
 
-    Args:
-        content: 工具输出内容
-        tool_name: 工具名称（辅助判断）
+    按块喂入工具输出（如 shell 的 stdout 流），只保留提取摘要所需的
+    固定大小状态（首行、前 200 字符、计数与首个匹配），内存占用与
+    输出总长度无关。
 
-    Returns:
-        提取的摘要
+    使用方式：
+        stream = ToolFilterStream(tool_name="shell")
+        for chunk in chunks:
+            stream.feed(chunk)
+        summary = stream.result()
     """
+
+    # 无换行的超长行按此长度分段处理
+    MAX_PENDING_CHARS = 8192
+
+    def __init__(self, tool_name: str = ""):
+        self.tool_name = tool_name
+        self.total_chars = 0
+        self.newlines = 0
+        self._head = ""               # 前 201 字符（用于默认截断摘要）
+        self._first_line: Optional[str] = None
+        self._pending = ""            # 尚未遇到换行的行片段
+        self._markers = set()
+        self._pytest_counts: Optional[Tuple[str, str, str, str]] = None
+        self._git_changes: List[str] = []
+        self._git_count = 0
+
+    def feed(self, chunk: str) -> None:
+        """喂入一段输出"""
+        if not chunk:
+            return
+        self.total_chars += len(chunk)
+        self.newlines += chunk.count("\n")
+        if len(self._head) <= 200:
+            self._head += chunk[:201 - len(self._head)]
+
+        data = self._pending + chunk
+        lines = data.split("\n")
+        self._pending = lines.pop()
+        for line in lines:
+            self._scan_line(line)
+        if len(self._pending) > self.MAX_PENDING_CHARS:
+            self._scan_line(self._pending, partial=True)
+            self._pending = ""
+
+    def _scan_line(self, line: str, partial: bool = False) -> None:
+        if self._first_line is None:
+            self._first_line = line
+        markers = self._markers
+        if "passed" not in markers and "passed" in line:
+            markers.add("passed")
+        if "failed" not in markers and "failed" in line:
+            markers.add("failed")
+        if "warnings" not in markers and "warnings" in line:
+            markers.add("warnings")
+        if "pytest" not in markers and "pytest" in line.lower():
+            markers.add("pytest")
+        if "py_code" not in markers and ("def " in line or "class " in line):
+            markers.add("py_code")
+        if "js_code" not in markers and ("function " in line or "const " in line):
+            markers.add("js_code")
+        if self._pytest_counts is None:
+            match = PYTEST_PATTERN.search(line)
+            if match:
+                self._pytest_counts = _pytest_counts(match)
+        for status, path in GIT_STATUS_PATTERN.findall(line):
+            self._git_count += 1
+            if len(self._git_changes) < 5:
+                self._git_changes.append(f"{status} {path}")
+
+    def result(self) -> str:
+        """结束输入并返回摘要（规则与 apply_tool_filter 一致）"""
+        if self._pending:
+            self._scan_line(self._pending)
+            self._pending = ""
+        return _tool_filter_summary(ContentFeatures(
+            length=self.total_chars,
+            newlines=self.newlines,
+            first_line=self._first_line or "",
+            head=self._head[:200],
+            markers=frozenset(self._markers),
+            pytest_counts=self._pytest_counts if "passed" in self._markers else None,
+            git_count=self._git_count,
+            git_changes=tuple(self._git_changes),
+        ), self.tool_name)
+
+
+def _tool_filter_summary(features: ContentFeatures, tool_name: str = "") -> str:
+    """按特征生成工具过滤摘要"""
+    markers = features.markers
+
     # pytest 输出
-    if "passed" in content and ("failed" in content or "warnings" in content or "pytest" in content.lower()):
-        return tool_filter_pytest(content)
+    if "passed" in markers and markers & {"failed", "warnings", "pytest"}:
+        if features.pytest_counts:
+            passed, failed, warnings, duration = features.pytest_counts
+            return f"pytest: {passed} passed, {failed} failed, {warnings} warnings {duration}".strip()
+        return f"[pytest output: {features.length} chars]"
 
     # git status 输出
     if tool_name and "git" in tool_name.lower():
-        return tool_filter_git_status(content)
+        if features.git_count:
+            return (f"Git changes: {features.git_count} files — "
+                    + ", ".join(features.git_changes))
+        return f"[git output: {features.length} chars]"
 
     # 文件内容（多行 + 代码特征）
-    if content.count("\n") > 5:
-        return tool_filter_file_content(content)
+    if features.newlines > 5:
+        first_line = features.first_line
+        lang = ""
+        if first_line.startswith("#!"):
+            lang = " (script)"
+        elif first_line.startswith("<?"):
+            lang = " (PHP)"
+        elif "py_code" in markers:
+            lang = " (Python)"
+        elif "js_code" in markers:
+            lang = " (JS/TS)"
+        return f"文件内容{lang}: {features.newlines + 1} 行"
 
     # 默认：截取前 200 字符
-    if len(content) > 200:
-        return content[:200] + "..."
-    return content
+    if features.length > 200:
+        return features.head + "..."
+    return features.head
+
+
+def apply_tool_filter(content: str, tool_name: str = "") -> str:
+    """应用工具过滤规则提取摘要
+
+    Args:
+        content: 工具输出内容
+        tool_name: 工具名称（辅助判断）
+
+    Returns:
+        提取的摘要
+    """
+    return _tool_filter_summary(analyze_content(content), tool_name)
 
 
 # ═══════════════════════════════════════════════════════════
@@ -308,9 +600,10 @@ class SummaryDecisionEngine:
 
         msg_type = message.get("role", "")
         content = message.get("content", "")
+        features = analyze_content(content)
 
         # 规则 0（最高优先级）: 错误信号 → KEEP_FULL
-        if msg_type == "tool_result" and has_error_signals(content):
+        if msg_type == "tool_result" and features.has_errors:
             logger.debug(f"KEEP_FULL: error signals detected in tool_result")
             return SummaryStrategy.KEEP_FULL
 
@@ -319,9 +612,9 @@ class SummaryDecisionEngine:
             return SummaryStrategy.TOOL_FILTER
 
         # 规则 2: 含决策关键词 → LLM_ANALYZE
-        if has_decision_keywords(content):
+        if features.decision_hits:
             # 如果同时包含结构化内容 → HYBRID
-            if msg_type == "tool_result" or self._has_structured_content(content):
+            if msg_type == "tool_result" or features.structured:
                 return SummaryStrategy.HYBRID
             return SummaryStrategy.LLM_ANALYZE
 
@@ -352,15 +645,7 @@ class SummaryDecisionEngine:
 
     def _has_structured_content(self, content: str) -> bool:
         """判断内容是否包含结构化输出特征"""
-        structured_indicators = [
-            "passed", "failed",     # 测试结果
-            "```",                   # 代码块
-            "| ", "|-",             # 表格
-            "Error:", "error:",     # 错误信息
-            "+", "-", "@@",          # diff 输出
-        ]
-        lower = content.lower()
-        return any(ind in lower for ind in structured_indicators)
+        return analyze_content(content).structured
 
     def get_layer1_action(self, message: Dict, strategy: SummaryStrategy) -> Dict:
         """获取 Layer1 压缩的具体操作
@@ -457,6 +742,58 @@ LAYER2_SUMMARY_PROMPT = """请对以下对话记录生成结构化摘要，用
 {content}
 """
 
+# 长记录分块摘要（map）：每块独立提取要点，保留原文中的文件名、命令与错误信息
+LAYER2_CHUNK_PROMPT = """以下是一段较长对话记录的第 {index}/{total} 部分。
+请提取这一部分中的要点，供之后与其他部分合并为完整摘要：
+
+- 关键决策和结论
+- 代码变更（新增/修改/删除的文件）
+- 测试结果
+- 错误与修复过程
+- 未完成事项
+- 经验教训
+
+只输出要点列表，保留原文中的文件名、命令和错误信息，忽略中间探索过程和重复讨论。
+
+---
+
+对话记录（第 {index}/{total} 部分）：
+{content}
+"""
+
+# 分块摘要合并（reduce）：按时间顺序合并，输出与 LAYER2_SUMMARY_PROMPT 相同的结构
+LAYER2_MERGE_PROMPT = """以下是同一对话记录按时间顺序分段提取的 {count} 份要点。
+请合并为一份结构化摘要，用于后续 session 的上下文恢复：去除重复，
+后出现的结论覆盖先前的结论，已在后续部分完成的事项不再列为未完成。
+
+输出格式：
+
+### 关键决策
+- [决策列表]
+
+### 代码变更
+- 新增: [文件列表]
+- 修改: [文件列表]
+- 删除: [文件列表]
+
+### 测试结果
+- [测试摘要]
+
+### 错误与修复
+- [错误和修复过程]
+
+### 未完成事项
+- [待办列表]
+
+### 经验教训
+- [经验列表]
+
+---
+
+分段要点：
+{content}
+"""
+
 
 # ═══════════════════════════════════════════════════════════
 # 单元测试
@@ -0,0 +1,1269 @@
+#!/usr/bin/env python3
+"""
+AgentCore 单元测试: 工具执行阶段
+"""
+
+import asyncio
+import io
+import json
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+from model.base import (
+    FormattedMessages, ModelInterface, ModelResponse, SystemBlock, SystemPrompt,
+)
+from model.api_adapter import APIAdapter
+from tool_registry import ToolSpec, default_registry
+from model.openai_adapter import OpenAIAdapter
+from message_store import MessageStore
+from async_shell import HeadTailBuffer, run_shell
+from shell_session import PersistentShell
+from read_cache import ReadCache, format_numbered, get_read_cache
+from session_manager import MemoryHeader
+from token_budget import load_ledger
+from agent_core import (
+    AgentCore, AgentCallbacks, is_readonly_tool, load_tool_config,
+    DEFAULT_TOOL_CONFIG,
+)
+
+
+# ═══════════════════════════════════════════════════════════
+# 测试用 Mock 模型
+# ═══════════════════════════════════════════════════════════
+
+class ScriptedModel(ModelInterface):
+    """按脚本逐轮返回工具调用或文本的 Mock 模型"""
+
+    def __init__(self, rounds=None, context_window=128000):
+        # rounds: 每轮为 str（文本回复）或 list[dict]（工具调用）
+        self._rounds = rounds or ["完成"]
+        self._call_count = 0
+        self.received = []  # 每轮收到的 (messages 对象, 当时的长度)
+
+    async def chat(self, messages, system_prompt=None, tools=None, stream=True, **kwargs):
+        self.received.append((messages, len(messages)))
+        step = self._rounds[min(self._call_count, len(self._rounds) - 1)]
+        self._call_count += 1
+        if isinstance(step, str):
+            yield ModelResponse(content=step, model="mock", finish_reason="stop")
+        else:
+            yield ModelResponse(content="", model="mock", tool_calls=step,
+                                finish_reason="tool_use")
+
+    def count_tokens(self, text: str) -> int:
+        return len(text) // 4
+
+    def get_context_window(self) -> int:
+        return 128000
+
+    def get_model_name(self) -> str:
+        return "mock-model"
+
+    def supports_feature(self, name: str) -> bool:
+        return name == "tools"
+
+
+class AgentCoreTestBase(unittest.TestCase):
+    """AgentCore 测试基类：临时项目目录 + settings.json"""
+
+    tool_settings = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="adds_core_")
+        ai_dir = Path(self.tmpdir) / ".ai"
+        (ai_dir / "sessions").mkdir(parents=True)
+        settings = {
+            "permissions": {
+                "mode": "default",
+                "rules": {
+                    "allow": ["read(*)", "write(./*)", "bash(echo*)"],
+                    "ask": [],
+                    "deny": ["bash(sudo*)"],
+                },
+            },
+        }
+        if self.tool_settings is not None:
+            settings["tools"] = self.tool_settings
+        (ai_dir / "settings.json").write_text(json.dumps(settings), encoding="utf-8")
+        for i in range(5):
+            (Path(self.tmpdir) / f"f{i}.txt").write_text(f"content-{i}", encoding="utf-8")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def make_core(self, rounds=None, mode="default") -> AgentCore:
+        core = AgentCore(ScriptedModel(rounds), project_root=self.tmpdir,
+                         permission_mode=mode)
+        core.init_session()
+        return core
+
+
+# ═══════════════════════════════════════════════════════════
+# 并发工具阶段
+# ═══════════════════════════════════════════════════════════
+
+class TestToolConfig(AgentCoreTestBase):
+
+    tool_settings = {"max_concurrency": 2, "parallel": False}
+
+    def test_load_tool_config_merges_defaults(self):
+        cfg = load_tool_config(self.tmpdir)
+        self.assertEqual(cfg["max_concurrency"], 2)
+        self.assertFalse(cfg["parallel"])
+        self.assertEqual(cfg["thread_pool_size"], DEFAULT_TOOL_CONFIG["thread_pool_size"])
+
+    def test_load_tool_config_missing_file(self):
+        cfg = load_tool_config(str(Path(self.tmpdir) / "nope"))
+        self.assertEqual(cfg, DEFAULT_TOOL_CONFIG)
+
+    def test_is_readonly_tool(self):
+        for name in ("read", "Read_File", "glob", "grep", "rg"):
+            self.assertTrue(is_readonly_tool(name))
+        for name in ("write", "shell", "bash", "", None):
+            self.assertFalse(is_readonly_tool(name))
+
+
+class TestConcurrentToolStage(AgentCoreTestBase):
+
+    def test_readonly_calls_run_concurrently_in_order(self):
+        core = self.make_core()
+        active = {"now": 0, "peak": 0}
+        lock = threading.Lock()
+        original = core._tool_read
+
+        def slow_read(args):
+            with lock:
+                active["now"] += 1
+                active["peak"] = max(active["peak"], active["now"])
+            time.sleep(0.1)
+            with lock:
+                active["now"] -= 1
+            return original(args)
+
+        core._tool_read = slow_read
+        calls = [("read", {"file_path": f"f{i}.txt"}) for i in range(4)]
+        start = time.monotonic()
+        results = asyncio.run(core._run_tool_calls(calls, AgentCallbacks()))
+        elapsed = time.monotonic() - start
+
+        self.assertEqual(results, [f"     1\tcontent-{i}" for i in range(4)])
+        self.assertGreater(active["peak"], 1)
+        self.assertLess(elapsed, 0.35)
+
+    def test_max_concurrency_respected(self):
+        core = self.make_core()
+        core.tool_config["max_concurrency"] = 1
+        active = {"now": 0, "peak": 0}
+        lock = threading.Lock()
+
+        def slow_read(args):
+            with lock:
+                active["now"] += 1
+                active["peak"] = max(active["peak"], active["now"])
+            time.sleep(0.02)
+            with lock:
+                active["now"] -= 1
+            return "ok"
+
+        core._tool_read = slow_read
+        calls = [("read", {"file_path": "f0.txt"})] * 3
+        asyncio.run(core._run_tool_calls(calls, AgentCallbacks()))
+        self.assertEqual(active["peak"], 1)
+
+    def test_write_is_barrier_between_reads(self):
+        core = self.make_core(mode="bypass")
+        calls = [
+            ("read", {"file_path": "f0.txt"}),
+            ("write", {"file_path": "f0.txt", "content": "changed"}),
+            ("read", {"file_path": "f0.txt"}),
+        ]
+        results = asyncio.run(core._run_tool_calls(calls, AgentCallbacks()))
+        self.assertEqual(results[0], "     1\tcontent-0")
+        self.assertIn("已写入", results[1])
+        self.assertEqual(results[2], "     1\tchanged")
+
+    def test_permission_checked_in_order(self):
+        core = self.make_core()
+        asked = []
+
+        def on_ask(decision):
+            asked.append(decision.command)
+            return False
+
+        core.permission.check = lambda tool, cmd: type(
+            "D", (), {"needs_confirmation": True, "is_denied": False, "command": cmd},
+        )()
+        calls = [("read", {"file_path": f"f{i}.txt"}) for i in range(3)]
+        results = asyncio.run(core._run_tool_calls(
+            calls, AgentCallbacks(on_permission_ask=on_ask)))
+        self.assertEqual(asked, [str(args) for _, args in calls])
+        self.assertTrue(all("用户拒绝" in r for r in results))
+
+    def test_send_message_appends_results_in_order(self):
+        tool_round = [{"name": "read", "arguments": {"file_path": f"f{i}.txt"}}
+                      for i in range(3)]
+        core = self.make_core(rounds=[tool_round, "完成"])
+        text = asyncio.run(core.send_message("读文件"))
+        self.assertEqual(text, "完成")
+        tool_results = [m["content"] for m in core.messages if m["role"] == "tool_result"]
+        self.assertEqual(tool_results, [f"     1\tcontent-{i}" for i in range(3)])
+
+
+# ═══════════════════════════════════════════════════════════
+# 异步流式 shell
+# ═══════════════════════════════════════════════════════════
+
+class TestHeadTailBuffer(unittest.TestCase):
+
+    def test_small_output_kept_whole(self):
+        buf = HeadTailBuffer(head_chars=10, tail_chars=10)
+        buf.write("hello ")
+        buf.write("world")
+        self.assertEqual(buf.getvalue(), "hello world")
+        self.assertFalse(buf.truncated)
+
+    def test_head_and_tail_kept(self):
+        buf = HeadTailBuffer(head_chars=5, tail_chars=5)
+        for i in range(1000):
+            buf.write(f"{i:04d}")
+        value = buf.getvalue()
+        self.assertTrue(value.startswith("00000"))
+        self.assertTrue(value.endswith("80999"))
+        self.assertEqual(buf.omitted_chars, 4000 - 10)
+        self.assertIn("省略 3990 字符", value)
+        self.assertLessEqual(sum(len(t) for t in buf._tail), 5 + 4)
+
+
+class TestAsyncShellTool(AgentCoreTestBase):
+
+    def test_run_shell_basic(self):
+        result = asyncio.run(run_shell("echo out; echo err 1>&2; exit 3", cwd=self.tmpdir))
+        self.assertEqual(result.stdout.strip(), "out")
+        self.assertEqual(result.stderr.strip(), "err")
+        self.assertEqual(result.returncode, 3)
+        self.assertFalse(result.success)
+
+    def test_shell_streams_output_to_callback(self):
+        core = self.make_core(mode="bypass")
+        chunks = []
+        cb = AgentCallbacks(on_tool_output=lambda tool, chunk: chunks.append((tool, chunk)))
+        output = asyncio.run(core._execute_tool("shell", {"command": "echo a; echo b"}, cb))
+        self.assertEqual(output.strip(), "a\nb")
+        self.assertEqual("".join(c for _, c in chunks).strip(), "a\nb")
+        self.assertTrue(all(tool == "shell" for tool, _ in chunks))
+
+    def test_shell_large_output_bounded_with_summary(self):
+        core = self.make_core(mode="bypass")
+        cmd = ("echo pytest session starts; for i in $(seq 1 20000); do echo tests/test_$i.py .; done; "
+               "echo '20000 passed in 9.9s'")
+        output = asyncio.run(core._execute_tool("shell", {"command": cmd}))
+        self.assertLess(len(output), 6000)
+        self.assertIn("tests/test_1.py .", output)
+        self.assertIn("20000 passed in 9.9s", output)
+        self.assertIn("省略", output)
+        self.assertIn("摘要: pytest: 20000 passed", output)
+
+    def test_shell_nonzero_exit_includes_stderr(self):
+        core = self.make_core(mode="bypass")
+        output = asyncio.run(core._execute_tool(
+            "shell", {"command": "echo boom 1>&2; exit 2"}))
+        self.assertIn("Exit code: 2", output)
+        self.assertIn("boom", output)
+
+    def test_shell_timeout_kills_process_group(self):
+        core = self.make_core(mode="bypass")
+        core.tool_config["shell_timeout"] = 0.3
+        marker = Path(self.tmpdir) / "child_survived"
+        cmd = f"(sleep 1.5; touch {marker}) & sleep 5"
+        start = time.monotonic()
+        output = asyncio.run(core._execute_tool("shell", {"command": cmd}))
+        self.assertLess(time.monotonic() - start, 3)
+        self.assertIn("命令超时", output)
+        time.sleep(1.6)
+        self.assertFalse(marker.exists())
+
+    def test_abort_tools(self):
+        core = self.make_core(mode="bypass")
+
+        async def _scenario():
+            shell = asyncio.ensure_future(
+                core._execute_tool("shell", {"command": "sleep 5"}))
+            await asyncio.sleep(0.2)
+            self.assertEqual(core.abort_tools(), 1)
+            return await shell
+
+        start = time.monotonic()
+        output = asyncio.run(_scenario())
+        self.assertIn("中止", output)
+        self.assertLess(time.monotonic() - start, 3)
+
+    def test_cli_callbacks_stream_tool_output(self):
+        from agent_loop import CLICallbacks
+        core = self.make_core(mode="bypass")
+        out = io.StringIO()
+        with mock.patch("sys.stdout", out):
+            asyncio.run(core._execute_tool(
+                "shell", {"command": "echo streamed"}, CLICallbacks()))
+        self.assertIn("streamed", out.getvalue())
+
+    def test_workspace_manager_wires_tool_output_and_abort(self):
+        from tui.state import AppState
+        from tui.workspace_manager import WorkspaceManager
+        wm = WorkspaceManager(AppState(), self.tmpdir)
+        wm.set_model(ScriptedModel())
+        ws = wm.create_workspace("pm")
+        core = wm._get_or_create_core(ws.workspace_id)
+        chunks = []
+
+        async def _scenario():
+            shell = asyncio.ensure_future(core._execute_tool(
+                "shell", {"command": "echo started; sleep 5"},
+                AgentCallbacks(on_tool_output=lambda tool, chunk: chunks.append(chunk))))
+            await asyncio.sleep(0.3)
+            self.assertEqual(wm.abort_tools(ws.workspace_id), 1)
+            return await shell
+
+        self.assertIn("中止", asyncio.run(_scenario()))
+        self.assertIn("started", "".join(chunks))
+        self.assertEqual(wm.abort_tools("missing"), 0)
+
+        seen = {}
+
+        async def _fake_send(text, callbacks):
+            seen["cb"] = callbacks
+            return "ok"
+
+        on_output = lambda tool, chunk: None
+        with mock.patch.object(core, "send_message", _fake_send):
+            asyncio.run(wm.send_message(ws.workspace_id, "hi", on_tool_output=on_output))
+        self.assertIs(seen["cb"].on_tool_output, on_output)
+        core.shutdown()
+
+    def test_shell_does_not_block_event_loop(self):
+        core = self.make_core(mode="bypass")
+        ticks = []
+
+        async def _ticker():
+            for _ in range(5):
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.05)
+
+        async def _scenario():
+            await asyncio.gather(
+                core._execute_tool("shell", {"command": "sleep 0.4"}),
+                _ticker(),
+            )
+
+        asyncio.run(_scenario())
+        self.assertEqual(len(ticks), 5)
+        self.assertLess(ticks[-1] - ticks[0], 0.35)
+
+
+# ═══════════════════════════════════════════════════════════
+# 持久化 shell 会话
+# ═══════════════════════════════════════════════════════════
+
+class TestPersistentShell(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="adds_shell_")
+        (Path(self.tmpdir) / "sub").mkdir()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def run_commands(self, *commands, **kwargs):
+        shell = PersistentShell(cwd=self.tmpdir)
+
+        async def _scenario():
+            try:
+                return [await shell.run(c, **kwargs) for c in commands]
+            finally:
+                await shell.close()
+
+        return shell, asyncio.run(_scenario())
+
+    def test_cwd_and_env_persist(self):
+        _, results = self.run_commands("cd sub && export ADDS_X=42", "pwd; echo $ADDS_X")
+        self.assertEqual(results[1].stdout.split(), [str(Path(self.tmpdir, "sub")), "42"])
+
+    def test_exit_code_and_stderr(self):
+        _, results = self.run_commands("echo oops >&2; false", "printf 'no newline'")
+        self.assertEqual(results[0].returncode, 1)
+        self.assertEqual(results[0].stderr, "oops\n")
+        self.assertEqual(results[1].stdout, "no newline")
+        self.assertEqual(results[1].returncode, 0)
+
+    def test_syntax_error_keeps_session(self):
+        shell, results = self.run_commands("if then", "echo ok")
+        self.assertNotEqual(results[0].returncode, 0)
+        self.assertEqual(results[1].stdout, "ok\n")
+        self.assertEqual(shell.restarts, 0)
+
+    def test_restart_after_exit_keeps_cwd(self):
+        shell, results = self.run_commands("cd sub", "exit 7", "pwd")
+        self.assertEqual(results[1].returncode, 7)
+        self.assertEqual(results[2].stdout.strip(), str(Path(self.tmpdir, "sub")))
+        self.assertEqual(shell.restarts, 1)
+
+    def test_timeout_restarts_session(self):
+        shell, results = self.run_commands("sleep 5", "echo alive", timeout=0.3)
+        self.assertTrue(results[0].timed_out)
+        self.assertEqual(results[1].stdout, "alive\n")
+        self.assertEqual(shell.restarts, 1)
+
+    def test_stdin_not_consumed(self):
+        _, results = self.run_commands("cat", "echo after")
+        self.assertEqual(results[0].stdout, "")
+        self.assertEqual(results[1].stdout, "after\n")
+
+    def test_small_command_latency(self):
+        shell, results = self.run_commands(*["echo hi"] * 50)
+        self.assertTrue(all(r.stdout == "hi\n" for r in results))
+        self.assertLess(sum(r.duration for r in results) / len(results), 0.05)
+        self.assertEqual(shell.restarts, 0)
+
+
+class TestPersistentShellTool(AgentCoreTestBase):
+
+    tool_settings = {"persistent_shell": True}
+
+    def test_agent_core_uses_persistent_session(self):
+        core = self.make_core(mode="bypass")
+
+        async def _scenario():
+            await core._execute_tool("shell", {"command": "mkdir -p sub && cd sub"})
+            output = await core._execute_tool("shell", {"command": "pwd"})
+            proc = core._shell_session._proc
+            core.shutdown()
+            await proc.wait()
+            return output
+
+        output = asyncio.run(_scenario())
+        self.assertEqual(output.strip(), str(Path(self.tmpdir, "sub").resolve()))
+        self.assertIsNone(core._shell_session)
+
+
+# ═══════════════════════════════════════════════════════════
+# 读取缓存 + 行范围读取
+# ═══════════════════════════════════════════════════════════
+
+class TestReadCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="adds_read_")
+        self.path = Path(self.tmpdir) / "lines.txt"
+        self.path.write_text("".join(f"line {i}\r\n" for i in range(1, 101)), encoding="utf-8")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_range_and_hit(self):
+        cache = ReadCache()
+        view = cache.read_lines(str(self.path), offset=50, limit=3)
+        self.assertEqual(view.lines, ["line 50", "line 51", "line 52"])
+        self.assertEqual((view.start, view.end, view.total_lines), (50, 52, 100))
+        self.assertFalse(view.cached)
+        self.assertTrue(cache.read_lines(str(self.path), offset=1, limit=1).cached)
+
+    def test_mmap_path_matches_small_path(self):
+        small = ReadCache().read_lines(str(self.path), offset=98)
+        large = ReadCache(mmap_threshold=1).read_lines(str(self.path), offset=98)
+        self.assertEqual(small.lines, large.lines)
+        self.assertEqual(large.lines, ["line 98", "line 99", "line 100"])
+
+    def test_change_invalidates(self):
+        cache = ReadCache()
+        cache.read_lines(str(self.path))
+        self.path.write_text("new\n", encoding="utf-8")
+        view = cache.read_lines(str(self.path))
+        self.assertFalse(view.cached)
+        self.assertEqual(view.lines, ["new"])
+
+    def test_byte_budget_eviction(self):
+        paths = []
+        for i in range(3):
+            p = Path(self.tmpdir) / f"f{i}.txt"
+            p.write_text("x" * 100, encoding="utf-8")
+            paths.append(str(p))
+        cache = ReadCache(max_bytes=250)
+        for p in paths:
+            cache.read_lines(p)
+        self.assertEqual(len(cache), 2)
+        self.assertLessEqual(cache.current_bytes, 250)
+        self.assertFalse(cache.read_lines(paths[0]).cached)
+
+    def test_format_numbered_respects_char_budget(self):
+        view = ReadCache().read_lines(str(self.path))
+        text, last = format_numbered(view, max_chars=50)
+        self.assertEqual(text.splitlines()[0], "     1\tline 1")
+        self.assertLess(last, 100)
+        self.assertLessEqual(len(text), 50)
+
+    def test_shared_cache(self):
+        self.assertIs(get_read_cache(), get_read_cache())
+
+
+class TestReadTool(AgentCoreTestBase):
+
+    def setUp(self):
+        super().setUp()
+        big = "".join(f"row {i}\n" for i in range(1, 5001))
+        (Path(self.tmpdir) / "big.txt").write_text(big, encoding="utf-8")
+
+    def test_truncated_read_points_to_next_offset(self):
+        core = self.make_core()
+        output = core._tool_read({"file_path": "big.txt"})
+        self.assertTrue(output.startswith("     1\trow 1\n"))
+        self.assertIn("共 5000 行", output)
+        self.assertIn("继续读取", output)
+
+    def test_deep_lines_reachable(self):
+        core = self.make_core()
+        output = core._tool_read({"file_path": "big.txt", "offset": 4999, "limit": 5})
+        self.assertEqual(output, "  4999\trow 4999\n  5000\trow 5000")
+
+    def test_offset_out_of_range_and_bad_args(self):
+        core = self.make_core()
+        self.assertIn("超出文件范围", core._tool_read({"file_path": "f0.txt", "offset": 5}))
+        self.assertIn("必须是整数", core._tool_read({"file_path": "f0.txt", "limit": "x"}))
+
+
+class TestToolLedger(AgentCoreTestBase):
+
+    def test_each_result_charged_to_its_own_call(self):
+        (Path(self.tmpdir) / "big.txt").write_text("x" * 4000, encoding="utf-8")
+        tool_round = [{"name": "read", "arguments": {"file_path": "f0.txt"}},
+                      {"name": "read", "arguments": {"file_path": "big.txt"}}]
+        core = self.make_core(rounds=[tool_round, "完成"])
+        asyncio.run(core.send_message("读文件"))
+
+        entries = core.budget.ledger()
+        self.assertEqual([e.tool for e in entries], ["read", "read"])
+        results = [m for m in core.messages if m["role"] == "tool_result"]
+        self.assertEqual([m["call_id"] for m in results], [e.call_id for e in entries])
+        self.assertEqual([e.raw_tokens for e in entries], [m.tokens for m in results])
+        self.assertNotEqual(entries[0].args_hash, entries[1].args_hash)
+        self.assertEqual(core.budget._tool_results, sum(e.tokens for e in entries))
+        self.assertEqual(core.budget.ledger(sort_by="tokens")[0].call_id, entries[1].call_id)
+
+        # 账本事件与 .ses 共用 SessionWriter 排队写出
+        core.session_mgr.flush()
+        ledger_files = list(Path(self.tmpdir, ".ai", "sessions").glob("*.ledger.jsonl"))
+        self.assertEqual(len(ledger_files), 1)
+        self.assertEqual(len(load_ledger(str(ledger_files[0]))), 2)
+
+    def test_repeated_reads_deduplicated_in_context(self):
+        src = Path(self.tmpdir) / "mod.py"
+        src.write_text("".join(f"x{i} = {i}\n" for i in range(80)), encoding="utf-8")
+        read = [{"name": "read", "arguments": {"file_path": "mod.py"}}]
+        edited = "".join(f"x{i} = {'None' if i == 40 else i}\n" for i in range(80))
+        write = [{"name": "write", "arguments": {"file_path": "mod.py", "content": edited}}]
+        core = self.make_core(rounds=[read, read, write, read, "完成"], mode="bypass")
+        asyncio.run(core.send_message("读两遍，改一行再读"))
+
+        results = [m for m in core.messages if m["role"] == "tool_result"]
+        reads = [results[0], results[1], results[3]]
+        self.assertIn("x79 = 79", reads[0]["content"])
+        self.assertTrue(reads[1]["content"].startswith("⟳"))
+        self.assertIn("+    41\tx40 = None", reads[2]["content"])
+        self.assertLess(reads[2].tokens, reads[0].tokens // 2)
+        entries = core.budget.ledger()
+        self.assertEqual(entries[1].raw_tokens, entries[0].raw_tokens)
+        self.assertEqual(entries[1].tokens, reads[1].tokens)
+        self.assertEqual(entries[3].tokens, reads[2].tokens)
+        self.assertGreater(entries[3].raw_tokens, entries[3].tokens)
+        self.assertEqual(core.budget._tool_results, sum(e.tokens for e in entries))
+        self.assertEqual(core.get_stats()["tool_dedup"]["unchanged"], 1)
+        self.assertEqual(core.get_stats()["tool_dedup"]["diffs"], 1)
+
+        # Session 中仍记录完整输出
+        _, body = core.session_mgr.read_session(core.session_mgr._current_session_id)
+        self.assertEqual(body.count("x79 = 79"), 3)
+
+
+# ═══════════════════════════════════════════════════════════
+# 增量消息存储
+# ═══════════════════════════════════════════════════════════
+
+class CountingModel(ScriptedModel):
+    """统计 format_message 调用次数"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.formatted = 0
+
+    def format_message(self, message):
+        self.formatted += 1
+        return super().format_message(message)
+
+
+class TestMessageStore(unittest.TestCase):
+
+    def test_tokens_cached_and_totalled(self):
+        store = MessageStore()
+        a = store.append({"role": "user", "content": "a" * 40})
+        store.append({"role": "assistant", "content": "b" * 80})
+        self.assertEqual(a.tokens, 10)
+        self.assertEqual(store.total_tokens, 30)
+        store.replace(1, "short")
+        self.assertEqual(store.total_tokens, 11)
+        store.remove([0])
+        self.assertEqual(store.total_tokens, 1)
+        self.assertEqual(store[0]["content"], "short")
+
+    def test_payload_is_append_only(self):
+        model = CountingModel()
+        store = MessageStore()
+        store.append({"role": "user", "content": "q1"})
+        first = store.payload(model)
+        store.append({"role": "assistant", "content": "a1"})
+        store.append({"role": "system", "content": "internal"})
+        second = store.payload(model)
+        self.assertIs(first, second)
+        self.assertIsInstance(second, FormattedMessages)
+        self.assertEqual(second, [{"role": "user", "content": "q1"},
+                                  {"role": "assistant", "content": "a1"}])
+        self.assertEqual(model.formatted, 3)
+        store.payload(model)
+        self.assertEqual(model.formatted, 3)
+
+    def test_replace_patches_payload_in_place(self):
+        model = CountingModel()
+        store = MessageStore([{"role": "user", "content": "q"},
+                              {"role": "tool_result", "content": "x" * 5000}])
+        payload = store.payload(model)
+        store.replace(1, "摘要")
+        self.assertEqual(payload[1], {"role": "tool_result", "content": "摘要"})
+        self.assertEqual(model.formatted, 3)
+
+    def test_remove_rebuilds_same_object(self):
+        model = ScriptedModel()
+        store = MessageStore([{"role": "user", "content": str(i)} for i in range(3)])
+        payload = store.payload(model)
+        store.remove([1])
+        self.assertIs(store.payload(model), payload)
+        self.assertEqual([m["content"] for m in payload], ["0", "2"])
+
+    def test_openai_format_with_system_head(self):
+        model = OpenAIAdapter({"base_url": "http://localhost"})
+        store = MessageStore([{"role": "user", "content": "q"},
+                              {"role": "tool_result", "content": "r"}])
+        payload = store.payload(model, "sys-1")
+        self.assertEqual(payload, [{"role": "system", "content": "sys-1"},
+                                   {"role": "user", "content": "q"}])
+        self.assertIs(model.build_messages(payload, "sys-1"), payload)
+        store.payload(model, "sys-2")
+        self.assertEqual(payload[0]["content"], "sys-2")
+        self.assertEqual(model.build_messages(payload, "other")[0]["content"], "other")
+        self.assertEqual(len(model.build_messages(payload, "other")), 2)
+
+    def test_agent_core_reuses_payload_across_rounds(self):
+        tool_round = [{"name": "read", "arguments": {"file_path": "missing.txt"}}]
+        model = ScriptedModel([tool_round, "完成"])
+        core = AgentCore(model, project_root=tempfile.mkdtemp(prefix="adds_msgs_"))
+        try:
+            core.init_session()
+            asyncio.run(core.send_message("hi"))
+            (first, n1), (second, n2) = model.received
+            self.assertIs(first, second)
+            self.assertEqual((n1, n2), (1, 3))
+            self.assertEqual(core.messages.total_tokens,
+                             sum(m.tokens for m in core.messages))
+        finally:
+            shutil.rmtree(core.project_root, ignore_errors=True)
+
+
+# ═══════════════════════════════════════════════════════════
+# 提供方提示词缓存
+# ═══════════════════════════════════════════════════════════
+
+class _FakeMessages:
+    """记录请求参数的 anthropic messages 替身（非流式）"""
+
+    def __init__(self, usage):
+        self.requests = []
+        self._usage = usage
+
+    async def create(self, **params):
+        self.requests.append(params)
+        return SimpleNamespace(
+            content=[SimpleNamespace(type="text", text="ok")],
+            model="fake", stop_reason="end_turn", usage=self._usage)
+
+
+class TestPromptCaching(AgentCoreTestBase):
+
+    def make_adapter(self, usage=None, **config):
+        adapter = APIAdapter(dict({"base_url": "http://localhost", "api_key": "k"}, **config))
+        fake = _FakeMessages(usage or SimpleNamespace(input_tokens=10, output_tokens=2))
+        adapter._client = SimpleNamespace(messages=fake)
+        return adapter, fake
+
+    def run_chat(self, adapter, messages, system_prompt):
+        async def scenario():
+            return [r async for r in adapter.chat(messages, system_prompt=system_prompt, stream=False)]
+        return asyncio.run(scenario())
+
+    def test_system_prompt_is_str_of_blocks(self):
+        prompt = SystemPrompt([SystemBlock("A", cache=True), SystemBlock(""), SystemBlock("B")])
+        self.assertEqual(prompt, "AB")
+        self.assertEqual(len(prompt.blocks), 2)
+        self.assertNotIsInstance(prompt + "C", SystemPrompt)
+
+    def test_init_session_splits_static_prefix(self):
+        core = self.make_core()
+        prompt = core.system_prompt
+        self.assertIsInstance(prompt, SystemPrompt)
+        self.assertTrue(prompt.blocks[0].cache)
+        self.assertIn("## 模型身份", prompt.blocks[0].text)
+        self.assertEqual(prompt, "".join(b.text for b in prompt.blocks))
+
+    def test_request_carries_cache_breakpoints(self):
+        adapter, fake = self.make_adapter()
+        store = MessageStore([{"role": "user", "content": "q1"},
+                              {"role": "assistant", "content": "a1"},
+                              {"role": "user", "content": "q2"}])
+        prompt = SystemPrompt([SystemBlock("static", cache=True),
+                               SystemBlock("skills", cache=True),
+                               SystemBlock("memory")])
+        payload = store.payload(adapter, prompt)
+        self.run_chat(adapter, payload, prompt)
+
+        params = fake.requests[0]
+        self.assertEqual([b.get("cache_control") for b in params["system"]],
+                         [{"type": "ephemeral"}, {"type": "ephemeral"}, None])
+        last = params["messages"][-1]
+        self.assertEqual(last["content"][0]["cache_control"], {"type": "ephemeral"})
+        self.assertEqual(params["messages"][:2], payload[:2])
+        # 载荷中的消息不被修改
+        self.assertEqual(payload[-1], {"role": "user", "content": "q2"})
+
+    def test_anthropic_reuses_payload_with_system_prompt(self):
+        adapter, fake = self.make_adapter()
+        store = MessageStore([{"role": "user", "content": "q1"}])
+        prompt = SystemPrompt([SystemBlock("static", cache=True)])
+        payload = store.payload(adapter, prompt)
+        self.assertIs(adapter._build_anthropic_messages(payload), payload)
+        with mock.patch.object(adapter, "format_message",
+                               side_effect=AssertionError("payload re-formatted")):
+            self.run_chat(adapter, payload, prompt)
+        self.assertEqual(fake.requests[0]["system"][0]["text"], "static")
+        self.assertEqual(fake.requests[0]["messages"][0]["content"][0]["text"], "q1")
+
+    def test_plain_prompt_and_disabled_caching(self):
+        adapter, fake = self.make_adapter(prompt_caching=False)
+        prompt = SystemPrompt([SystemBlock("static", cache=True)])
+        self.run_chat(adapter, [{"role": "user", "content": "q"}], prompt)
+        self.assertEqual(fake.requests[0]["system"], "static")
+        self.assertEqual(fake.requests[0]["messages"], [{"role": "user", "content": "q"}])
+
+        adapter, fake = self.make_adapter()
+        self.run_chat(adapter, [{"role": "user", "content": "q"}], "plain")
+        self.assertEqual(fake.requests[0]["system"], "plain")
+
+    def test_cache_usage_recorded(self):
+        usage = SimpleNamespace(input_tokens=5, output_tokens=3,
+                                cache_creation_input_tokens=100, cache_read_input_tokens=900)
+        adapter, _ = self.make_adapter(usage)
+        responses = self.run_chat(adapter, [{"role": "user", "content": "q"}], None)
+        self.assertEqual(responses[0].usage["cache_read_input_tokens"], 900)
+
+        core = self.make_core()
+        core._record_usage(responses[0].usage)
+        core._record_usage(responses[0].usage)
+        stats = core.get_stats()["usage"]
+        self.assertEqual((stats["cache_read_input_tokens"], stats["cache_creation_input_tokens"],
+                          stats["requests"]), (1800, 200, 2))
+
+
+class TestTokenCalibration(AgentCoreTestBase):
+
+    def test_usage_calibrates_budget_and_persists(self):
+        core = self.make_core()
+        estimated = core.budget.estimated_used
+        usage = {"input_tokens": estimated // 2, "output_tokens": 5,
+                 "cache_read_input_tokens": estimated - estimated // 2}
+        for _ in range(2):
+            core._record_usage(usage, estimated * 2)
+        self.assertEqual(core.budget.token_scale, 1.0)
+        core._record_usage(usage, estimated * 2)
+        self.assertAlmostEqual(core.budget.token_scale, 0.5, places=2)
+        self.assertEqual(core.get_stats()["token_scale"], 0.5)
+
+        # 新的 AgentCore 从 .ai/token_calibration.json 恢复系数
+        restored = self.make_core()
+        self.assertAlmostEqual(restored.budget.token_scale, 0.5, places=2)
+
+    def test_model_round_feeds_calibrator(self):
+        class UsageModel(ScriptedModel):
+            async def chat(self, messages, system_prompt=None, tools=None, stream=True, **kw):
+                yield ModelResponse(content="完成", model="mock", finish_reason="stop",
+                                    usage={"input_tokens": 4321, "output_tokens": 1})
+
+        core = AgentCore(UsageModel(), project_root=self.tmpdir)
+        core.init_session()
+        with mock.patch.object(core.token_calibrator, "observe",
+                               return_value=1.0) as observe:
+            asyncio.run(core.send_message("hi " * 100))
+        key, estimated, actual = observe.call_args[0]
+        self.assertEqual(key, "UsageModel:mock-model")
+        self.assertGreater(estimated, 0)
+        self.assertEqual(actual, 4321)
+
+
+class TestBackgroundLayer2(AgentCoreTestBase):
+
+    def make_slow_core(self, gate):
+        class SummaryModel(ScriptedModel):
+            async def chat(self, messages, system_prompt=None, tools=None, stream=True, **kw):
+                if system_prompt is None and "对话记录" in messages[0]["content"]:
+                    await gate.wait()
+                    yield ModelResponse(content="### 关键决策\n- 使用 JWT", model="mock",
+                                        finish_reason="stop")
+                    return
+                async for resp in ScriptedModel.chat(self, messages, system_prompt, tools, stream):
+                    yield resp
+
+        core = AgentCore(SummaryModel(["继续工作"]), project_root=self.tmpdir)
+        core.init_session()
+        return core
+
+    @staticmethod
+    def mem_header(core, session_id):
+        text = (core.session_mgr.sessions_dir / f"{session_id}.mem").read_text(encoding="utf-8")
+        return MemoryHeader.from_metadata(text.split("\n---", 1)[0])
+
+    def test_archive_runs_while_agent_continues(self):
+        events = []
+        cb = AgentCallbacks(on_compact=lambda strategy, saved: events.append(strategy))
+
+        async def scenario():
+            gate = asyncio.Event()
+            core = self.make_slow_core(gate)
+            old_sid = core.session_mgr.get_current_session_id()
+            core.messages.append({"role": "user", "content": "实现登录"})
+            core.session_mgr.append_message("user", "实现登录")
+
+            self.assertTrue(core._try_compact_for_ptl(cb))
+            new_sid = core.session_mgr.get_current_session_id()
+            self.assertNotEqual(new_sid, old_sid)
+            self.assertEqual(len(core.messages), 0)
+            self.assertEqual(core.get_stats()["layer2_pending"], 1)
+
+            # 摘要仍在进行，新 session 中的对话不受阻塞
+            reply = await core.send_message("下一步", callbacks=cb)
+            self.assertEqual(reply, "继续工作")
+            self.assertNotIn("使用 JWT", core.system_prompt)
+
+            gate.set()
+            await core.wait_for_archives()
+            self.assertEqual(core.get_stats()["layer2_pending"], 0)
+            self.assertIn("使用 JWT", core.system_prompt)
+            mem = core.session_mgr.sessions_dir / f"{old_sid}.mem"
+            self.assertIn("实现登录", mem.read_text(encoding="utf-8"))
+            core.shutdown()
+
+        asyncio.run(scenario())
+        self.assertEqual(events[0], "layer2_started")
+        self.assertIn("layer2 1/1", events)
+        self.assertEqual(events[-1], "layer2")
+
+    def test_shutdown_finishes_pending_archive(self):
+        async def scenario():
+            core = self.make_slow_core(asyncio.Event())
+            old_sid = core.session_mgr.get_current_session_id()
+            core.session_mgr.append_message("user", "决定使用 SQLite")
+            self.assertTrue(core._start_layer2(AgentCallbacks()))
+            await asyncio.sleep(0)
+            core.shutdown()
+            return core, old_sid
+
+        core, old_sid = asyncio.run(scenario())
+        mem = core.session_mgr.sessions_dir / f"{old_sid}.mem"
+        self.assertIn("决定使用 SQLite", mem.read_text(encoding="utf-8"))
+
+    def test_overlapping_archives_keep_session_order(self):
+        async def scenario():
+            gates = [asyncio.Event(), asyncio.Event()]
+
+            class GatedModel(ScriptedModel):
+                async def chat(self, messages, system_prompt=None, tools=None, stream=True, **kw):
+                    content = messages[0]["content"]
+                    gate = gates[0] if "第一段" in content else gates[1]
+                    await gate.wait()
+                    yield ModelResponse(content=f"### 摘要\n- {content[-20:]}", model="mock",
+                                        finish_reason="stop")
+
+            core = AgentCore(GatedModel(), project_root=self.tmpdir)
+            core.init_session()
+            sids = []
+            for text in ("第一段讨论", "第二段讨论"):
+                sids.append(core.session_mgr.get_current_session_id())
+                core.session_mgr.append_message("user", text)
+                self.assertTrue(core._start_layer2(AgentCallbacks()))
+            self.assertEqual(core.get_stats()["layer2_pending"], 2)
+
+            # 后开始的归档先完成摘要，仍须等前一个写入 .mem
+            gates[1].set()
+            await asyncio.sleep(0.05)
+            self.assertEqual(core.get_stats()["layer2_pending"], 2)
+            self.assertFalse((core.session_mgr.sessions_dir / f"{sids[1]}.mem").exists())
+            gates[0].set()
+            await core.wait_for_archives()
+            core.shutdown()
+            return core, sids
+
+        core, (first, second) = asyncio.run(scenario())
+        self.assertEqual(self.mem_header(core, first).next_mem, f"{second}.mem")
+        self.assertEqual(self.mem_header(core, second).prev_mem, first)
+
+    def test_shutdown_finishes_chained_archives_in_order(self):
+        async def scenario():
+            core = self.make_slow_core(asyncio.Event())
+            sids = []
+            for text in ("第一段讨论", "第二段讨论"):
+                sids.append(core.session_mgr.get_current_session_id())
+                core.session_mgr.append_message("user", text)
+                self.assertTrue(core._start_layer2(AgentCallbacks()))
+            await asyncio.sleep(0)
+            # 后开始的任务先被取消：更早的归档仍先写入
+            later = list(core._layer2_jobs)[1]
+            later.cancel()
+            await asyncio.wait([later])
+            core.shutdown()
+            return core, sids
+
+        core, (first, second) = asyncio.run(scenario())
+        self.assertEqual(self.mem_header(core, first).next_mem, f"{second}.mem")
+        self.assertEqual(self.mem_header(core, second).prev_mem, first)
+
+    def test_close_waits_for_archive(self):
+        async def scenario():
+            gate = asyncio.Event()
+            core = self.make_slow_core(gate)
+            old_sid = core.session_mgr.get_current_session_id()
+            core.session_mgr.append_message("user", "决定使用 SQLite")
+            self.assertTrue(core._start_layer2(AgentCallbacks()))
+            asyncio.get_running_loop().call_later(0.1, gate.set)
+            await core.close()
+            return core, old_sid
+
+        core, old_sid = asyncio.run(scenario())
+        mem = core.session_mgr.sessions_dir / f"{old_sid}.mem"
+        self.assertIn("使用 JWT", mem.read_text(encoding="utf-8"))
+
+    def test_close_wait_is_bounded(self):
+        async def scenario():
+            core = self.make_slow_core(asyncio.Event())
+            old_sid = core.session_mgr.get_current_session_id()
+            core.session_mgr.append_message("user", "决定使用 SQLite")
+            self.assertTrue(core._start_layer2(AgentCallbacks()))
+            self.assertFalse(await core.wait_for_archives(timeout=0.05))
+            start = time.monotonic()
+            await core.close(timeout=0.1)
+            self.assertLess(time.monotonic() - start, 1)
+            return core, old_sid
+
+        core, old_sid = asyncio.run(scenario())
+        mem = core.session_mgr.sessions_dir / f"{old_sid}.mem"
+        text = mem.read_text(encoding="utf-8")
+        self.assertIn("决定使用 SQLite", text)
+        self.assertNotIn("使用 JWT", text)
+
+    def test_workspace_manager_shutdown_waits_for_archives(self):
+        from tui.state import AppState
+        from tui.workspace_manager import WorkspaceManager
+
+        async def scenario():
+            gate = asyncio.Event()
+            wm = WorkspaceManager(AppState(), self.tmpdir)
+            wm.set_model(ScriptedModel())
+            closing = wm.create_workspace("pm")
+            wm._cores[closing.workspace_id] = core = self.make_slow_core(gate)
+            old_sid = core.session_mgr.get_current_session_id()
+            core.session_mgr.append_message("user", "决定使用 SQLite")
+            self.assertTrue(core._start_layer2(AgentCallbacks()))
+            wm.close_workspace(closing.workspace_id)
+            self.assertEqual(len(wm._closing), 1)
+            asyncio.get_running_loop().call_later(0.1, gate.set)
+            await wm.shutdown()
+            self.assertEqual(len(wm._closing), 0)
+            return core, old_sid
+
+        core, old_sid = asyncio.run(scenario())
+        mem = core.session_mgr.sessions_dir / f"{old_sid}.mem"
+        self.assertIn("使用 JWT", mem.read_text(encoding="utf-8"))
+
+
+# ═══════════════════════════════════════════════════════════
+# 工具 schema 与结构化工具调用
+# ═══════════════════════════════════════════════════════════
+
+class _FakeStream:
+    """anthropic messages.stream 替身：按给定事件序列回放"""
+
+    def __init__(self, events, final):
+        self._events = events
+        self._final = final
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __aiter__(self):
+        async def gen():
+            for event in self._events:
+                yield event
+        return gen()
+
+    async def get_final_message(self):
+        return self._final
+
+
+class _AsyncChunks:
+    def __init__(self, chunks):
+        self._chunks = chunks
+
+    def __aiter__(self):
+        async def gen():
+            for chunk in self._chunks:
+                yield chunk
+        return gen()
+
+
+def _ev(type_, **kw):
+    return SimpleNamespace(type=type_, **kw)
+
+
+class ToolRecordingModel(ScriptedModel):
+    """记录每次调用收到的 tools 参数"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tools_seen = []
+
+    async def chat(self, messages, system_prompt=None, tools=None, stream=True, **kwargs):
+        self.tools_seen.append(tools)
+        async for resp in super().chat(messages, system_prompt, tools, stream, **kwargs):
+            yield resp
+
+
+class TestToolRegistry(unittest.TestCase):
+
+    def test_resolve_aliases_and_schemas(self):
+        registry = default_registry()
+        self.assertEqual(registry.resolve("READ_FILE").name, "read")
+        self.assertEqual(registry.resolve("bash").name, "shell")
+        self.assertIsNone(registry.resolve("deploy"))
+        self.assertTrue(registry.is_readonly("rg"))
+        self.assertFalse(registry.is_readonly("write"))
+        schemas = registry.schemas()
+        self.assertIs(registry.schemas(), schemas)
+        self.assertEqual([t["name"] for t in schemas], ["read", "glob", "grep", "write", "shell"])
+        self.assertEqual(schemas[0]["input_schema"]["required"], ["file_path"])
+
+    def test_register_replaces_aliases(self):
+        registry = default_registry()
+        registry.register(ToolSpec("shell", "d", {"type": "object"}, aliases=("sh",)))
+        self.assertIsNone(registry.resolve("bash"))
+        self.assertEqual(registry.resolve("sh").description, "d")
+        self.assertEqual(len(registry), 5)
+
+    def test_openai_tool_format(self):
+        adapter = OpenAIAdapter({"base_url": "http://localhost"})
+        tools = adapter.format_tools(default_registry().schemas())
+        self.assertEqual(tools[0]["type"], "function")
+        self.assertEqual(tools[0]["function"]["parameters"]["required"], ["file_path"])
+        self.assertIs(adapter.format_tools(tools)[0], tools[0])
+
+
+class TestStructuredToolCalls(AgentCoreTestBase):
+
+    def test_anthropic_stream_parses_parallel_tool_use(self):
+        adapter = APIAdapter({"base_url": "http://localhost", "api_key": "k"})
+        events = [
+            _ev("content_block_start", index=0, content_block=SimpleNamespace(type="text")),
+            _ev("content_block_delta", index=0, delta=SimpleNamespace(type="text_delta", text="先看看")),
+            _ev("content_block_start", index=1, content_block=SimpleNamespace(
+                type="tool_use", id="tu_1", name="read", input={})),
+            _ev("content_block_delta", index=1, delta=SimpleNamespace(
+                type="input_json_delta", partial_json='{"file_pa')),
+            _ev("content_block_delta", index=1, delta=SimpleNamespace(
+                type="input_json_delta", partial_json='th": "f0.txt"}')),
+            _ev("content_block_start", index=2, content_block=SimpleNamespace(
+                type="tool_use", id="tu_2", name="grep", input={})),
+            _ev("content_block_delta", index=2, delta=SimpleNamespace(
+                type="input_json_delta", partial_json='{"pattern": "x"}')),
+            _ev("message_stop"),
+        ]
+        final = SimpleNamespace(model="m", usage=SimpleNamespace(input_tokens=1, output_tokens=1))
+        adapter._client = SimpleNamespace(messages=SimpleNamespace(
+            stream=lambda **params: _FakeStream(events, final)))
+
+        async def scenario():
+            return [r async for r in adapter.chat([{"role": "user", "content": "q"}],
+                                                  tools=default_registry().schemas())]
+        responses = asyncio.run(scenario())
+        self.assertEqual(responses[0].content, "先看看")
+        self.assertEqual(responses[-1].tool_calls, [
+            {"id": "tu_1", "name": "read", "arguments": {"file_path": "f0.txt"}},
+            {"id": "tu_2", "name": "grep", "arguments": {"pattern": "x"}},
+        ])
+
+    def test_thinking_blocks_replayed_with_tool_use(self):
+        adapter = APIAdapter({"base_url": "http://localhost", "api_key": "k"})
+        tool_round = [
+            _ev("content_block_start", index=0, content_block=SimpleNamespace(
+                type="thinking", thinking="", signature="")),
+            _ev("content_block_delta", index=0, delta=SimpleNamespace(
+                type="thinking_delta", thinking="需要先读")),
+            _ev("content_block_delta", index=0, delta=SimpleNamespace(
+                type="thinking_delta", thinking=" f0.txt")),
+            _ev("content_block_delta", index=0, delta=SimpleNamespace(
+                type="signature_delta", signature="sig-1")),
+            _ev("content_block_start", index=1, content_block=SimpleNamespace(
+                type="redacted_thinking", data="opaque")),
+            _ev("content_block_start", index=2, content_block=SimpleNamespace(
+                type="tool_use", id="tu_1", name="read", input={})),
+            _ev("content_block_delta", index=2, delta=SimpleNamespace(
+                type="input_json_delta", partial_json='{"file_path": "f0.txt"}')),
+            _ev("message_stop"),
+        ]
+        text_round = [
+            _ev("content_block_delta", index=0, delta=SimpleNamespace(type="text_delta", text="完成")),
+            _ev("message_stop"),
+        ]
+        final = SimpleNamespace(model="m", usage=SimpleNamespace(input_tokens=1, output_tokens=1))
+        requests = []
+
+        def stream(**params):
+            requests.append(params)
+            return _FakeStream(tool_round if len(requests) == 1 else text_round, final)
+        adapter._client = SimpleNamespace(messages=SimpleNamespace(stream=stream))
+
+        core = AgentCore(adapter, project_root=self.tmpdir)
+        core.init_session()
+        self.assertEqual(asyncio.run(core.send_message("读文件")), "完成")
+
+        replayed = requests[1]["messages"][1]
+        self.assertEqual(replayed["role"], "assistant")
+        self.assertEqual(replayed["content"][:2], [
+            {"type": "thinking", "thinking": "需要先读 f0.txt", "signature": "sig-1"},
+            {"type": "redacted_thinking", "data": "opaque"},
+        ])
+        self.assertEqual([b["type"] for b in replayed["content"]],
+                         ["thinking", "redacted_thinking", "tool_use"])
+        self.assertEqual(requests[1]["messages"][2]["content"][0]["tool_use_id"], "tu_1")
+
+    def test_non_stream_thinking_blocks_returned(self):
+        adapter = APIAdapter({"base_url": "http://localhost", "api_key": "k"})
+
+        async def create(**params):
+            return SimpleNamespace(model="m", stop_reason="tool_use",
+                                   usage=SimpleNamespace(input_tokens=1, output_tokens=1), content=[
+                SimpleNamespace(type="thinking", thinking="想", signature="sig"),
+                SimpleNamespace(type="tool_use", id="tu_1", name="read", input={"file_path": "a"}),
+            ])
+        adapter._client = SimpleNamespace(messages=SimpleNamespace(create=create))
+
+        async def scenario():
+            return [r async for r in adapter.chat([{"role": "user", "content": "q"}], stream=False)]
+        response = asyncio.run(scenario())[-1]
+        self.assertEqual(response.thinking_blocks,
+                         [{"type": "thinking", "thinking": "想", "signature": "sig"}])
+
+    def test_openai_stream_parses_tool_call_fragments(self):
+        adapter = OpenAIAdapter({"base_url": "http://localhost", "api_key": "k"})
+
+        def chunk(tool_calls=None, finish=None):
+            delta = SimpleNamespace(content=None, tool_calls=tool_calls)
+            return SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason=finish)])
+
+        def frag(index, id=None, name=None, arguments=None):
+            return SimpleNamespace(index=index, id=id,
+                                   function=SimpleNamespace(name=name, arguments=arguments))
+
+        chunks = [
+            chunk([frag(0, "c1", "read", '{"file_'), frag(1, "c2", "glob", "")]),
+            chunk([frag(0, arguments='path": "a.py"}'), frag(1, arguments='{"pattern": "*.py"}')]),
+            chunk(finish="tool_calls"),
+        ]
+
+        async def create(**params):
+            return _AsyncChunks(chunks)
+        adapter._client = SimpleNamespace(chat=SimpleNamespace(
+            completions=SimpleNamespace(create=create)))
+
+        async def scenario():
+            return [r async for r in adapter.chat([{"role": "user", "content": "q"}])]
+        responses = asyncio.run(scenario())
+        self.assertEqual(responses[-1].tool_calls, [
+            {"id": "c1", "name": "read", "arguments": {"file_path": "a.py"}},
+            {"id": "c2", "name": "glob", "arguments": {"pattern": "*.py"}},
+        ])
+
+    def test_core_sends_schemas_and_keeps_call_ids(self):
+        tool_round = [{"id": "tu_1", "name": "read", "arguments": {"file_path": "f0.txt"}},
+                      {"id": "tu_2", "name": "read", "arguments": {"file_path": "f1.txt"}}]
+        model = ToolRecordingModel([tool_round, "完成"])
+        core = AgentCore(model, project_root=self.tmpdir)
+        core.init_session()
+        asyncio.run(core.send_message("读文件"))
+
+        self.assertEqual([t["name"] for t in model.tools_seen[0]],
+                         ["read", "glob", "grep", "write", "shell"])
+        assistant = core.messages[1]
+        self.assertEqual([tc["id"] for tc in assistant["tool_calls"]], ["tu_1", "tu_2"])
+        results = [m for m in core.messages if m["role"] == "tool_result"]
+        self.assertEqual([m["tool_call_id"] for m in results], ["tu_1", "tu_2"])
+
+        anthropic = MessageStore(core.messages).payload(
+            APIAdapter({"base_url": "http://localhost", "api_key": "k"}))
+        self.assertEqual([b["type"] for b in anthropic[1]["content"]], ["tool_use", "tool_use"])
+        self.assertEqual(anthropic[2], {"role": "user", "content": [
+            {"type": "tool_result", "tool_use_id": "tu_1", "content": "     1\tcontent-0"}]})
+        openai = MessageStore(core.messages).payload(OpenAIAdapter({"base_url": "http://localhost"}))
+        self.assertEqual(openai[1]["tool_calls"][0]["function"]["arguments"], '{"file_path": "f0.txt"}')
+        self.assertEqual(openai[2], {"role": "tool", "tool_call_id": "tu_1",
+                                     "content": "     1\tcontent-0"})
+
+    def test_text_with_tool_calls_still_executes(self):
+        class TextAndTools(ScriptedModel):
+            async def chat(self, messages, system_prompt=None, tools=None, stream=True, **kwargs):
+                self._call_count += 1
+                if self._call_count == 1:
+                    yield ModelResponse(content="我先读文件", model="mock", finish_reason="streaming")
+                    yield ModelResponse(content="", model="mock", finish_reason="stop", tool_calls=[
+                        {"id": "tu_1", "name": "read", "arguments": {"file_path": "f0.txt"}}])
+                else:
+                    yield ModelResponse(content="完成", model="mock", finish_reason="stop")
+
+        core = AgentCore(TextAndTools(), project_root=self.tmpdir)
+        core.init_session()
+        reply = asyncio.run(core.send_message("读"))
+        self.assertEqual(reply, "完成")
+        self.assertEqual(core.messages[1]["content"], "我先读文件")
+        self.assertEqual(core.messages[2]["content"], "     1\tcontent-0")
+
+    def test_unknown_tool_lists_registry(self):
+        core = self.make_core()
+        output = asyncio.run(core._execute_tool("deploy", {}))
+        self.assertIn("read, glob, grep, write, shell", output)
+
+    def test_tools_not_sent_when_disabled(self):
+        core = self.make_core()
+        core.tool_config["native_tools"] = False
+        self.assertIsNone(core._tool_definitions())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Blob 存储单元测试: 内容寻址去重 / 压缩往返 / gc / SessionManager 接入与旧 .log 兼容
+"""
+
+import gzip
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+import unittest
+from pathlib import Path
+
+from blob_store import BlobStore, is_blob_ref
+from session_manager import SessionManager
+from session_writer import SessionWriter
+
+
+class BlobTestBase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="adds_blob_")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+class TestBlobStore(BlobTestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.store = BlobStore(os.path.join(self.tmp, "blobs"), codec="gzip")
+
+    def test_round_trip_and_compression(self):
+        content = "PASSED test_login\n" * 500 + "中文输出"
+        ref = self.store.put(content)
+        self.assertTrue(is_blob_ref(ref))
+        self.assertEqual(self.store.get(ref), content)
+        self.assertLess(self.store.disk_usage(), len(content.encode("utf-8")) // 10)
+
+    def test_identical_content_stored_once(self):
+        ref1 = self.store.put("same output")
+        ref2 = self.store.put("same output")
+        ref3 = self.store.put("other output")
+        self.assertEqual(ref1, ref2)
+        self.assertNotEqual(ref1, ref3)
+        self.assertEqual(sorted(self.store.refs()), sorted([ref1, ref3]))
+        self.assertEqual(self.store.stats["dedup_hits"], 1)
+
+    def test_gzip_output_is_deterministic(self):
+        ref = self.store.put("x" * 1000)
+        path = next(Path(self.tmp, "blobs").glob("??/*.gz"))
+        self.assertEqual(gzip.decompress(path.read_bytes()), b"x" * 1000)
+        self.assertEqual(path.name.split(".")[0], ref[len("blob:"):])
+
+    def test_missing_blob(self):
+        with self.assertRaises(FileNotFoundError):
+            self.store.get("blob:" + "0" * 32)
+
+    def test_gc_keeps_referenced_and_recent(self):
+        keep = self.store.put("keep")
+        drop = self.store.put("drop")
+        self.assertEqual(self.store.gc([keep], min_age=3600), (0, 0))
+
+        old = time.time() - 7200
+        for path in Path(self.tmp, "blobs").glob("??/*.gz"):
+            os.utime(path, (old, old))
+        removed, freed = self.store.gc([keep], min_age=3600, dry_run=True)
+        self.assertEqual(removed, 1)
+        self.assertTrue(self.store.contains(drop))
+
+        removed, _ = self.store.gc([keep], min_age=3600)
+        self.assertEqual(removed, 1)
+        self.assertFalse(self.store.contains(drop))
+        self.assertEqual(self.store.get(keep), "keep")
+        # 删除后重新写入同一内容
+        self.assertEqual(self.store.put("drop"), drop)
+        self.assertEqual(self.store.get(drop), "drop")
+
+    def test_open_text_streams_exact_content(self):
+        content = "line one\r\nline two\r\n中文\n" * 2000
+        ref = self.store.put(content)
+        with self.store.open_text(ref) as f:
+            chunks = iter(lambda: f.read(4096), "")
+            self.assertEqual("".join(chunks), content)
+        with self.assertRaises(FileNotFoundError):
+            self.store.open_text("blob:" + "0" * 32)
+
+    def test_invalid_codec(self):
+        with self.assertRaises(ValueError):
+            BlobStore(self.tmp, codec="lz4")
+
+
+class TestSessionManagerBlobs(BlobTestBase):
+
+    def test_tool_outputs_deduplicated_and_reconstructed(self):
+        mgr = SessionManager(sessions_dir=self.tmp)
+        sid = mgr.create_session(agent="developer")
+        ref1 = mgr.save_tool_output("file contents", summary="read a.py")
+        ref2 = mgr.save_tool_output("file contents", summary="read a.py again")
+        self.assertEqual(ref1, ref2)
+        self.assertEqual(len(list(mgr.blobs.refs())), 1)
+        self.assertEqual(mgr.list_logs(sid), [ref1])
+
+        full = mgr.reconstruct_full_session(sid)
+        self.assertEqual(full.count("file contents"), 2)
+        self.assertNotIn("Log file not found", full)
+
+    def test_batched_writer_blob_readable(self):
+        writer = SessionWriter(flush_interval=60)
+        mgr = SessionManager(sessions_dir=self.tmp, writer=writer)
+        mgr.create_session()
+        ref = mgr.save_tool_output("queued output", summary="ok")
+        self.assertEqual(mgr.read_log(ref), "queued output")
+        mgr.close()
+
+    def test_legacy_log_files_still_readable(self):
+        mgr = SessionManager(sessions_dir=self.tmp)
+        sid = mgr.create_session()
+        Path(self.tmp, f"{sid}-ses1.log").write_text("legacy output", encoding="utf-8")
+        mgr.append_message("tool_result", f"详见 `{sid}-ses1.log`")
+        self.assertEqual(mgr.read_log(f"{sid}-ses1.log"), "legacy output")
+        self.assertIn("legacy output", mgr.reconstruct_full_session(sid))
+        self.assertIn(f"{sid}-ses1.log", mgr.list_logs(sid))
+
+    def test_streaming_archive_bounded_memory(self):
+        mgr = SessionManager(sessions_dir=self.tmp)
+        sid = mgr.create_session(agent="developer")
+        mgr.append_message("user", "run the suite")
+        big = "".join(f"test_case_{i} PASSED\r\n" for i in range(400000))   # ~10 MB
+        mgr.save_tool_output(big, summary="400000 passed")
+        mgr.append_message("assistant", "done")
+        expected = mgr.reconstruct_full_session(sid)
+        self.assertEqual("".join(mgr.iter_full_session(sid)), expected)
+        del big, expected
+
+        tracemalloc.start()
+        try:
+            mem_path = mgr.archive_session(summary="全部通过")
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, 2 * 1024 * 1024)
+        with open(mem_path, encoding="utf-8", newline="") as f:
+            text = f.read()
+        self.assertIn("test_case_399999 PASSED\r\n", text)
+        self.assertIn("### [assistant]", text)
+
+    def test_gc_after_archive(self):
+        mgr = SessionManager(sessions_dir=self.tmp)
+        mgr.create_session()
+        live = mgr.save_tool_output("live output", summary="ok")
+        sid = mgr.detach_session()
+        mgr.create_session()
+        kept = mgr.save_tool_output("current output", summary="ok")
+        mgr.archive_session(summary="摘要", session_id=sid)
+
+        self.assertNotIn(live, mgr.referenced_blobs())
+        self.assertIn(kept, mgr.referenced_blobs())
+        removed, _ = mgr.gc_blobs(min_age=0)
+        self.assertEqual(removed, 1)
+        self.assertFalse(mgr.blobs.contains(live))
+        self.assertEqual(mgr.read_log(kept), "current output")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+记忆检索倒排索引单元测试: 分词 / 与逐行扫描一致 / 写入时增量更新 / 外部修改校验 / 大文件 / 快照改写 /
+字段划分 / BM25F 排序与片段
+"""
+
+import asyncio
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import memory_index
+from memory_index import INDEX_FILENAME, MemoryIndex, tokenize
+from memory_manager import MemoryManager
+from memory_retriever import RegexMemoryRetriever
+from session_manager import SessionManager
+
+
+class TestTokenize(unittest.TestCase):
+
+    def test_words_and_cjk_bigrams(self):
+        self.assertEqual(tokenize("使用JWT认证 auth_service v1.2 中"),
+                         ["使用", "jwt", "认证", "auth", "service", "v1", "2", "中"])
+
+    def test_punctuation_only(self):
+        self.assertEqual(tokenize("++ -- ..."), [])
+
+
+class TestMemoryIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="adds_test_memindex_")
+        self.index = MemoryIndex(self.tmp)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, name, text):
+        path = Path(self.tmp) / name
+        path.write_text(text, encoding="utf-8")
+        return path
+
+    def test_matches_line_scan(self):
+        words = ["JWT", "token", "认证", "失败", "auth_service", "AuthService", "v1.2",
+                 "数据库连接", "timeout", "Error:", "重试", "x", "中"]
+        rnd = random.Random(7)
+        for n in range(12):
+            lines = [" ".join(rnd.choice(words) for _ in range(rnd.randint(0, 6)))
+                     for _ in range(rnd.randint(1, 40))]
+            self.write(f"2026041{n % 10}-1000{n:02d}.mem", "\n".join(lines))
+        self.index.refresh()
+        retriever = RegexMemoryRetriever(self.tmp, index=self.index)
+        mem_files = sorted(Path(self.tmp).glob("*.mem"))
+        queries = ["jwt", "Auth", "认证失败", "据库", "service", "1.2", "timeout 重试", "中", "ERROR"]
+        for query in queries:
+            with self.subTest(query=query):
+                expected = [(r.file, r.line_number, r.content)
+                            for r in retriever._scan_files(query, mem_files)]
+                actual = [(f, n, line.strip()) for f, n, line in self.index.search(query)]
+                self.assertEqual(sorted(actual), sorted(expected))
+
+    def test_search_does_not_spawn_processes(self):
+        self.write("index.mem", "### 核心经验\n- JWT token 不兼容\n")
+        self.write("20260410-160000.mem", "JWT token implementation")
+        retriever = RegexMemoryRetriever(self.tmp, index=self.index)
+        with mock.patch("subprocess.run", side_effect=AssertionError("subprocess")):
+            results = asyncio.run(retriever.search("JWT", top_k=3))
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0].source, "固定记忆")
+
+    def test_external_changes_detected(self):
+        path = self.write("a.mem", "alpha\nbeta\n")
+        self.index.refresh()
+        self.assertEqual(len(self.index.search("beta")), 1)
+        path.write_text("gamma\n", encoding="utf-8")
+        os.utime(path, ns=(path.stat().st_atime_ns, path.stat().st_mtime_ns + 10**9))
+        self.assertEqual(self.index.refresh(), {"indexed": 1, "dropped": 0})
+        self.assertEqual(self.index.search("beta"), [])
+        path.unlink()
+        self.assertEqual(self.index.refresh(), {"indexed": 0, "dropped": 1})
+        self.assertEqual(self.index.search("gamma"), [])
+
+    def test_other_instance_and_torn_tail(self):
+        self.write("a.mem", "shared memory line\n")
+        self.index.refresh()
+        with open(Path(self.tmp) / INDEX_FILENAME, "a", encoding="utf-8") as f:
+            f.write('{"file": "b.mem", "terms": {"x')          # 崩溃残留
+        other = MemoryIndex(self.tmp)
+        self.assertEqual(other.refresh(), {"indexed": 0, "dropped": 0})
+        self.assertEqual([h[0] for h in other.search("shared")], ["a.mem"])
+        # 另一个实例写入的记录在下次 refresh 时读入，无需重新索引
+        self.write("b.mem", "shared too\n")
+        other.update_file(Path(self.tmp) / "b.mem")
+        self.assertEqual(self.index.refresh(), {"indexed": 0, "dropped": 0})
+        self.assertEqual([h[0] for h in self.index.search("shared")], ["a.mem", "b.mem"])
+
+    def test_large_files_scanned(self):
+        self.write("big.mem", "filler line\n" * 20 + "needle here\n")
+        with mock.patch.object(memory_index, "MAX_INDEXED_BYTES", 100):
+            self.index.refresh()
+        self.assertEqual(self.index.stats()["large_files"], 1)
+        self.assertEqual(self.index.search("needle"), [("big.mem", 21, "needle here")])
+
+    def test_compaction_rewrites_snapshot(self):
+        path = self.write("index.mem", "v0\n")
+        self.index.refresh()
+        with mock.patch.object(memory_index, "COMPACT_MIN_RECORDS", 5):
+            for i in range(12):
+                path.write_text(f"version {i}\n", encoding="utf-8")
+                self.index.update_file(path)
+            self.index.refresh()
+        lines = (Path(self.tmp) / INDEX_FILENAME).read_text(encoding="utf-8").splitlines()
+        snapshot = json.loads(lines[0])
+        self.assertEqual(snapshot["version"], 1)
+        self.assertEqual(list(snapshot["files"]), ["index.mem"])
+        self.assertLessEqual(len(lines), 6)
+        fresh = MemoryIndex(self.tmp)
+        self.assertEqual(fresh.refresh(), {"indexed": 0, "dropped": 0})
+        self.assertEqual(len(fresh.search("version 11")), 1)
+
+
+class TestBM25FRanking(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="adds_test_memindex_")
+        self.retriever = RegexMemoryRetriever(self.tmp)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, name, text):
+        (Path(self.tmp) / name).write_text(text, encoding="utf-8")
+
+    def search(self, query, top_k=5):
+        return asyncio.run(self.retriever.search(query, top_k=top_k))
+
+    def test_sections_map_to_fields(self):
+        self.write("index.mem", "# 记忆\n## 固定记忆\n- 规则 A\n## 记忆索引\n| 时间 | 摘要 |\n")
+        self.write("a.mem", "# 会话\n## 结构化摘要\n- 目标\n## 完整记录\n## 结构化摘要 (引用)\n")
+        index = self.retriever.index
+        index.refresh()
+        self.assertEqual(index.field_of("index.mem", 3), "fixed")
+        self.assertEqual(index.field_of("index.mem", 5), "index")
+        self.assertEqual(index.field_of("a.mem", 1), "record")
+        self.assertEqual(index.field_of("a.mem", 3), "summary")
+        # 完整记录中的标题行（对话内容）不再切换字段
+        self.assertEqual(index.field_of("a.mem", 5), "record")
+        totals = index.field_totals()
+        self.assertEqual(totals["fixed"][0], 3)
+        self.assertEqual(totals["summary"][0], 2)
+
+    def test_rare_term_outranks_common(self):
+        filler = "\n".join(f"redis cache note {i}" for i in range(30))
+        self.write("20260410-100000.mem", filler + "\nredis kafka\nredis partition")
+        results = self.search("redis kafka", top_k=3)
+        self.assertEqual(results[0].content, "redis kafka")
+        self.assertEqual(results[0].relevance, 1.0)
+        self.assertGreater(results[0].relevance, 1.5 * results[1].relevance)
+
+    def test_summary_field_outranks_record(self):
+        self.write("20260410-100000.mem",
+                   "## 结构化摘要\n- 决定迁移到 postgres\n## 完整记录\n- 决定迁移到 postgres\n")
+        results = self.search("postgres")
+        self.assertEqual([r.line_number for r in results], [2, 4])
+
+    def test_shorter_line_outranks_longer(self):
+        self.write("20260410-100000.mem",
+                   "flaky " + " ".join(f"word{i}" for i in range(40)) + "\nflaky test\n")
+        results = self.search("flaky")
+        self.assertEqual(results[0].line_number, 2)
+
+    def test_long_line_returns_snippet(self):
+        line = "x" * 500 + " deadlock detected " + "y" * 500
+        self.write("20260410-100000.mem", line)
+        result = self.search("deadlock")[0]
+        self.assertIn("deadlock detected", result.content)
+        self.assertTrue(result.content.startswith("…") and result.content.endswith("…"))
+        self.assertLessEqual(len(result.content), RegexMemoryRetriever.SNIPPET_CHARS + 2)
+
+    def test_top_k_bounds_results(self):
+        self.write("20260410-100000.mem", "\n".join(f"gc pause {i}" for i in range(50)))
+        self.assertEqual(len(self.search("gc pause", top_k=4)), 4)
+
+
+class TestIndexUpdatedOnWrite(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="adds_test_memindex_")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_archive_and_index_mem_writes_are_indexed(self):
+        sessions = SessionManager(sessions_dir=self.tmp)
+        sessions.create_session(agent="developer", feature="auth")
+        sessions.append_message("user", "决定使用 JWT 认证")
+        sessions.archive_session(summary="JWT 认证方案")
+
+        mgr = MemoryManager(sessions_dir=self.tmp)
+        mgr.add_item("Redis 连接池上限为 50", category="experience")
+        with mock.patch.object(mgr.memory_index, "update_file",
+                               side_effect=AssertionError("reindexed on search")):
+            self.assertEqual(mgr.memory_index.refresh(), {"indexed": 0, "dropped": 0})
+            results = asyncio.run(mgr.search_memory("JWT 认证", top_k=5))
+            self.assertTrue(any(r.file.endswith(".mem") and r.file != "index.mem" for r in results))
+            results = asyncio.run(mgr.search_memory("连接池", top_k=5))
+            self.assertEqual(results[0].file, "index.mem")
+
+
+if __name__ == "__main__":
+    unittest.main()
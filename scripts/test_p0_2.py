@@ -4,21 +4,37 @@ P0-2 单元测试: Token 预算 + Session 管理 + 摘要决策 + 上下文压
 """
 
 import asyncio
+import contextlib
+import io
+import os
+import random
+import re
 import shutil
+import sys
 import tempfile
+import time
 import unittest
+from unittest import mock
 from datetime import datetime
 from pathlib import Path
 
 from token_budget import (
-    TokenBudget, BudgetUsage, estimate_tokens, load_budget_config,
+    TokenBudget, BudgetUsage, estimate_tokens, load_budget_config, load_ledger, hash_tool_args,
     SYSTEM_PROMPT_RATIO, MEMORY_RATIO, HISTORY_RATIO, TOOL_RESULT_RATIO, RESERVE_RATIO,
 )
+from model.tokenizer import (
+    count_wide_chars, estimate_cache_info, clear_estimate_cache,
+    HeuristicTokenizer, Tokenizer, TokenCalibrator, get_tokenizer,
+)
 from session_manager import SessionManager, SessionHeader, MemoryHeader
+from message_store import MessageStore
+from model.base import ModelResponse
 from summary_decision_engine import (
     SummaryDecisionEngine, SummaryStrategy,
     has_error_signals, extract_error_context, is_redundant_message,
     has_decision_keywords, apply_tool_filter, tool_filter_pytest,
+    ToolFilterStream, ERROR_SIGNAL_PATTERNS, ALL_DECISION_KEYWORDS,
+    analyze_content, analysis_cache_info, clear_analysis_cache,
 )
 from context_compactor import (
     ContextCompactor, Layer1Result, Layer2Result, create_compactor,
@@ -133,6 +149,117 @@ class TestTokenBudget(unittest.TestCase):
         self.assertAlmostEqual(total, 1.0)
 
 
+class TestTokenLedger(unittest.TestCase):
+    """工具调用账本"""
+
+    def test_record_and_attribute_compaction(self):
+        budget = TokenBudget(context_window=10000)
+        a = budget.record_tool_call("read", {"file_path": "a.py"}, 800, turn=1)
+        b = budget.record_tool_call("grep", {"pattern": "x"}, 300, turn=1)
+        self.assertEqual(budget._tool_results, 1100)
+        self.assertEqual((a.call_id, b.call_id), (1, 2))
+
+        saved = budget.record_compaction(a.call_id, 50, log_file="x.log")
+        self.assertEqual(saved, 750)
+        self.assertEqual(budget._tool_results, 350)
+        self.assertEqual(budget.ledger_entry(b.call_id).tokens, 300)
+        self.assertTrue(budget.ledger_entry(a.call_id).compacted)
+        self.assertEqual(budget.record_compaction(99, 1), 0)
+
+    def test_sent_tokens_charged_separately(self):
+        budget = TokenBudget(context_window=10000)
+        entry = budget.record_tool_call("read", {"file_path": "a.py"}, 800, sent_tokens=20)
+        self.assertEqual((entry.raw_tokens, entry.tokens, entry.saved_tokens), (800, 20, 780))
+        self.assertEqual(budget._tool_results, 20)
+
+    def test_ledger_query(self):
+        budget = TokenBudget(context_window=10000)
+        for tokens in (100, 500, 300):
+            budget.record_tool_call("shell", {"command": str(tokens)}, tokens)
+        self.assertEqual([e.tokens for e in budget.ledger(sort_by="tokens", top=2)], [500, 300])
+        budget.record_compaction(2, 10)
+        self.assertEqual([e.call_id for e in budget.ledger(compacted=True)], [2])
+        self.assertEqual(budget.ledger(sort_by="saved_tokens")[0].call_id, 2)
+
+    def test_args_hash_stable(self):
+        self.assertEqual(hash_tool_args({"a": 1, "b": 2}), hash_tool_args({"b": 2, "a": 1}))
+        self.assertNotEqual(hash_tool_args({"a": 1}), hash_tool_args({"a": 2}))
+
+    def test_persist_and_replay(self):
+        tmp = tempfile.mkdtemp(prefix="adds_test_ledger_")
+        try:
+            path = Path(tmp) / "s.ledger.jsonl"
+            budget = TokenBudget(context_window=10000)
+            budget.set_ledger_path(str(path))
+            budget.record_tool_call("read", {"file_path": "a"}, 400, turn=2)
+            budget.record_tool_call("grep", {"pattern": "b"}, 200, turn=2)
+            budget.record_compaction(1, 40, log_file="s-ses1.log")
+            entries = load_ledger(str(path))
+            self.assertEqual([(e.tool, e.raw_tokens, e.tokens) for e in entries],
+                             [("read", 400, 40), ("grep", 200, 200)])
+            self.assertEqual(entries[0].log_file, "s-ses1.log")
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_ledger_events_go_through_session_writer(self):
+        from session_writer import SessionWriter
+        tmp = tempfile.mkdtemp(prefix="adds_test_ledger_")
+        writer = SessionWriter(batched=True, flush_interval=60)
+        try:
+            path = Path(tmp) / "s.ledger.jsonl"
+            budget = TokenBudget(context_window=10000)
+            budget.set_ledger_path(str(path), writer=writer)
+            with mock.patch("builtins.open", side_effect=AssertionError("sync write")):
+                budget.record_tool_call("read", {"file_path": "a"}, 400, turn=1)
+                budget.record_compaction(1, 40)
+            self.assertFalse(path.exists())
+            writer.flush()
+            entries = load_ledger(str(path))
+            self.assertEqual([(e.tool, e.raw_tokens, e.tokens) for e in entries],
+                             [("read", 400, 40)])
+        finally:
+            writer.close()
+            shutil.rmtree(tmp)
+
+    def run_budget_cli(self, project, *argv):
+        import adds
+        out = io.StringIO()
+        cwd = os.getcwd()
+        os.chdir(project)
+        try:
+            with mock.patch.object(sys, "argv", ["adds", "budget", *argv]), \
+                    mock.patch.object(adds, "check_dependencies", return_value=True), \
+                    contextlib.redirect_stdout(out):
+                adds.main()
+        finally:
+            os.chdir(cwd)
+        return out.getvalue()
+
+    def test_budget_cli_without_subcommand(self):
+        tmp = tempfile.mkdtemp(prefix="adds_test_budget_cli_")
+        try:
+            self.assertIn("暂无工具调用账本", self.run_budget_cli(tmp))
+            (Path(tmp) / ".ai" / "sessions").mkdir(parents=True)
+            budget = TokenBudget(context_window=10000)
+            budget.set_ledger_path(str(Path(tmp) / ".ai" / "sessions" / "s1.ledger.jsonl"))
+            budget.record_tool_call("read", {"file_path": "a"}, 400)
+            budget.record_tool_call("grep", {"pattern": "b"}, 200)
+            output = self.run_budget_cli(tmp)
+            self.assertIn("Token 账本: s1", output)
+            self.assertIn("最贵的 10 次调用", output)
+            self.assertIn("最贵的 1 次调用", self.run_budget_cli(tmp, "report", "--top", "1"))
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_reset_clears_ledger(self):
+        budget = TokenBudget(context_window=10000)
+        budget.allocate(system_prompt=100)
+        budget.record_tool_call("read", {}, 300)
+        budget.reset()
+        self.assertEqual(budget.used, 100)
+        self.assertEqual(budget.ledger(), [])
+
+
 class TestEstimateTokens(unittest.TestCase):
     """estimate_tokens 单元测试"""
 
@@ -155,6 +282,180 @@ class TestEstimateTokens(unittest.TestCase):
         self.assertGreater(zh_tokens, en_tokens)
 
 
+def _reference_wide_count(text: str) -> int:
+    """逐字符判定的宽字符计数（与 model.tokenizer 的首字节区间一致）"""
+    return sum(1 for c in text
+               if 0x3000 <= ord(c) <= 0xDFFF or 0xF000 <= ord(c) <= 0xFFFF
+               or 0x20000 <= ord(c) <= 0x33FFF)
+
+
+def _legacy_estimate_tokens(text: str) -> int:
+    """原逐字符循环实现（基准对照）"""
+    if not text:
+        return 0
+    chinese_chars = sum(1 for c in text if '\u4e00' <= c <= '\u9fff')
+    return max(1, int(chinese_chars / 2 + (len(text) - chinese_chars) / 4))
+
+
+def _mixed_text(size: int) -> str:
+    rng = random.Random(7)
+    lines = [
+        "    result = compute(value, key=item)  # comment\n",
+        "这是一个中文句子，包含标点符号和数字123。\n",
+        "ひらがなとカタカナ、한국어 문장도 있습니다。\n",
+        "ＦＵＬＬＷＩＤＴＨ １２３ and Ünïcödé — “quotes”\n",
+    ]
+    parts, total = [], 0
+    while total < size:
+        line = lines[0] if rng.random() < 0.5 else rng.choice(lines[1:])
+        parts.append(line)
+        total += len(line)
+    return "".join(parts)[:size]
+
+
+class TestEstimateTokensFastPath(unittest.TestCase):
+    """共用估算器：宽字符覆盖 / 缓存 / 吞吐"""
+
+    def test_wide_char_classes(self):
+        samples = {
+            "汉字": 2, "かなカナ": 4, "한국어": 3, "ＡＢ１": 3, "，。「」": 4,
+            "\U00020000\U0002A6D6": 2, "abc — “x” Ωж": 0, "😀🎉": 0, "㐀䶵": 2,
+        }
+        for text, expected in samples.items():
+            self.assertEqual(count_wide_chars(text), expected, text)
+
+    def test_matches_reference_on_mixed_text(self):
+        text = _mixed_text(20000)
+        self.assertEqual(count_wide_chars(text), _reference_wide_count(text))
+
+    def test_ascii_and_legacy_agreement(self):
+        text = "def f(x):\n    return x\n" * 100
+        self.assertEqual(estimate_tokens(text), _legacy_estimate_tokens(text))
+        self.assertEqual(estimate_tokens("汉字" * 300), _legacy_estimate_tokens("汉字" * 300))
+
+    def test_memoized_by_content(self):
+        clear_estimate_cache()
+        text = "重复的工具输出 line\n" * 100
+        first = estimate_tokens(text)
+        self.assertEqual(estimate_tokens("".join(["重复的工具输出 line\n"] * 100)), first)
+        info = estimate_cache_info()
+        self.assertEqual((info["hits"], info["misses"]), (1, 1))
+        estimate_tokens("short")
+        self.assertEqual(estimate_cache_info()["size"], 1)
+
+    def test_throughput_10x_on_1mb_mixed_text(self):
+        """微基准：1 MB 混合文本，吞吐至少为原逐字符实现的 10 倍（不计缓存）"""
+        text = _mixed_text(1_000_000)
+
+        def timed(fn):
+            clear_estimate_cache()
+            start = time.perf_counter()
+            fn(text)
+            return time.perf_counter() - start
+
+        # 交替计时取各自最优，降低并发负载对比值的影响
+        legacy = fast = float("inf")
+        for _ in range(7):
+            legacy = min(legacy, timed(_legacy_estimate_tokens))
+            fast = min(fast, timed(estimate_tokens))
+        self.assertGreaterEqual(legacy / fast, 10.0,
+                                f"legacy={legacy * 1000:.1f}ms fast={fast * 1000:.2f}ms")
+
+
+class TestTokenizerPlugins(unittest.TestCase):
+    """分词器插件：规格解析 / 回退 / 替换"""
+
+    def test_heuristic_spec(self):
+        tokenizer = get_tokenizer("heuristic")
+        self.assertIsInstance(tokenizer, HeuristicTokenizer)
+        self.assertFalse(tokenizer.exact)
+        self.assertEqual(tokenizer.count("汉字" * 300), estimate_tokens("汉字" * 300))
+
+    def test_unavailable_exact_tokenizer_falls_back(self):
+        with mock.patch("model.tokenizer._load_tiktoken", side_effect=ImportError("no tiktoken")):
+            tokenizer = get_tokenizer("tiktoken:missing_encoding")
+        self.assertEqual(tokenizer.name, "heuristic")
+
+    def test_model_uses_plugged_tokenizer(self):
+        from model.api_adapter import APIAdapter
+
+        class WordTokenizer(Tokenizer):
+            name = "words"
+            exact = True
+
+            def count(self, text):
+                return len(text.split())
+
+        adapter = APIAdapter({"base_url": "http://localhost", "api_key": "k",
+                              "tokenizer": "heuristic"})
+        self.assertEqual(adapter.count_tokens("a" * 40), 10)
+        adapter.set_tokenizer(WordTokenizer())
+        self.assertEqual(adapter.count_tokens("one two three"), 3)
+
+
+class TestTokenCalibration(unittest.TestCase):
+    """在线校正：拟合 / 异常样本 / 持久化 / 预算换算"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="adds_calib_")
+        self.path = Path(self.tmpdir) / ".ai" / "token_calibration.json"
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_factor_needs_min_samples(self):
+        calibrator = TokenCalibrator(min_samples=3)
+        calibrator.observe("p", 1000, 1500)
+        calibrator.observe("p", 2000, 3000)
+        self.assertEqual(calibrator.factor("p"), 1.0)
+        calibrator.observe("p", 4000, 6000)
+        self.assertAlmostEqual(calibrator.factor("p"), 1.5)
+        self.assertEqual(calibrator.factor("other"), 1.0)
+
+    def test_ignores_small_and_implausible_samples(self):
+        calibrator = TokenCalibrator(min_samples=1)
+        calibrator.observe("p", 10, 100)        # 估算值过小
+        calibrator.observe("p", 1000, 0)        # 无 usage
+        calibrator.observe("p", 1000, 50000)    # 比例超出范围
+        self.assertEqual(calibrator.samples("p"), 0)
+
+    def test_decay_tracks_recent_ratio(self):
+        calibrator = TokenCalibrator(min_samples=1, decay=0.5)
+        for _ in range(5):
+            calibrator.observe("p", 1000, 1000)
+        for _ in range(10):
+            calibrator.observe("p", 1000, 2000)
+        self.assertGreater(calibrator.factor("p"), 1.95)
+
+    def test_persisted_and_reloaded(self):
+        calibrator = TokenCalibrator(str(self.path), min_samples=2)
+        calibrator.observe("APIAdapter:m", 1000, 800)
+        calibrator.observe("APIAdapter:m", 3000, 2400)
+        self.assertTrue(self.path.exists())
+        reloaded = TokenCalibrator(str(self.path), min_samples=2)
+        self.assertAlmostEqual(reloaded.factor("APIAdapter:m"), 0.8)
+        self.assertEqual(reloaded.to_dict()["APIAdapter:m"]["samples"], 2)
+
+    def test_corrupt_file_starts_empty(self):
+        self.path.parent.mkdir(parents=True)
+        self.path.write_text("{not json", encoding="utf-8")
+        self.assertEqual(TokenCalibrator(str(self.path)).factor("p"), 1.0)
+
+    def test_budget_scale_moves_thresholds(self):
+        budget = TokenBudget(context_window=10000)
+        budget.allocate(system_prompt=2000)
+        budget.track("history", 2000)
+        self.assertFalse(budget.should_compact_layer1())
+        budget.set_token_scale(1.5)
+        self.assertEqual(budget.estimated_used, 4000)
+        self.assertEqual(budget.used, 6000)
+        self.assertTrue(budget.should_compact_layer1())
+        self.assertEqual(budget.snapshot().history, 3000)
+        self.assertFalse(budget.can_afford(3000))
+        budget.set_token_scale(0)
+        self.assertEqual(budget.token_scale, 1.5)
+
+
 class TestSessionManager(unittest.TestCase):
     """SessionManager 单元测试"""
 
@@ -184,9 +485,8 @@ class TestSessionManager(unittest.TestCase):
     def test_save_tool_output(self):
         sid = self.mgr.create_session(agent="developer", feature="auth")
         log_file = self.mgr.save_tool_output("tool output content", summary="2 passed")
-        self.assertTrue(log_file.endswith(".log"))
-        log_path = Path(self.tmp) / log_file
-        self.assertTrue(log_path.exists())
+        self.assertTrue(log_file.startswith("blob:"))
+        self.assertTrue(self.mgr.blobs.contains(log_file))
         content = self.mgr.read_log(log_file)
         self.assertEqual(content, "tool output content")
 
@@ -335,12 +635,183 @@ class TestSummaryDecisionEngine(unittest.TestCase):
         result = apply_tool_filter("line\n" * 100)
         self.assertLess(len(result), 500)
 
+    def test_tool_filter_stream_matches_whole_content(self):
+        samples = [
+            "line\n" * 100,
+            "test_a PASSED\n" * 50 + "50 passed, 2 failed in 3.1s\n",
+            "x" * 300,
+            "def foo():\n    pass\n" * 10,
+            "modified: a.py\nnew file: b.py\n" * 4,
+        ]
+        for content in samples:
+            for tool_name in ("", "git"):
+                stream = ToolFilterStream(tool_name=tool_name)
+                for i in range(0, len(content), 7):
+                    stream.feed(content[i:i + 7])
+                self.assertEqual(stream.result(), apply_tool_filter(content, tool_name))
+
+    def test_tool_filter_stream_bounded_state(self):
+        stream = ToolFilterStream()
+        stream.feed("x" * 100000)
+        self.assertLessEqual(len(stream._pending), ToolFilterStream.MAX_PENDING_CHARS)
+        self.assertEqual(stream.total_chars, 100000)
+        self.assertTrue(stream.result().endswith("..."))
+
     def test_layer1_action(self):
         msg = {"role": "tool_result", "content": "x" * 600}
         action = self.engine.get_layer1_action(msg, SummaryStrategy.TOOL_FILTER)
         self.assertEqual(action["strategy"], "tool_filter")
 
 
+_LEGACY_ERROR_PATTERNS = [re.compile(p, re.IGNORECASE) for p in ERROR_SIGNAL_PATTERNS]
+
+
+def _legacy_error_signals(content: str) -> bool:
+    """原实现：逐行过滤测试通过行后依次尝试 8 个模式（对照用）"""
+    filtered = "\n".join(
+        line for line in content.split("\n")
+        if not re.match(r'^\s*(\d+)\s+passed\s*,\s*0\s+(failed|error)', line, re.IGNORECASE))
+    return any(p.search(filtered) for p in _LEGACY_ERROR_PATTERNS)
+
+
+def _legacy_error_context(content: str, context_lines: int = 3) -> str:
+    """原实现：每行依次尝试 8 个模式（对照用）"""
+    lines = content.split("\n")
+    keep = set()
+    for i, line in enumerate(lines):
+        if any(p.search(line) for p in _LEGACY_ERROR_PATTERNS):
+            keep.update(range(max(0, i - context_lines), min(len(lines), i + context_lines + 1)))
+    return "\n".join(lines[i] for i in sorted(keep)) if keep else content
+
+
+def _legacy_decision_keywords(content: str) -> bool:
+    lower = content.lower()
+    return any(kw in lower for kw in ALL_DECISION_KEYWORDS)
+
+
+def _pytest_log(cases: int) -> str:
+    """大型 pytest 输出：每 500 个用例夹一个失败"""
+    parts = []
+    for i in range(cases):
+        parts.append(f"tests/test_mod{i % 50}.py::test_case_{i} PASSED [{i % 100:3d}%]")
+        if i % 500 == 0:
+            parts.append(f"tests/test_mod{i % 50}.py::test_fail_{i} FAILED - AssertionError: 1 != 2")
+    parts.append(f"== {cases // 500} failed, {cases} passed, 2 warnings in 41.2s ==")
+    return "\n".join(parts)
+
+
+class TestContentAnalysis(unittest.TestCase):
+    """单遍预分析：特征向量 / 与原实现一致 / 缓存 / 微基准"""
+
+    SAMPLES = [
+        "", "All tests passed", "12 passed, 0 failed in 3.2s", "3 passed, 1 failed",
+        "Exit code: 1", "exit code: 0", "Exit\ncode: 2", "12 passed, 0 failed\nError: boom",
+        "line1\nline2\nError: something failed\nline4\nline5\nline6",
+        "We decided to use JWT because it is stateless", "决定使用 JWT，原因是无状态",
+        "Traceback (most recent call last):\n  KeyError: 'x'\nsegmentation fault",
+        "FAILURE is not a signal but Permission denied is", "İstanbul ERROR",
+    ]
+
+    def test_matches_legacy_checks(self):
+        rng = random.Random(7)
+        samples = list(self.SAMPLES)
+        for _ in range(300):
+            samples.append("".join(rng.choice(self.SAMPLES) + rng.choice(["\n", " ", ""])
+                                   for _ in range(rng.randint(1, 8))))
+        for content in samples:
+            with self.subTest(content=content):
+                self.assertEqual(has_error_signals(content), _legacy_error_signals(content))
+                self.assertEqual(extract_error_context(content, 1), _legacy_error_context(content, 1))
+                self.assertEqual(has_decision_keywords(content), _legacy_decision_keywords(content))
+
+    def test_feature_vector(self):
+        content = "ok\n12 passed, 0 failed\nWe decided: retry\nValueError: bad\n```\n"
+        features = analyze_content(content)
+        self.assertEqual(features.error_lines, (1, 3))
+        self.assertTrue(features.has_errors)
+        self.assertEqual(features.decision_hits, frozenset({"decided"}))
+        self.assertTrue(features.structured)
+        self.assertIn("passed", features.markers)
+        self.assertEqual(features.pytest_counts, ("12", "0", "0", ""))
+        # 只有测试通过行命中错误模式
+        self.assertFalse(analyze_content("12 passed, 0 failed in 1.5s").has_errors)
+
+    def test_features_cached_per_content(self):
+        clear_analysis_cache()
+        engine = SummaryDecisionEngine()
+        message = {"role": "tool_result", "content": _pytest_log(200)}
+        engine.decide(message)
+        extract_error_context(message["content"])
+        engine.get_layer1_action(message, SummaryStrategy.TOOL_FILTER)
+        info = analysis_cache_info()
+        self.assertEqual(info["misses"], 1)
+        self.assertGreaterEqual(info["hits"], 2)
+
+    def test_benchmark_large_tool_output(self):
+        """微基准：1 MB pytest 输出，decide + 上下文提取 + 工具过滤至少比原实现快 3 倍"""
+        content = _pytest_log(20000)
+        message = {"role": "tool_result", "content": content}
+        engine = SummaryDecisionEngine()
+
+        def legacy():
+            _legacy_error_signals(content)
+            _legacy_error_context(content)
+            _legacy_decision_keywords(content)
+            stream = ToolFilterStream()
+            stream.feed(content)
+            stream.result()
+
+        def single_pass():
+            clear_analysis_cache()
+            engine.decide(message)
+            extract_error_context(content)
+            apply_tool_filter(content)
+
+        def timed(fn):
+            start = time.perf_counter()
+            fn()
+            return time.perf_counter() - start
+
+        # 交替计时取各自最优，降低并发负载对比值的影响
+        slow = fast = float("inf")
+        for _ in range(3):
+            slow = min(slow, timed(legacy))
+            fast = min(fast, timed(single_pass))
+        self.assertGreaterEqual(slow / fast, 3.0,
+                                f"legacy={slow * 1000:.1f}ms single_pass={fast * 1000:.1f}ms")
+        self.assertEqual(engine.decide(message), SummaryStrategy.KEEP_FULL)
+
+
+class _SummaryModel:
+    """Layer2 摘要替身：按提示词类型返回，记录并发峰值"""
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.prompts = []
+        self.kinds = []
+        self.active = 0
+        self.peak = 0
+
+    def get_context_window(self):
+        return 128000
+
+    async def chat(self, messages, system_prompt=None, tools=None, stream=True, **kwargs):
+        prompt = messages[0]["content"]
+        self.prompts.append(prompt)
+        kind = "merge" if "分段要点" in prompt else ("chunk" if "部分。" in prompt else "single")
+        self.kinds.append(kind)
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(0.01)
+            if self.fail_on and self.fail_on in prompt:
+                raise RuntimeError("boom")
+        finally:
+            self.active -= 1
+        text = f"merged-{self.kinds.count('merge')}" if kind == "merge" else f"{kind}-summary"
+        yield ModelResponse(content=text, model="mock", finish_reason="stop")
+
+
 class TestContextCompactor(unittest.TestCase):
     """ContextCompactor 单元测试"""
 
@@ -376,6 +847,33 @@ class TestContextCompactor(unittest.TestCase):
         self.assertTrue(result.saved_to_log)
         self.assertNotEqual(result.log_filename, "")
 
+    def test_layer1_keep_full_long_pytest_keeps_failures(self):
+        passing = "".join(f"test_mod.py::test_ok_{i} PASSED\n" for i in range(120))
+        content = (passing + "=" * 20 + " FAILURES " + "=" * 20 + "\n"
+                   + "_" * 10 + " test_bad " + "_" * 10 + "\n"
+                   + ">       assert total == 3\nE       assert 2 == 3\n\n"
+                   + "test_mod.py:9: AssertionError\n"
+                   + "=" * 10 + " 1 failed, 120 passed in 0.50s " + "=" * 10 + "\n")
+        msg = {"role": "tool_result", "content": content}
+        new_msg, result = self.compactor.layer1_compress(msg)
+        self.assertEqual(result.strategy, "keep_full")
+        self.assertTrue(result.saved_to_log)
+        self.assertIn("E       assert 2 == 3", new_msg["content"])
+        self.assertIn("1 failed, 120 passed", new_msg["content"])
+        self.assertLess(len(new_msg["content"]), len(content) / 3)
+        self.assertEqual(self.compactor.session_mgr.read_log(result.log_filename), content)
+        stats = self.compactor.get_stats()["layer1"]
+        self.assertEqual(stats["error_extract_count"], 1)
+        self.assertEqual(stats["extractors"], {"pytest": 1})
+
+    def test_layer1_keep_full_unstructured_error_kept(self):
+        content = "Error: connection refused\n" + "retrying...\n" * 300
+        msg = {"role": "tool_result", "content": content}
+        new_msg, result = self.compactor.layer1_compress(msg)
+        self.assertEqual(result.strategy, "keep_full")
+        self.assertIs(new_msg, msg)
+        self.assertFalse(result.saved_to_log)
+
     def test_layer1_llm_analyze(self):
         msg = {"role": "assistant", "content": "经过分析，我决定使用 JWT 进行认证，原因是安全性更好。"}
         _, result = self.compactor.layer1_compress(msg)
@@ -396,6 +894,63 @@ class TestContextCompactor(unittest.TestCase):
         # "好的" should be dropped
         self.assertEqual(len(compressed), 2)
 
+    def test_layer1_attributes_compaction_to_ledger(self):
+        budget = self.compactor.budget
+        small = budget.record_tool_call("grep", {"pattern": "x"}, 10)
+        big = budget.record_tool_call("read", {"file_path": "big"}, estimate_tokens("line\n" * 500))
+        messages = [
+            {"role": "tool_result", "content": "12 passed", "call_id": small.call_id},
+            {"role": "user", "content": "继续"},
+            {"role": "tool_result", "content": "line\n" * 500, "call_id": big.call_id},
+        ]
+        self.assertEqual(self.compactor.rank_by_cost(messages), [2, 0, 1])
+        new_msg, result = self.compactor.layer1_compress(messages[2])
+        self.assertTrue(result.saved_to_log)
+        entry = budget.ledger_entry(big.call_id)
+        self.assertTrue(entry.compacted)
+        self.assertEqual(entry.tokens, estimate_tokens(new_msg["content"]))
+        self.assertEqual(entry.log_file, result.log_filename)
+        self.assertEqual(budget._tool_results, 10 + entry.tokens)
+        self.assertEqual(self.compactor.rank_by_cost(messages), [0, 1, 2])
+
+    def test_layer1_store_is_incremental(self):
+        store = MessageStore([
+            {"role": "tool_result", "content": "line\n" * 500},
+            {"role": "assistant", "content": "好的"},
+            {"role": "user", "content": "继续"},
+        ])
+        results = self.compactor.layer1_compress_store(store)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(len(store), 2)
+        self.assertTrue(store[0]["content"].startswith("详见 `"))
+        self.assertTrue(all(entry.layer1_done for entry in store))
+
+        store.append({"role": "tool_result", "content": "12 passed"})
+        with mock.patch.object(self.compactor.engine, "decide",
+                               wraps=self.compactor.engine.decide) as decide:
+            results = self.compactor.layer1_compress_store(store)
+            self.assertEqual(decide.call_count, 1)
+            self.assertEqual(len(results), 1)
+            self.assertEqual(self.compactor.layer1_compress_store(store), [])
+            self.assertEqual(decide.call_count, 1)
+        stats = self.compactor.get_stats()["layer1"]
+        self.assertEqual((stats["scanned_count"], stats["skipped_count"]), (4, 5))
+
+    def test_layer1_store_rechecks_replaced_content(self):
+        store = MessageStore([{"role": "user", "content": "a"}, {"role": "user", "content": "b"}])
+        self.compactor.layer1_compress_store(store)
+        self.assertEqual(store.layer1_pending(), [])
+        self.assertEqual(store.layer1_watermark, 2)
+        store.replace(0, "line\n" * 500)
+        self.assertEqual(store.layer1_watermark, 0)
+        self.assertEqual(store.layer1_pending(), [0])
+        self.assertEqual(store.layer1_watermark, 0)
+
+    def test_layer1_store_stops_at_until(self):
+        store = MessageStore([{"role": "user", "content": "a"}, {"role": "user", "content": "b"}])
+        self.assertEqual(self.compactor.layer1_compress_store(store, until=1.0), [])
+        self.assertEqual(store.layer1_pending(), [0, 1])
+
     def test_layer2_archive(self):
         self.compactor.session_mgr.append_message("user", "Implement JWT auth")
         result = self.compactor.layer2_archive()
@@ -413,6 +968,73 @@ class TestContextCompactor(unittest.TestCase):
         result = self.compactor.layer2_archive()
         self.assertIsNone(result)
 
+    def test_split_record_respects_chunk_size(self):
+        record = "header\n\n---\n\n" + "".join(
+            f"\n### [user]\n消息 {i} " + "word " * 200 for i in range(20))
+        record += "\n### [tool_result]\n" + "x" * 20000
+        chunks = self.compactor.split_record(record, 1000)
+        self.assertEqual("".join(chunks), record)
+        self.assertTrue(all(estimate_tokens(c) <= 1000 for c in chunks))
+        self.assertTrue(chunks[1].startswith("\n### [user]"))
+
+    def test_iter_record_chunks_matches_split_record(self):
+        record = "header\n\n---\n\n" + "".join(
+            f"\n### [assistant]\n第 {i} 步 " + "detail\n" * (50 * i) for i in range(12))
+        expected = self.compactor.split_record(record, 400)
+        pieces = (record[i:i + 777] for i in range(0, len(record), 777))
+        self.assertEqual(list(self.compactor.iter_record_chunks(pieces, 400)), expected)
+
+    def test_layer2_map_reduce_bounded_concurrency(self):
+        model = _SummaryModel()
+        self.compactor.config.update(layer2_chunk_tokens=600, layer2_concurrency=3,
+                                     layer2_merge_fanin=4)
+        record = "".join(f"\n### [assistant]\n第 {i} 步 " + "detail " * 300 for i in range(10))
+        progress = []
+        summary = asyncio.run(self.compactor.summarize_async(
+            model, record, on_progress=lambda done, total: progress.append((done, total))))
+
+        chunks = self.compactor.split_record(record, 600)
+        self.assertEqual(model.kinds.count("chunk"), len(chunks))
+        self.assertLessEqual(model.peak, 3)
+        self.assertGreater(model.peak, 1)
+        # 10 块 → 3 次合并 → 1 次最终合并
+        self.assertEqual(len(chunks), 10)
+        self.assertEqual(model.kinds.count("merge"), 4)
+        self.assertEqual(summary, "merged-4")
+        self.assertEqual(progress[-1], (14, 14))
+
+        # 以片段流输入时结果相同
+        streamed = asyncio.run(self.compactor.summarize_async(
+            _SummaryModel(), iter(record[i:i + 1000] for i in range(0, len(record), 1000))))
+        self.assertEqual(streamed, "merged-4")
+
+    def test_layer2_failed_chunk_falls_back(self):
+        model = _SummaryModel(fail_on="第 1/")
+        self.compactor.config.update(layer2_chunk_tokens=600)
+        record = "".join(f"\n### [assistant]\n决定 {i} " + "detail " * 300 for i in range(3))
+        summary = asyncio.run(self.compactor.summarize_async(model, record))
+        self.assertEqual(summary, "merged-1")
+        # 失败的第 1 块以规则摘要参与合并
+        self.assertIn("- 决定 0", model.prompts[-1])
+        self.assertNotIn("- 决定 1", model.prompts[-1])
+
+    def test_layer2_background_steps(self):
+        mgr = self.compactor.session_mgr
+        mgr.append_message("user", "Implement JWT auth")
+        job = self.compactor.begin_layer2()
+        self.assertIsNone(mgr.get_current_session_id())
+        new_sid = mgr.create_session(agent="developer")
+        mgr.append_message("user", "下一个任务")
+        record_tokens = estimate_tokens(job.full_record)
+
+        result = asyncio.run(self.compactor.run_layer2(job, _SummaryModel()))
+        self.assertEqual(result.session_id, job.session_id)
+        self.assertIn("## 结构化摘要", Path(result.mem_path).read_text(encoding="utf-8"))
+        self.assertEqual(mgr.get_current_session_id(), new_sid)
+        self.assertIn("下一个任务", mgr.read_session(new_sid)[1])
+        self.assertIs(self.compactor.finish_layer2(job, "ignored"), result)
+        self.assertEqual(result.full_record_tokens, record_tokens)
+
     def test_get_stats(self):
         stats = self.compactor.get_stats()
         self.assertIn("layer1", stats)
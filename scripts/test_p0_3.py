@@ -4,6 +4,8 @@ P0-3 单元测试: 记忆系统（优先级排序 + 冲突检测 + 检索 + 排
 """
 
 import asyncio
+import multiprocessing
+import os
 import shutil
 import tempfile
 import unittest
@@ -25,7 +27,10 @@ from memory_retriever import (
 from memory_detox import MemoryDetox, InvalidationResult
 from role_memory_injector import RoleAwareMemoryInjector, RoleMemoryConfig
 from consistency_guard import ConsistencyGuard, DefenseFailureDiagnosis, RegressionAlarm
-from memory_manager import MemoryManager, MemoryUpgradeEvaluation, MemoryStatus
+import memory_manager
+from memory_manager import (
+    IndexMemConflictError, MemoryManager, MemoryUpgradeEvaluation, MemoryStatus,
+)
 
 
 class TestIndexPrioritySorter(unittest.TestCase):
@@ -685,6 +690,151 @@ class TestMemoryManager(unittest.TestCase):
         self.assertIsInstance(results, list)
 
 
+class TestIndexMemCache(unittest.TestCase):
+    """index.mem 解析缓存与按角色注入缓存"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="adds_test_mm_cache_")
+        self.mgr = MemoryManager(sessions_dir=self.tmp, project_root=self.tmp)
+        self.mgr.ensure_index_mem()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_add_item_parses_and_writes_once(self):
+        self.mgr.load_index_mem()
+        with patch('memory_manager.parse_index_mem', wraps=parse_index_mem) as parse, \
+                patch.object(self.mgr.index_mem_path.__class__, 'read_text',
+                             side_effect=AssertionError('index.mem re-read')):
+            with patch.object(self.mgr, '_write_index_content',
+                              wraps=self.mgr._write_index_content) as write:
+                self.mgr.add_item('Redis 连接池上限为 50', summary='连接池')
+                self.assertEqual(write.call_count, 1)
+            self.mgr.add_item('部署前先跑迁移', summary='迁移')
+            self.assertIsNotNone(self.mgr.get_item_by_id('exp-002'))
+            self.mgr.get_status()
+            self.mgr.build_memory_injection(role='developer')
+        # 写入后以写入内容直接更新缓存（解析一次，不读回文件）
+        self.assertEqual(parse.call_count, 2)
+        content, _ = self.mgr.read_index_mem()
+        # 一次写入同时保留已有索引行
+        self.assertIn('连接池', content)
+        self.assertIn('迁移', content)
+
+    def test_external_change_invalidates(self):
+        generation = self.mgr.index_generation
+        self.assertEqual(self.mgr.index_generation, generation)
+        path = self.mgr.index_mem_path
+        path.write_text(path.read_text(encoding='utf-8').replace(
+            '（暂无）', '- 外部写入的经验 | id: exp-042', 1), encoding='utf-8')
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertGreater(self.mgr.index_generation, generation)
+        self.assertIsNotNone(self.mgr.get_item_by_id('exp-042'))
+        # 同一进程内的其他 MemoryManager 共用缓存
+        other = MemoryManager(sessions_dir=self.tmp, project_root=self.tmp)
+        self.assertEqual(other.index_generation, self.mgr.index_generation)
+
+    def test_read_returns_copies(self):
+        _, items = self.mgr.read_index_mem()
+        items[0].content = 'mutated'
+        items[0].tags.append('x')
+        _, again = self.mgr.read_index_mem()
+        self.assertNotEqual(again[0].content, 'mutated')
+        self.assertEqual(again[0].tags, [])
+
+    def test_injection_cached_per_role(self):
+        with patch.object(self.mgr.injector, 'build_memory_section',
+                          wraps=self.mgr.injector.build_memory_section) as build:
+            first = self.mgr.build_memory_injection(role='developer')
+            self.assertEqual(self.mgr.build_memory_injection(role='developer'), first)
+            self.mgr.build_memory_injection(role='tester')
+            self.assertEqual(build.call_count, 2)
+            self.mgr.add_item('用 pytest -x 定位首个失败', category='experience')
+            self.assertIn('pytest -x', self.mgr.build_memory_injection(role='developer'))
+            self.assertEqual(build.call_count, 3)
+
+
+def _append_index_entries(sessions_dir, worker, count):
+    mgr = MemoryManager(sessions_dir=sessions_dir, project_root=sessions_dir)
+    for i in range(count):
+        mgr.add_index_entry('04-10 16:00', f'w{worker}.mem', f'worker {worker} entry {i}')
+
+
+class TestIndexMemTransaction(unittest.TestCase):
+    """index.mem 事务：批量原子写入 / 回滚 / 版本校验 / 多进程"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="adds_test_mm_txn_")
+        self.mgr = MemoryManager(sessions_dir=self.tmp, project_root=self.tmp)
+        self.mgr.ensure_index_mem()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_batch_writes_once(self):
+        path = self.mgr.index_mem_path
+        before = path.read_text(encoding='utf-8')
+        with patch.object(self.mgr, '_write_index_content',
+                          wraps=self.mgr._write_index_content) as write:
+            with self.mgr.transaction():
+                self.mgr.add_item('第一条经验')
+                self.mgr.add_item('第二条经验')
+                self.mgr.update_item('exp-001', {'status': 'suspected'})
+                self.mgr.add_conflict_record('冲突', 'a', 'b', 'auto')
+                # 块内读取看到未提交的修改，文件尚未改动
+                self.assertEqual(self.mgr.get_item_by_id('exp-001').status, 'suspected')
+                self.assertIn('第二条经验', self.mgr.build_memory_injection(role='developer'))
+                self.assertEqual(path.read_text(encoding='utf-8'), before)
+        self.assertEqual(write.call_count, 1)
+        content, items = self.mgr.read_index_mem()
+        self.assertEqual({i.id for i in items} >= {'exp-001', 'exp-002'}, True)
+        self.assertIn('第一条经验', content)
+        self.assertIn('冲突', content)
+        self.assertEqual(list(Path(self.tmp).glob('.index.mem.*.tmp')), [])
+
+    def test_exception_discards_changes(self):
+        before = self.mgr.index_mem_path.read_text(encoding='utf-8')
+        with self.assertRaises(ValueError):
+            with self.mgr.transaction():
+                self.mgr.add_item('不会写入')
+                raise ValueError('abort')
+        self.assertEqual(self.mgr.index_mem_path.read_text(encoding='utf-8'), before)
+        self.assertNotIn('不会写入', self.mgr.read_index_mem()[0])
+
+    def test_write_index_mem_keeps_tables(self):
+        self.mgr.add_index_entry('04-10 16:00', 'a.mem', '保留的索引行')
+        _, items = self.mgr.read_index_mem()
+        self.mgr.write_index_mem(items)
+        self.assertIn('保留的索引行', self.mgr.read_index_mem()[0])
+
+    def test_unlocked_writer_detected(self):
+        path = self.mgr.index_mem_path
+        with self.assertRaises(IndexMemConflictError):
+            with self.mgr.transaction():
+                self.mgr.add_item('事务内的修改')
+                path.write_text(path.read_text(encoding='utf-8') + '\n外部写入\n',
+                                encoding='utf-8')
+        content = path.read_text(encoding='utf-8')
+        self.assertIn('外部写入', content)
+        self.assertNotIn('事务内的修改', content)
+
+    @unittest.skipIf(memory_manager.fcntl is None, "fcntl unavailable")
+    def test_concurrent_processes_do_not_lose_updates(self):
+        ctx = multiprocessing.get_context('fork')
+        workers = [ctx.Process(target=_append_index_entries, args=(self.tmp, w, 10))
+                   for w in range(4)]
+        for p in workers:
+            p.start()
+        for p in workers:
+            p.join(60)
+            self.assertEqual(p.exitcode, 0)
+        content, _ = self.mgr.read_index_mem()
+        for w in range(4):
+            for i in range(10):
+                self.assertIn(f'worker {w} entry {i}', content)
+
+
 class TestMemoryUpgradeEvaluation(unittest.TestCase):
     """MemoryUpgradeEvaluation 单元测试"""
 
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+项目搜索索引单元测试: trigram 提取 + 增量刷新 + grep/glob 接入
+"""
+
+import asyncio
+import json
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from project_index import (
+    ProjectIndex, GitignoreMatcher, glob_to_regex, query_trigrams,
+    required_literals, list_project_files, read_git_head, ripgrep_search,
+    DEFAULT_INDEX_CONFIG,
+)
+
+
+class TestQueryTrigrams(unittest.TestCase):
+
+    def test_literal_runs(self):
+        self.assertEqual(required_literals(r"def \w+_tool\("), ["def ", "_tool("])
+
+    def test_optional_and_branch_are_breaks(self):
+        self.assertEqual(required_literals(r"ab?cde"), ["a", "cde"])
+        self.assertEqual(query_trigrams(r"foo|bar"), set())
+
+    def test_required_group_and_repeat(self):
+        self.assertEqual(required_literals(r"(class)+ X"), ["class", " X"])
+
+    def test_invalid_regex(self):
+        self.assertIsNone(query_trigrams("foo("))
+
+    def test_case_folded(self):
+        self.assertEqual(query_trigrams("ABCd"), {"abc", "bcd"})
+
+    def test_ignorecase_drops_non_ascii_trigrams(self):
+        self.assertEqual(query_trigrams("aσbc", re.IGNORECASE), set())
+        self.assertEqual(query_trigrams("σxyz", re.IGNORECASE), {"xyz"})
+        self.assertEqual(query_trigrams("σxyz"), {"σxy", "xyz"})
+
+    def test_inline_ignorecase_drops_non_ascii_trigrams(self):
+        self.assertEqual(query_trigrams("(?i)σxyz"), {"xyz"})
+        self.assertEqual(query_trigrams("ab(?i:σxyz)"), {"xyz"})
+        self.assertEqual(query_trigrams("(a|(?i:σxyz))"), set())
+
+
+class TestGlobAndGitignore(unittest.TestCase):
+
+    def test_glob_to_regex(self):
+        rx = glob_to_regex("**/*.py")
+        self.assertTrue(rx.match("a.py"))
+        self.assertTrue(rx.match("pkg/sub/a.py"))
+        self.assertFalse(rx.match("a.pyc"))
+        self.assertFalse(glob_to_regex("*.py").match("pkg/a.py"))
+        self.assertTrue(glob_to_regex("src/[!t]*.md").match("src/readme.md"))
+
+    def test_gitignore_matcher(self):
+        m = GitignoreMatcher(["# comment", "*.log", "build/", "/top.txt", "!keep.log"])
+        self.assertTrue(m.ignored("x/debug.log"))
+        self.assertFalse(m.ignored("keep.log"))
+        self.assertTrue(m.ignored("build", is_dir=True))
+        self.assertFalse(m.ignored("build"))
+        self.assertTrue(m.ignored("top.txt"))
+        self.assertFalse(m.ignored("sub/top.txt"))
+
+
+class IndexTestBase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="adds_index_")
+        self.root = Path(self.tmpdir)
+        self.write("src/alpha.py", "def alpha_tool(x):\n    return x\n")
+        self.write("src/beta.py", "class BetaManager:\n    pass\n")
+        self.write("docs/notes.md", "# Notes\nalpha and beta\n")
+        self.write("build/out.py", "def alpha_tool(): pass\n")
+        self.write("blob.bin", "abc\0def alpha_tool")
+        self.write(".gitignore", "build/\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def write(self, rel: str, content: str) -> Path:
+        p = self.root / rel
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_text(content, encoding="utf-8")
+        return p
+
+    def make_index(self, **overrides) -> ProjectIndex:
+        config = dict(DEFAULT_INDEX_CONFIG, **overrides)
+        return ProjectIndex(self.tmpdir, config=config)
+
+
+class TestProjectIndex(IndexTestBase):
+
+    def test_walk_respects_gitignore(self):
+        files = list_project_files(self.root)
+        self.assertIn("src/alpha.py", files)
+        self.assertNotIn("build/out.py", files)
+
+    def test_build_and_search(self):
+        index = self.make_index()
+        stats = index.refresh()
+        self.assertEqual(stats["added"], 5)
+        self.assertEqual(index.candidates(r"def \w+_tool"), ["src/alpha.py"])
+        hits = index.search(r"def \w+_tool")
+        self.assertEqual(hits, [("src/alpha.py", 1, "def alpha_tool(x):")])
+
+    def test_search_prefix_and_include(self):
+        index = self.make_index()
+        index.refresh()
+        self.assertEqual([h[0] for h in index.search("alpha", prefix="docs")], ["docs/notes.md"])
+        self.assertEqual([h[0] for h in index.search("alpha", include="*.py")], ["src/alpha.py"])
+
+    def test_regex_without_literals_scans_all_text_files(self):
+        index = self.make_index()
+        index.refresh()
+        self.assertEqual(len(index.search(r"Beta|beta")), 2)
+
+    def test_persisted_and_reloaded(self):
+        self.make_index().refresh()
+        index = self.make_index()
+        self.assertTrue(index.load())
+        self.assertFalse(index.is_stale())
+        self.assertEqual(index.glob("**/*.py"), ["src/alpha.py", "src/beta.py"])
+        self.assertEqual(index.glob("*.md", prefix="docs"), ["docs/notes.md"])
+
+    def test_incremental_refresh(self):
+        index = self.make_index()
+        index.refresh()
+        p = self.write("src/beta.py", "class GammaManager:\n    pass\n")
+        os.utime(p, ns=(1, 1))
+        (self.root / "docs/notes.md").unlink()
+        self.write("src/new.py", "GammaManager()\n")
+        stats = index.refresh()
+        self.assertEqual((stats["added"], stats["updated"], stats["removed"], stats["unchanged"]),
+                         (1, 1, 1, 3))
+        self.assertEqual([h[0] for h in index.search("GammaManager")], ["src/beta.py", "src/new.py"])
+        self.assertEqual(index.search("BetaManager"), [])
+
+    def test_compaction_drops_dead_ids(self):
+        index = self.make_index(compact_ratio=0.0)
+        index.refresh()
+        p = self.write("src/alpha.py", "def alpha_tool(y): pass\n")
+        os.utime(p, ns=(1, 1))
+        index.refresh()
+        live = {e[0] for e in index.files.values()}
+        self.assertTrue(all(i in live for ids in index.postings.values() for i in ids))
+
+    def test_large_files_always_candidates(self):
+        self.write("src/big.txt", "x" * 200 + "needle\n")
+        index = self.make_index(max_file_bytes=100)
+        index.refresh()
+        self.assertIn("src/big.txt", index.candidates("needle"))
+        self.assertEqual([h[0] for h in index.search("needle")], ["src/big.txt"])
+
+    def test_update_paths_and_dirty(self):
+        index = self.make_index()
+        index.refresh()
+        self.write("src/alpha.py", "def omega_tool(): pass\n")
+        index.update_paths(["src/alpha.py"])
+        self.assertEqual([h[0] for h in index.search("omega_tool")], ["src/alpha.py"])
+        self.assertFalse(index.is_stale())
+        index.mark_dirty()
+        self.assertTrue(index.is_stale())
+
+    def test_ignorecase_matches_non_ascii_case_variants(self):
+        self.write("docs/cities.md", "İstanbul\nſtrasse\nΟΔΥΣΣΕΥΣ\n")
+        index = self.make_index()
+        index.refresh()
+        for pattern in ("istanbul", "STRASSE", "οδυσσευς"):
+            brute = [i for i, line in enumerate(["İstanbul", "ſtrasse", "ΟΔΥΣΣΕΥΣ"], 1)
+                     if re.search(pattern, line, re.IGNORECASE)]
+            hits = index.search(pattern, flags=re.IGNORECASE)
+            self.assertEqual([h[1] for h in hits], brute, pattern)
+            self.assertTrue(hits, pattern)
+
+    def test_inline_ignorecase_matches_non_ascii_case_variants(self):
+        self.write("docs/odyssey.md", "ΟΔΥΣΣΕΥΣ\nοδυσσευς\n")
+        index = self.make_index()
+        index.refresh()
+        for pattern in ("(?i)οδυσσευσ", "(?i:οδυσσευσ)"):
+            self.assertEqual([(h[0], h[1]) for h in index.search(pattern)],
+                             [("docs/odyssey.md", 1), ("docs/odyssey.md", 2)], pattern)
+
+    def test_git_head_unborn_branch(self):
+        git = self.root / ".git"
+        (git / "refs" / "heads").mkdir(parents=True)
+        (git / "HEAD").write_text("ref: refs/heads/main\n", encoding="utf-8")
+        self.assertIsNone(read_git_head(self.root))
+        (git / "refs" / "heads" / "main").write_text("abc123\n", encoding="utf-8")
+        self.assertEqual(read_git_head(self.root), "abc123")
+
+    def test_max_age_makes_stale(self):
+        index = self.make_index(max_age_seconds=0)
+        index.refresh()
+        index.built_at -= 1
+        self.assertTrue(index.is_stale())
+
+
+class TestAgentCoreIndexedTools(IndexTestBase):
+
+    def setUp(self):
+        super().setUp()
+        settings = {"permissions": {"mode": "bypass"}, "index": {"use_ripgrep": False}}
+        self.write(".ai/settings.json", json.dumps(settings))
+
+    def make_core(self):
+        from agent_core import AgentCore
+        from test_agent_core import ScriptedModel
+        return AgentCore(ScriptedModel(), project_root=self.tmpdir, permission_mode="bypass")
+
+    def test_grep_builds_index_and_tracks_writes(self):
+        core = self.make_core()
+        output = core._tool_grep({"pattern": r"def \w+_tool"})
+        self.assertEqual(output, "src/alpha.py:1:def alpha_tool(x):")
+        self.assertTrue((self.root / ".ai" / "index" / "meta.json").exists())
+
+        core._tool_write({"file_path": "src/gamma.py", "content": "def gamma_tool(): pass\n"})
+        output = core._tool_grep({"pattern": "gamma_tool", "path": "src"})
+        self.assertEqual(output, "src/gamma.py:1:def gamma_tool(): pass")
+
+    def test_shell_marks_index_stale(self):
+        core = self.make_core()
+        core._tool_grep({"pattern": "alpha"})
+        asyncio.run(core._tool_shell({"command": "echo 'zeta_tool' > src/zeta.py"}))
+        self.assertTrue(core._project_index.is_stale())
+        self.assertEqual(core._tool_grep({"pattern": "zeta_tool"}), "src/zeta.py:1:zeta_tool")
+        core.shutdown()
+
+    def test_glob_uses_path_table(self):
+        core = self.make_core()
+        core._get_project_index().refresh()
+        self.assertEqual(core._tool_glob({"pattern": "**/*.py"}), "src/alpha.py\nsrc/beta.py")
+        self.assertEqual(core._tool_glob({"pattern": "*.md", "path": "docs"}), "docs/notes.md")
+
+    def test_invalid_regex(self):
+        core = self.make_core()
+        self.assertIn("无效的正则表达式", core._tool_grep({"pattern": "foo("}))
+
+    def test_fallback_uses_same_regex_dialect(self):
+        self.write("src/calc.py", "total = add(2, 40)\nprint(total)\n")
+        core = self.make_core()
+        patterns = [r"add\(\d+, \d+\)", r"def (\w+)_tool\(", r"(?<=print\()total", "alpha_tool"]
+        patterns.append("foo(")
+        indexed = [core._tool_grep({"pattern": p, "path": "src"}) for p in patterns]
+        core.index_config["enabled"] = False
+        fallback = [core._tool_grep({"pattern": p, "path": "src"}) for p in patterns]
+        self.assertEqual([o.replace(self.tmpdir + "/", "") for o in fallback], indexed)
+        self.assertEqual(indexed[0], "src/calc.py:1:total = add(2, 40)")
+        self.assertIn("无效的正则表达式", indexed[-1])
+
+    def test_ripgrep_literal_and_pcre2(self):
+        done = mock.Mock(returncode=1, stdout="")
+        with mock.patch("project_index.shutil.which", return_value="rg"), \
+                mock.patch("project_index.subprocess.run", return_value=done) as run:
+            ripgrep_search(r"foo\.bar", self.tmpdir)
+            self.assertEqual(run.call_args[0][0][-5:], ["-F", "-e", "foo.bar", "--", "."])
+            ripgrep_search(r"foo(bar)\d", self.tmpdir)
+            self.assertEqual(run.call_args[0][0][-5:], ["--pcre2", "-e", r"foo(bar)\d", "--", "."])
+
+    def test_session_files_never_searched(self):
+        self.write(".ai/sessions/20260410-100000.ses", "tool_result: def alpha_tool(x):\n")
+        self.write(".ai/sessions/catalog.jsonl", '{"note": "alpha_tool"}\n')
+        core = self.make_core()
+        self.assertEqual(core._tool_grep({"pattern": "alpha_tool"}), "src/alpha.py:1:def alpha_tool(x):")
+        core._project_index.update_paths([self.root / ".ai/sessions/20260410-100000.ses"])
+        self.assertNotIn(".ai/sessions/20260410-100000.ses", core._project_index.files)
+        self.assertEqual(core._tool_grep({"pattern": "alpha_tool", "path": ".ai"}),
+                         "未找到匹配: pattern=alpha_tool")
+
+        # ripgrep 回退同样排除运行时状态
+        done = mock.Mock(returncode=1, stdout="")
+        with mock.patch("project_index.shutil.which", return_value="rg"), \
+                mock.patch("project_index.subprocess.run", return_value=done) as run:
+            ripgrep_search("alpha_tool", self.tmpdir)
+        self.assertIn("!.ai/sessions/**", run.call_args[0][0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Session 目录单元测试: 生命周期事务 / 旧目录重建 / 多实例增量读取 / 半行容错 / 快照改写
+"""
+
+import json
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import session_catalog
+from session_catalog import CATALOG_FILENAME, CatalogEntry, SessionCatalog
+from session_manager import SessionManager
+from session_writer import SessionWriter
+
+
+class TestSessionCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="adds_test_catalog_")
+        self.mgr = SessionManager(sessions_dir=self.tmp)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def records(self):
+        path = Path(self.tmp) / CATALOG_FILENAME
+        return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+    def test_lifecycle_updates_catalog(self):
+        sid1 = self.mgr.create_session(agent="developer", feature="auth")
+        self.mgr.save_tool_output("output " * 100, summary="s")
+        self.mgr.save_tool_output("other " * 100, summary="s")
+        self.assertEqual(self.mgr.list_sessions()[0]["logs"], 2)
+        self.mgr.archive_session(summary="JWT")
+        sid2 = self.mgr.create_session(agent="developer", feature="dashboard")
+
+        e1, e2 = self.mgr.catalog.get(sid1), self.mgr.catalog.get(sid2)
+        self.assertEqual(e1.status, "archived")
+        self.assertEqual(e1.next_session, sid2)
+        self.assertEqual(e1.log_count, 0)      # 已内联到 .mem
+        self.assertTrue(e1.has_mem)
+        self.assertEqual(e1.mem_bytes, (Path(self.tmp) / f"{sid1}.mem").stat().st_size)
+        self.assertEqual(e1.ses_bytes, (Path(self.tmp) / f"{sid1}.ses").stat().st_size)
+        self.assertEqual(e2.prev_session, sid1)
+        self.assertEqual(e2.status, "active")
+        self.assertEqual(self.mgr.read_session(sid2)[0].prev_session, sid1)
+
+    def test_create_and_list_do_not_scan_directory(self):
+        self.mgr.create_session(agent="developer", feature="auth")
+        with mock.patch.object(Path, "glob", side_effect=AssertionError("directory scanned")):
+            sid2 = self.mgr.create_session(agent="developer", feature="b")
+            sid3 = self.mgr.create_session(agent="developer", feature="c")
+            sessions = self.mgr.list_sessions()
+        self.assertEqual([s["session_id"] for s in sessions][-2:], [sid2, sid3])
+        self.assertEqual(sessions[-1]["prev"], sid2)
+        self.assertEqual(sessions[-2]["next"], sid3)
+
+    def test_same_second_sessions_get_suffix(self):
+        ids = [self.mgr.create_session() for _ in range(3)]
+        self.assertEqual(len(set(ids)), 3)
+        base = ids[0]
+        if ids[1].startswith(base):
+            self.assertEqual(ids[1], f"{base}-2")
+
+    def test_legacy_directory_rebuilt_on_first_use(self):
+        sid = self.mgr.create_session(agent="developer", feature="auth")
+        self.mgr.save_tool_output("payload " * 50)
+        self.mgr.archive_session(summary="done")
+        (Path(self.tmp) / CATALOG_FILENAME).unlink()
+        (Path(self.tmp) / "index.mem").write_text("# index\n", encoding="utf-8")
+        (Path(self.tmp) / "index-prev.mem").write_text("# prev\n", encoding="utf-8")
+
+        fresh = SessionManager(sessions_dir=self.tmp)
+        sessions = fresh.list_sessions()
+        self.assertEqual([s["session_id"] for s in sessions], [sid])
+        self.assertEqual(sessions[0]["status"], "archived")
+        self.assertEqual(sessions[0]["mem"], f"{sid}.mem")
+        self.assertEqual(fresh._find_latest_mem_id(), sid)
+        self.assertTrue((Path(self.tmp) / CATALOG_FILENAME).exists())
+
+    def test_reindex_matches_incremental_catalog(self):
+        sid1 = self.mgr.create_session(agent="a", feature="f1")
+        self.mgr.save_tool_output("x" * 500)
+        self.mgr.archive_session(summary="one")
+        self.mgr.create_session(agent="a", feature="f2")
+        self.mgr.restore_session(sid1)
+        self.mgr.flush()
+
+        before = {e.session_id: e for e in self.mgr.catalog.entries()}
+        self.assertEqual(self.mgr.reindex(), 2)
+        after = {e.session_id: e for e in self.mgr.catalog.entries()}
+        self.assertEqual(before, after)
+        self.assertEqual(after[sid1].status, "restored")
+
+    def test_other_instance_sees_new_sessions(self):
+        other = SessionManager(sessions_dir=self.tmp)
+        self.assertEqual(other.list_sessions(), [])
+        sid = self.mgr.create_session(agent="developer", feature="auth")
+        self.assertEqual([s["session_id"] for s in other.list_sessions()], [sid])
+        # 另一个实例基于最新目录继续建链
+        sid2 = other.create_session(agent="developer", feature="next")
+        self.assertEqual(other.catalog.get(sid2).prev_session, sid)
+        self.assertEqual(self.mgr.catalog.get(sid).next_session, sid2)
+
+    def test_torn_tail_is_ignored(self):
+        sid = self.mgr.create_session(agent="developer")
+        path = Path(self.tmp) / CATALOG_FILENAME
+        with open(path, "a", encoding="utf-8") as f:
+            f.write('{"put": [{"session_id": "99999999-999999", "has_s')   # 崩溃残留
+        fresh = SessionManager(sessions_dir=self.tmp)
+        self.assertEqual(fresh.catalog.ids(), [sid])
+        sid2 = fresh.create_session(agent="developer")
+        again = SessionManager(sessions_dir=self.tmp)
+        self.assertEqual(again.catalog.ids(), sorted([sid, sid2]))
+
+    def test_compaction_rewrites_snapshot(self):
+        self.mgr.create_session(agent="developer")
+        with mock.patch.object(session_catalog, "COMPACT_MIN_RECORDS", 10):
+            for _ in range(30):
+                self.mgr.save_tool_output("payload")
+        records = self.records()
+        self.assertLess(len(records), 12)
+        self.assertEqual(records[0], {"version": 1})
+        fresh = SessionManager(sessions_dir=self.tmp)
+        self.assertEqual(fresh.list_sessions()[0]["logs"], 30)
+
+    def test_commit_after_other_instance_compacts(self):
+        def catalog():
+            return SessionCatalog(self.tmp, scan=list,
+                                  writer=SessionWriter(batched=False))
+
+        a, b = catalog(), catalog()
+        a.commit(CatalogEntry(session_id="s1"))
+        b.compact()
+        a.commit(CatalogEntry(session_id="s2"))
+        self.assertEqual(catalog().ids(), ["s1", "s2"])
+        self.assertEqual(b.ids(), ["s1", "s2"])
+
+    def test_compact_on_fresh_instance_keeps_entries(self):
+        a = SessionCatalog(self.tmp, scan=list)
+        a.commit(CatalogEntry(session_id="s1"), CatalogEntry(session_id="s2"))
+        SessionCatalog(self.tmp, scan=list).compact()
+        self.assertEqual(SessionCatalog(self.tmp, scan=list).ids(), ["s1", "s2"])
+
+
+class TestCatalogEntry(unittest.TestCase):
+
+    def test_unknown_fields_ignored(self):
+        entry = CatalogEntry.from_dict({"session_id": "x", "status": "archived", "future": 1})
+        self.assertEqual(entry, CatalogEntry(session_id="x", status="archived"))
+
+    def test_commit_is_one_record(self):
+        tmp = tempfile.mkdtemp(prefix="adds_test_catalog_")
+        try:
+            catalog = SessionCatalog(tmp, scan=lambda: [])
+            catalog.commit(CatalogEntry("a", has_ses=True), CatalogEntry("b", has_ses=True))
+            lines = (Path(tmp) / CATALOG_FILENAME).read_text(encoding="utf-8").splitlines()
+            self.assertEqual(len(lines), 2)
+            self.assertEqual([e["session_id"] for e in json.loads(lines[1])["put"]], ["a", "b"])
+            self.assertEqual(catalog.latest_session(), "b")
+            self.assertEqual(catalog.latest_session(exclude="b"), "a")
+            self.assertIsNone(catalog.latest_mem())
+        finally:
+            shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Session 批量写入单元测试: 排队 / 阈值刷盘 / 顺序 / 持久化级别 / SessionManager 接入
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from session_manager import SessionManager
+from session_writer import (
+    SessionWriter, load_session_writer_config, DEFAULT_SESSION_WRITER_CONFIG,
+)
+
+
+class WriterTestBase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="adds_writer_")
+        self.path = Path(self.tmp) / "a.ses"
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+class TestSessionWriter(WriterTestBase):
+
+    def test_batched_writes_wait_for_flush(self):
+        writer = SessionWriter(flush_interval=60)
+        try:
+            writer.append(self.path, "one\n")
+            writer.append(self.path, "two\n")
+            self.assertEqual(writer.pending, 2)
+            self.assertFalse(self.path.exists())
+            writer.flush()
+            self.assertEqual(self.path.read_text(encoding="utf-8"), "one\ntwo\n")
+            self.assertEqual((writer.batches, writer.records), (1, 2))
+        finally:
+            writer.close()
+
+    def test_background_flush_on_interval(self):
+        writer = SessionWriter(flush_interval=0.05)
+        try:
+            writer.append(self.path, "x")
+            deadline = time.monotonic() + 2
+            while writer.records < 1 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(self.path.read_text(encoding="utf-8"), "x")
+        finally:
+            writer.close()
+
+    def test_size_threshold_wakes_writer(self):
+        writer = SessionWriter(flush_interval=60, max_batch_records=3)
+        try:
+            for i in range(3):
+                writer.append(self.path, f"{i}")
+            deadline = time.monotonic() + 2
+            while writer.records < 3 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(writer.records, 3)
+            self.assertEqual(self.path.read_text(encoding="utf-8"), "012")
+        finally:
+            writer.close()
+
+    def test_order_preserved_across_write_and_append(self):
+        log = Path(self.tmp) / "a-ses1.log"
+        writer = SessionWriter(flush_interval=60)
+        writer.append(self.path, "head\n")
+        writer.write_file(log, "full output")
+        writer.append(self.path, "ref\n")
+        writer.write_file(self.path, "rewritten\n")
+        writer.append(self.path, "tail\n")
+        writer.close()
+        self.assertEqual(log.read_text(encoding="utf-8"), "full output")
+        self.assertEqual(self.path.read_text(encoding="utf-8"), "rewritten\ntail\n")
+
+    def test_writes_after_close_are_synchronous(self):
+        writer = SessionWriter()
+        writer.close()
+        writer.append(self.path, "late")
+        self.assertEqual(self.path.read_text(encoding="utf-8"), "late")
+
+    def test_fsync_durability(self):
+        writer = SessionWriter(durability="fsync", batched=False)
+        with mock.patch("session_writer.os.fsync", wraps=os.fsync) as fsync:
+            writer.append(self.path, "a")
+            writer.write_file(Path(self.tmp) / "b.log", "b")
+        writer.close()
+        self.assertEqual(fsync.call_count, 2)
+
+    def test_invalid_durability(self):
+        with self.assertRaises(ValueError):
+            SessionWriter(durability="sometimes")
+
+    def test_config_loading(self):
+        ai = Path(self.tmp) / ".ai"
+        ai.mkdir()
+        (ai / "settings.json").write_text(json.dumps(
+            {"session_writer": {"durability": "fsync", "flush_interval": 1}}), encoding="utf-8")
+        config = load_session_writer_config(self.tmp)
+        self.assertEqual((config["durability"], config["flush_interval"]), ("fsync", 1))
+        self.assertEqual(config["batched"], DEFAULT_SESSION_WRITER_CONFIG["batched"])
+
+
+class TestSessionManagerWriter(WriterTestBase):
+
+    def test_reads_and_archive_flush_queue(self):
+        writer = SessionWriter(flush_interval=60)
+        mgr = SessionManager(sessions_dir=self.tmp, writer=writer)
+        sid = mgr.create_session(agent="developer")
+        mgr.append_message("user", "Hello")
+        log = mgr.save_tool_output("tool output", summary="ok")
+        self.assertGreater(writer.pending, 0)
+
+        _, body = mgr.read_session(sid)
+        self.assertIn("Hello", body)
+        self.assertIn(f"详见 `{log}`", body)
+        self.assertEqual(mgr.read_log(log), "tool output")
+
+        mgr.append_message("assistant", "Done")
+        mem_path = mgr.archive_session(summary="摘要")
+        self.assertIn("Done", Path(mem_path).read_text(encoding="utf-8"))
+        self.assertIn("tool output", Path(mem_path).read_text(encoding="utf-8"))
+        mgr.close()
+
+    def test_default_manager_writes_synchronously(self):
+        mgr = SessionManager(sessions_dir=self.tmp)
+        sid = mgr.create_session()
+        mgr.append_message("user", "Hello")
+        self.assertIn("Hello", (Path(self.tmp) / f"{sid}.ses").read_text(encoding="utf-8"))
+
+
+if __name__ == "__main__":
+    unittest.main()
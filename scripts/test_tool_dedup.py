@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+工具结果去重单元测试: 相同结果占位 / 文件变化发送 diff / 被引用结果离开上下文时回退
+"""
+
+import unittest
+
+from message_store import MessageStore
+from tool_dedup import DEFAULT_DEDUP_CONFIG, ToolResultDeduper
+
+
+def numbered(lines):
+    return "\n".join(f"{i:>6}\tline {i}: {text}" for i, text in enumerate(lines, 1))
+
+
+class TestToolResultDeduper(unittest.TestCase):
+
+    def setUp(self):
+        self.dedup = ToolResultDeduper()
+        self.store = MessageStore()
+
+    def send(self, tool, args, result, turn):
+        content, hit = self.dedup.check(tool, args, result, turn, self.store)
+        entry = self.store.append({"role": "tool_result", "content": content})
+        self.dedup.record(tool, args, result, content, turn, entry, hit)
+        return content, hit
+
+    def test_identical_result_replaced_by_stub(self):
+        output = numbered(["import os"] * 40)
+        first, hit = self.send("read", {"file_path": "a.py"}, output, turn=1)
+        self.assertEqual((first, hit), (output, None))
+
+        second, hit = self.send("read", {"file_path": "a.py"}, output, turn=3)
+        self.assertEqual(hit.kind, "unchanged")
+        self.assertIn("第 1 轮", second)
+        self.assertIn("a.py", second)
+        self.assertLess(len(second), 200)
+        self.assertEqual(self.dedup.stats["unchanged"], 1)
+        self.assertGreater(self.dedup.stats["saved_tokens"], 0)
+
+    def test_identical_content_from_other_tool(self):
+        output = "On branch main\n" + "modified: src/x.py\n" * 20
+        self.send("shell", {"command": "git status"}, output, turn=1)
+        content, hit = self.send("shell", {"command": "git status --long"}, output, turn=2)
+        self.assertEqual(hit.kind, "unchanged")
+        self.assertIn("git status", content)
+
+    def test_modified_file_sends_diff(self):
+        lines = [f"value = {i}" for i in range(60)]
+        self.send("read", {"file_path": "a.py"}, numbered(lines), turn=1)
+        lines[30] = "value = 'changed'"
+        changed = numbered(lines)
+
+        content, hit = self.send("read", {"file_path": "a.py"}, changed, turn=2)
+        self.assertEqual(hit.kind, "diff")
+        self.assertIn("-    31\tline 31: value = 30", content)
+        self.assertIn("+    31\tline 31: value = 'changed'", content)
+        self.assertLess(len(content), len(changed) // 2)
+
+        # 再次读取未变化的新版本：diff 没有成为引用对象，仍相对第 1 轮发送 diff
+        again, hit = self.send("read", {"file_path": "a.py"}, changed, turn=3)
+        self.assertEqual((hit.kind, hit.turn), ("diff", 1))
+
+    def test_large_change_sends_full_result(self):
+        self.send("read", {"file_path": "a.py"}, numbered(["a"] * 30), turn=1)
+        rewritten = numbered(["b"] * 30)
+        content, hit = self.send("read", {"file_path": "a.py"}, rewritten, turn=2)
+        self.assertEqual((content, hit), (rewritten, None))
+
+    def test_shell_results_not_diffed(self):
+        self.send("shell", {"command": "pytest"}, "PASSED\n" * 40, turn=1)
+        content, hit = self.send("shell", {"command": "pytest"}, "PASSED\n" * 39 + "FAILED\n", turn=2)
+        self.assertIsNone(hit)
+
+    def test_falls_back_when_reference_left_context(self):
+        output = numbered(["x"] * 40)
+        self.send("read", {"file_path": "a.py"}, output, turn=1)
+        self.store.replace(0, "[Layer1 摘要]")
+        content, hit = self.send("read", {"file_path": "a.py"}, output, turn=2)
+        self.assertEqual((content, hit), (output, None))
+        # 重新完整发送后成为新的引用对象
+        content, hit = self.send("read", {"file_path": "a.py"}, output, turn=3)
+        self.assertEqual((hit.kind, hit.turn), ("unchanged", 2))
+
+        self.store.clear()
+        self.dedup.clear()
+        content, hit = self.send("read", {"file_path": "a.py"}, output, turn=4)
+        self.assertIsNone(hit)
+
+    def test_short_results_and_disabled(self):
+        self.send("read", {"file_path": "a.py"}, "short", turn=1)
+        self.assertEqual(self.send("read", {"file_path": "a.py"}, "short", turn=2)[1], None)
+
+        dedup = ToolResultDeduper(dict(DEFAULT_DEDUP_CONFIG, dedup_results=False))
+        output = "y" * 500
+        content, hit = dedup.check("read", {}, output, 1, self.store)
+        entry = self.store.append({"role": "tool_result", "content": content})
+        dedup.record("read", {}, output, content, 1, entry, hit)
+        self.assertEqual(dedup.check("read", {}, output, 2, self.store), (output, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
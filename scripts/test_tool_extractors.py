@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+工具输出提取器单元测试: pytest / unittest / 诊断 / git / traceback 的结构化提取与 Token 预算
+"""
+
+import unittest
+
+from token_budget import estimate_tokens
+from tool_extractors import (
+    Extractor,
+    ExtractorRegistry,
+    condense_traceback,
+    default_extractors,
+    fit_blocks,
+    split_tracebacks,
+    trim_lines,
+)
+
+
+def pytest_output(n_failures, n_passed=50):
+    lines = ["============================= test session starts ==============================",
+             f"collected {n_failures + n_passed} items", ""]
+    lines += [f"tests/test_mod.py::test_ok_{i} PASSED" for i in range(n_passed)]
+    lines.append("=================================== FAILURES ===================================")
+    for i in range(n_failures):
+        lines += [
+            f"_________________________________ test_bad_{i} _________________________________",
+            "",
+            f"    def test_bad_{i}():",
+            "        value = compute()",
+            "        other = 1",
+            f">       assert value == {i}",
+            f"E       assert -1 == {i}",
+            "",
+            f"tests/test_mod.py:{10 + i}: AssertionError",
+            "----------------------------- Captured stdout call -----------------------------",
+            "noise " * 30,
+        ]
+    lines.append("=========================== short test summary info ============================")
+    lines += [f"FAILED tests/test_mod.py::test_bad_{i} - assert -1 == {i}" for i in range(n_failures)]
+    lines.append(f"======================== {n_failures} failed, {n_passed} passed in 1.23s ========================")
+    return "\n".join(lines) + "\n"
+
+
+UNITTEST_OUTPUT = """\
+F.E
+======================================================================
+ERROR: test_load (test_io.TestIO)
+----------------------------------------------------------------------
+Traceback (most recent call last):
+  File "test_io.py", line 12, in test_load
+    load("missing.json")
+  File "io_utils.py", line 4, in load
+    return open(path).read()
+FileNotFoundError: [Errno 2] No such file or directory: 'missing.json'
+
+======================================================================
+FAIL: test_sum (test_io.TestIO)
+----------------------------------------------------------------------
+Traceback (most recent call last):
+  File "test_io.py", line 8, in test_sum
+    self.assertEqual(total([1, 2]), 4)
+AssertionError: 3 != 4
+
+----------------------------------------------------------------------
+Ran 3 tests in 0.002s
+
+FAILED (failures=1, errors=1)
+"""
+
+
+def recursion_traceback(depth=200):
+    frames = '  File "walk.py", line 3, in walk\n    return walk(node.parent)\n' * depth
+    return ("Traceback (most recent call last):\n"
+            '  File "main.py", line 10, in <module>\n    walk(root)\n'
+            + frames
+            + '  File "walk.py", line 2, in walk\n    if node.depth > LIMIT:\n'
+            + "RecursionError: maximum recursion depth exceeded in comparison\n")
+
+
+class TestBudgetFitting(unittest.TestCase):
+
+    def test_trim_lines_keeps_head_and_tail(self):
+        text = "\n".join(f"line {i}" for i in range(500))
+        trimmed = trim_lines(text, 60)
+        self.assertLessEqual(estimate_tokens(trimmed), 60)
+        self.assertTrue(trimmed.startswith("line 0\n"))
+        self.assertTrue(trimmed.endswith("line 499"))
+        self.assertIn("省略", trimmed)
+
+    def test_trim_lines_short_text_unchanged(self):
+        self.assertEqual(trim_lines("a\nb", 100), "a\nb")
+
+    def test_fit_blocks_omits_whole_blocks(self):
+        blocks = [f"block {i}\n" + "detail " * 20 for i in range(10)]
+        text, complete = fit_blocks(["header"], blocks, 100, unit="块")
+        self.assertFalse(complete)
+        self.assertLessEqual(estimate_tokens(text), 100)
+        self.assertIn("block 0", text)
+        self.assertNotIn("block 9", text)
+        self.assertRegex(text, r"另有 \d+ 块未显示")
+
+    def test_fit_blocks_complete_when_all_fit(self):
+        text, complete = fit_blocks(["h"], ["a", "b"], 100)
+        self.assertEqual((text, complete), ("h\na\nb", True))
+
+
+class TestTestOutputExtractor(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = default_extractors()
+
+    def test_pytest_keeps_summary_and_failure_details(self):
+        output = pytest_output(2)
+        extraction = self.registry.extract(output, "shell", budget_tokens=400)
+        self.assertEqual(extraction.extractor, "pytest")
+        self.assertTrue(extraction.complete)
+        text = extraction.text
+        self.assertTrue(text.startswith("pytest: 2 failed, 50 passed in 1.23s"))
+        self.assertIn("FAILED tests/test_mod.py::test_bad_0", text)
+        self.assertIn(">       assert value == 1", text)
+        self.assertIn("E       assert -1 == 1", text)
+        self.assertIn("tests/test_mod.py:11: AssertionError", text)
+        # 通过的用例与捕获输出被丢弃
+        self.assertNotIn("test_ok_3 PASSED", text)
+        self.assertNotIn("noise", text)
+
+    def test_pytest_respects_budget(self):
+        output = pytest_output(40)
+        extraction = self.registry.extract(output, budget_tokens=300)
+        self.assertLessEqual(extraction.tokens, 300)
+        self.assertFalse(extraction.complete)
+        self.assertIn("test_bad_0", extraction.text)
+        self.assertIn("失败", extraction.text)
+
+    def test_pytest_passing_run_is_one_line(self):
+        output = "\n".join(f"t.py::test_{i} PASSED" for i in range(100)) + \
+            "\n============ 100 passed in 0.50s ============\n"
+        extraction = self.registry.extract(output)
+        self.assertEqual(extraction.text, "pytest: 100 passed in 0.50s")
+
+    def test_pytest_parametrized_duplicates_collapsed(self):
+        block = ("_____ test_p[{i}] _____\n>       assert f(x)\nE       assert False\n"
+                 "t.py:3: AssertionError\n")
+        output = ("===== FAILURES =====\n" + "".join(block.format(i=i) for i in range(3))
+                  + "===== 3 failed in 0.1s =====\n")
+        text = self.registry.extract(output).text
+        self.assertEqual(text.count("E       assert False"), 1)
+        self.assertIn("失败详情同 test_p[0]", text)
+
+    def test_unittest_output(self):
+        extraction = self.registry.extract(UNITTEST_OUTPUT, budget_tokens=400)
+        self.assertEqual(extraction.extractor, "pytest")
+        text = extraction.text
+        self.assertIn("Ran 3 tests in 0.002s — FAILED (failures=1, errors=1)", text)
+        self.assertIn("ERROR: test_load (test_io.TestIO)", text)
+        self.assertIn("FileNotFoundError", text)
+        self.assertIn("AssertionError: 3 != 4", text)
+
+
+class TestDiagnosticsExtractor(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = default_extractors()
+
+    def test_mixed_compilers_and_linters(self):
+        output = "\n".join([
+            "src/app.py:3:1: F401 'os' imported but unused",
+            "src/util.py:1:1: F401 'os' imported but unused",
+            "src/app.py:9:80: E501 line too long (95 > 79 characters)",
+            "src/app.py:12: error: Incompatible return value type (got \"int\", expected \"str\")",
+            "src/web.ts(4,7): error TS2322: Type 'number' is not assignable to type 'string'.",
+            "main.c:5:12: warning: unused variable 'x' [-Wunused-variable]",
+            "    5 |     int x = 0;",
+            "      |         ^",
+            "error[E0308]: mismatched types",
+            "  --> src/main.rs:2:5",
+        ])
+        extraction = self.registry.extract(output, "shell")
+        self.assertEqual(extraction.extractor, "diagnostics")
+        text = extraction.text
+        lines = text.split("\n")
+        self.assertTrue(lines[0].startswith("诊断: 6 error, 1 warning"))
+        self.assertIn("×2，另见 src/util.py:1:1", text)
+        self.assertIn("src/main.rs:2:5: error: [E0308] mismatched types", text)
+        self.assertIn("      |         ^", text)
+        # 错误排在警告之前
+        self.assertLess(text.index("TS2322"), text.index("unused variable"))
+
+    def test_grep_results_are_not_diagnostics(self):
+        output = "\n".join(f"src/m{i}.py:{i}:    raise error: bad" for i in range(200))
+        self.assertIsNone(self.registry.select(output, "grep", errors_only=True))
+        self.assertEqual(self.registry.extract(output, "grep").extractor, "summary")
+
+
+class TestTracebackExtractor(unittest.TestCase):
+
+    def test_repeated_frames_collapsed(self):
+        blocks = split_tracebacks(recursion_traceback().split("\n"))
+        self.assertEqual(len(blocks), 1)
+        condensed = condense_traceback(blocks[0])
+        self.assertIn("    [上一帧重复 199 次]", condensed)
+        self.assertEqual(condensed[-1], "RecursionError: maximum recursion depth exceeded in comparison")
+        self.assertLess(len(condensed), 12)
+
+    def test_deep_stack_keeps_first_and_last_frames(self):
+        frames = "".join(f'  File "m.py", line {i}, in f{i}\n    f{i + 1}()\n' for i in range(30))
+        block = ("Traceback (most recent call last):\n" + frames + "ValueError: x").split("\n")
+        condensed = "\n".join(condense_traceback(block, max_frames=6))
+        self.assertIn("line 0, in f0", condensed)
+        self.assertIn("line 1, in f1", condensed)
+        self.assertIn("省略 24 帧", condensed)
+        self.assertIn("line 29, in f29", condensed)
+        self.assertNotIn("line 15,", condensed)
+
+    def test_identical_tracebacks_merged(self):
+        output = "worker 1 failed:\n" + recursion_traceback() + "\nworker 2 failed:\n" + recursion_traceback()
+        extraction = default_extractors().extract(output, budget_tokens=300)
+        self.assertEqual(extraction.extractor, "traceback")
+        self.assertIn("Python traceback: 2 个（1 种）", extraction.text)
+        self.assertIn("相同内容共出现 2 次", extraction.text)
+        self.assertEqual(extraction.text.count("RecursionError"), 1)
+
+
+class TestGitExtractors(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = default_extractors()
+
+    def test_git_diff_stats_and_changed_lines(self):
+        output = (
+            "diff --git a/a.py b/a.py\nindex 1..2 100644\n--- a/a.py\n+++ b/a.py\n"
+            "@@ -1,4 +1,4 @@\n context\n-old = 1\n+new = 2\n context\n"
+            "diff --git a/b.py b/b.py\nnew file mode 100644\n--- /dev/null\n+++ b/b.py\n"
+            "@@ -0,0 +1,2 @@\n+x = 1\n+y = 2\n"
+        )
+        extraction = self.registry.extract(output, "shell")
+        self.assertEqual(extraction.extractor, "git_diff")
+        text = extraction.text
+        self.assertIn("git diff: 2 个文件, +3 -1", text)
+        self.assertIn("  a.py (+1 -1)", text)
+        self.assertIn("  b.py (+2 -0)", text)
+        self.assertIn("-old = 1\n+new = 2", text)
+        self.assertNotIn("context", text)
+
+    def test_git_status_long_format(self):
+        output = (
+            "On branch main\nYour branch is ahead of 'origin/main' by 2 commits.\n\n"
+            "Changes to be committed:\n  (use \"git restore --staged <file>...\" to unstage)\n"
+            "\tnew file:   c.py\n\n"
+            "Changes not staged for commit:\n\tmodified:   a.py\n\tdeleted:    b.py\n\n"
+            "Untracked files:\n  (use \"git add <file>...\" to include)\n\tnotes.txt\n"
+        )
+        extraction = self.registry.extract(output, "shell")
+        self.assertEqual(extraction.extractor, "git_status")
+        self.assertEqual(extraction.text.split("\n"), [
+            "On branch main",
+            "Your branch is ahead of 'origin/main' by 2 commits.",
+            "git status: 已暂存 1, 未暂存 2, 未跟踪 1",
+            "[已暂存] new file: c.py",
+            "[未暂存] modified: a.py",
+            "[未暂存] deleted: b.py",
+            "[未跟踪] notes.txt",
+        ])
+
+    def test_git_status_porcelain(self):
+        output = "".join(f"?? gen/file_{i}.txt\n" for i in range(300)) + " M a.py\n"
+        extraction = self.registry.extract(output, budget_tokens=100)
+        self.assertEqual(extraction.extractor, "git_status")
+        self.assertIn("未跟踪 300", extraction.text)
+        self.assertIn("未暂存 1", extraction.text)
+        self.assertLessEqual(extraction.tokens, 100)
+        self.assertFalse(extraction.complete)
+
+
+class TestExtractorRegistry(unittest.TestCase):
+
+    def test_fallback_summary(self):
+        extraction = default_extractors().extract("plain output\n" * 300, "shell", budget_tokens=50)
+        self.assertEqual(extraction.extractor, "summary")
+        self.assertLessEqual(extraction.tokens, 50)
+
+    def test_errors_only_skips_git_extractors(self):
+        diff = "diff --git a/x b/x\n--- a/x\n+++ b/x\n@@ -1 +1 @@\n-a\n+b\n"
+        self.assertIsNone(default_extractors().extract(diff, errors_only=True))
+
+    def test_custom_extractor_registered_first(self):
+        class Marker(Extractor):
+            name = "marker"
+            keeps_errors = True
+
+            def detect(self, content, tool_name, features):
+                return tool_name == "custom"
+
+            def extract(self, content, budget_tokens):
+                return "custom summary", True
+
+        registry = default_extractors()
+        registry.register(Marker(), first=True)
+        self.assertEqual(registry.names()[0], "marker")
+        self.assertEqual(registry.extract(pytest_output(1), "custom").text, "custom summary")
+        self.assertEqual(registry.extract(pytest_output(1), "shell").extractor, "pytest")
+
+    def test_failing_extractor_falls_back(self):
+        class Broken(Extractor):
+            name = "broken"
+
+            def detect(self, content, tool_name, features):
+                return True
+
+            def extract(self, content, budget_tokens):
+                raise ValueError("boom")
+
+        registry = ExtractorRegistry([Broken()])
+        with self.assertLogs("tool_extractors", level="WARNING"):
+            extraction = registry.extract("x" * 3000)
+        self.assertEqual(extraction.extractor, "summary")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+记忆向量索引单元测试: 段落切分 / 嵌入 / memmap 检索 / 增量追加与改写 / RRF 融合 / 无 numpy 回退
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import vector_index
+from memory_manager import MemoryManager
+from memory_retriever import (
+    RegexMemoryRetriever, SearchResult, VectorMemoryRetriever, reciprocal_rank_fusion,
+)
+from session_manager import SessionManager
+from vector_index import VectorIndex, embed, np, split_passages
+
+
+class TestPassagesAndFusion(unittest.TestCase):
+
+    def test_split_passages(self):
+        lines = ["# 标题", "第一段 a", "第一段 b", "", "", "## 小节", "- x 1", "|---|", "- y 2"]
+        self.assertEqual([(a, b) for a, b, _ in split_passages(lines)],
+                         [(1, 3), (6, 9)])
+
+    def test_split_passages_limits(self):
+        lines = [f"line {i}" for i in range(20)]
+        spans = [(a, b) for a, b, _ in split_passages(lines)]
+        self.assertEqual(spans, [(1, 8), (9, 16), (17, 20)])
+        # 纯标点段落不产生向量
+        self.assertEqual(split_passages(["---", "***"]), [])
+
+    def test_reciprocal_rank_fusion(self):
+        def r(file, line):
+            return SearchResult(file=file, line_number=line, content=f"{file}:{line}")
+
+        keyword = [r("a.mem", 1), r("b.mem", 5), r("c.mem", 2)]
+        vector = [r("b.mem", 5), r("d.mem", 9), r("a.mem", 1)]
+        fused = reciprocal_rank_fusion([keyword, vector], top_k=3, k=60)
+        self.assertEqual([(x.file, x.line_number) for x in fused],
+                         [("b.mem", 5), ("a.mem", 1), ("d.mem", 9)])
+        self.assertEqual(fused[0].relevance, 1.0)
+        self.assertEqual(reciprocal_rank_fusion([[], []], top_k=3), [])
+
+    def test_falls_back_without_numpy(self):
+        tmp = tempfile.mkdtemp(prefix="adds_test_vector_")
+        self.addCleanup(shutil.rmtree, tmp)
+        (Path(tmp) / "20260410-100000.mem").write_text("JWT token 过期\n", encoding="utf-8")
+        retriever = VectorMemoryRetriever(tmp)
+        with mock.patch.object(vector_index, "np", None):
+            results = asyncio.run(retriever.search("JWT", top_k=3))
+            self.assertFalse(VectorIndex(tmp).exists())
+        self.assertEqual([(r.file, r.line_number) for r in results], [("20260410-100000.mem", 1)])
+        self.assertFalse((Path(tmp) / "vectors").exists())
+
+
+@unittest.skipIf(np is None, "numpy not installed")
+class TestVectorIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="adds_test_vector_")
+        self.index = VectorIndex(self.tmp, dim=128)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, name, text):
+        path = Path(self.tmp) / name
+        path.write_text(text, encoding="utf-8")
+        return path
+
+    def touch_later(self, path):
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    def test_embed_normalized_and_similar(self):
+        m = embed(["authentication token expired", "authenticate token", "redis pool size", ""], 128)
+        self.assertEqual(m.shape, (4, 128))
+        self.assertAlmostEqual(float(np.linalg.norm(m[0])), 1.0, places=5)
+        self.assertEqual(float(np.linalg.norm(m[3])), 0.0)
+        self.assertGreater(float(m[0] @ m[1]), float(m[0] @ m[2]))
+
+    def test_search_ranks_related_passage(self):
+        self.write("a.mem", "## 结构化摘要\n- 决定使用 JWT 认证，token 过期 15 分钟\n\n"
+                            "## 完整记录\nuser: 部署脚本超时\n")
+        self.write("b.mem", "## 结构化摘要\n- Redis 连接池上限 50\n- 缓存淘汰策略 LRU\n")
+        self.assertEqual(self.index.refresh(), {"indexed": 2, "dropped": 0})
+        hits = self.index.search("jwt 认证的 token 有效期", top_k=2)
+        self.assertEqual(hits[0][:3], ("a.mem", 1, 2))
+        self.assertEqual(self.index.passage_of("a.mem", 2), (1, 2))
+        self.assertIsNone(self.index.passage_of("a.mem", 3))
+        self.assertEqual(self.index.search("!!!", top_k=2), [])
+
+    def test_incremental_replace_drop_and_compact(self):
+        path = self.write("a.mem", "alpha beta\n")
+        self.write("b.mem", "gamma delta\n")
+        self.index.refresh()
+        path.write_text("epsilon zeta\n\nalpha again\n", encoding="utf-8")
+        self.touch_later(path)
+        (Path(self.tmp) / "b.mem").unlink()
+        self.assertEqual(self.index.refresh(), {"indexed": 1, "dropped": 1})
+        stats = self.index.stats()
+        self.assertEqual((stats["files"], stats["vectors"], stats["dead_vectors"]), (1, 2, 2))
+        self.assertNotIn("b.mem", [h[0] for h in self.index.search("gamma delta", 5)])
+
+        self.index.compact()
+        self.assertEqual(self.index.stats()["dead_vectors"], 0)
+        self.assertEqual(len(list((Path(self.tmp) / "vectors").glob("matrix-*.f32"))), 1)
+        fresh = VectorIndex(self.tmp)
+        self.assertEqual(fresh.refresh(), {"indexed": 0, "dropped": 0})
+        self.assertEqual(fresh.dim, 128)
+        self.assertEqual(fresh.search("epsilon", 1)[0][:3], ("a.mem", 1, 1))
+
+    def test_other_instance_appends_and_torn_tail(self):
+        self.write("a.mem", "shared memory line\n")
+        self.index.refresh()
+        with open(self.index.table_path, "a", encoding="utf-8") as f:
+            f.write('{"file": "x.mem", "row"')                     # 崩溃残留
+        with open(self.index.root / json.loads(
+                self.index.table_path.read_text(encoding="utf-8").splitlines()[0])["matrix"], "ab") as f:
+            f.write(b"\0" * 10)                                    # 半行向量
+        other = VectorIndex(self.tmp)
+        self.write("b.mem", "shared too\n")
+        other.update_file(Path(self.tmp) / "b.mem")
+        self.assertEqual(self.index.refresh(), {"indexed": 0, "dropped": 0})
+        self.assertEqual(sorted(h[0] for h in self.index.search("shared", 5)), ["a.mem", "b.mem"])
+
+    def test_fusion_aligns_keyword_lines_with_passages(self):
+        self.write("20260410-100000.mem", "## 结构化摘要\n- kafka 分区再平衡导致消费延迟\n"
+                                          "- 调大 session timeout\n")
+        self.write("20260411-100000.mem", "## 结构化摘要\n- 消费者 rebalance 频繁\n")
+        retriever = VectorMemoryRetriever(self.tmp, index=self.index)
+        results = asyncio.run(retriever.search("kafka 消费延迟", top_k=3))
+        self.assertEqual((results[0].file, results[0].line_number), ("20260410-100000.mem", 2))
+        self.assertEqual(results[0].relevance, 1.0)
+        self.assertEqual(len({(r.file, r.line_number) for r in results}), len(results))
+
+    def test_archive_appends_when_enabled(self):
+        settings = Path(self.tmp) / ".ai" / "settings.json"
+        settings.parent.mkdir()
+        settings.write_text(json.dumps({"memory_vector": {"enabled": True, "dim": 64}}),
+                            encoding="utf-8")
+        sessions_dir = str(Path(self.tmp) / ".ai" / "sessions")
+        mgr = MemoryManager(sessions_dir=sessions_dir, project_root=self.tmp)
+        self.assertIsInstance(mgr.retriever, VectorMemoryRetriever)
+        self.assertIsInstance(mgr.retriever.keyword, RegexMemoryRetriever)
+        mgr.vector_index.refresh()
+
+        sessions = SessionManager(sessions_dir=sessions_dir)
+        sessions.create_session(agent="developer", feature="auth")
+        sessions.append_message("user", "决定使用 JWT 认证")
+        sessions.archive_session(summary="JWT 认证方案")
+        with mock.patch.object(mgr.vector_index, "update_file",
+                               side_effect=AssertionError("re-embedded on search")):
+            self.assertEqual(mgr.vector_index.refresh(), {"indexed": 0, "dropped": 0})
+            results = asyncio.run(mgr.search_memory("JWT 认证", top_k=3))
+        self.assertTrue(any(r.file != "index.mem" for r in results))
+        self.assertEqual(mgr.vector_index.dim, 64)
+
+
+if __name__ == "__main__":
+    unittest.main()
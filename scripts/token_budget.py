@@ -6,15 +6,21 @@ ADDS Token Budget Manager — Token 预算管理器
 - 管理上下文窗口的 Token 预算分配
 - 提供 Layer1/Layer2 压缩触发判断
 - 监控各区域 Token 使用量
+- 工具调用账本：逐次记录工具输出的 Token 消耗（原始 / 压缩后），定位最贵的结果
 
 参考：P0-2 上下文压缩策略 — Token 预算管理
 """
 
+import hashlib
 import json
 import logging
+import time
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Any, Dict, List, Optional
+
+from model.tokenizer import estimate_tokens  # noqa: F401  (共用估算器，从此处导出)
+from session_writer import SessionWriter
 
 logger = logging.getLogger(__name__)
 
@@ -65,6 +71,46 @@ class BudgetUsage:
         }
 
 
+@dataclass
+class LedgerEntry:
+    """单次工具调用的 Token 账目"""
+    call_id: int
+    tool: str
+    args_hash: str
+    raw_tokens: int               # 原始输出的 Token 数
+    tokens: int                   # 当前在上下文中的 Token 数（压缩后会减少）
+    turn: int = 0                 # 所在对话轮次
+    timestamp: float = 0.0
+    compacted: bool = False
+    log_file: str = ""            # 压缩时原文保存到的 .log
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.raw_tokens - self.tokens
+
+    def to_dict(self) -> Dict:
+        return {
+            "call_id": self.call_id,
+            "tool": self.tool,
+            "args_hash": self.args_hash,
+            "raw_tokens": self.raw_tokens,
+            "tokens": self.tokens,
+            "turn": self.turn,
+            "timestamp": self.timestamp,
+            "compacted": self.compacted,
+            "log_file": self.log_file,
+        }
+
+
+def hash_tool_args(args: Any) -> str:
+    """工具参数的稳定短哈希（用于识别重复调用）"""
+    try:
+        raw = json.dumps(args, sort_keys=True, ensure_ascii=False, default=str)
+    except (TypeError, ValueError):
+        raw = repr(args)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:12]
+
+
 class TokenBudget:
     """Token 预算管理器
 
@@ -103,6 +149,9 @@ class TokenBudget:
         self._history: int = 0
         self._tool_results: int = 0
 
+        # 估算 → 实际 Token 的校正系数（由 TokenCalibrator 根据提供方 usage 拟合）
+        self.token_scale: float = 1.0
+
         # 预算上限（按比例）
         self._sp_budget = int(context_window * SYSTEM_PROMPT_RATIO)
         self._mem_budget = int(context_window * MEMORY_RATIO)
@@ -110,6 +159,12 @@ class TokenBudget:
         self._tool_budget = int(context_window * TOOL_RESULT_RATIO)
         self._reserve = int(context_window * RESERVE_RATIO)
 
+        # 工具调用账本（可选持久化为 JSONL 事件流）
+        self._ledger: Dict[int, LedgerEntry] = {}
+        self._next_call_id = 1
+        self._ledger_path: Optional[Path] = None
+        self._ledger_writer: Optional[SessionWriter] = None
+
         logger.debug(
             f"TokenBudget initialized: window={context_window}, "
             f"L1={self.layer1_trigger}, L2={self.layer2_trigger}"
@@ -154,13 +209,134 @@ class TokenBudget:
         elif category == "memory":
             self._memory = max(0, self._memory - tokens)
 
+    def set_token_scale(self, scale: float) -> None:
+        """设置校正系数：used / utilization 及各区域快照按此换算为实际 Token
+
+        各区域仍以估算值累计（追踪 / 扣减口径不变），只在读取时换算，
+        因此系数更新后压缩阈值立即按实际用量判断。
+        """
+        if scale <= 0:
+            logger.warning(f"Ignoring invalid token scale: {scale}")
+            return
+        if abs(scale - self.token_scale) >= 0.01:
+            logger.debug(f"Token scale: {self.token_scale:.3f} → {scale:.3f}")
+        self.token_scale = scale
+
+    def _scaled(self, tokens: int) -> int:
+        return int(tokens * self.token_scale)
+
+    def reset(self) -> None:
+        """重置对话相关的用量（新 session 时调用），保留系统提示词与记忆占位"""
+        self._history = 0
+        self._tool_results = 0
+        self._ledger.clear()
+
+    # ──── 工具调用账本 ────
+
+    def set_ledger_path(self, path: Optional[str],
+                        writer: Optional[SessionWriter] = None) -> None:
+        """设置账本持久化路径（JSONL，追加写入 call / compact 事件）
+
+        Args:
+            path: 账本文件路径（None 表示不持久化）
+            writer: SessionWriter（与 .ses 写入共用，事件循环中不做磁盘 I/O）；
+                    None 时同步追加写入
+        """
+        self._ledger_path = Path(path) if path else None
+        self._ledger_writer = writer
+
+    def record_tool_call(self, tool: str, args: Any, tokens: int,
+                         turn: int = 0, sent_tokens: Optional[int] = None) -> LedgerEntry:
+        """记录一次工具调用的输出并计入 tool_results
+
+        Args:
+            tokens: 原始输出的 Token 数
+            sent_tokens: 实际放入上下文的 Token 数（如去重后的占位 / diff）；None 表示原样放入
+
+        Returns:
+            账目（call_id 用于之后的压缩归因）
+        """
+        sent = tokens if sent_tokens is None else sent_tokens
+        entry = LedgerEntry(
+            call_id=self._next_call_id,
+            tool=tool or "unknown",
+            args_hash=hash_tool_args(args),
+            raw_tokens=tokens,
+            tokens=sent,
+            turn=turn,
+            timestamp=time.time(),
+        )
+        self._next_call_id += 1
+        self._ledger[entry.call_id] = entry
+        self.track("tool_results", sent)
+        self._append_ledger_event({"event": "call", **entry.to_dict()})
+        return entry
+
+    def record_compaction(self, call_id: int, tokens: int, log_file: str = "") -> int:
+        """记录某次工具输出被压缩后的 Token 数，并修正 tool_results
+
+        Returns:
+            节省的 Token 数（未知 call_id 返回 0）
+        """
+        entry = self._ledger.get(call_id)
+        if entry is None:
+            return 0
+        saved = entry.tokens - tokens
+        if saved >= 0:
+            self.deduct("tool_results", saved)
+        else:
+            self.track("tool_results", -saved)
+        entry.tokens = tokens
+        entry.compacted = True
+        entry.log_file = log_file or entry.log_file
+        self._append_ledger_event({"event": "compact", "call_id": call_id,
+                                   "tokens": tokens, "log_file": entry.log_file})
+        return saved
+
+    def ledger(self, sort_by: Optional[str] = None, top: Optional[int] = None,
+               compacted: Optional[bool] = None) -> List[LedgerEntry]:
+        """查询账本
+
+        Args:
+            sort_by: 排序字段（"tokens" / "raw_tokens" / "saved_tokens"，降序）；None 按调用顺序
+            top: 只返回前 N 条
+            compacted: 只返回已压缩（True）/ 未压缩（False）的账目
+        """
+        entries = list(self._ledger.values())
+        if compacted is not None:
+            entries = [e for e in entries if e.compacted == compacted]
+        if sort_by:
+            entries.sort(key=lambda e: getattr(e, sort_by), reverse=True)
+        return entries[:top] if top else entries
+
+    def ledger_entry(self, call_id: int) -> Optional[LedgerEntry]:
+        return self._ledger.get(call_id)
+
+    def _append_ledger_event(self, event: Dict) -> None:
+        if self._ledger_path is None:
+            return
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        if self._ledger_writer is not None:
+            self._ledger_writer.append(self._ledger_path, line)
+            return
+        try:
+            with open(self._ledger_path, "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError as e:
+            logger.warning("Failed to write token ledger: %s", e)
+
     # ──── 状态查询 ────
 
     @property
-    def used(self) -> int:
-        """已使用 Token 总量"""
+    def estimated_used(self) -> int:
+        """已使用 Token 总量（未校正的估算值）"""
         return self._system_prompt + self._memory + self._history + self._tool_results
 
+    @property
+    def used(self) -> int:
+        """已使用 Token 总量（按校正系数换算）"""
+        return self._scaled(self.estimated_used)
+
     @property
     def utilization(self) -> float:
         """上下文利用率 (0.0 ~ 1.0)"""
@@ -176,10 +352,10 @@ class TokenBudget:
     def snapshot(self) -> BudgetUsage:
         """获取当前预算使用快照"""
         return BudgetUsage(
-            system_prompt=self._system_prompt,
-            memory=self._memory,
-            history=self._history,
-            tool_results=self._tool_results,
+            system_prompt=self._scaled(self._system_prompt),
+            memory=self._scaled(self._memory),
+            history=self._scaled(self._history),
+            tool_results=self._scaled(self._tool_results),
             total_used=self.used,
             context_window=self.context_window,
         )
@@ -231,9 +407,9 @@ class TokenBudget:
         """预估的消息是否能放入预算
 
         Args:
-            estimated_tokens: 预估的新增 Token 数
+            estimated_tokens: 预估的新增 Token 数（估算值，按校正系数换算）
         """
-        return (self.used + estimated_tokens) < (self.context_window * self.hard_limit)
+        return (self.used + self._scaled(estimated_tokens)) < (self.context_window * self.hard_limit)
 
     def recommend_action(self) -> str:
         """根据当前利用率推荐操作
@@ -265,34 +441,32 @@ class TokenBudget:
             f"  SP={snap.system_prompt:,}  MEM={snap.memory:,}  "
             f"HIST={snap.history:,}  TOOL={snap.tool_results:,}  "
             f"AVAIL={snap.available:,}"
+            + (f"  SCALE={self.token_scale:.2f}" if self.token_scale != 1.0 else "")
         )
 
 
-def estimate_tokens(text: str) -> int:
-    """简单的 Token 估算
-
-    规则：
-    - 英文：约 4 字符/token
-    - 中文：约 2 字符/token
-    - 混合：按中文字符比例加权
-
-    Args:
-        text: 待估算文本
-
-    Returns:
-        估算的 Token 数
-    """
-    if not text:
-        return 0
-
-    # 统计中文字符数
-    chinese_chars = sum(1 for c in text if '\u4e00' <= c <= '\u9fff')
-    total_chars = len(text)
-    non_chinese = total_chars - chinese_chars
-
-    # 中文按 2 字符/token，其他按 4 字符/token
-    estimated = (chinese_chars / 2) + (non_chinese / 4)
-    return max(1, int(estimated))
+def load_ledger(path: str) -> List[LedgerEntry]:
+    """从 JSONL 事件流重放账本（用于 adds budget report）"""
+    entries: Dict[int, LedgerEntry] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                event = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if event.get("event") == "call":
+                fields = {k: v for k, v in event.items() if k in LedgerEntry.__dataclass_fields__}
+                entry = LedgerEntry(**fields)
+                entries[entry.call_id] = entry
+            elif event.get("event") == "compact" and event.get("call_id") in entries:
+                entry = entries[event["call_id"]]
+                entry.tokens = event.get("tokens", entry.tokens)
+                entry.compacted = True
+                entry.log_file = event.get("log_file", entry.log_file)
+    return list(entries.values())
 
 
 def load_budget_config(project_root: str) -> Dict:
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+ADDS Tool Dedup — 上下文级的工具结果去重
+
+Agent 经常重复读取同一文件、重复执行 `git status`，每次结果都完整追加到
+上下文并重复计入 Token 预算。本模块在结果进入 MessageStore 前做去重：
+
+- 内容完全相同（任意工具 / 参数）→ 替换为「与第 N 轮 xxx 的结果相同」的短占位
+- 同一调用（工具 + 参数相同）的结果发生变化（如文件被修改后重新 read）
+  → 发送相对上次完整输出的 unified diff（diff 不够短时仍发送完整结果）
+- 被引用的上一次完整输出必须仍原样留在上下文中（未被 Layer1 压缩 / 清空），
+  否则照常发送完整结果并以它作为新的基准
+
+去重只影响发给模型的上下文；.ses / blob 中仍记录完整输出。
+
+使用方式：
+    dedup = ToolResultDeduper(config)
+    content, hit = dedup.check("read", args, result, turn=3, messages=store)
+    entry = store.append({"role": "tool_result", "content": content})
+    dedup.record("read", args, result, content, turn=3, entry=entry, hit=hit)
+"""
+
+import difflib
+import hashlib
+import json
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from token_budget import estimate_tokens, hash_tool_args
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_DEDUP_CONFIG = {
+    "dedup_results": True,          # 是否对工具结果做上下文级去重
+    "dedup_min_chars": 200,         # 短于此长度的结果不去重（占位本身就有几十字符）
+    "dedup_diff_tools": ["read"],   # 结果变化时发送 diff 的工具
+    "dedup_diff_ratio": 0.5,        # diff 长度不超过完整结果的该比例时才发送 diff
+}
+
+# 占位中显示的参数摘要长度
+_ARGS_PREVIEW_CHARS = 80
+
+
+@dataclass
+class _Seen:
+    """一次完整发送给模型的工具结果"""
+    tool: str
+    args_preview: str
+    turn: int
+    text: str
+    entry: Any                  # 该结果在 MessageStore 中的条目（用于确认仍在上下文中）
+
+
+@dataclass
+class DedupHit:
+    """一次去重结果"""
+    kind: str                   # "unchanged" | "diff"
+    turn: int                   # 被引用的结果所在轮次
+    raw_chars: int
+    sent_chars: int
+
+
+class ToolResultDeduper:
+    """工具结果去重器（每个 AgentCore 一个，随对话历史一起清空）"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        cfg = dict(DEFAULT_DEDUP_CONFIG, **(config or {}))
+        self.enabled = bool(cfg["dedup_results"])
+        self.min_chars = int(cfg["dedup_min_chars"])
+        self.diff_tools = {t.lower() for t in cfg["dedup_diff_tools"]}
+        self.diff_ratio = float(cfg["dedup_diff_ratio"])
+        # 内容哈希 → 最近一次完整发送
+        self._by_content: Dict[str, _Seen] = {}
+        # (工具, 参数哈希) → 作为 diff 基准的完整发送
+        self._by_call: Dict[Tuple[str, str], _Seen] = {}
+        self.stats = {"unchanged": 0, "diffs": 0, "saved_tokens": 0}
+
+    def check(self, tool: str, args: Any, result: str, turn: int,
+              messages: Iterable[Any]) -> Tuple[str, Optional[DedupHit]]:
+        """计算发送给模型的内容
+
+        Args:
+            tool: 工具名
+            args: 工具参数
+            result: 完整结果
+            turn: 当前对话轮次
+            messages: 当前上下文（MessageStore），用于确认被引用的结果仍在其中
+
+        Returns:
+            (发送内容, 去重信息；未去重时为 None)
+        """
+        if not self.enabled or len(result) < self.min_chars:
+            return result, None
+        live = None
+
+        seen = self._by_content.get(_digest(result))
+        if seen is not None:
+            live = {id(m) for m in messages}
+            if id(seen.entry) in live and seen.text == result:
+                stub = (f"⟳ 结果与第 {seen.turn} 轮 {seen.tool}({seen.args_preview}) 相同，"
+                        f"内容未变化（省略 {len(result)} 字符）")
+                return stub, DedupHit("unchanged", seen.turn, len(result), len(stub))
+
+        base = self._by_call.get(_call_key(tool, args))
+        if base is None or tool.lower() not in self.diff_tools:
+            return result, None
+        if live is None:
+            live = {id(m) for m in messages}
+        if id(base.entry) not in live:
+            return result, None
+        diff = "\n".join(difflib.unified_diff(
+            base.text.splitlines(), result.splitlines(),
+            fromfile=f"第 {base.turn} 轮", tofile="当前", lineterm="", n=2))
+        header = f"Δ 与第 {base.turn} 轮 {base.tool}({base.args_preview}) 的结果相比有变化，以下为 unified diff：\n"
+        if not diff or len(header) + len(diff) > len(result) * self.diff_ratio:
+            return result, None
+        content = header + diff
+        return content, DedupHit("diff", base.turn, len(result), len(content))
+
+    def record(self, tool: str, args: Any, result: str, sent: str, turn: int,
+               entry: Any, hit: Optional[DedupHit] = None) -> None:
+        """记录已加入上下文的结果（check 之后、append 到 MessageStore 之后调用）
+
+        Args:
+            result: 完整结果
+            sent: 实际发送的内容（check 的返回值）
+            entry: MessageStore 中的条目
+            hit: check 返回的去重信息
+        """
+        if not self.enabled or len(result) < self.min_chars:
+            return
+        if hit is not None:
+            self.stats["unchanged" if hit.kind == "unchanged" else "diffs"] += 1
+            self.stats["saved_tokens"] += estimate_tokens(result) - estimate_tokens(sent)
+            logger.debug("Tool result dedup | %s | %s since turn %d | %d → %d chars",
+                         tool, hit.kind, hit.turn, hit.raw_chars, hit.sent_chars)
+            # 占位 / diff 都不作为之后的引用对象：引用始终指向一次完整发送，
+            # 只需确认这一条仍在上下文中
+            return
+        seen = _Seen(tool=tool, args_preview=_args_preview(args), turn=turn,
+                     text=result, entry=entry)
+        self._by_content[_digest(result)] = seen
+        self._by_call[_call_key(tool, args)] = seen
+
+    def clear(self) -> None:
+        """对话历史清空 / 开始新 session 时调用"""
+        self._by_content.clear()
+        self._by_call.clear()
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+def _call_key(tool: str, args: Any) -> Tuple[str, str]:
+    return (tool or "").lower(), hash_tool_args(args)
+
+
+def _args_preview(args: Any) -> str:
+    try:
+        text = json.dumps(args, ensure_ascii=False, sort_keys=True, default=str)
+    except (TypeError, ValueError):
+        text = repr(args)
+    text = text.strip("{}")
+    if len(text) > _ARGS_PREVIEW_CHARS:
+        text = text[:_ARGS_PREVIEW_CHARS] + "…"
+    return text
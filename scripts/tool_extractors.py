@@ -0,0 +1,658 @@
+#!/usr/bin/env python3
+"""
+ADDS Tool Extractors — 常见工具输出的结构化提取（按 Token 预算）
+
+apply_tool_filter 只把输出压成一行（"文件内容: N 行"、前 200 字符、pytest 计数），
+失败细节随之丢失；而含错误信号的输出（KEEP_FULL）又只能整段保留。
+提取器按输出类型保留有用的部分，并控制在调用方给定的 Token 预算内：
+
+- pytest / unittest：统计行 + 失败用例列表 + 前 N 个失败块（断言行、E 行、定位行）
+- 编译器 / linter 诊断：错误优先，相同诊断合并计数，附源码 / 插入符上下文
+- git diff：文件增删统计 + 变更行（不含上下文行）
+- git status：分支信息 + 已暂存 / 未暂存 / 未跟踪文件
+- Python traceback：连续重复的栈帧折叠，过深的栈只保留首尾，相同 traceback 合并
+
+提取器可插拔（ExtractorRegistry.register），按注册顺序取第一个 detect 命中的；
+都不命中时回退为 apply_tool_filter 的一行摘要。
+
+使用方式：
+    registry = default_extractors()
+    extraction = registry.extract(output, tool_name="shell", budget_tokens=400)
+    extraction.text           # 摘要（不超过预算）
+    extraction.extractor      # "pytest" / "diagnostics" / ... / "summary"
+"""
+
+import logging
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from summary_decision_engine import ContentFeatures, analyze_content, apply_tool_filter
+from token_budget import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_EXTRACT_BUDGET = 400      # 默认预算（Token）
+MAX_FAILURE_BLOCKS = 10           # 最多保留的失败 / 诊断 / traceback 块数
+MAX_TRACEBACK_FRAMES = 8          # 单个 traceback 保留的栈帧数（首 2 + 尾 N-2）
+MAX_CONTEXT_LINES = 3             # 诊断行之后保留的上下文行数
+
+
+@dataclass
+class Extraction:
+    """一次提取的结果"""
+    text: str
+    extractor: str
+    tokens: int
+    complete: bool = True         # False 表示因预算省略了部分内容
+
+
+# ═══════════════════════════════════════════════════════════
+# 预算装配
+# ═══════════════════════════════════════════════════════════
+
+def trim_lines(text: str, budget_tokens: int) -> str:
+    """按预算截取文本的头尾行（中间以省略行代替）"""
+    if estimate_tokens(text) <= budget_tokens:
+        return text
+    lines = text.split("\n")
+    head: List[str] = []
+    tail: List[str] = []
+    used = estimate_tokens("… 省略 0000 行")
+    i, j = 0, len(lines) - 1
+    while i <= j:
+        take_head = len(head) <= len(tail) * 2      # 头部约占 2/3
+        line = lines[i] if take_head else lines[j]
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget_tokens:
+            break
+        used += cost
+        if take_head:
+            head.append(line)
+            i += 1
+        else:
+            tail.append(line)
+            j -= 1
+    if not head:
+        # 单行就超出预算：按字符截断
+        return lines[0][:max(0, budget_tokens * 2)] + "…"
+    omitted = j - i + 1
+    return "\n".join(head + [f"… 省略 {omitted} 行"] + tail[::-1])
+
+
+def fit_blocks(header: List[str], blocks: List[str], budget_tokens: int,
+               unit: str = "项") -> Tuple[str, bool]:
+    """按顺序装入头部与各块，超出预算的块整体省略
+
+    Args:
+        header: 始终保留的头部行（自身超出预算时截断）
+        blocks: 按重要性排列的块
+        budget_tokens: 预算
+        unit: 省略提示中的量词
+
+    Returns:
+        (文本, 是否完整)
+    """
+    text = "\n".join(header)
+    if estimate_tokens(text) > budget_tokens:
+        return trim_lines(text, budget_tokens), False
+    parts = list(header)
+    used = estimate_tokens(text)
+    # 预留省略提示的位置
+    reserve = estimate_tokens(f"… 另有 {len(blocks)} {unit}未显示") + 1
+    kept = 0
+    complete = True
+    for block in blocks:
+        cost = estimate_tokens(block) + 1
+        last = kept == len(blocks) - 1
+        if used + cost <= budget_tokens - (0 if last else reserve):
+            parts.append(block)
+            used += cost
+            kept += 1
+            continue
+        if kept == 0:
+            # 第一块也放不下：截取其头尾
+            parts.append(trim_lines(block, budget_tokens - used - reserve))
+            kept = 1
+            complete = False
+        break
+    omitted = len(blocks) - kept
+    if omitted:
+        parts.append(f"… 另有 {omitted} {unit}未显示")
+        complete = False
+    return "\n".join(parts), complete
+
+
+# ═══════════════════════════════════════════════════════════
+# 提取器
+# ═══════════════════════════════════════════════════════════
+
+class Extractor:
+    """提取器接口
+
+    name 标识提取器；keeps_errors 表示输出保留失败 / 错误细节，
+    含错误信号（KEEP_FULL）的内容只交给这类提取器压缩。
+    """
+    name = "base"
+    keeps_errors = False
+
+    def detect(self, content: str, tool_name: str, features: ContentFeatures) -> bool:
+        raise NotImplementedError
+
+    def extract(self, content: str, budget_tokens: int) -> Tuple[str, bool]:
+        """返回 (摘要, 是否完整)"""
+        raise NotImplementedError
+
+
+# ──── Python traceback ────
+
+_TRACEBACK_HEAD = "Traceback (most recent call last):"
+_FRAME_LINE = re.compile(r'^\s*File "[^"]+", line \d+')
+_CHAIN_LINES = ("During handling of the above exception",
+                "The above exception was the direct cause")
+
+
+def split_tracebacks(lines: List[str]) -> List[List[str]]:
+    """找出所有 traceback 块（头行 + 栈帧 + 异常行）"""
+    blocks = []
+    i = 0
+    while i < len(lines):
+        if _TRACEBACK_HEAD not in lines[i]:
+            i += 1
+            continue
+        # pytest 等会给每行加相同前缀（如 "E   "），以头行的前缀为准
+        prefix = lines[i][:lines[i].index(_TRACEBACK_HEAD)]
+        block = [lines[i]]
+        i += 1
+        while i < len(lines):
+            body = lines[i][len(prefix):] if lines[i].startswith(prefix) else lines[i]
+            if body[:1].isspace() or body.startswith("[Previous line repeated"):
+                block.append(lines[i])
+                i += 1
+                continue
+            break
+        # 异常行（可能多行），到空行 / 下一个 traceback 为止
+        for _ in range(5):
+            if i >= len(lines) or not lines[i].strip() or _TRACEBACK_HEAD in lines[i] \
+                    or any(marker in lines[i] for marker in _CHAIN_LINES):
+                break
+            block.append(lines[i])
+            i += 1
+        blocks.append(block)
+    return blocks
+
+
+def condense_traceback(block: List[str], max_frames: int = MAX_TRACEBACK_FRAMES) -> List[str]:
+    """折叠连续重复的栈帧；栈过深时只保留首 2 帧与最后若干帧"""
+    head, rest = block[:1], block[1:]
+    frames: List[List[str]] = []
+    tail: List[str] = []
+    for line in rest:
+        if _FRAME_LINE.match(line) or (frames and line.strip().startswith("[Previous line repeated")):
+            frames.append([line])
+        elif frames and line[:1].isspace() and not tail:
+            frames[-1].append(line)
+        else:
+            tail.append(line)
+
+    collapsed: List[List[str]] = []
+    repeats: List[int] = []
+    for frame in frames:
+        if collapsed and frame == collapsed[-1]:
+            repeats[-1] += 1
+        else:
+            collapsed.append(frame)
+            repeats.append(0)
+
+    out_frames: List[List[str]] = []
+    for frame, count in zip(collapsed, repeats):
+        out_frames.append(frame + ([f"    [上一帧重复 {count} 次]"] if count else []))
+    if len(out_frames) > max_frames:
+        keep_tail = max(1, max_frames - 2)
+        omitted = len(out_frames) - 2 - keep_tail
+        out_frames = out_frames[:2] + [[f"    … 省略 {omitted} 帧"]] + out_frames[-keep_tail:]
+    return head + [line for frame in out_frames for line in frame] + tail
+
+
+def _dedupe_blocks(blocks: Iterable[List[str]]) -> List[str]:
+    """相同的块合并，标注出现次数（保持首次出现的顺序）"""
+    counts: "OrderedDict[str, int]" = OrderedDict()
+    for block in blocks:
+        text = "\n".join(block)
+        counts[text] = counts.get(text, 0) + 1
+    return [text if n == 1 else f"{text}\n（相同内容共出现 {n} 次）" for text, n in counts.items()]
+
+
+class TracebackExtractor(Extractor):
+    """Python traceback：折叠重复栈帧，相同 traceback 合并"""
+    name = "traceback"
+    keeps_errors = True
+
+    def detect(self, content, tool_name, features):
+        return _TRACEBACK_HEAD in content
+
+    def extract(self, content, budget_tokens):
+        blocks = split_tracebacks(content.split("\n"))
+        condensed = _dedupe_blocks(condense_traceback(b) for b in blocks)
+        # 最后一个 traceback 通常是最终抛出的异常，优先保留
+        ordered = condensed[-1:] + condensed[:-1][:MAX_FAILURE_BLOCKS - 1]
+        header = [f"Python traceback: {len(blocks)} 个（{len(condensed)} 种）"]
+        text, complete = fit_blocks(header, ordered, budget_tokens, unit="个 traceback ")
+        return text, complete and len(condensed) <= MAX_FAILURE_BLOCKS
+
+
+# ──── pytest / unittest ────
+
+_PYTEST_SECTION = re.compile(r"^=+ (.+?) =+$")
+_PYTEST_FAILURE_SECTION = re.compile(r"^=+ (FAILURES|ERRORS|short test summary info) =+$", re.MULTILINE)
+_PYTEST_BLOCK_TITLE = re.compile(r"^_{3,} (.+?) _{3,}$")
+_PYTEST_LOCATION = re.compile(r"^[^\s:]+:\d+: \w")
+_UNITTEST_BLOCK_TITLE = re.compile(r"^(FAIL|ERROR): (\S+) \((.+)\)")
+_UNITTEST_RAN = re.compile(r"^Ran \d+ tests? in [\d.]+s", re.MULTILINE)
+_UNITTEST_RESULT = re.compile(r"^(OK|FAILED)\b.*$", re.MULTILINE)
+_SEPARATOR = re.compile(r"^(={20,}|-{20,})$")
+
+
+def _condense_pytest_block(lines: List[str]) -> List[str]:
+    """失败块只保留断言源码行（> 及其前 2 行）、E 行与定位行"""
+    keep = set()
+    for i, line in enumerate(lines):
+        if line.startswith(">"):
+            keep.update(range(max(0, i - 2), i + 1))
+        elif line.startswith("E ") or _PYTEST_LOCATION.match(line):
+            keep.add(i)
+    if not keep:
+        return lines[:15]
+    out: List[str] = []
+    prev = -1
+    for i in sorted(keep):
+        if prev >= 0 and i > prev + 1:
+            out.append("    …")
+        if not (out and out[-1] == lines[i] and lines[i].startswith("E ")):
+            out.append(lines[i])
+        prev = i
+    return out
+
+
+class TestOutputExtractor(Extractor):
+    """pytest / unittest 输出：统计 + 失败列表 + 前 N 个失败块"""
+    name = "pytest"
+    keeps_errors = True
+
+    def detect(self, content, tool_name, features):
+        if _UNITTEST_RAN.search(content):
+            return True
+        return features.pytest_counts is not None or bool(_PYTEST_FAILURE_SECTION.search(content))
+
+    def extract(self, content, budget_tokens):
+        lines = content.split("\n")
+        if _UNITTEST_RAN.search(content) and "short test summary info" not in content:
+            header, blocks = self._unittest(content, lines)
+        else:
+            header, blocks = self._pytest(content, lines)
+        text, complete = fit_blocks(header, blocks[:MAX_FAILURE_BLOCKS], budget_tokens,
+                                    unit="个失败块")
+        return text, complete and len(blocks) <= MAX_FAILURE_BLOCKS
+
+    @staticmethod
+    def _pytest(content: str, lines: List[str]) -> Tuple[List[str], List[str]]:
+        summary = ""
+        failed: List[str] = []
+        blocks: List[List[str]] = []
+        section = ""
+        current: Optional[List[str]] = None
+        for line in lines:
+            match = _PYTEST_SECTION.match(line)
+            if match:
+                section = match.group(1).strip()
+                if re.search(r"\d+ (passed|failed|errors?)\b", section):
+                    summary = section
+                current = None
+                continue
+            if section in ("FAILURES", "ERRORS"):
+                title = _PYTEST_BLOCK_TITLE.match(line)
+                if title:
+                    current = [f"▸ {title.group(1)}"]
+                    blocks.append(current)
+                elif current is not None:
+                    current.append(line)
+            elif section == "short test summary info" and line.startswith(("FAILED", "ERROR")):
+                failed.append(line)
+
+        if not summary:
+            features = analyze_content(content)
+            if features.pytest_counts:
+                passed, n_failed, warnings, duration = features.pytest_counts
+                summary = f"{passed} passed, {n_failed} failed, {warnings} warnings {duration}".strip()
+        header = [f"pytest: {summary}" if summary else "pytest 输出"]
+        header.extend(failed[:20])
+        if len(failed) > 20:
+            header.append(f"… 另有 {len(failed) - 20} 个失败用例")
+
+        condensed = []
+        seen: Dict[str, str] = {}
+        for block in blocks:
+            body = "\n".join(_condense_pytest_block(block[1:]))
+            if body in seen:
+                # 参数化用例常见：失败详情相同，只列标题
+                condensed.append(f"{block[0]}（失败详情同 {seen[body]}）")
+            else:
+                seen[body] = block[0][2:]
+                condensed.append(f"{block[0]}\n{body}")
+        return header, condensed
+
+    @staticmethod
+    def _unittest(content: str, lines: List[str]) -> Tuple[List[str], List[str]]:
+        ran = _UNITTEST_RAN.search(content)
+        result = _UNITTEST_RESULT.search(content)
+        header = [f"unittest: {ran.group(0)}" + (f" — {result.group(0)}" if result else "")]
+
+        blocks: List[List[str]] = []
+        current: Optional[List[str]] = None
+        for line in lines:
+            title = _UNITTEST_BLOCK_TITLE.match(line)
+            if title:
+                current = [f"▸ {title.group(1)}: {title.group(2)} ({title.group(3)})"]
+                blocks.append(current)
+                header.append(line)
+            elif current is not None:
+                if _SEPARATOR.match(line):
+                    if len(current) > 1:
+                        current = None
+                    continue
+                if _UNITTEST_RAN.match(line):
+                    current = None
+                    continue
+                current.append(line)
+
+        condensed = []
+        for block in blocks:
+            body = block[1:]
+            tracebacks = split_tracebacks(body)
+            if tracebacks:
+                body = [line for tb in tracebacks for line in condense_traceback(tb)]
+            condensed.append([block[0]] + [line for line in body if line.strip()])
+        return header, _dedupe_blocks(condensed)
+
+
+# ──── 编译器 / linter 诊断 ────
+
+_DIAGNOSTIC_LINE = re.compile(
+    r"^(?P<loc>[^\s:()][^:()\n]*?(?::\d+){1,2}|[^\s()][^()\n]*?\(\d+,\d+\)):\s*"
+    r"(?:(?P<sev>fatal error|error|warning|note)(?:\[[\w-]+\])?(?::\s*|\s+(?=[A-Z]+\d+:))"
+    r"|(?P<code>[A-Z]{1,4}\d{2,5}):?\s+)"
+    r"(?P<msg>.+)$"
+)
+_RUST_HEADER = re.compile(r"^(?P<sev>error|warning)(?:\[(?P<code>\w+)\])?: (?P<msg>.+)$")
+_RUST_LOCATION = re.compile(r"^\s*--> (?P<loc>\S+)")
+_SEVERITY_ORDER = {"error": 0, "warning": 1, "note": 2}
+
+
+@dataclass
+class _Diagnostic:
+    severity: str
+    message: str
+    locations: List[str]
+    context: List[str]
+
+
+def _severity(sev: Optional[str], code: Optional[str]) -> str:
+    if sev:
+        return "error" if "error" in sev else sev
+    # flake8 / ruff / pylint 代码：E/F 为错误，其余（W/C/R/...）为警告
+    return "error" if code and code[0] in "EF" else "warning"
+
+
+def parse_diagnostics(lines: List[str]) -> List[_Diagnostic]:
+    """解析诊断行，相同的诊断（严重级别 + 信息）合并"""
+    merged: "OrderedDict[Tuple[str, str], _Diagnostic]" = OrderedDict()
+    current: Optional[_Diagnostic] = None
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        match = _DIAGNOSTIC_LINE.match(line)
+        rust = None if match else _RUST_HEADER.match(line)
+        if match:
+            code = match.group("code")
+            message = f"{code} {match.group('msg')}" if code else match.group("msg")
+            severity, location = _severity(match.group("sev"), code), match.group("loc")
+        elif rust and i + 1 < len(lines) and _RUST_LOCATION.match(lines[i + 1]):
+            code = rust.group("code")
+            message = f"[{code}] {rust.group('msg')}" if code else rust.group("msg")
+            severity, location = rust.group("sev"), _RUST_LOCATION.match(lines[i + 1]).group("loc")
+            i += 1
+        else:
+            # 诊断行之后的缩进 / 插入符行作为上下文
+            if current is not None and line.strip() and (line[:1].isspace() or "^" in line) \
+                    and len(current.context) < MAX_CONTEXT_LINES:
+                current.context.append(line)
+            else:
+                current = None
+            i += 1
+            continue
+        key = (severity, message.strip())
+        diag = merged.get(key)
+        if diag is None:
+            diag = merged[key] = _Diagnostic(severity, message.strip(), [], [])
+            current = diag
+        else:
+            current = None
+        diag.locations.append(location)
+        i += 1
+    return list(merged.values())
+
+
+class DiagnosticsExtractor(Extractor):
+    """编译器 / 类型检查 / linter 诊断（gcc/clang、mypy、tsc、rustc、flake8/ruff/pylint）"""
+    name = "diagnostics"
+    keeps_errors = True
+
+    def detect(self, content, tool_name, features):
+        if tool_name and tool_name.lower() in ("grep", "rg", "read", "read_file"):
+            return False     # 搜索结果 / 文件内容中的 "path:line: error:" 不是诊断
+        for line in content.split("\n", 200)[:200]:
+            if _DIAGNOSTIC_LINE.match(line) or _RUST_HEADER.match(line):
+                return True
+        return False
+
+    def extract(self, content, budget_tokens):
+        diagnostics = parse_diagnostics(content.split("\n"))
+        diagnostics.sort(key=lambda d: _SEVERITY_ORDER.get(d.severity, 3))
+        counts: Dict[str, int] = {}
+        files = set()
+        for d in diagnostics:
+            counts[d.severity] = counts.get(d.severity, 0) + len(d.locations)
+            files.update(loc.split(":")[0].split("(")[0] for loc in d.locations)
+        header = ["诊断: " + ", ".join(f"{n} {sev}" for sev, n in sorted(
+            counts.items(), key=lambda kv: _SEVERITY_ORDER.get(kv[0], 3))) + f"（{len(files)} 个文件）"]
+        blocks = []
+        for d in diagnostics[:MAX_FAILURE_BLOCKS]:
+            first = f"{d.locations[0]}: {d.severity}: {d.message}"
+            if len(d.locations) > 1:
+                more = ", ".join(d.locations[1:4]) + (" …" if len(d.locations) > 4 else "")
+                first += f"（×{len(d.locations)}，另见 {more}）"
+            blocks.append("\n".join([first] + d.context))
+        text, complete = fit_blocks(header, blocks, budget_tokens, unit="条诊断")
+        return text, complete and len(diagnostics) <= MAX_FAILURE_BLOCKS
+
+
+# ──── git diff / status ────
+
+_DIFF_FILE = re.compile(r"^diff --git a/(.+?) b/(.+)$")
+_STATUS_HEADINGS = {
+    "Changes to be committed:": "已暂存",
+    "Changes not staged for commit:": "未暂存",
+    "Untracked files:": "未跟踪",
+    "Unmerged paths:": "冲突",
+}
+_STATUS_ENTRY = re.compile(r"^\t(?:(?P<status>[a-z ]+):\s+)?(?P<path>.+)$")
+_PORCELAIN_ENTRY = re.compile(r"^[ MADRCUT?!]{2} \S")
+
+
+class GitDiffExtractor(Extractor):
+    """git diff：文件增删统计 + 变更行"""
+    name = "git_diff"
+
+    def detect(self, content, tool_name, features):
+        return content.startswith("diff --git ") or "\ndiff --git " in content
+
+    def extract(self, content, budget_tokens):
+        files: List[Tuple[str, int, int, List[str]]] = []
+        path, added, removed, changes = None, 0, 0, []
+        for line in content.split("\n"):
+            match = _DIFF_FILE.match(line)
+            if match:
+                if path is not None:
+                    files.append((path, added, removed, changes))
+                path, added, removed, changes = match.group(2), 0, 0, []
+            elif path is None:
+                continue
+            elif line.startswith("@@"):
+                changes.append(line)
+            elif line.startswith("+") and not line.startswith("+++"):
+                added += 1
+                changes.append(line)
+            elif line.startswith("-") and not line.startswith("---"):
+                removed += 1
+                changes.append(line)
+        if path is not None:
+            files.append((path, added, removed, changes))
+
+        header = [f"git diff: {len(files)} 个文件, +{sum(f[1] for f in files)} "
+                  f"-{sum(f[2] for f in files)}"]
+        header.extend(f"  {p} (+{a} -{r})" for p, a, r, _ in files[:30])
+        if len(files) > 30:
+            header.append(f"  … 另有 {len(files) - 30} 个文件")
+        blocks = [f"▸ {p}\n" + "\n".join(c) for p, _, _, c in files if c]
+        return fit_blocks(header, blocks, budget_tokens, unit="个文件的变更")
+
+
+class GitStatusExtractor(Extractor):
+    """git status（长格式 / porcelain）：分支信息 + 各类文件"""
+    name = "git_status"
+
+    def detect(self, content, tool_name, features):
+        if content.startswith("On branch ") or any(h in content for h in _STATUS_HEADINGS):
+            return True
+        lines = [line for line in content.split("\n") if line.strip()]
+        return bool(lines) and all(_PORCELAIN_ENTRY.match(line) for line in lines[:50])
+
+    def extract(self, content, budget_tokens):
+        header: List[str] = []
+        groups: "OrderedDict[str, List[str]]" = OrderedDict()
+        group = None
+        for line in content.split("\n"):
+            if line.startswith(("On branch ", "Your branch ", "HEAD detached")):
+                header.append(line)
+            elif line in _STATUS_HEADINGS:
+                group = _STATUS_HEADINGS[line]
+                groups.setdefault(group, [])
+            elif _PORCELAIN_ENTRY.match(line) and group is None:
+                code = line[:2]
+                name = "未跟踪" if code == "??" else ("已暂存" if code[0] not in " ?!" else "未暂存")
+                groups.setdefault(name, []).append(f"{code.strip()} {line[3:]}")
+            elif group is not None:
+                match = _STATUS_ENTRY.match(line)
+                if match:
+                    status = match.group("status")
+                    groups[group].append(f"{status}: {match.group('path')}" if status
+                                         else match.group("path"))
+        header.append("git status: " + (", ".join(
+            f"{name} {len(entries)}" for name, entries in groups.items()) or "工作区干净"))
+        blocks = [f"[{name}] {entry}" for name, entries in groups.items() for entry in entries]
+        return fit_blocks(header, blocks, budget_tokens, unit="个文件")
+
+
+# ═══════════════════════════════════════════════════════════
+# 注册表
+# ═══════════════════════════════════════════════════════════
+
+BUILTIN_EXTRACTORS: List[Extractor] = [
+    TestOutputExtractor(),
+    GitDiffExtractor(),
+    GitStatusExtractor(),
+    DiagnosticsExtractor(),
+    TracebackExtractor(),
+]
+
+
+class ExtractorRegistry:
+    """提取器注册表（按注册顺序匹配，同名覆盖并保持原位置）"""
+
+    def __init__(self, extractors: Optional[Iterable[Extractor]] = None):
+        self._extractors: "OrderedDict[str, Extractor]" = OrderedDict()
+        for extractor in extractors or ():
+            self.register(extractor)
+
+    def register(self, extractor: Extractor, first: bool = False) -> None:
+        """注册提取器
+
+        Args:
+            extractor: 提取器
+            first: 放在最前（优先于内置提取器匹配）
+        """
+        self._extractors[extractor.name] = extractor
+        if first:
+            self._extractors.move_to_end(extractor.name, last=False)
+
+    def unregister(self, name: str) -> None:
+        self._extractors.pop(name, None)
+
+    def select(self, content: str, tool_name: str = "",
+               errors_only: bool = False) -> Optional[Extractor]:
+        """第一个能处理该输出的提取器"""
+        features = analyze_content(content)
+        for extractor in self._extractors.values():
+            if errors_only and not extractor.keeps_errors:
+                continue
+            try:
+                if extractor.detect(content, tool_name, features):
+                    return extractor
+            except Exception as e:  # 第三方提取器出错不影响压缩流程
+                logger.warning("Extractor %s detect failed: %s", extractor.name, e)
+        return None
+
+    def extract(self, content: str, tool_name: str = "",
+                budget_tokens: int = DEFAULT_EXTRACT_BUDGET,
+                errors_only: bool = False) -> Optional[Extraction]:
+        """提取摘要
+
+        Args:
+            content: 工具输出
+            tool_name: 工具名（辅助判断）
+            budget_tokens: 摘要的 Token 上限
+            errors_only: 只使用保留错误细节的提取器（KEEP_FULL 内容），
+                         都不命中时返回 None
+
+        Returns:
+            Extraction；errors_only 且无提取器命中时为 None
+        """
+        extractor = self.select(content, tool_name, errors_only=errors_only)
+        if extractor is not None:
+            try:
+                text, complete = extractor.extract(content, budget_tokens)
+                if estimate_tokens(text) > budget_tokens:
+                    text, complete = trim_lines(text, budget_tokens), False
+                return Extraction(text, extractor.name, estimate_tokens(text), complete)
+            except Exception as e:
+                logger.warning("Extractor %s failed, falling back: %s", extractor.name, e)
+        if errors_only:
+            return None
+        text = trim_lines(apply_tool_filter(content, tool_name), budget_tokens)
+        return Extraction(text, "summary", estimate_tokens(text), complete=False)
+
+    def names(self) -> List[str]:
+        return list(self._extractors)
+
+    def __iter__(self) -> Iterator[Extractor]:
+        return iter(self._extractors.values())
+
+    def __len__(self) -> int:
+        return len(self._extractors)
+
+
+def default_extractors() -> ExtractorRegistry:
+    """内置提取器注册表"""
+    return ExtractorRegistry(BUILTIN_EXTRACTORS)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+ADDS Tool Registry — 内置工具定义与 JSON Schema
+
+设计目标：
+- 每个工具一份定义：规范名、别名、描述、参数 JSON Schema、是否只读
+- 生成提供方无关的工具定义（Anthropic 形状：name/description/input_schema），
+  由适配器的 format_tools 转为自身格式（如 OpenAI function）
+- 定义列表缓存且顺序固定：每次请求发送相同的工具前缀，便于提供方缓存
+- 别名解析：兼容模型按文本猜测的工具名（read_file、bash 等）
+
+使用方式：
+    registry = default_registry()
+    spec = registry.resolve("read_file")     # → read
+    tools = registry.schemas()               # 传给 model.chat(tools=...)
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ToolSpec:
+    """工具定义"""
+    name: str
+    description: str
+    parameters: Dict[str, Any]          # JSON Schema（type=object）
+    aliases: Tuple[str, ...] = ()
+    readonly: bool = False              # 只读工具可在同一轮内并发执行
+
+    def schema(self) -> Dict[str, Any]:
+        """提供方无关的工具定义"""
+        return {
+            "name": self.name,
+            "description": self.description,
+            "input_schema": self.parameters,
+        }
+
+
+def _object(properties: Dict[str, Any], required: Iterable[str]) -> Dict[str, Any]:
+    return {"type": "object", "properties": properties, "required": list(required)}
+
+
+# ═══════════════════════════════════════════════════════════
+# 内置工具
+# ═══════════════════════════════════════════════════════════
+
+BUILTIN_TOOLS: List[ToolSpec] = [
+    ToolSpec(
+        name="read",
+        description="读取项目中的文本文件，返回带行号的内容。大文件用 offset/limit 分段读取。",
+        parameters=_object({
+            "file_path": {"type": "string", "description": "文件路径（相对项目根目录或绝对路径）"},
+            "offset": {"type": "integer", "description": "起始行号（1 起）", "minimum": 1},
+            "limit": {"type": "integer", "description": "最多读取的行数", "minimum": 1},
+        }, required=["file_path"]),
+        aliases=("read_file",),
+        readonly=True,
+    ),
+    ToolSpec(
+        name="glob",
+        description="按 glob 模式查找文件（如 **/*.py），返回相对路径列表（最多 50 个）。",
+        parameters=_object({
+            "pattern": {"type": "string", "description": "glob 模式"},
+            "path": {"type": "string", "description": "搜索目录（默认项目根目录）"},
+        }, required=["pattern"]),
+        aliases=("search", "search_file", "find"),
+        readonly=True,
+    ),
+    ToolSpec(
+        name="grep",
+        description="按正则表达式（Python re 语法）搜索文件内容，返回 path:line:text 形式的匹配行。",
+        parameters=_object({
+            "pattern": {"type": "string", "description": "正则表达式（Python re 语法，如 \\d、(?i)、前后断言）"},
+            "path": {"type": "string", "description": "搜索目录（默认项目根目录）"},
+            "include": {"type": "string", "description": "只搜索匹配该 glob 的文件（如 *.py）"},
+        }, required=["pattern"]),
+        aliases=("search_content", "rg"),
+        readonly=True,
+    ),
+    ToolSpec(
+        name="write",
+        description="写入文件（覆盖已有内容，自动创建父目录）。",
+        parameters=_object({
+            "file_path": {"type": "string", "description": "文件路径（相对项目根目录或绝对路径）"},
+            "content": {"type": "string", "description": "完整的文件内容"},
+        }, required=["file_path", "content"]),
+        aliases=("write_file",),
+    ),
+    ToolSpec(
+        name="shell",
+        description="在项目根目录执行 shell 命令，返回 stdout（过长时保留头尾）、stderr 与退出码。",
+        parameters=_object({
+            "command": {"type": "string", "description": "要执行的命令"},
+        }, required=["command"]),
+        aliases=("bash", "command", "exec"),
+    ),
+]
+
+
+class ToolRegistry:
+    """工具注册表（规范名 + 别名 → ToolSpec）"""
+
+    def __init__(self, specs: Optional[Iterable[ToolSpec]] = None):
+        self._specs: Dict[str, ToolSpec] = {}
+        self._lookup: Dict[str, ToolSpec] = {}
+        self._schemas: Optional[List[Dict[str, Any]]] = None
+        for spec in specs or ():
+            self.register(spec)
+
+    def register(self, spec: ToolSpec) -> None:
+        """注册工具（同名覆盖）"""
+        old = self._specs.get(spec.name)
+        if old is not None:
+            for key in (old.name, *old.aliases):
+                self._lookup.pop(key.lower(), None)
+        self._specs[spec.name] = spec
+        for key in (spec.name, *spec.aliases):
+            self._lookup[key.lower()] = spec
+        self._schemas = None
+
+    def resolve(self, name: Optional[str]) -> Optional[ToolSpec]:
+        """按名称或别名查找工具（大小写不敏感）"""
+        if not name:
+            return None
+        return self._lookup.get(name.lower().strip())
+
+    def is_readonly(self, name: Optional[str]) -> bool:
+        spec = self.resolve(name)
+        return spec is not None and spec.readonly
+
+    def names(self) -> List[str]:
+        return list(self._specs)
+
+    def schemas(self) -> List[Dict[str, Any]]:
+        """全部工具的定义列表（缓存，调用方不要修改）"""
+        if self._schemas is None:
+            self._schemas = [spec.schema() for spec in self._specs.values()]
+        return self._schemas
+
+    def __contains__(self, name: str) -> bool:
+        return self.resolve(name) is not None
+
+    def __iter__(self) -> Iterator[ToolSpec]:
+        return iter(self._specs.values())
+
+    def __len__(self) -> int:
+        return len(self._specs)
+
+
+def default_registry() -> ToolRegistry:
+    """内置工具注册表"""
+    return ToolRegistry(BUILTIN_TOOLS)
@@ -56,6 +56,7 @@ class ADDSApp(App):
         Binding("ctrl+n", "new_agent", "新建Agent", show=True),
         Binding("ctrl+w", "close_agent", "关闭Agent", show=True),
         Binding("ctrl+tab", "next_tab", "下一个", show=False),
+        Binding("escape", "abort_tools", "中止命令", show=False),
         Binding("ctrl+p", "command_palette", "命令面板", show=True),
         Binding("ctrl+h", "show_help", "帮助", show=True),
         Binding("alt", "focus_menubar", "菜单", show=False),
@@ -143,12 +144,26 @@ class ADDSApp(App):
         self.wm.close_workspace(workspace_id)
         self._update_header()
 
+    async def action_quit(self) -> None:
+        """Ctrl+Q — 等待各 Agent 的后台归档并释放资源后退出"""
+        await self.wm.shutdown()
+        self.exit()
+
     def action_next_tab(self) -> None:
         """Ctrl+Tab — 切换到下一个 Agent"""
         tabs = self.query_one("#tabs", TabbedContent)
         # Textual TabbedContent 内置 tab 切换
         tabs.action_next_tab()
 
+    def action_abort_tools(self) -> None:
+        """Esc — 中止当前 Agent 正在执行的 shell 命令"""
+        active = self.app_state.get_active()
+        if not active:
+            return
+        count = self.wm.abort_tools(active.workspace_id)
+        if count:
+            self.notify(f"已中止 {count} 个运行中的命令", title="中止命令")
+
     def action_toggle_perm(self) -> None:
         """Ctrl+P — 切换权限侧边栏"""
         self.query_one("#perm-sidebar", PermissionSidebar).toggle()
@@ -202,6 +217,7 @@ class ADDSApp(App):
             "  Ctrl+N    新建 Agent\n"
             "  Ctrl+W    关闭 Agent\n"
             "  Ctrl+Tab  切换 Agent\n"
+            "  Esc       中止运行中的命令\n"
             "  Ctrl+S    切换分屏\n"
             "  Ctrl+P    命令面板（搜索所有操作）\n"
             "  Ctrl+Q    退出\n"
@@ -304,7 +320,7 @@ class ADDSApp(App):
         cmd = parts[0].lower()
 
         if cmd in ("/quit", "/exit", "/q"):
-            self.exit()
+            self.run_worker(self.action_quit(), exclusive=False)
 
         elif cmd == "/new":
             role = parts[1] if len(parts) > 1 else "pm"
@@ -413,6 +429,10 @@ class ADDSApp(App):
             """工具调用回调 — 在 UI 显示调用的工具"""
             panel.show_tool_call(tool_name, args)
 
+        def on_tool_output(tool_name: str, chunk: str) -> None:
+            """工具实时输出回调 — 长命令执行时滚动显示输出"""
+            panel.append_tool_output(tool_name, chunk)
+
         def on_status(status: str) -> None:
             """Agent Loop 状态变化回调"""
             panel.update_status(status)
@@ -426,6 +446,7 @@ class ADDSApp(App):
             on_done=on_done,
             on_thinking=on_thinking,
             on_tool_call=on_tool_call,
+            on_tool_output=on_tool_output,
             on_status=on_status,
         )
         self._update_header()
@@ -445,6 +466,7 @@ class ADDSApp(App):
                 def append_stream_chunk(self, *a): pass
                 def append_thinking_chunk(self, *a, **k): pass
                 def show_tool_call(self, *a, **k): pass
+                def append_tool_output(self, *a): pass
                 def update_status(self, *a): pass
                 def end_stream(self, *a): pass
                 def clear_messages(self): pass
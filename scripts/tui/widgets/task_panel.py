@@ -133,6 +133,7 @@ class TaskPanel(Widget):
         self._stream_buffer: List[str] = []
         self._thinking_buffer: List[str] = []
         self._tool_call_shown: bool = False
+        self._tool_output_tail: str = ""
 
     def compose(self) -> ComposeResult:
         yield RichLog(id="message-log", highlight=True, markup=True, wrap=True)
@@ -163,6 +164,7 @@ class TaskPanel(Widget):
         self._stream_buffer = []
         self._thinking_buffer = []
         self._tool_call_shown = False
+        self._tool_output_tail = ""
         self.streaming = True
         # 写入 ASSISTANT 标题行
         log = self.query_one("#message-log", RichLog)
@@ -228,6 +230,20 @@ class TaskPanel(Widget):
         indicator = self.query_one("#streaming-indicator", Static)
         indicator.update(f"🔧 {tool_name}")
 
+    def append_tool_output(self, tool_name: str, chunk: str) -> None:
+        """
+        追加工具实时输出（如 shell 命令的 stdout/stderr）
+
+        按整行写入 RichLog，不完整的行暂存到下一个 chunk 或 end_stream
+        """
+        from rich.text import Text
+        log = self.query_one("#message-log", RichLog)
+        *lines, self._tool_output_tail = (self._tool_output_tail + chunk).split("\n")
+        for line in lines:
+            log.write(Text(f"  │ {line}", style="dim"))
+        indicator = self.query_one("#streaming-indicator", Static)
+        indicator.update(f"⚙️ {tool_name} 输出中… (Esc 中止)")
+
     def append_stream_chunk(self, chunk: str) -> None:
         """追加流式片段 — 缓冲，不逐 chunk 写入 RichLog（避免每 chunk 换行）"""
         self._stream_buffer.append(chunk)
@@ -242,6 +258,11 @@ class TaskPanel(Widget):
         self._stream_buffer = []
         log = self.query_one("#message-log", RichLog)
 
+        if self._tool_output_tail:
+            from rich.text import Text
+            log.write(Text(f"  │ {self._tool_output_tail}", style="dim"))
+            self._tool_output_tail = ""
+
         # 思考摘要（如果有积累的 thinking 内容）
         if self._thinking_buffer:
             full_thinking = "".join(self._thinking_buffer)
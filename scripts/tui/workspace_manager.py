@@ -28,6 +28,7 @@ class WorkspaceManager:
         self.project_root = Path(project_root)
         self._model = None
         self._cores: dict[str, AgentCore] = {}  # workspace_id → AgentCore
+        self._closing: set[asyncio.Task] = set()  # 正在关闭（等待归档）的 AgentCore
 
     def set_model(self, model) -> None:
         """注入共享模型实例"""
@@ -79,22 +80,39 @@ class WorkspaceManager:
         if not ws:
             return False
 
-        # 通过 AgentCore 归档
+        # 通过 AgentCore 归档（事件循环中先等待后台归档，再释放资源）
         core = self._cores.pop(workspace_id, None)
         if core:
-            core.archive_session()
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+            if loop is not None:
+                task = loop.create_task(core.close())
+                self._closing.add(task)
+                task.add_done_callback(self._closing.discard)
+            else:
+                core.archive_session()
+                core.shutdown()
 
         ws.status = WorkspaceStatus.COMPLETED
         ok = self.state.close_workspace(workspace_id)
         logger.info("Workspace closed: %s", workspace_id)
         return ok
 
+    async def shutdown(self) -> None:
+        """退出 TUI：关闭所有工作区的 AgentCore，并等待正在关闭的完成"""
+        cores = list(self._cores.values())
+        self._cores.clear()
+        await asyncio.gather(*(core.close() for core in cores), *self._closing,
+                             return_exceptions=True)
+
     # ── Agent Loop 入口 ─────────────────────────────────
 
     async def send_message(self, workspace_id: str, user_text: str,
                            on_chunk=None, on_done=None,
                            on_thinking=None, on_tool_call=None,
-                           on_status=None) -> Optional[str]:
+                           on_status=None, on_tool_output=None) -> Optional[str]:
         """
         向指定工作区发送消息 — 委托给 AgentCore
         """
@@ -112,6 +130,7 @@ class WorkspaceManager:
             on_done=on_done,
             on_thinking=on_thinking,
             on_tool_call=on_tool_call,
+            on_tool_output=on_tool_output,
             on_status=on_status,
             on_error=lambda msg: (
                 ws.add_message("system", msg) if ws else None,
@@ -133,6 +152,13 @@ class WorkspaceManager:
         finally:
             ws.streaming = False
 
+    def abort_tools(self, workspace_id: str) -> int:
+        """中止工作区内运行中的 shell 命令，返回被中止的命令数"""
+        core = self._cores.get(workspace_id)
+        if not core:
+            return 0
+        return core.abort_tools()
+
     def _make_permission_callback(self, workspace_id: str):
         """创建权限确认回调 — 通知 TUI 显示确认对话框"""
         def _ask_permission(decision: PermissionDecision) -> bool:
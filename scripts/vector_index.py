@@ -0,0 +1,539 @@
+#!/usr/bin/env python3
+"""
+ADDS Vector Index — .mem 文件的本地向量索引（语义检索，无需网络 / GPU）
+
+关键词检索只能命中字面相同的子串；向量索引把 .mem 切成段落并嵌入为定长向量，
+查询按余弦相似度取 top_k，与关键词结果做倒数排名融合（RRF）：
+
+- 嵌入：词项（memory_index.tokenize：英文单词 + CJK 二元组）与英文单词的字符
+  三元组做特征哈希（带符号），次线性词频，L2 归一化；不需要训练，
+  新文件直接追加，不必重新拟合（TF-IDF + SVD 每次追加都要重算全部向量）
+- 存储：float32 矩阵按行追加到 vectors/matrix-<代>.f32，查询时 memmap 按批读取；
+  行号 → 文件 / 段落的 ID 表为 vectors/ids.jsonl（与 memory_index.jsonl 相同的半行容错）
+- 增量：索引建立后 SessionManager.archive_session / MemoryManager 写 .mem 时追加
+  该文件的段落向量；查询前按 mtime/size 校验目录，外部修改的文件重新嵌入，
+  旧行作废，作废行过多时改写为新一代矩阵
+- numpy 为可选依赖：未安装时 VectorMemoryRetriever 回退到关键词检索
+
+ID 表（.ai/sessions/vectors/ids.jsonl）：
+
+    {"version": 1, "dim": 256, "matrix": "matrix-3fa2c1.f32"}
+    {"file": "20260409-153000.mem", "mtime_ns": ..., "size": ..., "row": 0, "spans": "1-4,6-9"}
+    {"drop": "20260401-090000.mem"}
+
+同一文件的新记录整体替换旧记录（旧行作废）。追加与改写在 vectors/lock 上加
+文件锁（fcntl 可用时），多个进程追加时行号不会冲突。
+
+配置（.ai/settings.json 的 memory_vector 节，默认关闭）：
+
+    {"memory_vector": {"enabled": true, "dim": 256, "fusion": true, "rrf_k": 60}}
+
+使用方式：
+    index = VectorIndex(".ai/sessions")
+    index.refresh()                        # 嵌入新增 / 修改的 .mem
+    hits = index.search("登录鉴权方案", top_k=5)   # [(文件名, 起始行, 结束行, 相似度), ...]
+"""
+
+import bisect
+import contextlib
+import json
+import logging
+import math
+import os
+import threading
+import uuid
+import zlib
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from memory_index import MAX_INDEXED_BYTES, tokenize
+from session_writer import write_bytes_atomic
+
+try:
+    import numpy as np  # 可选依赖
+except ImportError:
+    np = None
+
+try:
+    import fcntl  # 仅 POSIX
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+VECTOR_DIRNAME = "vectors"
+TABLE_FILENAME = "ids.jsonl"
+LOCK_FILENAME = "lock"
+INDEX_VERSION = 1
+
+DEFAULT_DIM = 256
+
+# 段落：连续非空行，遇到标题或超过行数 / 字符数上限时切分
+PASSAGE_MAX_LINES = 8
+PASSAGE_MAX_CHARS = 800
+
+# 查询时每批读取的矩阵行数（256 维时约 64MB）
+SEARCH_BATCH_ROWS = 65536
+
+# 作废行超过该值且多于有效行时改写矩阵
+COMPACT_MIN_DEAD_ROWS = 4096
+
+# 英文单词字符三元组的权重（相对整词；让 auth / authentication 这类词形变化也相近）
+TRIGRAM_WEIGHT = 0.25
+
+DEFAULT_VECTOR_CONFIG = {
+    "enabled": False,        # 是否启用向量检索（需安装 numpy）
+    "dim": DEFAULT_DIM,      # 新建索引的向量维数（已有索引以 ID 表头为准）
+    "fusion": True,          # 是否与关键词检索做 RRF 融合
+    "rrf_k": 60,             # RRF 常数：score = Σ 1 / (k + 排名)
+}
+
+Span = Tuple[int, int]
+VectorHit = Tuple[str, int, int, float]
+
+
+def load_vector_config(project_root: str) -> Dict[str, Any]:
+    """从 .ai/settings.json 加载 memory_vector 配置（缺省项用默认值）"""
+    config = dict(DEFAULT_VECTOR_CONFIG)
+    settings_path = Path(project_root) / ".ai" / "settings.json"
+    if settings_path.exists():
+        try:
+            data = json.loads(settings_path.read_text(encoding="utf-8"))
+            config.update(data.get("memory_vector", {}))
+        except (json.JSONDecodeError, OSError) as e:
+            logger.warning("Failed to load memory_vector config: %s", e)
+    return config
+
+
+def available() -> bool:
+    return np is not None
+
+
+# ═══════════════════════════════════════════════════════════
+# 段落切分与嵌入
+# ═══════════════════════════════════════════════════════════
+
+def split_passages(lines: Iterable[str]) -> List[Tuple[int, int, str]]:
+    """把文件行切成段落 [(起始行, 结束行, 文本), ...]（行号从 1 开始，含两端）"""
+    passages = []
+    start, buf, chars = 0, [], 0
+
+    def close():
+        text = "\n".join(buf)
+        if tokenize(text):
+            passages.append((start, start + len(buf) - 1, text))
+
+    for number, line in enumerate(lines, 1):
+        line = line.rstrip("\r\n")
+        stripped = line.strip()
+        if buf and (not stripped or stripped.startswith("#")
+                    or len(buf) >= PASSAGE_MAX_LINES or chars + len(line) > PASSAGE_MAX_CHARS):
+            close()
+            buf, chars = [], 0
+        if stripped:
+            if not buf:
+                start = number
+            buf.append(line)
+            chars += len(line)
+    if buf:
+        close()
+    return passages
+
+
+def _features(text: str) -> Counter:
+    weights: Counter = Counter()
+    for term, count in Counter(tokenize(text)).items():
+        weight = 1.0 + math.log(count)
+        weights[term] += weight
+        if term.isascii() and len(term) > 4:
+            padded = f"#{term}#"
+            for i in range(len(padded) - 2):
+                weights["3:" + padded[i:i + 3]] += TRIGRAM_WEIGHT * weight
+    return weights
+
+
+def embed(texts: List[str], dim: int = DEFAULT_DIM) -> "np.ndarray":
+    """特征哈希嵌入，返回 (len(texts), dim) 的 float32 矩阵（每行 L2 归一化，无特征时为零向量）"""
+    rows, cols, values = [], [], []
+    for row, text in enumerate(texts):
+        for feature, weight in _features(text).items():
+            h = zlib.crc32(feature.encode("utf-8"))
+            rows.append(row)
+            cols.append(h % dim)
+            values.append(weight if h & 0x80000000 else -weight)
+    flat = np.asarray(rows, dtype=np.int64) * dim + np.asarray(cols, dtype=np.int64)
+    matrix = np.bincount(flat, weights=values, minlength=len(texts) * dim)
+    matrix = matrix.astype(np.float32).reshape(len(texts), dim)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+# ═══════════════════════════════════════════════════════════
+# 索引
+# ═══════════════════════════════════════════════════════════
+
+@dataclass
+class VectorEntry:
+    """一个 .mem 文件在矩阵中的行（连续的 len(spans) 行，从 row 开始）"""
+    mtime_ns: int
+    size: int
+    row: int
+    spans: List[Span]
+
+
+def _encode_spans(spans: List[Span]) -> str:
+    return ",".join(f"{a}-{b}" for a, b in spans)
+
+
+def _decode_spans(text: str) -> List[Span]:
+    spans = []
+    for part in text.split(",") if text else []:
+        a, _, b = part.partition("-")
+        spans.append((int(a), int(b)))
+    return spans
+
+
+class VectorIndex:
+    """sessions 目录中 .mem 文件的段落向量索引"""
+
+    def __init__(self, sessions_dir: str = ".ai/sessions", dim: int = DEFAULT_DIM):
+        self.sessions_dir = Path(sessions_dir)
+        self.root = self.sessions_dir / VECTOR_DIRNAME
+        self.table_path = self.root / TABLE_FILENAME
+        self.dim = dim
+        self._matrix_name: Optional[str] = None
+        self._files: Dict[str, VectorEntry] = {}
+        self._loaded = False
+        self._inode: Optional[int] = None
+        self._offset = 0
+        # 查询用的派生状态（ID 表变化时作废）
+        self._alive: Optional["np.ndarray"] = None
+        self._starts: Optional[List[int]] = None
+        self._owners: List[str] = []
+        self._map: Optional["np.memmap"] = None
+        self._lock = threading.RLock()
+
+    def exists(self) -> bool:
+        """索引是否已建立（已建立时写 .mem 的一方负责追加向量）"""
+        return np is not None and self.table_path.exists()
+
+    # ──── 写入 ────
+
+    def update_file(self, path) -> None:
+        """（重新）嵌入一个 .mem 文件，向量追加到矩阵末尾"""
+        path = Path(path)
+        try:
+            stat = path.stat()
+            if stat.st_size > MAX_INDEXED_BYTES:
+                passages = []
+            else:
+                with open(path, encoding="utf-8", errors="replace", newline="\n") as f:
+                    passages = split_passages(f)
+        except FileNotFoundError:
+            self.drop_file(path.name)
+            return
+        with self._locked():
+            header = self._ensure_header()
+            vectors = embed([text for _, _, text in passages], header["dim"])
+            with open(self.root / header["matrix"], "ab") as f:
+                row = self._row_count(f.tell(), header["dim"], f)
+                f.write(vectors.astype("<f4").tobytes())
+            self._append({"file": path.name, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size,
+                          "row": row, "spans": _encode_spans([(a, b) for a, b, _ in passages])})
+
+    def drop_file(self, name: str) -> None:
+        with self._locked():
+            if self.table_path.exists():
+                self._append({"drop": name})
+
+    @staticmethod
+    def _row_count(size: int, dim: int, f) -> int:
+        row_bytes = dim * 4
+        if size % row_bytes:
+            # 崩溃残留的半行：截掉，从整行处继续追加
+            f.truncate(size - size % row_bytes)
+        return size // row_bytes
+
+    def _ensure_header(self) -> Dict[str, Any]:
+        """读取磁盘上的 ID 表头（其他进程可能已改写），不存在时新建空索引"""
+        try:
+            with open(self.table_path, "rb") as f:
+                header = json.loads(f.readline())
+            if header.get("version") == INDEX_VERSION:
+                return header
+            logger.warning("Vector index: unknown table header, rebuilding")
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            logger.warning("Vector index: malformed table header, rebuilding")
+        return self._write_generation({}, [])
+
+    def _write_generation(self, header: Dict[str, Any], records: List[Dict]) -> Dict[str, Any]:
+        """写出新一代 ID 表（矩阵文件须已就绪），删除不再引用的旧矩阵"""
+        header = {"version": INDEX_VERSION, "dim": header.get("dim", self.dim),
+                  "matrix": header.get("matrix") or f"matrix-{uuid.uuid4().hex[:12]}.f32"}
+        (self.root / header["matrix"]).touch()
+        lines = [header] + records
+        data = "".join(json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n" for r in lines)
+        write_bytes_atomic(self.table_path, data.encode("utf-8"))
+        for stale in self.root.glob("matrix-*.f32"):
+            if stale.name != header["matrix"]:
+                stale.unlink()
+        return header
+
+    def _append(self, record: Dict) -> None:
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with open(self.table_path, "ab+") as f:
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    line = "\n" + line
+            f.write(line.encode("utf-8"))
+
+    @contextlib.contextmanager
+    def _locked(self) -> Iterator[None]:
+        with self._lock:
+            self.root.mkdir(parents=True, exist_ok=True)
+            with open(self.root / LOCK_FILENAME, "a") as lock:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+
+    # ──── 加载 / 校验 ────
+
+    def refresh(self) -> Dict[str, int]:
+        """读入 ID 表的新记录，并按 mtime/size 校验目录中的 .mem
+
+        Returns:
+            {"indexed": 重新嵌入的文件数, "dropped": 移除的文件数}
+        """
+        with self._lock:
+            self._load()
+            on_disk: Dict[str, Tuple[int, int]] = {}
+            try:
+                with os.scandir(self.sessions_dir) as it:
+                    for entry in it:
+                        if entry.name.endswith(".mem") and entry.is_file():
+                            stat = entry.stat()
+                            on_disk[entry.name] = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                pass
+
+            stats = {"indexed": 0, "dropped": 0}
+            for name, key in sorted(on_disk.items()):
+                known = self._files.get(name)
+                if known is None or (known.mtime_ns, known.size) != key:
+                    self.update_file(self.sessions_dir / name)
+                    stats["indexed"] += 1
+            for name in [n for n in self._files if n not in on_disk]:
+                self.drop_file(name)
+                stats["dropped"] += 1
+            if not self.table_path.exists():
+                with self._locked():
+                    self._ensure_header()     # 目录中还没有 .mem：建立空索引
+            self._load()
+
+            live = sum(len(entry.spans) for entry in self._files.values())
+            dead = self._total_rows() - live
+            if dead > max(COMPACT_MIN_DEAD_ROWS, live):
+                self.compact()
+            if stats["indexed"] or stats["dropped"]:
+                logger.debug(f"Vector index refreshed: {stats}")
+            return stats
+
+    def _load(self) -> None:
+        try:
+            stat = self.table_path.stat()
+        except FileNotFoundError:
+            self._reset()
+            return
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            self._reset()
+            self._inode = stat.st_ino
+        if stat.st_size > self._offset:
+            with open(self.table_path, "rb") as f:
+                f.seek(self._offset)
+                data = f.read()
+            end = data.rfind(b"\n") + 1
+            for raw in data[:end].splitlines():
+                if not raw.strip():
+                    continue
+                try:
+                    self._apply(json.loads(raw))
+                except (ValueError, KeyError, TypeError):
+                    logger.warning("Vector index: skipping malformed record in %s", TABLE_FILENAME)
+            self._offset += end
+        self._loaded = True
+
+    def _apply(self, record: Dict) -> None:
+        self._alive = self._starts = None
+        if "version" in record:
+            self.dim = record["dim"]
+            self._matrix_name = record["matrix"]
+            self._files, self._map = {}, None
+        elif "drop" in record:
+            self._files.pop(record["drop"], None)
+        else:
+            self._files[record["file"]] = VectorEntry(record["mtime_ns"], record["size"],
+                                                      record["row"], _decode_spans(record["spans"]))
+
+    def _reset(self) -> None:
+        self._matrix_name, self._files, self._map = None, {}, None
+        self._alive = self._starts = None
+        self._inode, self._offset, self._loaded = None, 0, False
+
+    def compact(self) -> None:
+        """只保留有效行，改写为新一代矩阵与 ID 表"""
+        with self._locked():
+            self._load()
+            if self._matrix_name is None:
+                return
+            source = self._matrix()
+            name = f"matrix-{uuid.uuid4().hex[:12]}.f32"
+            records, row = [], 0
+            with open(self.root / name, "wb") as out:
+                for file_name, entry in sorted(self._files.items()):
+                    count = len(entry.spans)
+                    if count:
+                        out.write(np.ascontiguousarray(source[entry.row:entry.row + count]).tobytes())
+                    records.append({"file": file_name, "mtime_ns": entry.mtime_ns, "size": entry.size,
+                                    "row": row, "spans": _encode_spans(entry.spans)})
+                    row += count
+            del source
+            self._map = None
+            self._write_generation({"dim": self.dim, "matrix": name}, records)
+            self._load()
+
+    def rebuild(self) -> int:
+        """丢弃索引并重新嵌入目录中全部 .mem
+
+        Returns:
+            文件数
+        """
+        with self._locked():
+            for path in [self.table_path, *self.root.glob("matrix-*.f32")]:
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+            self._reset()
+        self.refresh()
+        return len(self._files)
+
+    # ──── 查询 ────
+
+    def search(self, query: str, top_k: int = 5) -> List[VectorHit]:
+        """按余弦相似度取最相近的段落
+
+        Returns:
+            [(文件名, 起始行, 结束行, 相似度), ...]（相似度降序，只含正相似度）
+        """
+        with self._lock:
+            if not self._loaded:
+                self.refresh()
+            else:
+                self._load()
+            total = self._total_rows()
+            if top_k <= 0 or not total:
+                return []
+            matrix = self._matrix()
+            alive = self._alive_rows(total)
+            q = embed([query], self.dim)[0]
+            if not q.any():
+                return []
+
+            best_scores = np.empty(0, dtype=np.float32)
+            best_rows = np.empty(0, dtype=np.int64)
+            for start in range(0, total, SEARCH_BATCH_ROWS):
+                end = min(total, start + SEARCH_BATCH_ROWS)
+                scores = np.asarray(matrix[start:end] @ q)
+                scores[~alive[start:end]] = -np.inf
+                k = min(top_k, end - start)
+                top = np.argpartition(-scores, k - 1)[:k]
+                best_scores = np.concatenate([best_scores, scores[top]])
+                best_rows = np.concatenate([best_rows, top + start])
+            order = np.argsort(-best_scores, kind="stable")[:top_k]
+
+            hits: List[VectorHit] = []
+            for i in order:
+                score = float(best_scores[i])
+                if score <= 0:
+                    break
+                name, span = self._owner(int(best_rows[i]))
+                hits.append((name, span[0], span[1], round(score, 4)))
+            return hits
+
+    def passage_of(self, name: str, line_number: int) -> Optional[Span]:
+        """包含该行的段落 (起始行, 结束行)；行不在任何段落中时返回 None"""
+        with self._lock:
+            entry = self._files.get(name)
+        if entry is None:
+            return None
+        i = bisect.bisect_right(entry.spans, (line_number, float("inf"))) - 1
+        if i >= 0 and entry.spans[i][0] <= line_number <= entry.spans[i][1]:
+            return entry.spans[i]
+        return None
+
+    def _total_rows(self) -> int:
+        if self._matrix_name is None:
+            return 0
+        try:
+            return (self.root / self._matrix_name).stat().st_size // (self.dim * 4)
+        except FileNotFoundError:
+            return 0
+
+    def _matrix(self) -> "np.ndarray":
+        rows = self._total_rows()
+        if self._map is None or self._map.shape[0] != rows:
+            if rows == 0:
+                return np.empty((0, self.dim), dtype=np.float32)
+            self._map = np.memmap(self.root / self._matrix_name, dtype="<f4", mode="r",
+                                  shape=(rows, self.dim))
+        return self._map
+
+    def _alive_rows(self, total: int) -> "np.ndarray":
+        if self._alive is None or len(self._alive) != total:
+            alive = np.zeros(total, dtype=bool)
+            for entry in self._files.values():
+                alive[entry.row:entry.row + len(entry.spans)] = True
+            self._alive = alive
+        return self._alive
+
+    def _owner(self, row: int) -> Tuple[str, Span]:
+        if self._starts is None:
+            owners = sorted((entry.row, name) for name, entry in self._files.items() if entry.spans)
+            self._starts = [start for start, _ in owners]
+            self._owners = [name for _, name in owners]
+        i = bisect.bisect_right(self._starts, row) - 1
+        name = self._owners[i]
+        return name, self._files[name].spans[row - self._starts[i]]
+
+    def read_passage(self, name: str, span: Span) -> str:
+        """读取段落文本（行间以空格连接）"""
+        lines = []
+        try:
+            with open(self.sessions_dir / name, encoding="utf-8", errors="replace") as f:
+                for number, line in enumerate(f, 1):
+                    if number > span[1]:
+                        break
+                    if number >= span[0]:
+                        lines.append(line.strip())
+        except FileNotFoundError:
+            pass
+        return " ".join(lines)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            self._load()
+            total = self._total_rows()
+            live = sum(len(entry.spans) for entry in self._files.values())
+            return {"files": len(self._files), "vectors": live,
+                    "dead_vectors": max(0, total - live), "dim": self.dim}